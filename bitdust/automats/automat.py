@@ -70,15 +70,19 @@ of Information Technologies, Mechanics and Optics, Programming Technologies Depa
 from __future__ import absolute_import
 import sys
 import time
+import types
 import traceback
 from io import open
 
 from twisted.internet import reactor  # @UnresolvedImport
-from twisted.internet.task import LoopingCall  #@UnresolvedImport
 from twisted.internet.defer import Deferred, fail  #@UnresolvedImport
 
 #------------------------------------------------------------------------------
 
+from bitdust.automats import timer_wheel
+
+#------------------------------------------------------------------------------
+
 _Debug = False
 _DebugLevel = 10
 
@@ -95,6 +99,18 @@ _GlobalLogTransitions = False
 
 #------------------------------------------------------------------------------
 
+_ProfileTimer = time.perf_counter
+_ProfileSampling = 0  # : Profiler is off when zero, otherwise every N-th event is measured
+_ProfileCounter = 0
+_ProfileDepth = 0  # : Greater than zero while measured event is processed, actions are timed only then
+_ProfileMaxKeys = 2048  # : All new handlers and actions are counted in one "*" record after that limit
+_ProfileBuckets = 20  # : Latency histogram, bucket N counts calls which took less than 2^N microseconds
+_ProfileHandlers = {}  # : (automat class, state, event) -> [count, total, max, A(), state_changed, callbacks, histogram]
+_ProfileActions = {}  # : (automat class, action method) -> [count, total, max, histogram]
+_ProfileInstrumented = {}  # : automat class -> list of (method name, original method or None)
+
+#------------------------------------------------------------------------------
+
 _Counter = 0  # : Increment by one for every new object, the idea is to keep unique ID's in the index
 _Index = {}  # : Index dictionary, unique id (string) to index (int)
 _Objects = {}  # : Objects dictionary to store all state machines objects
@@ -122,6 +138,9 @@ def shutdown():
     _Index.clear()
     _Objects.clear()
     _Counter = 0
+    SetProfiling(0)
+    ResetProfiling()
+    timer_wheel.shutdown()
 
 
 #------------------------------------------------------------------------------
@@ -341,6 +360,187 @@ def SetGlobalLogTransitions(value=False):
 #------------------------------------------------------------------------------
 
 
+def SetProfiling(sampling=1):
+    """
+    Turns on the profiler: every ``sampling``-th event of all state machines will be measured.
+    Pass ``sampling=0`` to switch it off, collected statistics are kept until ``ResetProfiling()`` is called.
+
+    Action methods (``doSomething()``) are timed only while a measured event is being processed,
+    the profiler wraps them in the automat class when the class receives first measured event.
+    """
+    global _ProfileSampling
+    global _ProfileCounter
+    global _ProfileDepth
+    _ProfileSampling = max(0, int(sampling or 0))
+    _ProfileCounter = 0
+    _ProfileDepth = 0
+    if not _ProfileSampling:
+        for cls, originals in _ProfileInstrumented.items():
+            for name, original in originals:
+                if original is None:
+                    delattr(cls, name)
+                else:
+                    setattr(cls, name, original)
+        _ProfileInstrumented.clear()
+
+
+def ResetProfiling():
+    _ProfileHandlers.clear()
+    _ProfileActions.clear()
+
+
+def ProfilingStats(top=20, sort_by='total'):
+    """
+    Returns top-N slowest event handlers and action methods measured by the profiler.
+    Records can be sorted by ``total``, ``max``, ``avg`` or ``count``.
+    """
+
+    def _info(record):
+        count, total, maximum = record[0], record[1], record[2]
+        return {
+            'count': count,
+            'total_ms': round(total*1000.0, 3),
+            'avg_us': round(total*1000000.0/count, 2) if count else 0,
+            'max_us': round(maximum*1000000.0, 2),
+            'p50_us': _profile_percentile(record[-1], count, 0.5),
+            'p99_us': _profile_percentile(record[-1], count, 0.99),
+        }
+
+    sort_index = {
+        'total': lambda r: r[1],
+        'max': lambda r: r[2],
+        'avg': lambda r: r[1]/r[0] if r[0] else 0,
+        'count': lambda r: r[0],
+    }[sort_by]
+    handlers = []
+    for key, record in sorted(_ProfileHandlers.items(), key=lambda i: sort_index(i[1]), reverse=True)[:top]:
+        info = _info(record)
+        info.update({
+            'automat': key[0],
+            'state': key[1],
+            'event': key[2],
+            'A_ms': round(record[3]*1000.0, 3),
+            'state_changed_ms': round(record[4]*1000.0, 3),
+            'callbacks_ms': round(record[5]*1000.0, 3),
+        })
+        handlers.append(info)
+    actions = []
+    for key, record in sorted(_ProfileActions.items(), key=lambda i: sort_index(i[1]), reverse=True)[:top]:
+        info = _info(record)
+        info.update({
+            'automat': key[0],
+            'action': key[1],
+        })
+        actions.append(info)
+    return {
+        'sampling': _ProfileSampling,
+        'events': sum([r[0] for r in _ProfileHandlers.values()]),
+        'handlers': handlers,
+        'actions': actions,
+    }
+
+
+def _profile_percentile(histogram, count, fraction):
+    if not count:
+        return 0
+    limit = count*fraction
+    passed = 0
+    for bucket, value in enumerate(histogram):
+        passed += value
+        if passed >= limit:
+            return 2**bucket
+    return 2**len(histogram)
+
+
+def _profile_bucket(duration):
+    micro = int(duration*1000000.0)
+    if micro <= 0:
+        return 0
+    return min(micro.bit_length(), _ProfileBuckets - 1)
+
+
+def _profile_record(records, key, duration, phases=0):
+    record = records.get(key)
+    if record is None:
+        if len(records) >= _ProfileMaxKeys:
+            key = ('*', ) * len(key)
+            record = records.get(key)
+        if record is None:
+            record = [0, 0.0, 0.0] + [0.0]*phases + [[0]*_ProfileBuckets]
+            records[key] = record
+    record[0] += 1
+    record[1] += duration
+    if duration > record[2]:
+        record[2] = duration
+    record[-1][_profile_bucket(duration)] += 1
+    return record
+
+
+def _profile_sample():
+    global _ProfileCounter
+    _ProfileCounter += 1
+    if _ProfileCounter < _ProfileSampling:
+        return False
+    _ProfileCounter = 0
+    return True
+
+
+def _profile_begin(machine):
+    global _ProfileDepth
+    cls = machine.__class__
+    if cls not in _ProfileInstrumented:
+        _profile_instrument(cls)
+    _ProfileDepth += 1
+    return [_ProfileTimer()]
+
+
+def _profile_end(machine, state, event, marks):
+    global _ProfileDepth
+    finished = _ProfileTimer()
+    _ProfileDepth -= 1
+    started = marks[0]
+    dispatched = marks[1] if len(marks) > 1 else finished
+    changed = marks[2] if len(marks) > 2 else dispatched
+    record = _profile_record(_ProfileHandlers, (machine.__class__.__name__, state, event), finished - started, phases=3)
+    record[3] += dispatched - started
+    record[4] += changed - dispatched
+    record[5] += finished - changed
+
+
+def _profile_instrument(cls):
+    originals = []
+    for name in dir(cls):
+        if not name.startswith('do') or len(name) < 3 or not name[2].isupper():
+            continue
+        method = getattr(cls, name, None)
+        if not isinstance(method, types.FunctionType):
+            continue
+        originals.append((name, cls.__dict__.get(name)))
+        setattr(cls, name, _profile_wrap_action(cls.__name__, name, getattr(method, '_profiled_original', method)))
+    _ProfileInstrumented[cls] = originals
+
+
+def _profile_wrap_action(class_name, name, method):
+    key = (class_name, name)
+
+    def _action(*args, **kwargs):
+        if not _ProfileDepth:
+            return method(*args, **kwargs)
+        started = _ProfileTimer()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _profile_record(_ProfileActions, key, _ProfileTimer() - started)
+
+    _action.__name__ = name
+    _action.__doc__ = method.__doc__
+    _action._profiled_original = method
+    return _action
+
+
+#------------------------------------------------------------------------------
+
+
 class Automat(object):
 
     """
@@ -403,6 +603,7 @@ class Automat(object):
         self.log_events = log_events
         self.log_transitions = log_transitions
         self._timers = {}
+        self._wheel_timers = {}
         self._state_callbacks = {}
         self._callbacks_before_die = {}
         self._past_states = []
@@ -427,6 +628,7 @@ class Automat(object):
         global _GlobalLogTransitions
         global _LogFile
         self._timers.clear()
+        self._wheel_timers.clear()
         self._past_states.clear()
         self._state_callbacks.clear()
         self._callbacks_before_die.clear()
@@ -573,41 +775,53 @@ class Automat(object):
                 self._past_states.append(old_state)
         else:
             self._past_states.append(old_state)
-        if self.post:
-            try:
-                new_state = self.A(event, *args, **kwargs)
-            except Exception as exc:
-                self.exc(msg='Exception in {}:{} automat, state is {}, event="{}" : {}'.format(self.id, self.name, self.state, event, exc))
-                return self
-            self.state = new_state
-        else:
-            try:
-                self.A(event, *args, **kwargs)
-            except Exception as exc:
-                self.exc(msg='Exception in {}:{} automat, state is {}, event="{}" : {}'.format(self.id, self.name, self.state, event, exc))
-                return self
-            new_state = self.state
-        if old_state != new_state:
-            if _GlobalLogTransitions or self.log_transitions:
-                self.log(self.debug_level, '%s(%s): (%s)->(%s)' % (
-                    repr(self),
-                    event,
-                    old_state,
-                    new_state,
-                ))
-            self.stopTimers()
-            self.state_changed(old_state, new_state, event, *args, **kwargs)
-            if self.publish_events:
-                self.pushEvent(old_state, new_state, event)
-            self.startTimers()
-            if _StateChangedCallback is not None:
-                _StateChangedCallback(self.index, self.id, self.name, new_state)
-        else:
-            self.state_not_changed(self.state, event, *args, **kwargs)
-            if self.publish_events:
-                if self.publish_event_state_not_changed:
+        profile_marks = None
+        if _ProfileSampling and _profile_sample():
+            profile_marks = _profile_begin(self)
+        try:
+            if self.post:
+                try:
+                    new_state = self.A(event, *args, **kwargs)
+                except Exception as exc:
+                    self.exc(msg='Exception in {}:{} automat, state is {}, event="{}" : {}'.format(self.id, self.name, self.state, event, exc))
+                    return self
+                self.state = new_state
+            else:
+                try:
+                    self.A(event, *args, **kwargs)
+                except Exception as exc:
+                    self.exc(msg='Exception in {}:{} automat, state is {}, event="{}" : {}'.format(self.id, self.name, self.state, event, exc))
+                    return self
+                new_state = self.state
+            if profile_marks is not None:
+                profile_marks.append(_ProfileTimer())
+            if old_state != new_state:
+                if _GlobalLogTransitions or self.log_transitions:
+                    self.log(self.debug_level, '%s(%s): (%s)->(%s)' % (
+                        repr(self),
+                        event,
+                        old_state,
+                        new_state,
+                    ))
+                self.stopTimers()
+                self.state_changed(old_state, new_state, event, *args, **kwargs)
+                if self.publish_events:
                     self.pushEvent(old_state, new_state, event)
-        self.executeStateChangedCallbacks(old_state, new_state, event, *args, **kwargs)
+                self.startTimers()
+                if _StateChangedCallback is not None:
+                    _StateChangedCallback(self.index, self.id, self.name, new_state)
+            else:
+                self.state_not_changed(self.state, event, *args, **kwargs)
+                if self.publish_events:
+                    if self.publish_event_state_not_changed:
+                        self.pushEvent(old_state, new_state, event)
+            if profile_marks is not None:
+                profile_marks.append(_ProfileTimer())
+            self.executeStateChangedCallbacks(old_state, new_state, event, *args, **kwargs)
+        finally:
+            # measurement must be finished even if state callback failed, otherwise all next results are wrong
+            if profile_marks is not None:
+                _profile_end(self, old_state, event, profile_marks)
         return self
 
     def timerEvent(self, name, interval):
@@ -627,20 +841,28 @@ class Automat(object):
         """
         Stop all state machine timers.
         """
-        for name, timer in self._timers.items():  # @UnusedVariable
-            if timer.running:
-                timer.stop()
+        for timer in self._timers.values():
+            timer.stop()
         self._timers.clear()
 
     def startTimers(self):
         """
         Start all state machine timers.
+
+        Timers are registered in the process-wide ``timer_wheel``,
+        ``WheelTimer`` objects are created only once and re-used after every state change.
         """
         for name, (interval, states) in self.timers.items():
             if len(states) > 0 and self.state not in states:
                 continue
-            self._timers[name] = LoopingCall(self.timerEvent, name, interval)
-            self._timers[name].start(interval, self.instant_timers)
+            timer = self._wheel_timers.get(name)
+            if timer is None:
+                timer = timer_wheel.WheelTimer(self.timerEvent, interval, name, interval)
+                self._wheel_timers[name] = timer
+            self._timers[name] = timer
+            timer.start()
+            if self.instant_timers:
+                self.timerEvent(name, interval)
 
     def restartTimers(self):
         """
@@ -869,3 +1091,45 @@ class Automat(object):
             return
         from bitdust.main import events
         events.send('state-changed', data=state_snapshot, fast=self.publish_fast)
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Measures cost of the profiler per event: switched off, sampling every 100th event and measuring every event.
+    """
+
+    class _Machine(Automat):
+
+        def A(self, event, *args, **kwargs):
+            if event == 'ping':
+                self.doCount()
+                self.state = 'PONG' if self.state == 'PING' else 'PING'
+
+        def doCount(self, *args, **kwargs):
+            self.counter = getattr(self, 'counter', 0) + 1
+
+    machine = _Machine('profiled', 'PING')
+    events_count = 500000
+    results = []
+    for sampling in (0, 100, 1):
+        SetProfiling(sampling)
+        ResetProfiling()
+        dt = time.time()
+        for _ in range(events_count):
+            machine.event('ping')
+        results.append((sampling, (time.time() - dt)*1000000.0/events_count))
+    SetProfiling(0)
+    machine.destroy()
+    for sampling, per_event in results:
+        print('sampling=%d: %.3f us per event, overhead %.3f us' % (sampling, per_event, per_event - results[0][1]))
+    stats = ProfilingStats(top=3)
+    print('    events measured: %d' % stats['events'])
+    for item in stats['handlers'] + stats['actions']:
+        print('    %r' % item)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/python
+# timer_wheel.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (timer_wheel.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+"""
+.. module:: timer_wheel.
+
+Single process-wide hierarchical timer wheel used by all state machines.
+
+Before that every ``Automat`` with ``timers`` was creating a new ``LoopingCall`` for every timer
+on every state change, so the reactor's delayed calls heap was churned by thousands of machines.
+
+Here every timer is a ``WheelTimer`` object created only once per machine and timer name.
+Starting or stopping the timer only moves that object in or out of one slot of the wheel - no new objects are allocated.
+
+The wheel has four levels, just like the classic timer wheel in the Linux kernel:
+
+    + level 0: 256 slots of ``TICK_SECONDS`` each (2.56 seconds in total)
+    + level 1: 64 slots of 2.56 seconds each (~2.7 minutes)
+    + level 2: 64 slots of ~2.7 minutes each (~2.9 hours)
+    + level 3: 64 slots of ~2.9 hours each (~7.7 days)
+
+When lower level wraps around, one slot from the upper level is "cascaded" down.
+Only one reactor delayed call exists at any moment and it is scheduled to the nearest non-empty slot,
+so an idle node with only long timers wakes up rarely.
+
+Timers are periodic and behave like ``LoopingCall``: first call happens after ``interval`` seconds
+and missed iterations are skipped.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import sys
+
+#------------------------------------------------------------------------------
+
+from twisted.python import log as twisted_log  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+TICK_SECONDS = 0.01
+
+_LevelBits = (8, 6, 6, 6)
+_LevelShifts = (0, 8, 14, 20)
+_LevelMasks = tuple((1 << bits) - 1 for bits in _LevelBits)
+_LevelLimits = (1 << 8, 1 << 14, 1 << 20, 1 << 26)
+
+#------------------------------------------------------------------------------
+
+_Clock = None
+_StartTime = 0.0
+_NextTick = 0
+_Levels = None
+_LevelCounts = [0, 0, 0, 0]
+_SpareSlot = set()
+_Task = None
+_TaskTime = None
+_Counters = {
+    'fired': 0,
+    'started': 0,
+    'stopped': 0,
+    'wakeups': 0,
+}
+
+#------------------------------------------------------------------------------
+
+
+def init(clock=None):
+    """
+    Prepares the wheel, ``clock`` can be used to pass ``twisted.internet.task.Clock`` in tests.
+    Called automatically when first timer is started.
+    """
+    global _Clock
+    global _StartTime
+    global _NextTick
+    global _Levels
+    if _Levels is not None:
+        shutdown()
+    if clock is None:
+        from twisted.internet import reactor  # @UnresolvedImport
+        clock = reactor
+    _Clock = clock
+    _StartTime = _Clock.seconds()
+    _NextTick = 0
+    _Levels = [[set() for _ in range(1 << bits)] for bits in _LevelBits]
+    for level in range(len(_LevelCounts)):
+        _LevelCounts[level] = 0
+
+
+def shutdown():
+    """
+    Stops all registered timers and cancels the reactor call.
+    """
+    global _Clock
+    global _Levels
+    global _Task
+    global _TaskTime
+    if _Task and _Task.active():
+        _Task.cancel()
+    _Task = None
+    _TaskTime = None
+    if _Levels is not None:
+        for slots in _Levels:
+            for slot in slots:
+                for timer in slot:
+                    timer.slot = None
+                slot.clear()
+    _Levels = None
+    _Clock = None
+
+
+def counters():
+    return dict(
+        _Counters,
+        timers=sum(_LevelCounts),
+        delayed_calls=1 if _Task and _Task.active() else 0,
+    )
+
+
+#------------------------------------------------------------------------------
+
+
+class WheelTimer(object):
+
+    """
+    Periodic timer registered in the wheel, calls ``callback(*args)`` every ``interval`` seconds.
+    Create it once and then call ``start()`` and ``stop()`` as many times as needed.
+    """
+
+    __slots__ = ('callback', 'args', 'interval', 'ticks', 'expires', 'level', 'slot')
+
+    def __init__(self, callback, interval, *args):
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.ticks = max(1, int(round(interval/TICK_SECONDS)))
+        self.expires = 0
+        self.level = 0
+        self.slot = None
+
+    def __repr__(self):
+        return 'WheelTimer(%r, %r)' % (self.interval, self.args)
+
+    def active(self):
+        return self.slot is not None
+
+    def start(self):
+        global _NextTick
+        if _Levels is None:
+            init()
+        if self.slot is not None:
+            _remove(self)
+        elif _TaskTime is None and not any(_LevelCounts):
+            # the wheel is idle, there is nothing to cascade
+            _NextTick = max(_NextTick, _current_tick())
+        self.expires = _current_tick() + self.ticks
+        _add(self)
+        _Counters['started'] += 1
+        if _TaskTime is None or self.expires < _TaskTime:
+            _schedule(self.expires)
+
+    def stop(self):
+        global _Task
+        global _TaskTime
+        if self.slot is None:
+            return False
+        _remove(self)
+        _Counters['stopped'] += 1
+        if _Task and not any(_LevelCounts):
+            # the last timer was stopped, do not leave the reactor call behind
+            if _Task.active():
+                _Task.cancel()
+            _Task = None
+            _TaskTime = None
+        return True
+
+
+#------------------------------------------------------------------------------
+
+
+def _current_tick():
+    return int((_Clock.seconds() - _StartTime)/TICK_SECONDS + 0.000001)
+
+
+def _add(timer):
+    delta = timer.expires - _NextTick
+    if delta < 0:
+        level = 0
+        index = _NextTick & _LevelMasks[0]
+    else:
+        level = 0
+        while level < 3 and delta >= _LevelLimits[level]:
+            level += 1
+        if delta >= _LevelLimits[3]:
+            # too far away, will be placed again during the cascade
+            index = (_NextTick + _LevelLimits[3] - 1) >> _LevelShifts[3] & _LevelMasks[3]
+        else:
+            index = (timer.expires >> _LevelShifts[level]) & _LevelMasks[level]
+    timer.level = level
+    timer.slot = _Levels[level][index]
+    timer.slot.add(timer)
+    _LevelCounts[level] += 1
+
+
+def _remove(timer):
+    timer.slot.discard(timer)
+    timer.slot = None
+    _LevelCounts[timer.level] -= 1
+
+
+def _cascade(level):
+    index = (_NextTick >> _LevelShifts[level]) & _LevelMasks[level]
+    slot = _Levels[level][index]
+    if slot:
+        timers = list(slot)
+        slot.clear()
+        _LevelCounts[level] -= len(timers)
+        for timer in timers:
+            _add(timer)
+    return index
+
+
+def _fire(slot, now_tick):
+    global _SpareSlot
+    # swap the slot with an empty one, so timers started again in callbacks do not land into the batch being processed
+    batch = slot
+    _Levels[0][_NextTick & _LevelMasks[0]], _SpareSlot = _SpareSlot, batch
+    while batch:
+        timer = batch.pop()
+        timer.slot = None
+        _LevelCounts[0] -= 1
+        if timer.expires <= now_tick:
+            timer.expires += ((now_tick - timer.expires)//timer.ticks + 1)*timer.ticks
+        else:
+            timer.expires += timer.ticks
+        _add(timer)
+        _Counters['fired'] += 1
+        try:
+            timer.callback(*timer.args)
+        except:
+            twisted_log.err()
+
+
+def _advance(target_tick):
+    global _NextTick
+    levels0 = _Levels[0]
+    mask0 = _LevelMasks[0]
+    while _NextTick <= target_tick:
+        index = _NextTick & mask0
+        if index == 0:
+            level = 1
+            while level < 4 and _cascade(level) == 0:
+                level += 1
+        if _LevelCounts[0] == 0:
+            # nothing to fire on the lowest level, jump to the next cascade or to the target
+            _NextTick = min(_NextTick - index + mask0 + 1, target_tick + 1)
+            continue
+        slot = levels0[index]
+        if slot:
+            _fire(slot, target_tick)
+        _NextTick += 1
+
+
+def _next_expiry():
+    if _LevelCounts[0]:
+        levels0 = _Levels[0]
+        mask0 = _LevelMasks[0]
+        for delta in range(mask0 + 1):
+            if levels0[(_NextTick + delta) & mask0]:
+                return _NextTick + delta
+    if sum(_LevelCounts):
+        return (_NextTick + _LevelMasks[0]) & ~_LevelMasks[0]
+    return None
+
+
+def _schedule(tick):
+    global _Task
+    global _TaskTime
+    delay = max(0, _StartTime + tick*TICK_SECONDS - _Clock.seconds())
+    _TaskTime = tick
+    if _Task and _Task.active():
+        _Task.reset(delay)
+    else:
+        _Task = _Clock.callLater(delay, _run)
+
+
+def _run():
+    global _Task
+    global _TaskTime
+    _Task = None
+    # timers started from the callbacks must not schedule the reactor call, it is done below
+    _TaskTime = -1
+    _Counters['wakeups'] += 1
+    try:
+        _advance(_current_tick())
+    finally:
+        _TaskTime = None
+        tick = _next_expiry()
+        if tick is not None:
+            _schedule(tick)
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Compares ``LoopingCall`` timers with the timer wheel on 10k state machines.
+    Every state transition restarts timers of the machine.
+    """
+    import time
+    from twisted.internet import reactor  # @UnresolvedImport
+    from twisted.internet.task import LoopingCall  #@UnresolvedImport
+    from bitdust.automats import automat
+
+    class _Machine(automat.Automat):
+        timers = {
+            'timer-1sec': (1.0, ['ONE']),
+            'timer-10sec': (10.0, ['TWO']),
+            'timer-1min': (60.0, ['ONE', 'TWO']),
+        }
+
+        def init(self, **kwargs):
+            self.fired = 0
+
+        def A(self, event, *args, **kwargs):
+            if event == 'switch':
+                self.state = 'TWO' if self.state == 'ONE' else 'ONE'
+            elif event.startswith('timer-'):
+                self.fired += 1
+
+    class _LegacyMachine(_Machine):
+
+        def stopTimers(self):
+            for timer in self._timers.values():
+                if timer.running:
+                    timer.stop()
+            self._timers.clear()
+
+        def startTimers(self):
+            for name, (interval, states) in self.timers.items():
+                if len(states) > 0 and self.state not in states:
+                    continue
+                self._timers[name] = LoopingCall(self.timerEvent, name, interval)
+                self._timers[name].start(interval, self.instant_timers)
+
+    machines_count = 10000
+    transitions_count = 200000
+    results = {}
+
+    def _bench(label, machine_class, next_step):
+        machines = [machine_class('machine%d' % i, 'ONE') for i in range(machines_count)]
+        delayed_calls = len(reactor.getDelayedCalls())
+        dt = time.time()
+        for i in range(transitions_count):
+            machines[i % machines_count].automat('switch')
+        transitions_time = time.time() - dt
+
+        def _finish():
+            fired = sum([m.fired for m in machines])
+            for m in machines:
+                m.destroy()
+            results[label] = (delayed_calls, transitions_count/transitions_time, fired)
+            print('%s:' % label)
+            print('    delayed calls in the reactor: %d' % delayed_calls)
+            print('    state transitions: %d per second' % (transitions_count/transitions_time))
+            print('    timer events fired in 1.5 sec: %d' % fired)
+            next_step()
+
+        reactor.callLater(1.5, _finish)  # @UndefinedVariable
+
+    def _bench_wheel():
+        _bench('timer wheel', _Machine, reactor.stop)  # @UndefinedVariable
+
+    reactor.callWhenRunning(_bench, 'LoopingCall', _LegacyMachine, _bench_wheel)  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+    print('    %r' % counters())
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, '../..')
+    main()
@@ -42,11 +42,16 @@ _DebugLevel = 10
 #------------------------------------------------------------------------------
 
 import os
+import time
 import json
 import sqlite3
 
 #------------------------------------------------------------------------------
 
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
 if __name__ == '__main__':
     import sys
     import os.path as _p
@@ -77,6 +82,15 @@ from bitdust.userid import my_id
 _HistoryDB = None
 _HistoryCursor = None
 
+_PendingHistory = []
+_PendingConversations = {}
+_KnownConversations = set()
+_FlushTask = None
+_FlushIntervalSeconds = 0.5
+_MaxPendingMessages = 500
+
+_FullTextSearchEnabled = False
+
 #------------------------------------------------------------------------------
 
 MESSAGE_TYPES = {
@@ -155,9 +169,15 @@ def init(filepath=None):
     _HistoryDB = sqlite3.connect(filepath, timeout=1)
     _HistoryDB.text_factory = str
     _HistoryDB.execute('PRAGMA case_sensitive_like = 1;')
+    # readers from the API are not blocked by the writer and only one fsync is done per checkpoint
+    _HistoryDB.execute('PRAGMA journal_mode = WAL;')
+    _HistoryDB.execute('PRAGMA synchronous = NORMAL;')
     _HistoryDB.commit()
     _HistoryCursor = _HistoryDB.cursor()
 
+    check_create_conversations_unique_index()
+    check_create_history_indexes()
+    load_known_conversations()
     check_create_keys()
 
 
@@ -167,8 +187,10 @@ def shutdown():
     if _Debug:
         lg.dbg(_DebugLevel, '')
 
+    flush()
     _HistoryDB.commit()
     _HistoryDB.close()
+    _KnownConversations.clear()
     _HistoryDB = None
     _HistoryCursor = None
 
@@ -189,6 +211,175 @@ def cur(instance='current'):
 #------------------------------------------------------------------------------
 
 
+def check_create_conversations_unique_index():
+    """
+    Conversations are written with UPSERT statement which requires unique index.
+    Older databases may contain duplicated records, only the latest one is kept.
+    """
+    cur().execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='conversations'")
+    if not cur().fetchone()[0]:
+        return
+    cur().execute("SELECT count(name) FROM sqlite_master WHERE type='index' AND name='conversation id unique'")
+    if cur().fetchone()[0]:
+        return
+    cur().execute('DELETE FROM conversations WHERE rowid NOT IN (SELECT MAX(rowid) FROM conversations GROUP BY conversation_id)')
+    cur().execute('CREATE UNIQUE INDEX "conversation id unique" on conversations(conversation_id)')
+    db().commit()
+
+
+def check_create_history_indexes():
+    """
+    Creates index used for keyset pagination and the full-text search index.
+    When full-text index is created for the first time all existing messages are indexed.
+    """
+    global _FullTextSearchEnabled
+    cur().execute('CREATE INDEX IF NOT EXISTS "conversation time" on history(recipient_local_key_id, sender_local_key_id, payload_time)')
+    db().commit()
+    cur().execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='history_fts'")
+    if cur().fetchone()[0]:
+        _FullTextSearchEnabled = True
+        return
+    try:
+        cur().execute("CREATE VIRTUAL TABLE history_fts USING fts5(message_text, content='', tokenize='unicode61')")
+    except sqlite3.OperationalError as exc:
+        lg.warn('full-text search is not available: %r' % exc)
+        _FullTextSearchEnabled = False
+        return
+    fts_rows = []
+    for row in cur().execute('SELECT rowid, payload_body FROM history'):
+        try:
+            fts_rows.append((row[0], extract_message_text(json.loads(row[1]))))
+        except:
+            continue
+    cur().executemany('INSERT INTO history_fts (rowid, message_text) VALUES (?, ?)', fts_rows)
+    db().commit()
+    _FullTextSearchEnabled = True
+    if _Debug:
+        lg.args(_DebugLevel, indexed_messages=len(fts_rows))
+
+
+def extract_message_text(data):
+    """
+    Returns all text values found in the message payload to be stored in the full-text search index.
+    """
+    if strng.is_string(data):
+        return strng.to_text(data)
+    if isinstance(data, dict):
+        return ' '.join(filter(None, [extract_message_text(v) for v in data.values()]))
+    if isinstance(data, (list, tuple)):
+        return ' '.join(filter(None, [extract_message_text(v) for v in data]))
+    return ''
+
+
+def make_full_text_query(text):
+    """
+    Every word is passed to FTS5 as a quoted string, so user input can not break the query syntax.
+    """
+    words = strng.to_text(text).split()
+    return ' '.join(['"%s"' % w.replace('"', '""') for w in words])
+
+
+def make_cursor(payload_time, row_id):
+    return '%s_%d' % (payload_time, row_id)
+
+
+def parse_cursor(cursor):
+    payload_time, _, row_id = strng.to_text(cursor).partition('_')
+    return (float(payload_time) if '.' in payload_time else int(payload_time)), int(row_id)
+
+
+def load_known_conversations():
+    _KnownConversations.clear()
+    try:
+        for row in cur().execute('SELECT conversation_id FROM conversations'):
+            _KnownConversations.add(row[0])
+    except sqlite3.OperationalError:
+        lg.exc()
+
+
+#------------------------------------------------------------------------------
+
+
+def flush():
+    """
+    Writes all pending messages and conversation updates to the database in a single transaction.
+    Returns number of written messages.
+    """
+    global _FlushTask
+    if _FlushTask:
+        if _FlushTask.active():
+            _FlushTask.cancel()
+        _FlushTask = None
+    if not _PendingHistory and not _PendingConversations:
+        return 0
+    history_rows = list(_PendingHistory)
+    conversation_rows = list(_PendingConversations.values())
+    if not db():
+        lg.warn('database is closed, %d messages and %d conversation updates are lost' % (len(history_rows), len(conversation_rows)))
+        _PendingHistory[:] = []
+        _PendingConversations.clear()
+        return 0
+    try:
+        with db():
+            fts_rows = []
+            for history_row in history_rows:
+                cur().execute(
+                    '''INSERT INTO history (
+                        sender_local_key_id,
+                        sender_id,
+                        recipient_local_key_id,
+                        recipient_id,
+                        direction,
+                        payload_type,
+                        payload_time,
+                        payload_message_id,
+                        payload_body
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    history_row,
+                )
+                if _FullTextSearchEnabled:
+                    fts_rows.append((cur().lastrowid, extract_message_text(history_row[8])))
+            if fts_rows:
+                cur().executemany('INSERT INTO history_fts (rowid, message_text) VALUES (?, ?)', fts_rows)
+            if conversation_rows:
+                cur().executemany(
+                    '''INSERT INTO conversations (
+                        conversation_id,
+                        payload_type,
+                        started_time,
+                        last_updated_time,
+                        last_message_id
+                    ) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(conversation_id) DO UPDATE SET
+                        last_updated_time=excluded.last_updated_time,
+                        last_message_id=excluded.last_message_id''',
+                    conversation_rows,
+                )
+    except sqlite3.Error:
+        # the transaction was rolled back, pending records are kept in memory and written with the next attempt
+        lg.exc()
+        _FlushTask = reactor.callLater(_FlushIntervalSeconds, flush)  # @UndefinedVariable
+        return 0
+    _PendingHistory[:] = []
+    _PendingConversations.clear()
+    if _Debug:
+        lg.args(_DebugLevel, messages=len(history_rows), conversations=len(conversation_rows))
+    return len(history_rows)
+
+
+def schedule_flush():
+    global _FlushTask
+    if len(_PendingHistory) >= _MaxPendingMessages:
+        flush()
+        return
+    if _FlushTask and _FlushTask.active():
+        return
+    _FlushTask = reactor.callLater(_FlushIntervalSeconds, flush)  # @UndefinedVariable
+
+
+#------------------------------------------------------------------------------
+
+
 def adapt_json(data):
     return (json.dumps(data, sort_keys=True)).encode()
 
@@ -348,30 +539,18 @@ def insert_message(data, message_id, message_time=None, sender=None, recipient=N
     if sender_local_key_id is None or recipient_local_key_id is None:
         lg.err('failed to store message because local_key_id is not found, sender=%r recipient=%r' % (sender_local_key_id, recipient_local_key_id))
         return None
-    cur().execute(
-        '''INSERT INTO history (
-            sender_local_key_id,
-            sender_id,
-            recipient_local_key_id,
-            recipient_id,
-            direction,
-            payload_type,
-            payload_time,
-            payload_message_id,
-            payload_body
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
-            sender_local_key_id,
-            sender,
-            recipient_local_key_id,
-            recipient,
-            0 if direction == 'in' else 1,
-            payload_type,
-            payload_time,
-            payload_message_id,
-            data,
-        )
-    )
-    db().commit()
+    # the record is written to the database by flush() together with other pending messages
+    _PendingHistory.append((
+        sender_local_key_id,
+        sender,
+        recipient_local_key_id,
+        recipient,
+        0 if direction == 'in' else 1,
+        payload_type,
+        payload_time,
+        payload_message_id,
+        data,
+    ))
     conversation_id = update_conversation(sender_local_key_id, recipient_local_key_id, payload_type, payload_time, payload_message_id)
     snap_id = '{}/{}'.format(conversation_id, payload_message_id)
     message_json = build_json_message(
@@ -393,31 +572,16 @@ def update_conversation(sender_local_key_id, recipient_local_key_id, payload_typ
     if conversation_id is None:
         lg.err('failed to update conversation, local_key_id was not found')
         return None
-    sql = 'SELECT * FROM conversations WHERE conversation_id=?'
-    params = [
-        conversation_id,
-    ]
-    found_conversation = list(cur().execute(sql, params))
-    if found_conversation:
-        sql = 'UPDATE conversations SET last_updated_time=?, last_message_id=? WHERE conversation_id=?'
-        params = [
-            payload_time,
-            payload_message_id,
-            conversation_id,
-        ]
+    found_conversation = conversation_id in _KnownConversations
+    pending = _PendingConversations.get(conversation_id)
+    if pending:
+        _PendingConversations[conversation_id] = (conversation_id, pending[1], pending[2], payload_time, payload_message_id)
     else:
-        sql = 'INSERT INTO conversations (conversation_id, payload_type, started_time, last_updated_time, last_message_id) VALUES (?, ?, ?, ?, ?)'
-        params = [
-            conversation_id,
-            payload_type,
-            payload_time,
-            payload_time,
-            payload_message_id,
-        ]
+        _PendingConversations[conversation_id] = (conversation_id, payload_type, payload_time, payload_time, payload_message_id)
+    _KnownConversations.add(conversation_id)
     if _Debug:
-        lg.args(_DebugLevel, conversation_id=conversation_id, found_conversation=len(found_conversation), params=params)
-    cur().execute(sql, params)
-    db().commit()
+        lg.args(_DebugLevel, conversation_id=conversation_id, found_conversation=found_conversation)
+    schedule_flush()
     if not found_conversation:
         snapshot = build_json_conversation(
             conversation_id=conversation_id,
@@ -430,8 +594,33 @@ def update_conversation(sender_local_key_id, recipient_local_key_id, payload_typ
     return conversation_id
 
 
-def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_by_id=True, order_by_time=False, message_types=[], sequence_head=None, sequence_tail=None, offset=None, limit=None, raw_results=False):
-    sql = 'SELECT * FROM history'
+def query_messages(
+    sender_id=None,
+    recipient_id=None,
+    bidirectional=True,
+    order_by_id=True,
+    order_by_time=False,
+    message_types=[],
+    sequence_head=None,
+    sequence_tail=None,
+    offset=None,
+    limit=None,
+    raw_results=False,
+    cursor=None,
+    text_query=None,
+    with_row_id=False,
+):
+    """
+    Returns stored messages, latest first.
+
+    When ``cursor`` is passed the keyset pagination is used instead of ``offset``: the results are ordered
+    by time and only messages older than the cursor are returned. Use ``cursor='latest'`` to get the first page,
+    the value for the next page is made with ``make_cursor()`` from the time and row id of the last message.
+    With ``text_query`` only messages containing all given words are returned.
+    With ``with_row_id=True`` every result is a tuple ``(row_id, message)``.
+    """
+    flush()
+    sql = 'SELECT *, rowid FROM history' if with_row_id else 'SELECT * FROM history'
     q = ''
     params = []
     if bidirectional and sender_id and recipient_id:
@@ -484,9 +673,30 @@ def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_
         else:
             q += ' payload_message_id<=?'
         params.append(sequence_tail)
+    if text_query:
+        if params:
+            q += ' AND'
+        if _FullTextSearchEnabled:
+            q += ' rowid IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)'
+            params.append(make_full_text_query(text_query))
+        else:
+            q += ' payload_body LIKE ?'
+            params.append('%' + strng.to_text(text_query) + '%')
+    if cursor is not None and cursor != 'latest':
+        try:
+            cursor_time, cursor_row_id = parse_cursor(cursor)
+        except:
+            lg.warn('invalid cursor: %r' % cursor)
+            return []
+        if params:
+            q += ' AND'
+        q += ' (payload_time, rowid) < (?, ?)'
+        params.extend([cursor_time, cursor_row_id])
     if q:
         sql += ' WHERE %s' % q
-    if order_by_id:
+    if cursor is not None:
+        sql += ' ORDER BY payload_time DESC, rowid DESC'
+    elif order_by_id:
         sql += ' ORDER BY payload_message_id DESC'
     else:
         if order_by_time:
@@ -494,7 +704,7 @@ def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_
     if limit is not None:
         sql += ' LIMIT ?'
         params.append(limit)
-    if offset is not None:
+    if offset is not None and cursor is None:
         sql += ' OFFSET ?'
         params.append(offset)
     if _Debug:
@@ -514,6 +724,8 @@ def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_
             # lg.warn('unknown sender or recipient local key_id')
             continue
         if raw_results:
+            if with_row_id:
+                row = (row[9], row[:9])
             if order_by_time:
                 results.insert(0, row)
             else:
@@ -529,6 +741,8 @@ def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_
             message_id=row[7],
             data=json.loads(row[8]),
         )
+        if with_row_id:
+            json_msg = (row[9], json_msg)
         if order_by_time:
             results.insert(0, json_msg)
         else:
@@ -537,6 +751,7 @@ def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_
 
 
 def list_conversations(order_by_time=True, message_types=[], offset=None, limit=None):
+    flush()
     sql = 'SELECT * FROM conversations'
     q = ''
     params = []
@@ -577,6 +792,7 @@ def list_conversations(order_by_time=True, message_types=[], offset=None, limit=
 
 
 def update_history_with_new_local_key_id(old_id, new_id):
+    flush()
     sql = 'UPDATE history SET sender_local_key_id=? WHERE sender_local_key_id=?'
     params = [
         new_id,
@@ -598,6 +814,7 @@ def update_history_with_new_local_key_id(old_id, new_id):
 
 
 def update_conversations_with_new_local_key_id(old_id, new_id):
+    flush()
     sql = 'SELECT * FROM conversations'
     params = []
     modifications = {}
@@ -620,12 +837,14 @@ def update_conversations_with_new_local_key_id(old_id, new_id):
     if _Debug:
         lg.args(_DebugLevel, modifications=modifications)
     for old_conv_id, new_conv_id in modifications.items():
-        sql = 'UPDATE conversations SET conversation_id=? WHERE conversation_id=?'
+        sql = 'UPDATE OR REPLACE conversations SET conversation_id=? WHERE conversation_id=?'
         params = [new_conv_id, old_conv_id]
         cur().execute(sql, params)
         db().commit()
         if _Debug:
             lg.args(_DebugLevel, sql=sql, params=params)
+    if modifications:
+        load_known_conversations()
 
 
 def rebuild_conversations():
@@ -639,7 +858,9 @@ def rebuild_conversations():
         "last_updated_time" INTEGER,
         "last_message_id" TEXT)''')
     cur().execute('CREATE INDEX "conversation id" on conversations(conversation_id)')
+    cur().execute('CREATE UNIQUE INDEX "conversation id unique" on conversations(conversation_id)')
     db().commit()
+    _KnownConversations.clear()
     for message_json in list(query_messages()):
         msg_typ = message_json['payload'].get('msg_type') or message_json['payload'].get('type')
         payload_type = MESSAGE_TYPES.get(msg_typ, 1)
@@ -877,6 +1098,69 @@ def notify_group_conversation(oldstate, newstate, group_json_info):
 #------------------------------------------------------------------------------
 
 
+def speed_test(filepath, messages=20000, conversations=50, readers=2, batched=True):
+    """
+    Measures sustained messages per second written to the database and latency of
+    the queries made in parallel threads, similar to ``api.message_history()``.
+    With ``batched=False`` every message is committed separately as it was done before.
+    """
+    import threading
+    if os.path.isfile(filepath):
+        os.remove(filepath)
+    init(filepath=filepath)
+    if not batched:
+        db().execute('PRAGMA journal_mode = DELETE;')
+        db().execute('PRAGMA synchronous = FULL;')
+    for c in range(conversations):
+        _KnownConversations.add('{}&{}'.format(c, c))
+    stop_flag = []
+    latencies = []
+
+    def _reader():
+        reader_db = sqlite3.connect(filepath, timeout=10)
+        while not stop_flag:
+            t = time.time()
+            try:
+                list(reader_db.execute('SELECT * FROM history WHERE recipient_local_key_id=? ORDER BY payload_message_id DESC LIMIT 100', (len(latencies) % conversations, )))
+            except sqlite3.OperationalError:
+                pass
+            latencies.append(time.time() - t)
+        reader_db.close()
+
+    threads = [threading.Thread(target=_reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    started = time.time()
+    for i in range(messages):
+        c = i % conversations
+        row = (c, 'group_%d$alice@somehost.net' % c, c, 'group_%d$alice@somehost.net' % c, 0, 3, started + i, '%08d' % i, {'text': 'message %d' % i})
+        if batched:
+            _PendingHistory.append(row)
+            update_conversation(c, c, 3, started + i, '%08d' % i)
+            if len(_PendingHistory) >= _MaxPendingMessages:
+                flush()
+        else:
+            cur().execute('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            db().commit()
+            list(cur().execute('SELECT * FROM conversations WHERE conversation_id=?', ('{}&{}'.format(c, c), )))
+            cur().execute('UPDATE conversations SET last_updated_time=?, last_message_id=? WHERE conversation_id=?', (started + i, '%08d' % i, '{}&{}'.format(c, c)))
+            db().commit()
+    flush()
+    duration = time.time() - started
+    stop_flag.append(True)
+    for t in threads:
+        t.join()
+    shutdown()
+    latencies.sort()
+    result = {
+        'messages_per_second': int(messages/duration),
+        'queries': len(latencies),
+        'query_latency_median_ms': round(latencies[int(len(latencies)*0.5)]*1000.0, 3) if latencies else None,
+        'query_latency_p99_ms': round(latencies[int(len(latencies)*0.99)]*1000.0, 3) if latencies else None,
+    }
+    return result
+
+
 def main():
     import pprint
     my_keys.init()
@@ -898,4 +1182,8 @@ def main():
 
 if __name__ == '__main__':
     lg.set_debug_level(20)
-    main()
+    if len(sys.argv) > 2 and sys.argv[1] == 'speed_test':
+        print('before:', speed_test(sys.argv[2], batched=False))
+        print('after:', speed_test(sys.argv[2], batched=True))
+    else:
+        main()
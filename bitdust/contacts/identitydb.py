@@ -28,6 +28,12 @@
 Here is a simple1 database for identities cache. Also keep track of
 changing identities sources and maintain a several "index" dictionaries
 to speed up processes.
+
+A compact index of all cached identities is stored in the ``settings.IdentityCacheIndexFile()``:
+revision, sources, contacts and public key fingerprint of every identity together with the
+file modification time and size. At startup only files which were changed since the index was
+saved are parsed, other identity objects are read from disk only when they are requested
+and only ``MAX_LOADED_IDENTITIES`` recently used objects are kept in memory.
 """
 
 #------------------------------------------------------------------------------
@@ -36,6 +42,8 @@ from __future__ import absolute_import
 import os
 import time
 
+from collections import OrderedDict
+
 #------------------------------------------------------------------------------
 
 _Debug = False
@@ -50,6 +58,10 @@ from bitdust.system import bpio
 from bitdust.main import settings
 
 from bitdust.lib import nameurl
+from bitdust.lib import strng
+from bitdust.lib import jsn
+
+from bitdust.crypt import hashes
 
 from bitdust.userid import identity
 from bitdust.userid import id_url
@@ -68,11 +80,23 @@ _IDURL2Contacts = {}
 _IPPort2IDURL = {}
 _LocalIPs = {}
 _IdentityCacheUpdatedCallbacks = []
+_IdentityCacheIndex = {}
+_IdentityCacheIndexChanged = False
+_LoadedIdentities = OrderedDict()
+_StartupStats = {}
+
+#------------------------------------------------------------------------------
+
+MAX_LOADED_IDENTITIES = 1000
 
 #------------------------------------------------------------------------------
 
 
 def cache():
+    """
+    Returns dictionary with all cached identities by original IDURL.
+    Item value can be None which means identity object was not read from disk yet, use ``get_ident()``.
+    """
     global _IdentityCache
     return _IdentityCache
 
@@ -87,6 +111,16 @@ def cache_contacts():
     return _Contact2IDURL
 
 
+def cache_index():
+    global _IdentityCacheIndex
+    return _IdentityCacheIndex
+
+
+def startup_stats():
+    global _StartupStats
+    return _StartupStats
+
+
 #------------------------------------------------------------------------------
 
 
@@ -95,23 +129,129 @@ def init():
     Need to call before all other methods.
 
     Check to exist and create a folder to keep all cached identities.
+    All known identities are registered at startup, but only files which are not
+    matching with the stored index are parsed.
     """
+    global _IdentityCacheIndexChanged
+    global _StartupStats
     if _Debug:
         lg.out(_DebugLevel, 'identitydb.init')
+    started = time.time()
     id_cache_dir = settings.IdentityCacheDir()
     if not os.path.exists(id_cache_dir):
         if _Debug:
             lg.out(_DebugLevel, 'identitydb.init create folder %r' % id_cache_dir)
         bpio._dir_make(id_cache_dir)
-    # make sure to read and cache all known identities at startup
-    for id_filename in os.listdir(id_cache_dir):
-        idurl = nameurl.FilenameUrl(id_filename)
-        get_ident(idurl)
+    stored_index = read_index()
+    indexed_count = 0
+    parsed_count = 0
+    for entry in os.scandir(id_cache_dir):
+        idurl = nameurl.FilenameUrl(entry.name)
+        if not idurl:
+            continue
+        info = stored_index.get(strng.to_text(idurl))
+        if info:
+            file_stat = entry.stat()
+            if info.get('mtime') == file_stat.st_mtime_ns and info.get('size') == file_stat.st_size:
+                idset_indexed(idurl, info)
+                indexed_count += 1
+                continue
+        # make sure to read and cache all new or modified identities at startup
+        if get_ident(idurl):
+            parsed_count += 1
+    if len(stored_index) != indexed_count:
+        _IdentityCacheIndexChanged = True
+    if _IdentityCacheIndexChanged:
+        save_index()
+    if indexed_count:
+        fire_cache_updated_callbacks()
+    _StartupStats = {
+        'cache_size': len(_IdentityCache),
+        'indexed': indexed_count,
+        'parsed': parsed_count,
+        'duration': round(time.time() - started, 3),
+    }
+    lg.info('%d identities found in cache, %d taken from the index and %d files parsed in %.3f seconds' % (
+        _StartupStats['cache_size'],
+        indexed_count,
+        parsed_count,
+        _StartupStats['duration'],
+    ))
 
 
 def shutdown():
+    global _IdentityCacheCounter
     if _Debug:
         lg.out(_DebugLevel, 'identitydb.shutdown')
+    if _IdentityCacheIndexChanged:
+        save_index()
+    _IdentityCache.clear()
+    _IdentityCacheIDs.clear()
+    _IdentityCacheModifiedTime.clear()
+    _IdentityCacheIndex.clear()
+    _LoadedIdentities.clear()
+    _Contact2IDURL.clear()
+    _IPPort2IDURL.clear()
+    _IDURL2Contacts.clear()
+    _IdentityCacheCounter = 0
+
+
+#------------------------------------------------------------------------------
+
+
+def read_index():
+    """
+    Reads stored index of cached identities from disk.
+    """
+    src = bpio.ReadTextFile(settings.IdentityCacheIndexFile())
+    if not src:
+        return {}
+    try:
+        return jsn.loads_text(src)
+    except:
+        lg.exc()
+        return {}
+
+
+def save_index():
+    global _IdentityCacheIndexChanged
+    if not bpio.WriteTextFile(settings.IdentityCacheIndexFile(), jsn.dumps(_IdentityCacheIndex, separators=(',', ':'))):
+        lg.err('failed to save identity cache index')
+        return False
+    _IdentityCacheIndexChanged = False
+    return True
+
+
+def make_index_info(idurl, id_obj):
+    """
+    Prepares info about given identity to be stored in the index.
+    File modification time and size are used to detect changes made to the file since the index was saved.
+    """
+    info = {
+        'revision': id_obj.getRevisionValue(),
+        'sources': [strng.to_text(s) for s in id_obj.getSources(as_originals=True)],
+        'contacts': [strng.to_text(c) for c in id_obj.getContacts()],
+        'fingerprint': strng.to_text(hashes.sha1(id_obj.getPublicKey(), hexdigest=True)),
+        'mtime': None,
+        'size': None,
+    }
+    filename = get_filename(idurl)
+    if filename:
+        try:
+            file_stat = os.stat(filename)
+        except:
+            file_stat = None
+        if file_stat:
+            info['mtime'] = file_stat.st_mtime_ns
+            info['size'] = file_stat.st_size
+    return info
+
+
+def idinfo(idurl):
+    """
+    Returns info about cached identity stored in the index without reading the identity file.
+    """
+    return _IdentityCacheIndex.get(strng.to_text(id_url.to_original(idurl)))
 
 
 #------------------------------------------------------------------------------
@@ -127,11 +267,15 @@ def clear(exclude_list=None):
     global _IdentityCache
     global _IdentityCacheIDs
     global _IdentityCacheModifiedTime
+    global _IdentityCacheIndexChanged
     if _Debug:
         lg.out(_DebugLevel, 'identitydb.clear')
     _IdentityCache.clear()
     _IdentityCacheIDs.clear()
     _IdentityCacheModifiedTime.clear()
+    _IdentityCacheIndex.clear()
+    _IdentityCacheIndexChanged = True
+    _LoadedIdentities.clear()
     _Contact2IDURL.clear()
     _IPPort2IDURL.clear()
     _IDURL2Contacts.clear()
@@ -149,6 +293,7 @@ def clear(exclude_list=None):
         os.remove(path)
         if _Debug:
             lg.out(_DebugLevel, 'identitydb.clear remove ' + path)
+    save_index()
     fire_cache_updated_callbacks()
 
 
@@ -190,18 +335,54 @@ def idset(idurl, id_obj):
     global _IdentityCacheIDs
     global _IdentityCacheCounter
     global _IdentityCacheModifiedTime
+    global _IdentityCacheIndexChanged
     idurl = id_url.to_original(idurl)
     if not has_idurl(idurl):
         if _Debug:
             lg.out(_DebugLevel, 'identitydb.idset new identity: %r' % idurl)
     _IdentityCache[idurl] = id_obj
     _IdentityCacheModifiedTime[idurl] = time.time()
+    _IdentityCacheIndex[strng.to_text(idurl)] = make_index_info(idurl, id_obj)
+    _IdentityCacheIndexChanged = True
+    remember_loaded_ident(idurl)
     identid = _IdentityCacheIDs.get(idurl, None)
     if identid is None:
         identid = _IdentityCacheCounter
         _IdentityCacheCounter += 1
         _IdentityCacheIDs[idurl] = identid
-    for contact in id_obj.getContacts():
+    index_contacts(idurl, id_obj.getContacts())
+    # TODO: when identity contacts changed - need to remove old items from _Contact2IDURL
+    fire_cache_updated_callbacks(single_item=(identid, idurl, id_obj))
+    if _Debug:
+        lg.out(_DebugLevel, 'identitydb.idset %r' % idurl)
+    # now make sure we properly handle changes in the sources of that identity
+    try:
+        id_url.identity_cached(id_obj)
+    except:
+        lg.exc()
+
+
+def idset_indexed(idurl, info):
+    """
+    Registers cached identity using only info stored in the index, identity file is not read.
+    Sources of that identity were already processed by ``id_url.identity_cached()`` when it was cached first time.
+    """
+    global _IdentityCacheCounter
+    idurl = id_url.to_original(idurl)
+    _IdentityCache[idurl] = None
+    _IdentityCacheModifiedTime[idurl] = time.time()
+    _IdentityCacheIndex[strng.to_text(idurl)] = info
+    if idurl not in _IdentityCacheIDs:
+        _IdentityCacheIDs[idurl] = _IdentityCacheCounter
+        _IdentityCacheCounter += 1
+    index_contacts(idurl, [strng.to_bin(c) for c in info.get('contacts', [])])
+
+
+def index_contacts(idurl, contacts):
+    global _Contact2IDURL
+    global _IDURL2Contacts
+    global _IPPort2IDURL
+    for contact in contacts:
         if contact not in _Contact2IDURL:
             _Contact2IDURL[contact] = set()
         # else:
@@ -217,24 +398,61 @@ def idset(idurl, id_obj):
             _IPPort2IDURL[ipport] = idurl
         except:
             pass
-    # TODO: when identity contacts changed - need to remove old items from _Contact2IDURL
-    fire_cache_updated_callbacks(single_item=(identid, idurl, id_obj))
-    if _Debug:
-        lg.out(_DebugLevel, 'identitydb.idset %r' % idurl)
-    # now make sure we properly handle changes in the sources of that identity
-    try:
-        id_url.identity_cached(id_obj)
-    except:
-        lg.exc()
 
 
 def idget(idurl):
     """
-    Get identity from cache.
+    Get identity from cache, identity file is read from disk if the object was not loaded yet.
     """
     global _IdentityCache
     idurl = id_url.to_original(idurl)
-    return _IdentityCache.get(idurl, None)
+    id_obj = _IdentityCache.get(idurl, None)
+    if id_obj is None:
+        if idurl in _IdentityCache:
+            return load_ident(idurl)
+        return None
+    if idurl in _LoadedIdentities:
+        _LoadedIdentities.move_to_end(idurl)
+    return id_obj
+
+
+def load_ident(idurl):
+    """
+    Reads and parses identity file of already indexed identity.
+    """
+    idurl = id_url.to_original(idurl)
+    filename = get_filename(idurl)
+    idxml = bpio.ReadTextFile(filename) if filename else None
+    if not idxml:
+        lg.warn('identity file for %r not found' % idurl)
+        return None
+    try:
+        id_obj = identity.identity(xmlsrc=idxml)
+    except:
+        lg.exc()
+        return None
+    if id_obj.getIDURL(as_original=True) != idurl:
+        lg.err('not found identity object idurl=%r idurl_orig=%r' % (idurl, id_obj.getIDURL(as_original=True)))
+        return None
+    _IdentityCache[idurl] = id_obj
+    remember_loaded_ident(idurl)
+    return id_obj
+
+
+def remember_loaded_ident(idurl):
+    """
+    Keeps only ``MAX_LOADED_IDENTITIES`` recently used identity objects in memory.
+    Identity which does not have its file stored in the index yet is never unloaded.
+    """
+    _LoadedIdentities.pop(idurl, None)
+    _LoadedIdentities[idurl] = True
+    for _ in range(len(_LoadedIdentities) - MAX_LOADED_IDENTITIES):
+        oldest_idurl, _ = _LoadedIdentities.popitem(last=False)
+        info = _IdentityCacheIndex.get(strng.to_text(oldest_idurl))
+        if not info or info.get('mtime') is None:
+            continue
+        if oldest_idurl in _IdentityCache:
+            _IdentityCache[oldest_idurl] = None
 
 
 def idremove(idurl):
@@ -249,20 +467,25 @@ def idremove(idurl):
     global _Contact2IDURL
     global _IDURL2Contacts
     global _IPPort2IDURL
+    global _IdentityCacheIndexChanged
     idurl = id_url.to_original(idurl)
     idobj = _IdentityCache.pop(idurl, None)
     identid = _IdentityCacheIDs.pop(idurl, None)
     _IdentityCacheModifiedTime.pop(idurl, None)
-    _IDURL2Contacts.pop(idurl, None)
+    _LoadedIdentities.pop(idurl, None)
+    if _IdentityCacheIndex.pop(strng.to_text(idurl), None) is not None:
+        _IdentityCacheIndexChanged = True
+    contacts = _IDURL2Contacts.pop(idurl, set())
     if idobj is not None:
-        for contact in idobj.getContacts():
-            _Contact2IDURL.pop(contact, None)
-            try:
-                proto, host, port, fname = nameurl.UrlParse(contact)
-                ipport = (host, int(port))
-                _IPPort2IDURL.pop(ipport, None)
-            except:
-                pass
+        contacts = idobj.getContacts()
+    for contact in contacts:
+        _Contact2IDURL.pop(contact, None)
+        try:
+            proto, host, port, fname = nameurl.UrlParse(contact)
+            ipport = (host, int(port))
+            _IPPort2IDURL.pop(ipport, None)
+        except:
+            pass
     fire_cache_updated_callbacks(single_item=(identid, None, None))
     if _Debug:
         lg.args(_DebugLevel, idurl=idurl)
@@ -518,3 +741,70 @@ def fire_cache_updated_callbacks(single_item=None):
     global _IdentityCacheUpdatedCallbacks
     for cb in _IdentityCacheUpdatedCallbacks:
         cb(cache_ids(), cache(), single_item)
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Caches 1000 identities (or given number) in a temporary folder and measures how long it takes to start.
+    Previous way of loading the cache is reproduced when the index file is removed: every identity file is parsed at startup.
+    """
+    import sys
+    import shutil
+    import tempfile
+    from bitdust.crypt import rsa_key
+    identities_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    temp_dir = tempfile.mkdtemp(prefix='identitydb_')
+    settings.init(base_dir=temp_dir)
+    id_url.init()
+    init()
+    for i in range(identities_count):
+        key_object = rsa_key.RSAKey()
+        key_object.generate(1024)
+        idurl = 'http://127.0.0.1:8084/user%05d.xml' % i
+        id_obj = identity.identity(xmlsrc=identity.default_identity_src)
+        id_obj.setSources([idurl])
+        id_obj.setContacts(['tcp://127.0.0.%d:%d' % (i % 250 + 1, 7000 + i)])
+        id_obj.setPublicKey(key_object.toPublicString())
+        id_obj.setRevision(1)
+        id_obj.setSignature(key_object.sign(id_obj.makehash()))
+        update(idurl, id_obj.serialize())
+    shutdown()
+    id_url.shutdown()
+
+    # previous implementation, also first start with the index
+    os.remove(settings.IdentityCacheIndexFile())
+    id_url.init()
+    t = time.time()
+    init()
+    parse_time = time.time() - t
+    shutdown()
+    id_url.shutdown()
+
+    # start from the index
+    id_url.init()
+    t = time.time()
+    init()
+    index_time = time.time() - t
+    idurl = b'http://127.0.0.1:8084/user%05d.xml' % (identities_count - 1)
+    t = time.time()
+    get_ident(idurl).getPublicKey()
+    first_use_time = time.time() - t
+    t = time.time()
+    get_ident(idurl).getPublicKey()
+    next_use_time = time.time() - t
+    print('%d identities in cache' % size())
+    print('    parse every identity file on start:  %.3f sec' % parse_time)
+    print('    read the index on start:             %.3f sec, %d identities loaded' % (index_time, len(_LoadedIdentities)))
+    print('    first use of identity:  %.2f ms, next use %.3f ms' % (first_use_time*1000.0, next_use_time*1000.0))
+    print('    lookup by IP:PORT without loading:  %r' % get_idurl_by_ip_port('127.0.0.1', 7000))
+    shutdown()
+    id_url.shutdown()
+    settings.shutdown()
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
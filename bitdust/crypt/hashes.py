@@ -32,6 +32,8 @@
 
 from __future__ import absolute_import
 
+import binascii
+
 #------------------------------------------------------------------------------
 
 _Debug = False
@@ -106,3 +108,21 @@ def sha256(inp, hexdigest=False, return_object=False):
     if hexdigest:
         return strng.to_bin(h.hexdigest())
     return h.digest()
+
+
+def merkle_root(leaves, hexdigest=True):
+    """
+    Builds a Merkle tree on top of given list of binary SHA256 digests and returns the root.
+    When a level has odd number of nodes the last node is paired with itself.
+    Returns None if the list is empty.
+    """
+    level = list(leaves)
+    if not level:
+        return None
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [sha256(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    if hexdigest:
+        return strng.to_text(binascii.hexlify(level[0]))
+    return level[0]
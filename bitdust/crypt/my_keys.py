@@ -43,6 +43,8 @@ import sys
 import gc
 import base64
 
+from collections import OrderedDict
+
 #------------------------------------------------------------------------------
 
 if __name__ == '__main__':
@@ -74,10 +76,19 @@ from bitdust.userid import my_id
 
 #------------------------------------------------------------------------------
 
+MAX_LOADED_KEYS = 500
+KEYS_INDEX_FILENAME = 'keys_index'
+
+#------------------------------------------------------------------------------
+
 _KnownKeys = {}
 _LatestLocalKeyID = -1
 _LocalKeysRegistry = {}
 _LocalKeysIndex = {}
+_KeysIndex = {}
+_KeysIndexFolder = None
+_KeysIndexChanged = False
+_LoadedKeys = OrderedDict()
 
 #------------------------------------------------------------------------------
 
@@ -90,11 +101,17 @@ def init():
 
 def shutdown():
     global _LatestLocalKeyID
+    global _KeysIndexFolder
     if _Debug:
         lg.out(_DebugLevel, 'my_keys.shutdown')
+    if _KeysIndexFolder and _KeysIndexChanged:
+        save_keys_index(keys_folder=_KeysIndexFolder)
     known_keys().clear()
     local_keys().clear()
     local_keys_index().clear()
+    keys_index().clear()
+    _LoadedKeys.clear()
+    _KeysIndexFolder = None
     _LatestLocalKeyID = 0
 
 
@@ -115,16 +132,28 @@ def key_obj(key_id=None):
             raise Exception('key %r is not registered' % new_key_id)
         rename_key(key_id, new_key_id)
         key_id = new_key_id
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
+    return loaded_key(key_id)
+
+
+def loaded_key(key_id):
+    """
+    Returns key object of a registered key, reads and parses the key file if it was not loaded yet.
+    """
+    key_object = known_keys()[key_id]
+    if key_object is None:
+        if not load_key(key_id, keys_folder=_KeysIndexFolder):
             raise Exception('key load failed: %s' % key_id)
-    return known_keys()[key_id]
+        key_object = known_keys()[key_id]
+    elif key_id in _LoadedKeys:
+        _LoadedKeys.move_to_end(key_id)
+    return key_object
 
 
 def known_keys():
     """
     Returns dictionary with all registered keys by global identifiers.
     Item value can be None which means the key needs to be loaded first from local file.
+    Only up to ``MAX_LOADED_KEYS`` recently used keys are kept loaded in memory.
     """
     global _KnownKeys
     return _KnownKeys
@@ -140,12 +169,22 @@ def local_keys():
 
 def local_keys_index():
     """
-    Keeps an index of public key part and local key identifier.
+    Keeps an index of public key fingerprint and local key identifier.
     """
     global _LocalKeysIndex
     return _LocalKeysIndex
 
 
+def keys_index():
+    """
+    Short info about every registered key, available without reading and parsing the key file:
+    "local_key_id", "label", "active", "is_private", "fingerprint", "size" and "mtime" of the key file.
+    The index is stored in the keys folder and is checked against modification time of every key file on start.
+    """
+    global _KeysIndex
+    return _KeysIndex
+
+
 #------------------------------------------------------------------------------
 
 
@@ -180,7 +219,28 @@ def is_key_private(key_id, include_master=True):
             return True
         if key_id == my_id.getGlobalID(key_alias='master'):
             return True
-    return not key_obj(key_id).isPublic()
+    return key_field(key_id, 'is_private')
+
+
+def key_field(key_id, field):
+    """
+    Returns one of the fields stored in the ``keys_index()`` for a registered key.
+    If the key is loaded already the value is taken from the key object, otherwise the key is not loaded at all.
+    """
+    if known_keys().get(key_id) is None and key_id in keys_index():
+        return keys_index()[key_id][field]
+    key_object = key_obj(key_id)
+    if field == 'is_private':
+        return not key_object.isPublic()
+    if field == 'fingerprint':
+        return key_fingerprint(key_object)
+    if field == 'size':
+        return key_object.size()
+    return getattr(key_object, field)
+
+
+def key_fingerprint(key_object):
+    return strng.to_text(hashes.sha1(strng.to_bin(key_object.toPublicString()), hexdigest=True))
 
 
 #------------------------------------------------------------------------------
@@ -282,6 +342,8 @@ def get_creator_idurl(key_id, as_field=True):
 
 def scan_local_keys(keys_folder=None):
     global _LatestLocalKeyID
+    global _KeysIndexFolder
+    global _KeysIndexChanged
     if not keys_folder:
         keys_folder = settings.KeyStoreDir()
     if _Debug:
@@ -295,29 +357,52 @@ def scan_local_keys(keys_folder=None):
     known_keys().clear()
     local_keys().clear()
     local_keys_index().clear()
-    count = 0
-    unregistered_keys = []
-    for key_filename in os.listdir(keys_folder):
-        if key_filename == 'latest_local_key_id':
-            continue
-        key_id = key_filename.replace('.private', '').replace('.public', '')
-        if not is_valid_key_id(key_id):
-            lg.err('key_id is not valid: %r' % key_id)
+    keys_index().clear()
+    _LoadedKeys.clear()
+    stored_index = read_keys_index(keys_folder=keys_folder)
+    _KeysIndexFolder = keys_folder
+    _KeysIndexChanged = False
+    key_files = {}
+    for entry in os.scandir(keys_folder):
+        if entry.name in ('latest_local_key_id', KEYS_INDEX_FILENAME):
             continue
-        key_dict = read_key_file(key_id, keys_folder=keys_folder)
-        local_key_id = key_dict.get('local_key_id')
-        if local_key_id is None:
-            key_dict['key_id'] = key_id
-            unregistered_keys.append(key_dict)
+        is_private = entry.name.endswith('.private')
+        key_id = entry.name.replace('.private', '').replace('.public', '')
+        if key_id in key_files and not is_private:
+            # private key file is always preferred
             continue
+        key_files[key_id] = (is_private, entry.stat().st_mtime_ns)
+    count = 0
+    indexed_count = 0
+    unregistered_keys = []
+    for key_id, (is_private, mtime) in key_files.items():
+        key_info = stored_index.get(key_id)
+        if key_info and key_info.get('mtime') == mtime and key_info.get('is_private') == is_private:
+            indexed_count += 1
+        else:
+            if not is_valid_key_id(key_id):
+                lg.err('key_id is not valid: %r' % key_id)
+                continue
+            key_info = read_key_file_info(key_id, keys_folder=keys_folder)
+            if key_info is None:
+                continue
+            if key_info['local_key_id'] is None:
+                unregistered_keys.append(key_id)
+                continue
+            key_info['mtime'] = mtime
+            _KeysIndexChanged = True
+        local_key_id = key_info['local_key_id']
         if _LatestLocalKeyID < local_key_id:
             _LatestLocalKeyID = local_key_id
+        keys_index()[key_id] = key_info
         local_keys()[local_key_id] = key_id
+        local_keys_index()[key_info['fingerprint']] = local_key_id
         known_keys()[key_id] = None
         count += 1
+    if len(stored_index) != indexed_count:
+        _KeysIndexChanged = True
     registered_count = 0
-    for key_dict in unregistered_keys:
-        key_id = key_dict['key_id']
+    for key_id in unregistered_keys:
         if not load_key(key_id, keys_folder=keys_folder):
             continue
         _LatestLocalKeyID += 1
@@ -328,8 +413,101 @@ def scan_local_keys(keys_folder=None):
         registered_count += 1
     unregistered_keys = []
     save_latest_local_key_id(keys_folder=keys_folder)
+    if _KeysIndexChanged:
+        save_keys_index(keys_folder=keys_folder)
     if _Debug:
-        lg.out(_DebugLevel, '    %d keys found and %d registered' % (count, registered_count))
+        lg.out(_DebugLevel, '    %d keys found (%d from the index) and %d registered' % (count, indexed_count, registered_count))
+
+
+def read_keys_index(keys_folder=None):
+    if not keys_folder:
+        keys_folder = settings.KeyStoreDir()
+    src = local_fs.ReadTextFile(os.path.join(keys_folder, KEYS_INDEX_FILENAME))
+    if not src:
+        return {}
+    try:
+        return jsn.loads_text(src)
+    except:
+        lg.exc()
+        return {}
+
+
+def save_keys_index(keys_folder=None):
+    global _KeysIndexChanged
+    if not keys_folder:
+        keys_folder = settings.KeyStoreDir()
+    if not local_fs.WriteTextFile(os.path.join(keys_folder, KEYS_INDEX_FILENAME), jsn.dumps(keys_index(), separators=(',', ':'))):
+        lg.err('failed saving keys index to %r' % keys_folder)
+        return False
+    _KeysIndexChanged = False
+    return True
+
+
+def make_key_file_info(key_object, mtime=None):
+    return {
+        'local_key_id': key_object.local_key_id,
+        'label': key_object.label,
+        'active': key_object.active,
+        'is_private': not key_object.isPublic(),
+        'fingerprint': key_fingerprint(key_object),
+        'size': key_object.size(),
+        'mtime': mtime,
+    }
+
+
+def read_key_file_info(key_id, keys_folder=None):
+    """
+    Reads the key file and returns info to be stored in the ``keys_index()``.
+    """
+    key_dict = read_key_file(key_id, keys_folder=keys_folder)
+    if key_dict is None:
+        return None
+    if key_dict.get('need_to_convert') or key_dict.get('local_key_id') is None:
+        return {'local_key_id': None}
+    try:
+        public_key = rsa_key.read_public_key(key_dict['body'])
+    except:
+        lg.exc()
+        return None
+    public_key_string = strng.to_text(public_key.exportKey(format='OpenSSH'))
+    return {
+        'local_key_id': key_dict.get('local_key_id'),
+        'label': key_dict.get('label', ''),
+        'active': key_dict.get('active', True),
+        'is_private': not strng.to_text(key_dict['body']).startswith('ssh-rsa'),
+        'fingerprint': strng.to_text(hashes.sha1(strng.to_bin(public_key_string), hexdigest=True)),
+        'size': public_key.size_in_bits(),
+        'mtime': None,
+    }
+
+
+def update_key_file_info(key_id, key_object, key_filepath):
+    global _KeysIndexChanged
+    try:
+        mtime = os.stat(key_filepath).st_mtime_ns
+    except:
+        mtime = None
+    keys_index()[key_id] = make_key_file_info(key_object, mtime=mtime)
+    _KeysIndexChanged = True
+
+
+def remember_loaded_key(key_id):
+    """
+    Keeps only ``MAX_LOADED_KEYS`` recently used keys in memory, the rest are loaded again when needed.
+    A key which was changed in memory but was not saved yet is never unloaded.
+    """
+    _LoadedKeys.pop(key_id, None)
+    _LoadedKeys[key_id] = True
+    for _ in range(len(_LoadedKeys) - MAX_LOADED_KEYS):
+        oldest_key_id, _ = _LoadedKeys.popitem(last=False)
+        key_object = known_keys().get(oldest_key_id)
+        key_info = keys_index().get(oldest_key_id)
+        if key_object is None:
+            continue
+        if not key_info or key_info['active'] != key_object.active or key_info['label'] != key_object.label:
+            _LoadedKeys[oldest_key_id] = True
+            continue
+        known_keys()[oldest_key_id] = None
 
 
 def read_key_file(key_id, keys_folder=None):
@@ -389,11 +567,12 @@ def load_key(key_id, keys_folder=None):
                 _LatestLocalKeyID = key_object.local_key_id
                 save_latest_local_key_id(keys_folder=keys_folder)
             local_keys()[key_object.local_key_id] = key_id
-            local_keys_index()[key_object.toPublicString()] = key_object.local_key_id
+            local_keys_index()[key_fingerprint(key_object)] = key_object.local_key_id
             if _Debug:
                 lg.out(_DebugLevel, 'my_keys.load_key %r  label=%r  active=%r  is_private=%r  local_key_id=%r  from %s' % (key_id, key_object.label, key_object.active, not key_object.isPublic(), key_object.local_key_id, keys_folder))
         else:
             lg.warn('for key %r local_key_id was not set' % key_id)
+    remember_loaded_key(key_id)
     events.send('key-loaded', data=dict(
         key_id=key_id,
         label=key_object.label,
@@ -434,7 +613,10 @@ def save_key(key_id, keys_folder=None):
         lg.err('failed saving key %r to %r' % (key_id, key_filepath))
         return False
     local_keys()[key_object.local_key_id] = key_id
-    local_keys_index()[key_object.toPublicString()] = key_object.local_key_id
+    local_keys_index()[key_fingerprint(key_object)] = key_object.local_key_id
+    update_key_file_info(key_id, key_object, key_filepath)
+    if key_id not in _LoadedKeys:
+        remember_loaded_key(key_id)
     if _Debug:
         lg.out(_DebugLevel, 'my_keys.save_key stored key %r with local_key_id=%r in %r' % (key_id, key_object.local_key_id, key_filepath))
     return True
@@ -532,7 +714,7 @@ def register_key(key_id, key_object_or_string, label='', active=True, keys_folde
             lg.out(_DebugLevel, 'my_keys.register_key %r from object' % key_id)
         key_object = key_object_or_string
         label = key_object.label or label
-    known_local_key_id = local_keys_index().get(key_object.toPublicString())
+    known_local_key_id = local_keys_index().get(key_fingerprint(key_object))
     if known_local_key_id is not None:
         known_key_id = local_keys().get(known_local_key_id)
         if known_key_id is not None:
@@ -596,7 +778,8 @@ def erase_key(key_id, keys_folder=None):
     k_obj = known_keys().pop(key_id)
     erased_local_key_id = k_obj.local_key_id
     local_keys().pop(k_obj.local_key_id, None)
-    local_keys_index().pop(k_obj.toPublicString(), None)
+    local_keys_index().pop(key_fingerprint(k_obj), None)
+    forget_key_file_info(key_id)
     gc.collect()
     if _Debug:
         lg.out(_DebugLevel, '    key %s removed, file %s deleted' % (key_id, key_filepath))
@@ -616,6 +799,13 @@ def erase_key(key_id, keys_folder=None):
     return True
 
 
+def forget_key_file_info(key_id):
+    global _KeysIndexChanged
+    if keys_index().pop(key_id, None) is not None:
+        _KeysIndexChanged = True
+    _LoadedKeys.pop(key_id, None)
+
+
 def validate_key(key_object):
     sample_data = strng.to_bin(base64.b64encode(os.urandom(256)))
     sample_hash_base = hashes.sha1(sample_data, hexdigest=True)
@@ -654,6 +844,7 @@ def rename_key(current_key_id, new_key_id, keys_folder=None):
     key_object = known_keys().pop(current_key_id)
     known_keys()[new_key_id] = key_object
     local_keys()[key_object.local_key_id] = new_key_id
+    forget_key_file_info(current_key_id)
     if is_signed:
         sign_key(
             key_id=new_key_id,
@@ -676,7 +867,7 @@ def sign_key(key_id, keys_folder=None, ignore_shared_keys=False, save=True):
         return False
     if not keys_folder:
         keys_folder = settings.KeyStoreDir()
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     if key_object.signed:
         if key_object.signed[1] != key.MyPublicKey():
             if ignore_shared_keys:
@@ -728,10 +919,7 @@ def sign(key_id, inp):
     key_id = latest_key_id(key_id)
     if not is_key_registered(key_id):
         raise Exception('key %s is not registered' % key_id)
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
-            raise Exception('key load failed: %s' % key_id)
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     result = key_object.sign(inp)
     return result
 
@@ -749,10 +937,7 @@ def verify(key_id, hashcode, signature):
     key_id = latest_key_id(key_id)
     if not is_key_registered(key_id):
         raise Exception('key %s is not registered' % key_id)
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
-            raise Exception('key load failed: %s' % key_id)
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     result = key_object.verify(signature, hashcode)
     return result
 
@@ -784,10 +969,7 @@ def encrypt(key_id, inp):
     key_id = latest_key_id(key_id)
     if not is_key_registered(key_id):
         raise Exception('key %s is not registered' % key_id)
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
-            raise Exception('key load failed: %s' % key_id)
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     if _Debug:
         lg.out(_DebugLevel, 'my_keys.encrypt  payload of %d bytes with key %s' % (len(inp), key_id))
     result = key_object.encrypt(inp)
@@ -818,10 +1000,7 @@ def decrypt(key_id, inp):
     key_id = latest_key_id(key_id)
     if not is_key_registered(key_id):
         raise Exception('key %s is not registered' % key_id)
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
-            raise Exception('key load failed: %s' % key_id)
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     if _Debug:
         lg.out(_DebugLevel, 'my_keys.decrypt  payload of %d bytes with registered key %s' % (len(inp), key_id))
     result = key_object.decrypt(inp)
@@ -835,10 +1014,7 @@ def serialize_key(key_id):
     key_id = latest_key_id(key_id)
     if not is_key_registered(key_id):
         raise Exception('key %s is not registered' % key_id)
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
-            raise Exception('key load failed: %s' % key_id)
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     return key_object.toPrivateString()
 
 
@@ -874,7 +1050,7 @@ def get_label(key_id):
     key_id = strng.to_text(key_id)
     if not is_key_registered(key_id):
         return ''
-    return key_obj(key_id).label
+    return key_field(key_id, 'label')
 
 
 def get_local_key_id(key_id):
@@ -887,7 +1063,7 @@ def get_local_key_id(key_id):
         return 0
     if not is_key_registered(key_id, include_master=False):
         return None
-    return key_obj(key_id).local_key_id
+    return key_field(key_id, 'local_key_id')
 
 
 def get_local_key(local_key_id):
@@ -906,7 +1082,7 @@ def is_active(key_id):
     key_id = strng.to_text(key_id)
     if not is_key_registered(key_id):
         return None
-    return key_obj(key_id).active
+    return key_field(key_id, 'active')
 
 
 def set_active(key_id, active=True):
@@ -1008,10 +1184,7 @@ def get_key_info(key_id, include_private=False, include_signature=False, generat
         )
     if not is_key_registered(key_id):
         raise Exception('key %s is not registered' % key_id)
-    if known_keys()[key_id] is None:
-        if not load_key(key_id):
-            raise Exception('key load failed: %s' % key_id)
-    key_object = known_keys()[key_id]
+    key_object = loaded_key(key_id)
     key_info = make_key_info(
         key_object=key_object,
         key_id=key_id,
@@ -1118,7 +1291,12 @@ def check_rename_my_keys(prefix=None):
 
 
 def populate_keys():
-    for key_id, key_object in known_keys().items():
+    for key_id in list(known_keys().keys()):
+        try:
+            key_object = loaded_key(key_id)
+        except:
+            lg.exc()
+            continue
         listeners.push_snapshot('key', snap_id=key_id, data=make_key_info(
             key_object=key_object,
             key_id=key_id,
@@ -1133,12 +1311,84 @@ def populate_keys():
 
 #------------------------------------------------------------------------------
 
+
+def main():
+    """
+    Writes 10000 key files (10 percents of them are private) to a temporary folder and measures
+    how long it takes to start and to use the keys.
+    Previous way of loading keys is reproduced here as well: every key file is read and parsed on start
+    and every private key is parsed and validated when it is checked the first time, like ``groups.open_known_groups()`` does.
+    """
+    import time
+    import shutil
+    import tempfile
+    keys_count = 10000
+    temp_dir = tempfile.mkdtemp(prefix='my_keys_')
+    source_keys = []
+    for i in range(20):
+        key_object = rsa_key.RSAKey()
+        key_object.generate(1024)
+        source_keys.append(key_object)
+    key_ids = []
+    for i in range(keys_count):
+        key_id = 'group_%05d$alice@127.0.0.1_8084' % i
+        key_object = source_keys[i % len(source_keys)]
+        key_object.local_key_id = i + 1
+        key_object.label = 'group %d' % i
+        is_private = (i % 10 == 0)
+        key_filepath = os.path.join(temp_dir, key_id + ('.private' if is_private else '.public'))
+        local_fs.WriteTextFile(key_filepath, jsn.dumps(key_object.toDict(include_private=is_private), indent=1, separators=(',', ':')))
+        key_ids.append(key_id)
+    local_fs.WriteTextFile(os.path.join(temp_dir, 'latest_local_key_id'), '%d' % keys_count)
+
+    # previous implementation
+    t = time.time()
+    key_dicts = {}
+    for key_filename in os.listdir(temp_dir):
+        if key_filename == 'latest_local_key_id':
+            continue
+        key_id = key_filename.replace('.private', '').replace('.public', '')
+        if not is_valid_key_id(key_id):
+            continue
+        key_dicts[key_id] = read_key_file(key_id, keys_folder=temp_dir)
+    previous_start_time = time.time() - t
+    t = time.time()
+    for key_id in key_ids:
+        key_object = rsa_key.RSAKey()
+        key_object.fromDict(read_key_file(key_id, keys_folder=temp_dir))
+        if not key_object.isPublic():
+            validate_key(key_object)
+    previous_check_time = time.time() - t
+
+    # keys index
+    t = time.time()
+    scan_local_keys(keys_folder=temp_dir)
+    first_start_time = time.time() - t
+    shutdown()
+    t = time.time()
+    scan_local_keys(keys_folder=temp_dir)
+    start_time = time.time() - t
+    t = time.time()
+    private_count = 0
+    for key_id in key_ids:
+        if is_key_private(key_id, include_master=False) and is_active(key_id):
+            private_count += 1
+    check_time = time.time() - t
+    t = time.time()
+    key_obj(key_ids[0])
+    first_use_time = time.time() - t
+    t = time.time()
+    key_obj(key_ids[0])
+    next_use_time = time.time() - t
+    loaded_count = len([k for k in known_keys().values() if k is not None])
+    print('%d keys, %d of them are private' % (keys_count, private_count))
+    print('    read every key file on start:  %.3f sec, checking all keys %.3f sec' % (previous_start_time, previous_check_time))
+    print('    keys index, first start:  %.3f sec (index is created)' % first_start_time)
+    print('    keys index, next start:   %.3f sec, checking all keys %.3f sec' % (start_time, check_time))
+    print('    first use of a key:  %.2f ms, next use %.3f ms, %d keys loaded in memory' % (first_use_time*1000.0, next_use_time*1000.0, loaded_count))
+    shutdown()
+    shutil.rmtree(temp_dir)
+
+
 if __name__ == '__main__':
-    lg.set_debug_level(18)
-    settings.init()
-    init()
-    import pprint
-    pprint.pprint(local_keys_index())
-    pprint.pprint(local_keys())
-    print(get_key_info('master$recalx@seed.bitdust.io'))
-    pprint.pprint(local_keys_index())
+    main()
@@ -142,6 +142,10 @@ from bitdust.userid import id_url
 
 #-------------------------------------------------------------------------
 
+MAX_PARALLEL_HIRES = 4
+
+#-------------------------------------------------------------------------
+
 _FireHire = None
 _LastFireTime = 0
 _SuppliersToFire = []
@@ -317,6 +321,8 @@ class FireHire(automat.Automat):
             elif event == 'supplier-connected' and self.isStillNeeded(*args, **kwargs):
                 self.doSubstituteSupplier(*args, **kwargs)
                 self.doFindNewSupplier(*args, **kwargs)
+            elif event == 'search-failed' and self.isHiringInProgress(*args, **kwargs):
+                pass
             elif event == 'search-failed' and not self.isSomeoneToDismiss(*args, **kwargs):
                 self.state = 'READY'
                 self.doScheduleNextRestart(*args, **kwargs)
@@ -423,6 +429,13 @@ class FireHire(automat.Automat):
         #     len(s), settings.getSuppliersNumberDesired(), result))
         return result
 
+    def isHiringInProgress(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        from bitdust.customer import supplier_finder
+        return supplier_finder.is_searching()
+
     def isConfigChanged(self, *args, **kwargs):
         """
         Condition method.
@@ -646,34 +659,40 @@ class FireHire(automat.Automat):
                 lg.out(_DebugLevel, '        network_connector is not CONNECTED at the moment, SKIP')
             self.automat('search-failed')
             return
-        position_for_new_supplier = None
+        from bitdust.customer import supplier_finder
+        positions_for_new_suppliers = []
         for pos in range(settings.getSuppliersNumberDesired()):
+            if len(supplier_finder.finders()) + len(positions_for_new_suppliers) >= MAX_PARALLEL_HIRES:
+                break
             if pos in self.hire_list:
                 continue
             supplier_idurl = contactsdb.supplier(pos)
             if not supplier_idurl:
                 lg.info('found empty supplier at position %d and going to find new supplier on that position' % pos)
-                position_for_new_supplier = pos
-                break
+                positions_for_new_suppliers.append(pos)
+                continue
             if id_url.is_in(supplier_idurl, self.dismiss_list, as_field=False):
                 lg.info('going to find new supplier on existing position %d to replace supplier %s' % (pos, supplier_idurl))
-                position_for_new_supplier = pos
-                break
-        if position_for_new_supplier is None:
+                positions_for_new_suppliers.append(pos)
+                continue
+        if not positions_for_new_suppliers:
+            if supplier_finder.is_searching():
+                if _Debug:
+                    lg.out(_DebugLevel, '        %d suppliers are still being hired' % len(supplier_finder.finders()))
+                return
             lg.err('did not found position for new supplier')
             self.automat('search-failed')
             return
-        from bitdust.customer import supplier_finder
         for idurl_txt in strng.to_text(config.conf().getString('services/employer/candidates')).split(','):
             if idurl_txt.strip():
                 supplier_finder.AddSupplierToHire(idurl_txt)
-        self.hire_list.append(position_for_new_supplier)
-        supplier_finder.A(
-            'start',
-            family_position=position_for_new_supplier,
-            ecc_map=eccmap.Current().name,
-            family_snapshot=id_url.to_bin_list(contactsdb.suppliers()),
-        )
+        for position_for_new_supplier in positions_for_new_suppliers:
+            self.hire_list.append(position_for_new_supplier)
+            supplier_finder.start(
+                family_position=position_for_new_supplier,
+                ecc_map=eccmap.Current().name,
+                family_snapshot=id_url.to_bin_list(contactsdb.suppliers()),
+            )
 
     def doSubstituteSupplier(self, *args, **kwargs):
         """
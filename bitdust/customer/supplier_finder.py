@@ -25,6 +25,11 @@
 .. role:: red
 BitDust supplier_finder() Automat
 
+Every instance of the state machine is looking for one new supplier for a given position in my family,
+so several suppliers can be hired at the same time.
+Candidates are taken from the list of preferred suppliers first, then from ``supplier_pool``
+and only when the pool is empty a new DHT lookup is started.
+
 
 EVENTS:
     * :red:`ack-received`
@@ -58,7 +63,8 @@ from bitdust.lib import strng
 from bitdust.p2p import lookup
 from bitdust.p2p import online_status
 
-from bitdust.contacts import identitycache
+from bitdust.customer import supplier_pool
+
 from bitdust.contacts import contactsdb
 
 from bitdust.userid import my_id
@@ -66,7 +72,8 @@ from bitdust.userid import id_url
 
 #------------------------------------------------------------------------------
 
-_SupplierFinder = None
+_SupplierFinders = {}
+_LatestFinderID = 0
 _SuppliersToHire = []
 
 #------------------------------------------------------------------------------
@@ -93,23 +100,39 @@ def InsertSupplierToHire(idurl):
 #------------------------------------------------------------------------------
 
 
-def A(event=None, *args, **kwargs):
+def finders():
+    global _SupplierFinders
+    return _SupplierFinders
+
+
+def is_searching():
+    return len(finders()) > 0
+
+
+def targets():
     """
-    Access method to interact with the state machine.
+    Returns list of IDURLs which are currently processed by all running ``supplier_finder()`` instances.
     """
-    global _SupplierFinder
-    if _SupplierFinder is None:
-        # set automat name and starting state here
-        _SupplierFinder = SupplierFinder(
-            name='supplier_finder',
-            state='AT_STARTUP',
-            debug_level=_DebugLevel,
-            log_events=_Debug,
-            log_transitions=_Debug,
-        )
-    if event is not None:
-        _SupplierFinder.automat(event, *args, **kwargs)
-    return _SupplierFinder
+    return [sf.target_idurl.to_bin() for sf in finders().values() if sf.target_idurl]
+
+
+def start(family_position=None, ecc_map=None, family_snapshot=None):
+    """
+    Creates a new instance of ``supplier_finder()`` state machine to hire one supplier on given position.
+    """
+    global _LatestFinderID
+    _LatestFinderID += 1
+    sf = SupplierFinder(
+        name='supplier_finder_%d' % _LatestFinderID,
+        state='AT_STARTUP',
+        debug_level=_DebugLevel,
+        log_events=_Debug,
+        log_transitions=_Debug,
+    )
+    sf.finder_id = _LatestFinderID
+    finders()[sf.finder_id] = sf
+    sf.automat('start', family_position=family_position, ecc_map=ecc_map, family_snapshot=family_snapshot)
+    return sf
 
 
 class SupplierFinder(automat.Automat):
@@ -130,6 +153,8 @@ class SupplierFinder(automat.Automat):
         state machine.
         """
         self.target_idurl = None
+        self.finder_id = None
+        self.family_position = None
 
     def A(self, event, *args, **kwargs):
         #---AT_STARTUP---
@@ -198,8 +223,11 @@ class SupplierFinder(automat.Automat):
         Condition method.
         """
         global _SuppliersToHire
+        busy = targets()
         available = []
         for idurl in _SuppliersToHire:
+            if idurl in busy:
+                continue
             if id_url.is_not_in(idurl, contactsdb.suppliers(), as_field=False):
                 available.append(idurl)
         return len(available) > 0
@@ -222,7 +250,7 @@ class SupplierFinder(automat.Automat):
             keep_alive=False,
         )
         d.addCallback(lambda ok: self.automat('ack-received', ok))
-        d.addErrback(lambda err: self.automat('ping-failed'))
+        d.addErrback(self._on_ping_failed)
 
     def doSupplierConnect(self, *args, **kwargs):
         """
@@ -261,7 +289,14 @@ class SupplierFinder(automat.Automat):
         """
         Action method.
         """
-        tsk = lookup.random_supplier(ignore_idurls=list(set(contactsdb.suppliers()) | set(contactsdb.customers())))
+        ignore_idurls = set(id_url.to_bin_list(contactsdb.suppliers())) | set(id_url.to_bin_list(contactsdb.customers())) | set(targets())
+        candidate_idurl = supplier_pool.pop_best(ignore_idurls=ignore_idurls)
+        if candidate_idurl:
+            if _Debug:
+                lg.dbg(_DebugLevel, 'selected %r from the pool of candidates' % candidate_idurl)
+            self.automat('found-one-user', candidate_idurl)
+            return
+        tsk = lookup.random_supplier(ignore_idurls=list(ignore_idurls))
         tsk.result_defer.addCallback(self._nodes_lookup_finished)
         tsk.result_defer.addErrback(lambda err: self.automat('users-not-found'))
 
@@ -289,7 +324,10 @@ class SupplierFinder(automat.Automat):
         Action method.
         """
         global _SuppliersToHire
+        busy = targets()
         for idurl in _SuppliersToHire:
+            if idurl in busy:
+                continue
             if id_url.is_not_in(idurl, contactsdb.suppliers(), as_field=False):
                 self.target_idurl = id_url.field(idurl)
                 _SuppliersToHire.remove(idurl)
@@ -308,16 +346,14 @@ class SupplierFinder(automat.Automat):
         Action method.
         """
         from bitdust.customer import fire_hire
-        fire_hire.A('search-failed', *args, **kwargs)
+        fire_hire.A('search-failed', family_position=self.family_position)
 
     def doDestroyMe(self, *args, **kwargs):
         """
         Remove all references to the state machine object to destroy it.
         """
         from bitdust.customer import supplier_connector
-        global _SupplierFinder
-        del _SupplierFinder
-        _SupplierFinder = None
+        finders().pop(self.finder_id, None)
         if self.target_idurl:
             sc = supplier_connector.by_idurl(self.target_idurl)
             if sc:
@@ -335,15 +371,17 @@ class SupplierFinder(automat.Automat):
             self.automat('users-not-found')
             return
         found_idurl = None
+        busy = targets()
         for idurl in idurls:
+            if id_url.to_bin(idurl) in busy:
+                if _Debug:
+                    lg.out(_DebugLevel, '    skip %r because another supplier_finder() is connecting to it' % idurl)
+                continue
             #             if id_url.is_in(idurl, contactsdb.suppliers(), as_field=True):
             #                 if _Debug:
             #                     lg.out('    skip %r because already my supplier' % idurl)
             #                 continue
-            ident = identitycache.FromCache(idurl)
-            remoteprotos = set(ident.getProtoOrder())
-            myprotos = set(my_id.getLocalIdentity().getProtoOrder())
-            if not len(myprotos.intersection(remoteprotos)):
+            if not supplier_pool.is_compatible(idurl):
                 if _Debug:
                     lg.out(_DebugLevel, '    skip %r because no matching protocols exists' % idurl)
                 continue
@@ -361,12 +399,21 @@ class SupplierFinder(automat.Automat):
         if id_url.field(supplier_idurl) != self.target_idurl:
             return
         if newstate in ['DISCONNECTED', 'NO_SERVICE']:
+            if newstate == 'NO_SERVICE':
+                supplier_pool.on_refused(self.target_idurl)
             self.automat('supplier-not-connected')
             return
         if newstate != 'CONNECTED':
             return
         if contactsdb.is_supplier(self.target_idurl):
             return
+        supplier_pool.on_hired(self.target_idurl)
         family_position = kwargs.get('family_position', None)
         ecc_map = kwargs.get('ecc_map')
         self.automat('supplier-connected', self.target_idurl, family_position=family_position, ecc_map=ecc_map, family_snapshot=self.family_snapshot)
+
+    def _on_ping_failed(self, err):
+        if self.target_idurl:
+            supplier_pool.on_ping_failed(self.target_idurl)
+        self.automat('ping-failed')
+        return None
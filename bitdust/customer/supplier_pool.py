@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# supplier_pool.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (supplier_pool.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+"""
+.. module:: supplier_pool.
+
+Keeps a small pool of nodes which are ready to be hired as my suppliers.
+
+Periodically a random nodes are discovered in the suppliers DHT layer, pinged and scored by:
+
+    * latency of the ping
+    * uptime from the local ratings
+    * refusals: how many times the node recently did not accept my storage request
+      (for example because it had not enough free space), refusals are remembered for a day
+    * failed pings
+
+``supplier_finder()`` takes the candidate with the best score from the pool instead of doing
+DHT lookup, identity fetching and handshake for every attempt, so several suppliers can be hired
+in parallel right after an outage.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import sys
+
+try:
+    from twisted.internet import reactor  # @UnresolvedImport
+except:
+    sys.exit('Error initializing twisted.internet.reactor in supplier_pool.py')
+
+from twisted.internet import task
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.lib import strng
+
+from bitdust.userid import id_url
+from bitdust.userid import my_id
+
+#------------------------------------------------------------------------------
+
+POOL_SIZE = 8
+DISCOVERY_BATCH = 4
+REFILL_INTERVAL = 60.0
+CANDIDATE_TTL = 5*60.0
+REFUSALS_MEMORY = 24*60*60.0
+UNKNOWN_UPTIME = 50.0
+LATENCY_NORM = 1.0
+
+#------------------------------------------------------------------------------
+
+_Candidates = {}
+_Refusals = {}
+_Pinging = set()
+_RefillTask = None
+_DiscoveryTask = None
+_Clock = None
+
+#------------------------------------------------------------------------------
+
+
+def init(clock=None):
+    global _RefillTask
+    global _Clock
+    if _Debug:
+        lg.out(_DebugLevel, 'supplier_pool.init')
+    _Clock = clock or reactor
+    _RefillTask = task.LoopingCall(refill)
+    _RefillTask.clock = _Clock
+    _RefillTask.start(REFILL_INTERVAL, now=False)
+    _Clock.callLater(0, refill)  # @UndefinedVariable
+
+
+def shutdown():
+    global _RefillTask
+    global _DiscoveryTask
+    global _Clock
+    if _Debug:
+        lg.out(_DebugLevel, 'supplier_pool.shutdown')
+    if _RefillTask:
+        if _RefillTask.running:
+            _RefillTask.stop()
+        _RefillTask = None
+    if _DiscoveryTask:
+        _DiscoveryTask.stop()
+        _DiscoveryTask = None
+    _Candidates.clear()
+    _Refusals.clear()
+    _Pinging.clear()
+    _Clock = None
+
+
+#------------------------------------------------------------------------------
+
+
+def candidates():
+    global _Candidates
+    return _Candidates
+
+
+def now():
+    return (_Clock or reactor).seconds()
+
+
+#------------------------------------------------------------------------------
+
+
+def score(latency, uptime=None, refusals=0, failures=0):
+    """
+    Higher is better. Fast nodes which are often online and did not refuse my requests are on top.
+    Nodes which were never rated get "neutral" uptime.
+    """
+    if uptime is None:
+        uptime = UNKNOWN_UPTIME
+    latency_factor = 1.0/(1.0 + max(0.0, latency)/LATENCY_NORM)
+    return round(uptime*latency_factor/(1.0 + refusals + 0.5*failures), 3)
+
+
+def refusals(idurl):
+    idurl = strng.to_bin(idurl)
+    info = _Refusals.get(idurl)
+    if not info:
+        return 0
+    if now() - info[1] > REFUSALS_MEMORY:
+        _Refusals.pop(idurl, None)
+        return 0
+    return info[0]
+
+
+def ranked(ignore_idurls=None):
+    """
+    Returns list of ``(score, idurl)`` tuples for all fresh candidates, best candidate goes first.
+    """
+    ignore = set(id_url.to_bin_list(ignore_idurls or []))
+    uptimes = _read_uptimes(list(_Candidates.keys()))
+    result = []
+    for idurl, info in _Candidates.items():
+        if idurl in ignore:
+            continue
+        if now() - info['pinged'] > CANDIDATE_TTL:
+            continue
+        result.append((
+            score(
+                latency=info['latency'],
+                uptime=uptimes.get(strng.to_text(idurl)),
+                refusals=refusals(idurl),
+                failures=info['failures'],
+            ),
+            idurl,
+        ))
+    result.sort(key=lambda i: (-i[0], i[1]))
+    return result
+
+
+def pop_best(ignore_idurls=None):
+    """
+    Removes the best candidate from the pool and returns its IDURL, or None if the pool is empty.
+    """
+    top = ranked(ignore_idurls=ignore_idurls)
+    if not top:
+        if _Debug:
+            lg.dbg(_DebugLevel, 'no candidates available in the pool')
+        return None
+    best_score, best_idurl = top[0]
+    _Candidates.pop(best_idurl, None)
+    if _Debug:
+        lg.args(_DebugLevel, idurl=best_idurl, score=best_score, left=len(_Candidates))
+    return best_idurl
+
+
+#------------------------------------------------------------------------------
+
+
+def add_candidate(idurl, latency):
+    idurl = strng.to_bin(idurl)
+    info = _Candidates.get(idurl)
+    if info is None:
+        info = {
+            'failures': 0,
+        }
+        _Candidates[idurl] = info
+    info['latency'] = latency
+    info['pinged'] = now()
+    if _Debug:
+        lg.args(_DebugLevel, idurl=idurl, latency=latency, candidates=len(_Candidates))
+
+
+def on_ping_failed(idurl):
+    idurl = strng.to_bin(idurl)
+    info = _Candidates.pop(idurl, None)
+    if _Debug:
+        lg.args(_DebugLevel, idurl=idurl, was_candidate=bool(info))
+
+
+def on_refused(idurl):
+    idurl = strng.to_bin(idurl)
+    _Candidates.pop(idurl, None)
+    _Refusals[idurl] = (refusals(idurl) + 1, now())
+    if _Debug:
+        lg.args(_DebugLevel, idurl=idurl, refusals=_Refusals[idurl][0])
+
+
+def on_hired(idurl):
+    idurl = strng.to_bin(idurl)
+    _Candidates.pop(idurl, None)
+    _Refusals.pop(idurl, None)
+
+
+#------------------------------------------------------------------------------
+
+
+def refill():
+    """
+    Drops outdated candidates and starts a new discovery if the pool is not full.
+    """
+    global _DiscoveryTask
+    for idurl in list(_Candidates.keys()):
+        if now() - _Candidates[idurl]['pinged'] > CANDIDATE_TTL:
+            _Candidates.pop(idurl)
+    if _DiscoveryTask or _Pinging:
+        return False
+    if len(_Candidates) >= POOL_SIZE:
+        return False
+    from bitdust.p2p import lookup
+    from bitdust.contacts import contactsdb
+    ignore_idurls = list(set(id_url.to_bin_list(contactsdb.suppliers())) | set(id_url.to_bin_list(contactsdb.customers())) | set(_Candidates.keys()))
+    _DiscoveryTask = lookup.random_supplier(count=DISCOVERY_BATCH, ignore_idurls=ignore_idurls)
+    _DiscoveryTask.result_defer.addCallback(_on_nodes_discovered)
+    _DiscoveryTask.result_defer.addErrback(_on_discovery_failed)
+    if _Debug:
+        lg.args(_DebugLevel, candidates=len(_Candidates), ignore=len(ignore_idurls))
+    return True
+
+
+def is_compatible(idurl):
+    """
+    Remote node must support at least one of my transport protocols.
+    """
+    from bitdust.contacts import identitycache
+    ident = identitycache.FromCache(idurl)
+    if not ident:
+        return False
+    return len(set(ident.getProtoOrder()).intersection(set(my_id.getLocalIdentity().getProtoOrder()))) > 0
+
+
+#------------------------------------------------------------------------------
+
+
+def _read_uptimes(idurls):
+    from bitdust.p2p import ratings
+    if not idurls or ratings.db() is None:
+        return {}
+    try:
+        return ratings.uptime_percents(idurls=idurls)
+    except:
+        lg.exc()
+    return {}
+
+
+def _ping_candidate(idurl):
+    from bitdust.p2p import online_status
+    _Pinging.add(idurl)
+    started = now()
+    d = online_status.ping(idurl=idurl, channel='supplier_pool', keep_alive=False)
+    d.addCallback(_on_candidate_pinged, idurl, started)
+    d.addErrback(_on_candidate_ping_failed, idurl)
+
+
+def _on_nodes_discovered(idurls):
+    global _DiscoveryTask
+    _DiscoveryTask = None
+    for idurl in idurls or []:
+        idurl = id_url.to_bin(idurl)
+        if idurl in _Candidates or idurl in _Pinging:
+            continue
+        if not is_compatible(idurl):
+            if _Debug:
+                lg.dbg(_DebugLevel, 'skip %r because no matching protocols exists' % idurl)
+            continue
+        _ping_candidate(idurl)
+    return None
+
+
+def _on_discovery_failed(err):
+    global _DiscoveryTask
+    _DiscoveryTask = None
+    if _Debug:
+        lg.args(_DebugLevel, err=err)
+    return None
+
+
+def _on_candidate_pinged(response, idurl, started):
+    _Pinging.discard(idurl)
+    add_candidate(idurl, latency=now() - started)
+    return None
+
+
+def _on_candidate_ping_failed(err, idurl):
+    _Pinging.discard(idurl)
+    on_ping_failed(idurl)
+    return None
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Simulates replacement of several dead suppliers in a network of 300 nodes.
+    Each node has random latency, uptime and about 20% of nodes have no free space and refuse any request.
+    Previous way: hire one supplier at a time, every attempt starts from a DHT lookup.
+    New way: every replacement is hired in parallel from the top of a pre-warmed and scored pool.
+    """
+    import random
+    rnd = random.Random(1)
+    lookup_time = 3.0
+    ack_timeout = 10.0
+    max_attempts = 5
+    runs = 50
+
+    def _make_network():
+        nodes = {}
+        for i in range(300):
+            nodes[b'http://127.0.0.1:8084/node%d.xml' % i] = {
+                'latency': rnd.uniform(0.05, 1.5),
+                'uptime': rnd.choice([20.0, 50.0, 80.0, 95.0, 99.0]),
+                'full': rnd.random() < 0.2,
+            }
+        return nodes
+
+    def _attempt(node, pinged_recently=False):
+        # returns (seconds spent, result)
+        online_chance = 0.95 if pinged_recently else node['uptime']/100.0
+        if rnd.random() > online_chance:
+            return ack_timeout, 'offline'
+        spent = 4*node['latency']
+        if node['full']:
+            return spent, 'refused'
+        return spent, 'hired'
+
+    def _sequential(nodes, replacements):
+        total = 0.0
+        for _ in range(replacements):
+            for _ in range(max_attempts):
+                total += lookup_time
+                spent, result = _attempt(nodes[rnd.choice(list(nodes.keys()))])
+                total += spent
+                if result == 'hired':
+                    break
+        return total
+
+    def _parallel(nodes, replacements):
+        _Candidates.clear()
+        _Refusals.clear()
+        for idurl in rnd.sample(list(nodes.keys()), POOL_SIZE*2):
+            if rnd.random() < nodes[idurl]['uptime']/100.0:
+                add_candidate(idurl, latency=2*nodes[idurl]['latency'])
+        finished = []
+        for _ in range(replacements):
+            total = 0.0
+            for _ in range(max_attempts):
+                idurl = pop_best()
+                if idurl is None:
+                    total += lookup_time
+                    idurl = rnd.choice(list(nodes.keys()))
+                    spent, result = _attempt(nodes[idurl])
+                else:
+                    spent, result = _attempt(nodes[idurl], pinged_recently=True)
+                total += spent
+                if result == 'refused':
+                    on_refused(idurl)
+                if result == 'hired':
+                    on_hired(idurl)
+                    break
+            finished.append(total)
+        return max(finished)
+
+    global _Clock
+    _Clock = task.Clock()
+    for replacements in (1, 3, 6):
+        seq_total = 0.0
+        par_total = 0.0
+        for _ in range(runs):
+            nodes = _make_network()
+            seq_total += _sequential(nodes, replacements)
+            par_total += _parallel(nodes, replacements)
+        print('%d replacements: one at a time %.1f sec, parallel from the pool %.1f sec' % (replacements, seq_total/runs, par_total/runs))
+    _Candidates.clear()
+    _Refusals.clear()
+    _Clock = None
+
+
+if __name__ == '__main__':
+    main()
@@ -507,6 +507,7 @@ def process_info():
             'cache': len(identitydb.cache()),
             'cache_ids': len(identitydb.cache_ids()),
             'cache_contacts': len(identitydb.cache_contacts()),
+            'cache_startup': identitydb.startup_stats(),
         },
         'contact': {
             'active': 0,
@@ -1351,11 +1352,9 @@ def network_status(suppliers: bool = False, customers: bool = False, cache: bool
             items = []
             for idurl in contactsdb.all_suppliers():
                 i = {'idurl': idurl, 'global_id': global_id.UrlToGlobalID(idurl), 'state': None}
-                inst = online_status.getInstance(idurl)
-                if inst:
-                    i['state'] = inst.state
-                    if inst.state == 'CONNECTED':
-                        connected += 1
+                i['state'] = online_status.getCurrentState(idurl)
+                if i['state'] == 'CONNECTED':
+                    connected += 1
                 items.append(i)
             r['suppliers'] = {
                 'desired': settings.getSuppliersNumberDesired(),
@@ -1369,11 +1368,9 @@ def network_status(suppliers: bool = False, customers: bool = False, cache: bool
             items = []
             for idurl in contactsdb.customers():
                 i = {'idurl': idurl, 'global_id': global_id.UrlToGlobalID(idurl), 'state': None}
-                inst = online_status.getInstance(idurl)
-                if inst:
-                    i['state'] = inst.state
-                    if inst.state == 'CONNECTED':
-                        connected += 1
+                i['state'] = online_status.getCurrentState(idurl)
+                if i['state'] == 'CONNECTED':
+                    connected += 1
                 items.append(i)
             r['customers'] = {
                 'connected': connected,
@@ -1386,11 +1383,9 @@ def network_status(suppliers: bool = False, customers: bool = False, cache: bool
             items = []
             for idurl in identitycache.Items().keys():
                 i = {'idurl': idurl, 'global_id': global_id.UrlToGlobalID(idurl), 'state': None}
-                inst = online_status.getInstance(idurl)
-                if inst:
-                    i['state'] = inst.state
-                    if inst.state == 'CONNECTED':
-                        connected += 1
+                i['state'] = online_status.getCurrentState(idurl)
+                if i['state'] == 'CONNECTED':
+                    connected += 1
                 items.append(i)
             r['cache'] = {
                 'total': identitycache.CacheLen(),
@@ -1945,7 +1940,10 @@ def identity_cache_list():
     """
     from bitdust.contacts import identitycache
     results = []
-    for id_obj in identitycache.Items().values():
+    for idurl in list(identitycache.Items().keys()):
+        id_obj = identitycache.FromCache(idurl)
+        if not id_obj:
+            continue
         r = id_obj.serialize_json()
         results.append(r)
     results.sort(key=lambda r: r['name'])
@@ -2003,11 +2001,17 @@ def keys_list(sort: bool = False, include_private: bool = False):
         lg.out(_DebugLevel, 'api.keys_list')
     from bitdust.crypt import my_keys
     r = []
-    for key_id, key_object in my_keys.known_keys().items():
+    for key_id in list(my_keys.known_keys().keys()):
         key_alias, creator_idurl = my_keys.split_key_id(key_id)
         if not key_alias or not creator_idurl:
             lg.warn('incorrect key_id: %s' % key_id)
             continue
+        try:
+            # key could be unloaded from memory, read it again from the key file
+            key_object = my_keys.loaded_key(key_id)
+        except:
+            lg.exc()
+            continue
         try:
             key_info = my_keys.make_key_info(key_object, key_id=key_id, include_private=include_private, include_local_id=True, include_state=True)
         except:
@@ -3110,6 +3114,24 @@ def files_downloads():
     )
 
 
+def files_rebuilding():
+    """
+    Returns info about the rebuilding queue: how many backups and blocks are waiting to be rebuilt
+    and a histogram of missing blocks by the number of suppliers you can lose before the data become unrecoverable.
+    Most endangered blocks are rebuilt first.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/file/rebuild/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "files_rebuilding", "kwargs": {} }');
+    """
+    if not driver.is_on('service_rebuilding'):
+        return ERROR('service_rebuilding() is not started')
+    from bitdust.storage import backup_rebuilder
+    return OK(backup_rebuilder.RebuildQueueStats())
+
+
 def file_download_start(remote_path: str, destination_path: str = None, wait_result: bool = False, publish_events: bool = False):
     """
     Download data from remote suppliers to your local machine.
@@ -4629,12 +4651,17 @@ def user_observe(nickname: str, attempts: int = 3):
 #------------------------------------------------------------------------------
 
 
-def message_history(recipient_id: str = None, sender_id: str = None, message_type: str = None, offset: int = 0, limit: int = 100):
+def message_history(recipient_id: str = None, sender_id: str = None, message_type: str = None, offset: int = 0, limit: int = 100, cursor: str = None, query: str = None):
     """
     Returns chat communications history stored for given user or messaging group.
 
+    To page through a long history use `cursor` instead of `offset`: pass `cursor=latest` to get the first page
+    and then the `cursor` value of the last returned message to get the next page.
+    Parameter `query` can be used to find only messages containing all of the given words.
+
     ###### HTTP
         curl -X GET 'localhost:8180/message/history/v1?message_type=group_message&recipient_id=group_95d0fedc46308e2254477fcb96364af9$alice@server-a.com'
+        curl -X GET 'localhost:8180/message/history/v1?id=carlos@computer-c.net&cursor=latest&limit=20&query=hola'
 
     ###### WebSocket
         websocket.send('{"command": "api_call", "method": "message_history", "kwargs": {"recipient_id" : "group_95d0fedc46308e2254477fcb96364af9$alice@server-a.com", "message_type": "group_message"} }');
@@ -4676,7 +4703,8 @@ def message_history(recipient_id: str = None, sender_id: str = None, message_typ
             return RESULT([])
     messages = [{
         'doc': m,
-    } for m in message_database.query_messages(
+        'cursor': message_database.make_cursor(m['payload']['time'], row_id),
+    } for row_id, m in message_database.query_messages(
         sender_id=sender_id,
         recipient_id=recipient_id,
         bidirectional=bidirectional,
@@ -4685,6 +4713,9 @@ def message_history(recipient_id: str = None, sender_id: str = None, message_typ
         ] if message_type else [],
         offset=offset,
         limit=limit,
+        cursor=cursor or None,
+        text_query=query or None,
+        with_row_id=True,
     )]
     if _Debug:
         lg.out(_DebugLevel, 'api.message_history with recipient_id=%s sender_id=%s message_type=%s found %d messages' % (recipient_id, sender_id, message_type, len(messages)))
@@ -5391,6 +5422,20 @@ def services_list(with_configs: bool = False, as_tree: bool = False):
     return RESULT(result)
 
 
+def services_startup():
+    """
+    Returns timings of the latest network services startup: when each service was scheduled, how long it was waiting
+    for dependencies, how long it was preparing and starting and which chain of services took most of the time.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/service/startup/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "services_startup", "kwargs": {} }');
+    """
+    return OK(driver.startup_report())
+
+
 def service_info(service_name: str):
     """
     Returns detailed info about single service.
@@ -5601,9 +5646,11 @@ def packets_stats():
     if not driver.is_on('service_gateway'):
         return ERROR('service_gateway() is not started')
     from bitdust.p2p import p2p_stats
+    from bitdust.transport import bandwidth
     return OK({
         'in': p2p_stats.counters_in(),
         'out': p2p_stats.counters_out(),
+        'last_hour': bandwidth.peers_stats(window=60*60),
     })
 
 
@@ -6150,6 +6197,25 @@ def dht_user_random(layer_id: int = 0, count: int = 1):
     return ret
 
 
+def dht_lookup_stats(layer_id: int = None):
+    """
+    Returns latency statistics of recently finished random nodes lookups for every DHT layer:
+    how long the tasks were waiting in the queue, how long the DHT requests took and the total duration.
+
+    Parameter `layer_id` can be used to get info only about one layer of the routing table.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/dht/lookup/stats/v1?layer_id=3'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "dht_lookup_stats", "kwargs": {"layer_id": 3} }');
+    """
+    if not driver.is_on('service_nodes_lookup'):
+        return ERROR('service_nodes_lookup() is not started')
+    from bitdust.p2p import lookup
+    return OK(lookup.lookup_stats(layer_id=layer_id))
+
+
 def dht_value_get(key: str, record_type: str = 'skip_validation', layer_id: int = 0, use_cache_ttl: int = None):
     """
     Fetch single key/value record from DHT network.
@@ -6625,6 +6691,59 @@ def automat_events_stop(index: int = None, automat_id: str = None):
     return OK(message='stopped publishing events from the state machine', result=inst.to_json())
 
 
+def automats_profile(top: int = 20, sort_by: str = 'total'):
+    """
+    Returns top-N slowest state machine event handlers and action methods measured by the profiler.
+
+    Records can be sorted by `total`, `max`, `avg` or `count`.
+    The profiler must be started first with `automats_profile_start()` API method.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/automat/profile/v1?top=10&sort_by=max'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "automats_profile", "kwargs": {"top": 10, "sort_by": "max"} }');
+    """
+    if sort_by not in ('total', 'max', 'avg', 'count'):
+        return ERROR('unknown sorting: %r' % sort_by)
+    from bitdust.automats import automat
+    return OK(automat.ProfilingStats(top=int(top), sort_by=sort_by))
+
+
+def automats_profile_start(sampling: int = 1, reset: bool = True):
+    """
+    Starts measuring latency of the state machines events: every N-th event is measured, where N is `sampling`.
+
+    ###### HTTP
+        curl -X POST 'localhost:8180/automat/profile/start/v1' -d '{"sampling": 100}'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "automats_profile_start", "kwargs": {"sampling": 100} }');
+    """
+    if int(sampling) < 1:
+        return ERROR('sampling must be a positive number')
+    from bitdust.automats import automat
+    if reset:
+        automat.ResetProfiling()
+    automat.SetProfiling(int(sampling))
+    return OK(message='state machines profiler started, sampling every %d event' % int(sampling))
+
+
+def automats_profile_stop():
+    """
+    Stops the state machines profiler, collected statistics is still available via `automats_profile()` API method.
+
+    ###### HTTP
+        curl -X POST 'localhost:8180/automat/profile/stop/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "automats_profile_stop", "kwargs": {} }');
+    """
+    from bitdust.automats import automat
+    automat.SetProfiling(0)
+    return OK(message='state machines profiler stopped')
+
+
 #------------------------------------------------------------------------------
 
 _ALL = [
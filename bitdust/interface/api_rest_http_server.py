@@ -864,6 +864,10 @@ class BitDustRESTHTTPServer(JsonAPIResource):
     def files_downloads_v1(self, request):
         return api.files_downloads()
 
+    @GET('^/file/rebuild/v1$')
+    def files_rebuilding_v1(self, request):
+        return api.files_rebuilding()
+
     @POST('^/f/d/o$')
     @POST('^/v1/file/download/start$')
     @POST('^/file/download/start/v1$')
@@ -1151,6 +1155,8 @@ class BitDustRESTHTTPServer(JsonAPIResource):
             message_type=_request_arg(request, 'message_type', 'private_message'),
             offset=int(_request_arg(request, 'offset', '0')),
             limit=int(_request_arg(request, 'limit', '100')),
+            cursor=_request_arg(request, 'cursor', None),
+            query=_request_arg(request, 'query', None),
         )
 
     @GET('^/msg/c$')
@@ -1301,6 +1307,11 @@ class BitDustRESTHTTPServer(JsonAPIResource):
     def service_list_v1(self, request):
         return api.services_list(with_configs=bool(_request_arg(request, 'with_configs', '0') in YES))
 
+    @GET('^/v1/service/startup$')
+    @GET('^/service/startup/v1$')
+    def service_startup_v1(self, request):
+        return api.services_startup()
+
     @GET('^/svc/i/(?P<service_name>[^/]+)/$')
     @GET('^/v1/service/info/(?P<service_name>[^/]+)$')
     @GET('^/service/info/(?P<service_name>[^/]+)/v1$')
@@ -1448,6 +1459,12 @@ class BitDustRESTHTTPServer(JsonAPIResource):
             count=int(_request_arg(request, 'count', mandatory=False, default=1)),
         )
 
+    @GET('^/v1/dht/lookup/stats$')
+    @GET('^/dht/lookup/stats/v1$')
+    def dht_lookup_stats_v1(self, request):
+        layer_id = _request_arg(request, 'layer_id', mandatory=False, default=None)
+        return api.dht_lookup_stats(layer_id=int(layer_id) if layer_id not in (None, '') else None)
+
     @GET('^/d/v/g$')
     @GET('^/v1/dht/value/get$')
     @GET('^/dht/value/get/v1$')
@@ -1555,6 +1572,25 @@ class BitDustRESTHTTPServer(JsonAPIResource):
             automat_id=data.get('automat_id', None),
         )
 
+    @GET('^/automat/profile/v1$')
+    def automat_profile_v1(self, request):
+        return api.automats_profile(
+            top=int(_request_arg(request, 'top', default=20, mandatory=False)),
+            sort_by=_request_arg(request, 'sort_by', default='total', mandatory=False),
+        )
+
+    @POST('^/automat/profile/start/v1$')
+    def automat_profile_start_v1(self, request):
+        data = _request_data(request)
+        return api.automats_profile_start(
+            sampling=int(data.get('sampling', 1)),
+            reset=bool(data.get('reset', '1') in YES),
+        )
+
+    @POST('^/automat/profile/stop/v1$')
+    def automat_profile_stop_v1(self, request):
+        return api.automats_profile_stop()
+
     #------------------------------------------------------------------------------
 
     @ALL('^/*')
@@ -67,6 +67,8 @@ CMD_ACK = b'k'
 CMD_ALIVE = b'a'
 CMD_STUN = b's'
 CMD_MYIPPORT = b'm'
+CMD_FLOW_DATA = b'D'
+CMD_FLOW_ACK = b'K'
 
 #------------------------------------------------------------------------------
 
@@ -137,12 +137,14 @@ from bitdust.userid import id_url
 #-------------------------------------------------------------------------------
 
 
-def SpaceTime():
+def SpaceTime(removed_paths=None):
     """
     Test all packets for each customer.
 
     Check if he use more space than we gave him and if packets is too
     old.
+
+    If ``removed_paths`` list is given, all removed files and folders are added there.
     """
     if _Debug:
         printlog('SpaceTime %r' % time.strftime('%a, %d %b %Y %H:%M:%S +0000'))
@@ -202,6 +204,8 @@ def SpaceTime():
                     continue
                 try:
                     os.remove(path)
+                    if removed_paths is not None:
+                        removed_paths.append(path)
                     if _Debug:
                         printlog('SpaceTime %r file removed (cur:%s, max: %s)' % (path, str(currentV), str(maxspaceV)))
                 except:
@@ -230,6 +234,8 @@ def SpaceTime():
         if os.path.isdir(path):
             try:
                 bpio._dir_remove(path)
+                if removed_paths is not None:
+                    removed_paths.append(path)
                 if _Debug:
                     printlog('SpaceTime %r dir removed (%s)' % (path, remove_list[path]))
             except:
@@ -243,6 +249,8 @@ def SpaceTime():
             pass
         try:
             os.remove(path)
+            if removed_paths is not None:
+                removed_paths.append(path)
             if _Debug:
                 printlog('SpaceTime %r file removed (%s)' % (path, remove_list[path]))
         except:
@@ -258,9 +266,11 @@ def SpaceTime():
 #------------------------------------------------------------------------------
 
 
-def UpdateCustomers():
+def UpdateCustomers(removed_paths=None):
     """
     Test packets after list of customers was changed.
+
+    If ``removed_paths`` list is given, all removed files and folders are added there.
     """
     space, _ = accounting.read_customers_quotas()
     if space is None:
@@ -295,6 +305,8 @@ def UpdateCustomers():
         if os.path.isdir(path):
             try:
                 bpio._dir_remove(path)
+                if removed_paths is not None:
+                    removed_paths.append(path)
                 if _Debug:
                     printlog('UpdateCustomers %r folder removed (%s)' % (
                         path,
@@ -311,6 +323,8 @@ def UpdateCustomers():
             pass
         try:
             os.remove(path)
+            if removed_paths is not None:
+                removed_paths.append(path)
             if _Debug:
                 printlog('UpdateCustomers %r file removed (%s)' % (
                     path,
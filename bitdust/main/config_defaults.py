@@ -233,6 +233,7 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/proxy-transport/current-router', '')
 
     conf_obj.setDefaultValue('services/rebuilding/enabled', 'true')
+    conf_obj.setDefaultValue('services/rebuilding/batch-mode-enabled', 'false')
 
     conf_obj.setDefaultValue('services/restores/enabled', 'true')
 
@@ -240,6 +241,7 @@ def reset(conf_obj):
 
     conf_obj.setDefaultValue('services/supplier/enabled', 'true')
     conf_obj.setDefaultValue('services/supplier/donated-space', diskspace.MakeStringFromBytes(settings.DefaultDonatedBytes()))
+    conf_obj.setDefaultValue('services/supplier/scrub-budget', diskspace.MakeStringFromBytes(settings.DefaultScrubBudgetBytes()))
 
     conf_obj.setDefaultValue('services/supplier-contracts/enabled', 'true')
     conf_obj.setDefaultValue('services/supplier-contracts/initial-duration-hours', 6)
@@ -253,6 +255,7 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/tcp-transport/receiving-enabled', 'true')
     conf_obj.setDefaultValue('services/tcp-transport/sending-enabled', 'true')
     conf_obj.setDefaultValue('services/tcp-transport/priority', 10)
+    conf_obj.setDefaultValue('services/tcp-transport/worker-process-enabled', 'false')
 
     conf_obj.setDefaultValue('services/udp-datagrams/enabled', 'true')
     conf_obj.setDefaultValue('services/udp-datagrams/udp-port', settings.DefaultUDPPort())
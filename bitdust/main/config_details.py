@@ -390,6 +390,10 @@ When one of your suppliers is not available for some reason, all encrypted fragm
 The `rebuilding` service will automatically download the available fragments from those suppliers that are still online, and "rebuild" the lost fragments that the new supplier receives.
 **WARNING!** At the moment when a critical number of fragments are lost, downloading data is no longer possible.
 
+{services/rebuilding/batch-mode-enabled} rebuild in batches
+Request fragments from every supplier in batches, many files in a single packet, and reconstruct many blocks at once.
+This makes rebuilding faster after a supplier was replaced. Suppliers running older software will receive requests one by one.
+
 {services/restores/enabled} enable data downloading
 Controls network connections and incoming data streams when downloading encrypted fragments from suppliers nodes.
 
@@ -403,6 +407,9 @@ The `supplier` service allocates a part of your disk and serves encrypted files
 {services/supplier/donated-space} donated space
 The amount of storage space you want to donate to other users.
 
+{services/supplier/scrub-budget} scrubbing budget
+How much of the stored customers data can be read from the disk during one integrity check pass, the pass is started every 10 minutes.
+
 {services/supplier-contracts/enabled} digitally signed supplier contracts
 The service is under development.
 
@@ -430,6 +437,10 @@ Disable this option if you do not want to send encrypted data over TCP and use `
 You can change this setting if you want BitDust to use the `tcp-transport` more often than other transport protocols.
 Lower values have higher priority.
 
+{services/tcp-transport/worker-process-enabled} run in a separate process
+Enable this option to run the `tcp-transport` in its own worker process, so network traffic is handled on another CPU core.
+Not available on Windows and Android, the change takes effect after the service is restarted.
+
 {services/udp-datagrams/enabled} UDP enabled
 This will allow BitDust to use the UDP protocol for service data and encrypted traffic.
 
@@ -207,10 +207,12 @@ def defaults():
         'services/proxy-transport/current-router': TYPE_STRING,
         'services/proxy-transport/preferred-routers': TYPE_TEXT,  # 'services/proxy-transport/router-lifetime-seconds': TYPE_POSITIVE_INTEGER,
         'services/rebuilding/enabled': TYPE_BOOLEAN,
+        'services/rebuilding/batch-mode-enabled': TYPE_BOOLEAN,
         'services/restores/enabled': TYPE_BOOLEAN,
         'services/shared-data/enabled': TYPE_BOOLEAN,
         'services/supplier/donated-space': TYPE_DISK_SPACE,
         'services/supplier/enabled': TYPE_BOOLEAN,
+        'services/supplier/scrub-budget': TYPE_DISK_SPACE,
         'services/supplier-contracts/enabled': TYPE_BOOLEAN,
         'services/supplier-contracts/initial-duration-hours': TYPE_NON_ZERO_POSITIVE_INTEGER,
         'services/supplier-contracts/duration-raise-factor': TYPE_NON_ZERO_POSITIVE_FLOATING_POINT,
@@ -221,6 +223,7 @@ def defaults():
         'services/tcp-transport/receiving-enabled': TYPE_BOOLEAN,
         'services/tcp-transport/sending-enabled': TYPE_BOOLEAN,
         'services/tcp-transport/priority': TYPE_POSITIVE_INTEGER,
+        'services/tcp-transport/worker-process-enabled': TYPE_BOOLEAN,
         'services/udp-datagrams/enabled': TYPE_BOOLEAN,
         'services/udp-datagrams/udp-port': TYPE_PORT_NUMBER,
         'services/udp-transport/enabled': TYPE_BOOLEAN,
@@ -380,6 +380,13 @@ def DefaultDonatedBytes():
     return 8*1024*1024*1024  # 8 GB
 
 
+def DefaultScrubBudgetBytes():
+    """
+    Default amount of customers data supplier re-reads from the disk during one scrubbing pass.
+    """
+    return 64*1024*1024  # 64 MB
+
+
 def DefaultNeededBytes():
     """
     Default needed space value. User can set this at any moment in the settings.
@@ -510,6 +517,13 @@ def DefaultLocaltesterValidateTimeout():
     return 120*60
 
 
+def DefaultLocaltesterScrubTimeout():
+    """
+    A period in seconds to call ``Scrub`` action of the local tester.
+    """
+    return 10*60
+
+
 def DefaultLocaltesterUpdateCustomersTimeout():
     """
     A period in seconds to call ``UpdateCustomers`` action of the local tester.
@@ -696,6 +710,14 @@ def IdentityCacheDir():
     return os.path.join(BaseDir(), 'identitycache')
 
 
+def IdentityCacheIndexFile():
+    """
+    Revisions, sources and contacts of all cached identities are stored in that file,
+    see ``contacts.identitydb`` module.
+    """
+    return os.path.join(BaseDir(), 'identitycache.index')
+
+
 def IdentityServerDir():
     return os.path.join(BaseDir(), 'identityserver')
 
@@ -782,6 +804,20 @@ def RatingsDir():
     return os.path.join(BaseDir(), 'ratings')
 
 
+def RatingsDatabaseFile():
+    """
+    Uptime samples and counters of all known users are stored in that SQLite database.
+    """
+    return os.path.join(RatingsDir(), 'ratings.db')
+
+
+def SupplierPiecesManifestFile():
+    """
+    Hashes of all customers pieces stored on that node are kept in that SQLite database.
+    """
+    return os.path.join(ServiceDir('service_supplier'), 'pieces.db')
+
+
 def ContractChainDir():
     return os.path.join(BaseDir(), 'contracts')
 
@@ -1811,6 +1847,13 @@ def getDonatedBytes():
     return diskspace.GetBytesFromString(getDonatedString())
 
 
+def getScrubBudgetBytes():
+    """
+    How many bytes of stored customers data can be re-checked during one scrubbing pass.
+    """
+    return diskspace.GetBytesFromString(config.conf().getData('services/supplier/scrub-budget') or '', default=DefaultScrubBudgetBytes())
+
+
 def getUpdatesMode():
     """
     User can set different modes to update the BitDust software.
@@ -68,10 +68,11 @@ def init():
         Ack(),
         Fail(),
     ]
-    # Ack Retrieve with Data or Fail
+    # Ack Retrieve with Data or Fail, multi-file Retrieve is also confirmed with Ack
     P2PCommandAcks[Retrieve()] = [
         Data(),
         Fail(),
+        Ack(),
     ]
     # Ack ListFiles with Files
     P2PCommandAcks[ListFiles()] = [
@@ -27,6 +27,18 @@
 .. module:: lookup.
 
 .. role:: red
+
+Discovery of random nodes in the DHT layers.
+
+Several ``DiscoveryTask`` objects are running at the same time (up to ``MAX_CONCURRENT_LOOKUPS``),
+other tasks are waiting in the queue. Identities of discovered nodes are fetched in parallel,
+but not more than ``MAX_CONCURRENT_FETCHES`` at once for all tasks.
+
+Results of observing DHT nodes are shared between tasks of the same layer:
+a node which recently responded with its IDURL is not asked again
+and a node which recently failed to respond or whose identity was not possible to fetch is skipped.
+
+Duration of every task is recorded, see ``lookup_stats()``.
 """
 
 #------------------------------------------------------------------------------
@@ -44,12 +56,14 @@ import sys
 import time
 import random
 
+from collections import deque
+
 try:
     from twisted.internet import reactor  # @UnresolvedImport
 except:
     sys.exit('Error initializing twisted.internet.reactor in lookup.py')
 
-from twisted.internet.defer import DeferredList, Deferred
+from twisted.internet.defer import DeferredList, Deferred, DeferredSemaphore, succeed
 
 #------------------------------------------------------------------------------
 
@@ -65,11 +79,24 @@ from bitdust.userid import id_url
 
 #------------------------------------------------------------------------------
 
+MAX_CONCURRENT_LOOKUPS = 4
+MAX_CONCURRENT_FETCHES = 8
+KNOWN_IDURL_TTL = 30.0
+OBSERVED_NODE_TTL = 60.0
+REJECTED_NODE_TTL = 60.0
+STATS_HISTORY_SIZE = 100
+
+#------------------------------------------------------------------------------
+
 _KnownIDURLsDict = {}
 _DiscoveredIDURLsList = {}
+_ObservedNodes = {}
+_RejectedNodes = {}
 _LookupTasks = []
 _LatestLookupID = 0
-_CurrentLookupTask = None
+_RunningLookupTasks = []
+_FetchSemaphore = DeferredSemaphore(MAX_CONCURRENT_FETCHES)
+_LookupStats = {}
 _LookupMethod = None  # method to get a list of random nodes
 _ObserveMethod = None  # method to get IDURL from given node
 _ProcessMethod = None  # method to do some stuff with discovered IDURL
@@ -102,9 +129,11 @@ def shutdown():
 #------------------------------------------------------------------------------
 
 
-def known_idurls():
+def known_idurls(layer_id=0):
     global _KnownIDURLsDict
-    return _KnownIDURLsDict
+    if layer_id not in _KnownIDURLsDict:
+        _KnownIDURLsDict[layer_id] = {}
+    return _KnownIDURLsDict[layer_id]
 
 
 def discovered_idurls(layer_id=0):
@@ -114,6 +143,103 @@ def discovered_idurls(layer_id=0):
     return _DiscoveredIDURLsList[layer_id]
 
 
+def observed_nodes(layer_id=0):
+    """
+    DHT nodes which recently responded with their IDURL: ``{node_id: (idurl, observed_time)}``.
+    """
+    global _ObservedNodes
+    if layer_id not in _ObservedNodes:
+        _ObservedNodes[layer_id] = {}
+    return _ObservedNodes[layer_id]
+
+
+def rejected_nodes(layer_id=0):
+    """
+    DHT nodes which recently did not respond or their identity was not possible to fetch: ``{node_id: rejected_time}``.
+    """
+    global _RejectedNodes
+    if layer_id not in _RejectedNodes:
+        _RejectedNodes[layer_id] = {}
+    return _RejectedNodes[layer_id]
+
+
+def is_rejected(node_id, layer_id=0):
+    rejected_time = rejected_nodes(layer_id=layer_id).get(node_id)
+    if rejected_time is None:
+        return False
+    if time.time() - rejected_time > REJECTED_NODE_TTL:
+        rejected_nodes(layer_id=layer_id).pop(node_id, None)
+        return False
+    return True
+
+
+def get_observed_idurl(node_id, layer_id=0):
+    info = observed_nodes(layer_id=layer_id).get(node_id)
+    if info is None:
+        return None
+    if time.time() - info[1] > OBSERVED_NODE_TTL:
+        observed_nodes(layer_id=layer_id).pop(node_id, None)
+        return None
+    return info[0]
+
+
+def remember_observed_node(node_id, idurl, layer_id=0):
+    if node_id is None:
+        return
+    rejected_nodes(layer_id=layer_id).pop(node_id, None)
+    observed_nodes(layer_id=layer_id)[node_id] = (idurl, time.time())
+
+
+def remember_rejected_node(node_id, layer_id=0):
+    if node_id is None:
+        return
+    observed_nodes(layer_id=layer_id).pop(node_id, None)
+    rejected_nodes(layer_id=layer_id)[node_id] = time.time()
+
+
+#------------------------------------------------------------------------------
+
+
+def lookup_stats(layer_id=None):
+    """
+    Returns latency statistics of recently finished lookups for every DHT layer (or only for given layer).
+    All durations are in seconds: "queued" is time spent waiting for a free slot, "dht" is the duration
+    of the DHT request and "total" is the time from creating the task till reporting the result.
+    """
+    result = {}
+    for one_layer_id, history in _LookupStats.items():
+        if layer_id is not None and one_layer_id != layer_id:
+            continue
+        totals = sorted(h['total'] for h in history)
+        if not totals:
+            continue
+        result[one_layer_id] = {
+            'count': len(totals),
+            'min': totals[0],
+            'max': totals[-1],
+            'avg': round(sum(totals)/len(totals), 3),
+            'p50': totals[int(len(totals)*0.5)],
+            'p90': totals[min(len(totals) - 1, int(len(totals)*0.9))],
+            'avg_queued': round(sum(h['queued'] for h in history)/len(history), 3),
+            'avg_dht': round(sum(h['dht'] for h in history)/len(history), 3),
+            'nodes': sum(h['nodes'] for h in history),
+            'succeed': sum(h['succeed'] for h in history),
+            'failed': sum(h['failed'] for h in history),
+            'cache_hits': sum(h['cache_hits'] for h in history),
+        }
+    return {
+        'running': len(_RunningLookupTasks),
+        'queued': len(_LookupTasks),
+        'layers': result,
+    }
+
+
+def add_lookup_stats(layer_id, info):
+    if layer_id not in _LookupStats:
+        _LookupStats[layer_id] = deque(maxlen=STATS_HISTORY_SIZE)
+    _LookupStats[layer_id].append(info)
+
+
 #------------------------------------------------------------------------------
 
 
@@ -199,7 +325,8 @@ def start(
     layer_id=0,
 ):
     """
-    NOTE: no parallel threads, DHT lookup can be started only one at time.
+    Creates a new ``DiscoveryTask`` and puts it in the queue, or returns already discovered nodes if there are enough of them.
+    Up to ``MAX_CONCURRENT_LOOKUPS`` tasks are running at the same time.
     """
     global _LookupTasks
     t = DiscoveryTask(
@@ -233,49 +360,30 @@ def start(
 #------------------------------------------------------------------------------
 
 
-def on_lookup_task_success(result):
-    global _CurrentLookupTask
+def on_lookup_task_finished(t):
+    global _RunningLookupTasks
     if _Debug:
-        lg.out(_DebugLevel - 4, 'lookup.on_lookup_task_success %s' % result)
-    _CurrentLookupTask = None
-    reactor.callLater(0, work)  # @UndefinedVariable
-    return result
-
-
-def on_lookup_task_failed(err):
-    global _CurrentLookupTask
-    if _Debug:
-        lg.out(_DebugLevel - 4, 'lookup.on_lookup_task_failed: %s' % err)
-    _CurrentLookupTask = None
-    reactor.callLater(0, work)  # @UndefinedVariable
-    return err
+        lg.out(_DebugLevel - 4, 'lookup.on_lookup_task_finished %r, %d tasks running' % (t.id, len(_RunningLookupTasks)))
+    if t in _RunningLookupTasks:
+        _RunningLookupTasks.remove(t)
+        reactor.callLater(0, work)  # @UndefinedVariable
 
 
 def work():
-    global _CurrentLookupTask
+    global _RunningLookupTasks
     global _LookupTasks
-    if _CurrentLookupTask:
+    while _LookupTasks and len(_RunningLookupTasks) < MAX_CONCURRENT_LOOKUPS:
+        t = _LookupTasks.pop(0)
+        if t.stopped or not t.result_defer or not t.lookup_method:
+            lg.warn('task %s is closed' % t)
+            continue
         if _Debug:
-            lg.out(_DebugLevel - 4, 'lookup.work SKIP, %s is in progress' % _CurrentLookupTask)
-        return
-    if not _LookupTasks:
-        if _Debug:
-            lg.out(_DebugLevel - 4, 'lookup.work SKIP no lookup tasks in the queue')
-        return
+            lg.out(_DebugLevel - 4, 'lookup.work starting task %r, %d tasks running, %d in the queue' % (t.id, len(_RunningLookupTasks), len(_LookupTasks)))
+        _RunningLookupTasks.append(t)
+        t.start()
     if _Debug:
-        lg.out(_DebugLevel - 4, 'lookup.work starting next task in the queue')
-    _CurrentLookupTask = _LookupTasks.pop(0)
-    if _CurrentLookupTask.stopped or not _CurrentLookupTask.result_defer or not _CurrentLookupTask.lookup_method:
-        lg.warn('task %s is closed' % _CurrentLookupTask)
-        _CurrentLookupTask = None
-        return
-    _CurrentLookupTask.start()
-    if _CurrentLookupTask.result_defer:
-        _CurrentLookupTask.result_defer.addCallback(on_lookup_task_success)
-        _CurrentLookupTask.result_defer.addErrback(on_lookup_task_failed)
-    else:
-        lg.warn('task %s was closed immediately' % _CurrentLookupTask)
-        _CurrentLookupTask = None
+        if _LookupTasks:
+            lg.out(_DebugLevel - 4, 'lookup.work %d tasks are running, %d tasks are waiting in the queue' % (len(_RunningLookupTasks), len(_LookupTasks)))
 
 
 #------------------------------------------------------------------------------
@@ -378,10 +486,14 @@ class DiscoveryTask(object):
         self.consume = consume
         self.observed_count = 0
         self.cached_count = 0
+        self.cache_hits = 0
         self.succeed = 0
         self.failed = 0
         self.lookup_now = False
         self.stopped = False
+        self.finished = False
+        self.work_started = None
+        self.nodes_discovered = None
         self.observe_finished = False
         self.lookup_task = None
         self.result_defer = Deferred(canceller=lambda d: self._close())
@@ -402,6 +514,8 @@ class DiscoveryTask(object):
             return self.lookup_task
         if _Debug:
             lg.out(_DebugLevel, 'lookup.DiscoveryTask[%r].start  layer_id=%d' % (self.id, self.layer_id))
+        if self.work_started is None:
+            self.work_started = time.time()
         return self._lookup_nodes()
 
     def stop(self):
@@ -410,6 +524,25 @@ class DiscoveryTask(object):
         self.stopped = True
         self._close()
 
+    def _finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self.work_started is not None:
+            finished_time = time.time()
+            add_lookup_stats(
+                self.layer_id, {
+                    'total': round(finished_time - self.started, 3),
+                    'queued': round(self.work_started - self.started, 3),
+                    'dht': round((self.nodes_discovered or finished_time) - self.work_started, 3),
+                    'nodes': self.observed_count,
+                    'succeed': self.succeed,
+                    'failed': self.failed,
+                    'cache_hits': self.cache_hits,
+                }
+            )
+        on_lookup_task_finished(self)
+
     def _close(self):
         self.stopped = True
         if self.lookup_task and not self.lookup_task.called:
@@ -421,6 +554,7 @@ class DiscoveryTask(object):
         self.result_defer = None
         if _Debug:
             lg.out(_DebugLevel, 'lookup.DiscoveryTask[%r].close finished in %f seconds' % (self.id, round(time.time() - self.started, 3)))
+        self._finish()
 
     def _lookup_nodes(self):
         if self.lookup_task and not self.lookup_task.called:
@@ -443,7 +577,19 @@ class DiscoveryTask(object):
             lg.out(_DebugLevel, 'lookup.DiscoveryTask[%r]._observe_nodes  started for %d items  layer_id=%d' % (self.id, len(nodes), self.layer_id))
         observe_list = []
         for node in nodes:
-            d = self.observe_method(node, layer_id=self.layer_id)
+            node_id = getattr(node, 'id', None) if self.is_idurl else None
+            if node_id is not None and is_rejected(node_id, layer_id=self.layer_id):
+                if _Debug:
+                    lg.out(_DebugLevel, 'lookup.DiscoveryTask[%r]._observe_nodes  SKIP %r, recently rejected' % (self.id, node))
+                self.cache_hits += 1
+                self.failed += 1
+                continue
+            cached_idurl = get_observed_idurl(node_id, layer_id=self.layer_id) if node_id is not None else None
+            if cached_idurl:
+                self.cache_hits += 1
+                d = succeed(cached_idurl)
+            else:
+                d = self.observe_method(node, layer_id=self.layer_id)
             d.addCallback(self._on_node_observed, node)
             d.addErrback(self._on_node_observe_failed, node)
             observe_list.append(d)
@@ -467,12 +613,14 @@ class DiscoveryTask(object):
         if self.result_defer and not self.result_defer.called:
             self.result_defer.callback(results)
         self.result_defer = None
+        self._finish()
 
     def _report_fails(self, err):
         lg.err('DHT lookup %r failed: %r' % (self.id, err))
         if self.result_defer:
             self.result_defer.errback(err)
         self.result_defer = None
+        self._finish()
 
     def _on_node_succeed(self, node, idurl):
         self.succeed += 1
@@ -483,6 +631,8 @@ class DiscoveryTask(object):
 
     def _on_node_process_failed(self, err, node):
         self.failed += 1
+        if err is not None and self.is_idurl:
+            remember_rejected_node(getattr(node, 'id', None), layer_id=self.layer_id)
         if _Debug:
             lg.warn('DiscoveryTask[%r] : node %r processing failed with  %r' % (self.id, node, err))
         reactor.callLater(0, self._on_node_processed, node, None)  # @UndefinedVariable
@@ -491,6 +641,8 @@ class DiscoveryTask(object):
     def _on_node_observe_failed(self, err, node):
         try:
             self.failed += 1
+            if self.is_idurl:
+                remember_rejected_node(getattr(node, 'id', None), layer_id=self.layer_id)
             if _Debug:
                 err = strng.to_text(err, errors='ignore')
                 if err.count('idurl observe failed'):
@@ -509,13 +661,14 @@ class DiscoveryTask(object):
         idurl = id_url.to_bin(value)
         if _Debug:
             lg.out(_DebugLevel + 4, 'lookup.DiscoveryTask[%r]._on_node_observed %r : %r' % (self.id, node, idurl))
-        cached_time = known_idurls().get(idurl)
-        if cached_time and time.time() - cached_time < 30.0:
+        remember_observed_node(getattr(node, 'id', None), idurl, layer_id=self.layer_id)
+        cached_time = known_idurls(layer_id=self.layer_id).get(idurl)
+        if cached_time and time.time() - cached_time < KNOWN_IDURL_TTL:
             if _Debug:
                 lg.out(_DebugLevel + 4, 'lookup.DiscoveryTask[%r]._on_node_observed   SKIP processing node %r because already observed recently' % (self.id, idurl))
             self._on_identity_cached(idurl, node)
             return idurl
-        d = self.process_method(idurl, node)
+        d = _FetchSemaphore.run(self.process_method, idurl, node)
         d.addCallback(self._on_identity_cached, node)
         d.addErrback(self._on_node_process_failed, node)
         return idurl
@@ -582,7 +735,7 @@ class DiscoveryTask(object):
         idurl = id_url.to_bin(idurl)
         if idurl not in discovered_idurls(layer_id=self.layer_id):
             discovered_idurls(layer_id=self.layer_id).append(idurl)
-        known_idurls()[idurl] = time.time()
+        known_idurls(layer_id=self.layer_id)[idurl] = time.time()
         self._on_node_succeed(node, idurl)
         if _Debug:
             lg.out(_DebugLevel, 'lookup.DiscoveryTask[%r]._on_identity_cached : %s' % (self.id, idurl))
@@ -592,6 +745,7 @@ class DiscoveryTask(object):
         if _Debug:
             lg.out(_DebugLevel, 'lookup.DiscoveryTask[%r]._on_nodes_discovered : %s, stopped=%s' % (self.id, str(nodes), self.stopped))
         self.lookup_now = False
+        self.nodes_discovered = time.time()
         if self.stopped:
             lg.warn('DiscoveryTask[%r] : nodes are discovered, but the task was already stopped' % self.id)
             self._close()
@@ -618,3 +772,74 @@ class DiscoveryTask(object):
 
 
 #------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Runs 12 lookups in 3 layers with simulated network delays: DHT request takes 0.3 sec,
+    every node responds with IDURL in 0.1 sec and identity fetching takes 0.2 sec.
+    First all tasks are executed one by one, as it was before, then concurrently.
+    """
+
+    class _Node(object):
+
+        def __init__(self, node_id):
+            self.id = node_id
+
+    def _delayed(delay, value):
+        d = Deferred()
+        reactor.callLater(delay, d.callback, value)  # @UndefinedVariable
+        return d
+
+    def _lookup_method(layer_id=0):
+        return _delayed(0.3, [_Node(b'node%d' % random.randint(0, 40)) for _ in range(8)])
+
+    def _observe_method(node, layer_id=0):
+        return _delayed(0.1, b'http://127.0.0.1:8084/%s.xml' % node.id)
+
+    def _process_method(idurl, node):
+        return _delayed(0.2, idurl)
+
+    def _run_tasks(concurrency, results):
+        global MAX_CONCURRENT_LOOKUPS
+        MAX_CONCURRENT_LOOKUPS = concurrency
+        _KnownIDURLsDict.clear()
+        _DiscoveredIDURLsList.clear()
+        _ObservedNodes.clear()
+        _RejectedNodes.clear()
+        _LookupStats.clear()
+        started = time.time()
+        dl = []
+        for i in range(12):
+            t = start(
+                count=2,
+                layer_id=i % 3,
+                force_discovery=True,
+                lookup_method=_lookup_method,
+                observe_method=_observe_method,
+                process_method=_process_method,
+            )
+            dl.append(t.result_defer)
+        d = DeferredList(dl)
+        d.addCallback(lambda _: results.append((concurrency, time.time() - started, lookup_stats())))
+        return d
+
+    def _run_all():
+        results = []
+        d = _run_tasks(1, results)
+        d.addCallback(lambda _: _run_tasks(4, results))
+        d.addCallback(lambda _: _report(results))
+        d.addBoth(lambda _: reactor.stop())  # @UndefinedVariable
+
+    def _report(results):
+        for concurrency, duration, stats in results:
+            avg_latency = sum(s['avg'] for s in stats['layers'].values())/len(stats['layers'])
+            cache_hits = sum(s['cache_hits'] for s in stats['layers'].values())
+            print('%d lookups at once: 12 lookups finished in %.2f sec, average lookup latency %.2f sec, %d cache hits' % (concurrency, duration, avg_latency, cache_hits))
+
+    reactor.callWhenRunning(_run_all)  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+
+
+if __name__ == '__main__':
+    main()
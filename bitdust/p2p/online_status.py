@@ -41,8 +41,15 @@ This simple state machine is used to detect connection status with remote user.
 The situation when remote user replies to a packet sent to him
 means that he is currently available over the network.
 
-A one instance of ``online_status()`` machine is created for
-every remote contact and monitor his status.
+Every known remote contact has a compact ``PeerStatus`` record in a single table.
+Most of the time remote peer is only passively tracked: the record is updated on every
+incoming packet and a single scheduler (a heap of due times) decides when the peer must be
+pinged again. The state transitions of the passive tracking are defined in ``_PassiveTransitions``
+and follow exactly the ``online_status()`` state machine.
+
+A real instance of ``online_status()`` machine is created only when it is really needed:
+someone requested ping/handshake, attached a listener callback or called ``getInstance()``.
+The state is always kept in the record, so the machine and the record can not go out of sync.
 
 
 EVENTS:
@@ -71,7 +78,9 @@ _DebugLevel = 20
 
 #------------------------------------------------------------------------------
 
-from twisted.internet.task import LoopingCall
+import heapq
+
+from twisted.internet import reactor  # @UnresolvedImport
 from twisted.internet.defer import Deferred
 
 #------------------------------------------------------------------------------
@@ -108,73 +117,116 @@ _StatusLabels = {
 
 #------------------------------------------------------------------------------
 
-_OnlineStatusDict = {}
+CONNECTED_CHECK_INTERVAL = 60
+PING_TIMEOUT = 20.0
+OFFLINE_CHECK_PERIOD = 10
+OFFLINE_CHECK_INTERVAL = 10*60
+RECENT_INBOX_INTERVAL = 60
+
+#------------------------------------------------------------------------------
+
+_PeersTable = {}
+_Clock = None
+_ScheduleHeap = []
+_ScheduleTask = None
+_ScheduleCounter = 0
 _ShutdownFlag = False
-_OfflineCheckTask = None
 
 #------------------------------------------------------------------------------
 
 
-def init():
+def init(clock=None):
     """
     Called from top level code when the software is starting.
     Needs to be called before other methods here.
+    The ``clock`` can be used to pass ``twisted.internet.task.Clock`` in tests.
     """
-    global _OfflineCheckTask
     global _ShutdownFlag
+    global _Clock
     if _Debug:
         lg.out(_DebugLevel, 'online_status.init')
     _ShutdownFlag = False
+    _Clock = clock
     callback.insert_inbox_callback(1, Inbox)  # try to not overwrite top callback in the list, but stay on top
     callback.add_queue_item_status_callback(OutboxStatus)
-    _OfflineCheckTask = LoopingCall(RunOfflineChecks)
-    _OfflineCheckTask.start(10, now=False)
 
 
 def shutdown():
     """
     Called from top level code when the software is stopping.
     """
-    global _OfflineCheckTask
+    global _ScheduleTask
     global _ShutdownFlag
-    global _OnlineStatusDict
+    global _Clock
     if _Debug:
         lg.out(_DebugLevel, 'online_status.shutdown')
     handshaker.cancel_all()
-    _OfflineCheckTask.stop()
-    del _OfflineCheckTask
-    _OfflineCheckTask = None
+    if _ScheduleTask and _ScheduleTask.active():
+        _ScheduleTask.cancel()
+    _ScheduleTask = None
+    del _ScheduleHeap[:]
     callback.remove_inbox_callback(Inbox)
     callback.remove_queue_item_status_callback(OutboxStatus)
-    for o_status in list(_OnlineStatusDict.values()):
-        o_status.automat('shutdown')
-    _OnlineStatusDict.clear()
+    for peer in list(_PeersTable.values()):
+        peer.due = None
+        if peer.instance:
+            peer.instance.automat('shutdown')
+        else:
+            peer.state = 'CLOSED'
+    _PeersTable.clear()
     _ShutdownFlag = True
+    _Clock = None
 
 
 #------------------------------------------------------------------------------
 
 
 def online_statuses():
-    global _OnlineStatusDict
-    return _OnlineStatusDict
+    return _PeersTable
 
 
 def check_create(idurl, keep_alive=True):
     """
-    Creates new instance of online_status() state machine and send "init" event to it.
+    Creates a new record for given remote node in the table if it not exist yet.
+    Initial state of the new record is OFFLINE.
     """
+    return _get_peer(idurl, autocreate=True, keep_alive=keep_alive) is not None
+
+
+def _get_peer(idurl, autocreate=False, keep_alive=True):
+    if _ShutdownFlag:
+        return None
     idurl = strng.to_bin(idurl)
     if id_url.is_empty(idurl):
-        return False
+        return None
     if not id_url.is_cached(idurl):
-        return False
+        return None
     idurl = id_url.field(idurl)
-    if idurl not in list(_OnlineStatusDict.keys()):
-        A(idurl, 'init', keep_alive=keep_alive)
+    peer = _PeersTable.get(idurl)
+    if peer is None and autocreate:
+        peer = PeerStatus(idurl, keep_alive=keep_alive)
+        _PeersTable[idurl] = peer
+        _schedule_by_state(peer)
         if _Debug:
-            lg.out(_DebugLevel, 'online_status.check_create instance for %r was not found, made a new with state OFFLINE' % idurl)
-    return True
+            lg.out(_DebugLevel, 'online_status._get_peer record for %r was not found, made a new with state OFFLINE' % idurl)
+    return peer
+
+
+def _clock():
+    return _Clock or reactor
+
+
+def _get_instance(peer):
+    if peer.instance is None:
+        peer.instance = OnlineStatus(
+            peer=peer,
+            name='online_%s' % global_id.UrlToGlobalID(peer.idurl),
+            state=peer.state,
+            debug_level=_DebugLevel,
+            log_events=False,
+            log_transitions=_Debug,
+        )
+    return peer.instance
 
 
 #------------------------------------------------------------------------------
@@ -254,36 +306,19 @@ def handshake(idurl, channel=None, ack_timeout=None, ping_retries=2, keep_alive=
 
 def isKnown(idurl):
     """
-    Return `True` if state machine online_status() already exists for this
-    user.
+    Return `True` if this user is already tracked.
     """
-    global _OnlineStatusDict
-    global _ShutdownFlag
-    if _ShutdownFlag:
-        return False
-    if id_url.is_empty(idurl):
-        return False
-    if not id_url.is_cached(idurl):
-        return False
-    idurl = id_url.field(idurl)
-    return idurl in list(_OnlineStatusDict.keys())
+    return _get_peer(idurl) is not None
 
 
 def isOnline(idurl):
     """
     Return True if given contact's state is ONLINE.
     """
-    global _ShutdownFlag
-    if _ShutdownFlag:
-        return False
-    if id_url.is_empty(idurl):
-        return False
-    if not id_url.is_cached(idurl):
+    peer = _get_peer(idurl)
+    if not peer:
         return False
-    idurl = id_url.field(idurl)
-    if not isKnown(idurl):
-        return False
-    return A(idurl).state in [
+    return peer.state in [
         'CONNECTED',
         'PING?',
     ]
@@ -293,48 +328,30 @@ def isOffline(idurl):
     """
     Return True if given contact's state is OFFLINE.
     """
-    global _ShutdownFlag
-    if _ShutdownFlag:
+    peer = _get_peer(idurl)
+    if not peer:
         return True
-    if id_url.is_empty(idurl):
-        return True
-    if not id_url.is_cached(idurl):
-        return True
-    idurl = id_url.field(idurl)
-    if not isKnown(idurl):
-        return True
-    return A(idurl).state == 'OFFLINE'
+    return peer.state == 'OFFLINE'
 
 
 def isCheckingNow(idurl):
     """
     Return True if given contact's state is PING or ACK?.
     """
-    global _ShutdownFlag
-    if _ShutdownFlag:
-        return False
-    if id_url.is_empty(idurl):
-        return False
-    if not id_url.is_cached(idurl):
+    peer = _get_peer(idurl)
+    if not peer:
         return False
-    idurl = id_url.field(idurl)
-    if not isKnown(idurl):
-        return False
-    return A(idurl).state == 'PING'
+    return peer.state == 'PING'
 
 
 def getInstance(idurl, autocreate=True):
-    if _ShutdownFlag:
-        return None
-    if id_url.is_empty(idurl):
-        return None
-    if not id_url.is_cached(idurl):
-        return None
-    idurl = id_url.field(idurl)
-    if not isKnown(idurl) and not autocreate:
+    """
+    Returns ``online_status()`` state machine for given user, it is created on demand.
+    """
+    peer = _get_peer(idurl, autocreate=autocreate)
+    if not peer:
         return None
-    check_create(idurl)
-    return A(idurl)
+    return _get_instance(peer)
 
 
 def stateToLabel(state, default='?'):
@@ -346,34 +363,20 @@ def getCurrentState(idurl):
     """
     Return the current state of that user or `None` if that contact is unknown.
     """
-    global _ShutdownFlag
-    if _ShutdownFlag:
-        return None
-    if id_url.is_empty(idurl):
+    peer = _get_peer(idurl)
+    if not peer:
         return None
-    if not id_url.is_cached(idurl):
-        return None
-    idurl = id_url.field(idurl)
-    if not isKnown(idurl):
-        return None
-    return A(idurl).state
+    return peer.state
 
 
 def getStatusLabel(idurl):
     """
     Return some text description about the current state of that user.
     """
-    global _ShutdownFlag
-    if _ShutdownFlag:
-        return '?'
-    if id_url.is_empty(idurl):
-        return '?'
-    if not id_url.is_cached(idurl):
-        return '?'
-    idurl = id_url.field(idurl)
-    if not isKnown(idurl):
+    peer = _get_peer(idurl)
+    if not peer:
         return '?'
-    return stateToLabel(A(idurl).state)
+    return stateToLabel(peer.state)
 
 
 def listOfflineSuppliers(customer_idurl=None):
@@ -459,6 +462,33 @@ def remove_online_status_listener_callback(idurl, callback_method=None, callback
 #------------------------------------------------------------------------------
 
 
+def on_identity_url_changed(old_idurl):
+    """
+    Called when identity of remote node was rotated to another ID server.
+    The record in the table is moved to the new IDURL and the connection is checked again.
+    """
+    old_idurl = id_url.field(old_idurl)
+    for idurl in list(_PeersTable.keys()):
+        if idurl != old_idurl:
+            continue
+        peer = _PeersTable.pop(idurl)
+        idurl.refresh(replace_original=True)
+        peer.idurl.refresh(replace_original=True)
+        new_idurl = id_url.field(peer.idurl.to_bin())
+        peer.idurl = new_idurl
+        _PeersTable[new_idurl] = peer
+        if peer.instance is not None:
+            peer.instance.name = 'online_%s' % global_id.UrlToGlobalID(new_idurl)
+        _dispatch(peer, 'shook-up-hands')
+        _clock().callLater(0, A, new_idurl, 'ping-now')  # @UndefinedVariable
+        lg.info('found %r with rotated identity and refreshed: %r' % (peer, new_idurl))
+        return True
+    return False
+
+
+#------------------------------------------------------------------------------
+
+
 def populate_online_statuses():
     for online_s in online_statuses().values():
         listeners.push_snapshot('online_status', snap_id=online_s.idurl.to_text(), data=online_s.to_json())
@@ -514,8 +544,14 @@ def Inbox(newpacket, info, status, message):
         return False
     if newpacket.RemoteID != my_id.getIDURL():
         return False
-    check_create(newpacket.OwnerID)
-    A(newpacket.OwnerID, 'inbox-packet', (newpacket, info, status, message))
+    peer = _get_peer(newpacket.OwnerID, autocreate=True)
+    if not peer:
+        return False
+    if peer.state == 'CONNECTED':
+        # most of the packets are coming from already connected nodes: only remember the time
+        _do_remember_time(peer, 'inbox-packet')
+    else:
+        _dispatch(peer, 'inbox-packet', (newpacket, info, status, message))
     return False
 
 
@@ -530,33 +566,265 @@ def PacketSendingTimeout(remoteID, packetID):
         return False
     if remoteID == my_id.getIDURL():
         return False
-    check_create(remoteID)
+    peer = _get_peer(remoteID, autocreate=True)
+    if not peer:
+        return False
     # TODO: do something in that case ... send event "ping-now" ?
-    A(remoteID, 'sent-timeout', packetID)
+    _dispatch(peer, 'sent-timeout', packetID)
     return True
 
 
 #------------------------------------------------------------------------------
 
 
-def RunOfflineChecks():
-    for o_status in list(_OnlineStatusDict.values()):
-        if o_status.state != 'OFFLINE':
-            # if user is online or checking: do nothing
-            continue
-        if not o_status.latest_check_time:
-            # if no checks done yet but he is offline: ping user
-            o_status.automat('offline-check')
-            continue
-        if utime.utcnow_to_sec1970() - o_status.latest_check_time > 10*60:
-            # user is offline and latest check was sent a while ago: lets try to ping user again
-            o_status.automat('offline-check')
+def _is_recent_inbox(peer):
+    if handshaker.is_running(peer.idurl.to_bin()):
+        return True
+    if not peer.latest_inbox_time:
+        return False
+    return utime.utcnow_to_sec1970() - peer.latest_inbox_time > RECENT_INBOX_INTERVAL
+
+
+def _is_offline_check_needed(peer):
+    if not peer.latest_check_time:
+        # if no checks done yet but he is offline: ping user
+        return True
+    if utime.utcnow_to_sec1970() - peer.latest_check_time > OFFLINE_CHECK_INTERVAL:
+        # user is offline and latest check was sent a while ago: lets try to ping user again
+        return True
+    if peer.latest_inbox_time and utime.utcnow_to_sec1970() - peer.latest_inbox_time < RECENT_INBOX_INTERVAL:
+        # user is offline, but we know that he was online recently: lets try to ping him again
+        return True
+    return False
+
+
+def _do_remember_time(peer, event, *args, **kwargs):
+    now = utime.utcnow_to_sec1970()
+    if not peer.latest_inbox_time or now - peer.latest_inbox_time >= 5*60:
+        ratings.remember_connected_time(peer.idurl.to_bin())
+    peer.latest_inbox_time = now
+
+
+def _do_remember_check_time(peer, event, *args, **kwargs):
+    peer.latest_check_time = utime.utcnow_to_sec1970()
+
+
+def _do_handshake(peer, event, *args, **kwargs):
+    channel = kwargs.get('channel', None)
+    ack_timeout = kwargs.get('ack_timeout', 15)
+    ping_retries = kwargs.get('ping_retries', 2)
+    original_idurl = kwargs.get('original_idurl', peer.idurl.to_bin())
+    d = None
+    if event == 'ping-now':
+        d = handshaker.ping(
+            idurl=original_idurl,
+            ack_timeout=ack_timeout,
+            ping_retries=ping_retries,
+            channel=channel or 'ping',
+            cancel_running=True,
+        )
+    elif event == 'handshake':
+        d = handshaker.ping(
+            idurl=original_idurl,
+            ack_timeout=ack_timeout,
+            ping_retries=ping_retries,
+            force_cache=True,
+            channel=channel or 'handshake',
+            cancel_running=True,
+        )
+    elif event == 'offline-ping':
+        if peer.keep_alive:
+            d = handshaker.ping(
+                idurl=original_idurl,
+                ack_timeout=ack_timeout,
+                cache_timeout=15,
+                ping_retries=ping_retries,
+                force_cache=True,
+                channel='offline_ping',
+            )
+    else:
+        if peer.keep_alive:
+            d = handshaker.ping(
+                idurl=original_idurl,
+                ack_timeout=ack_timeout,
+                cache_timeout=15,
+                ping_retries=ping_retries,
+                force_cache=True,
+                channel='idle_ping',
+            )
+    if d:
+        d.addCallback(_on_ping_success, peer)
+        d.addErrback(_on_ping_failed, peer)
+
+
+def _on_ping_success(result, peer):
+    response = None
+    info = None
+    try:
+        response = result[0]
+        info = result[1]
+    except:
+        lg.exc()
+    if _Debug:
+        lg.out(_DebugLevel, 'online_status._on_ping_success %r : %r' % (peer.idurl, result))
+    _dispatch(peer, 'shook-up-hands', (
+        response,
+        info,
+    ))
+    return None
+
+
+def _on_ping_failed(err, peer):
+    try:
+        msg = err.getErrorMessage()
+    except:
+        msg = str(err)
+    if _Debug:
+        lg.out(_DebugLevel, 'online_status._on_ping_failed %r : %s' % (peer.idurl, msg))
+    _dispatch(peer, 'ping-failed', err)
+    return None
+
+
+def _on_state_changed(peer, oldstate, newstate):
+    if newstate == 'CONNECTED':
+        lg.info('remote node connected : %s' % peer.idurl)
+        events.send('node-connected', data=dict(
+            global_id=peer.idurl.to_id(),
+            idurl=peer.idurl,
+            old_state=oldstate,
+            new_state=newstate,
+        ))
+        listeners.push_snapshot('online_status', snap_id=peer.idurl.to_text(), data=peer.to_json())
+    if newstate == 'OFFLINE' and oldstate != 'AT_STARTUP':
+        lg.info('remote node disconnected : %s' % peer.idurl)
+        events.send('node-disconnected', data=dict(
+            global_id=peer.idurl.to_id(),
+            idurl=peer.idurl,
+            old_state=oldstate,
+            new_state=newstate,
+        ))
+        listeners.push_snapshot('online_status', snap_id=peer.idurl.to_text(), data=peer.to_json())
+    if newstate == 'PING?' and oldstate != 'AT_STARTUP':
+        listeners.push_snapshot('online_status', snap_id=peer.idurl.to_text(), data=peer.to_json())
+    _schedule_by_state(peer)
+
+
+#------------------------------------------------------------------------------
+
+_PassiveTransitions = {
+    # (state, event): (condition, new state, actions)
+    # same as in the OnlineStatus.A() for states OFFLINE and CONNECTED,
+    # other events like "ping-now" or "handshake" are always passed to the state machine
+    ('OFFLINE', 'inbox-packet'): (None, 'CONNECTED', (_do_remember_time, )),
+    ('OFFLINE', 'shook-up-hands'): (None, 'CONNECTED', (_do_remember_time, )),
+    ('OFFLINE', 'offline-check'): (None, None, (_do_remember_check_time, _do_handshake)),
+    ('OFFLINE', 'ack-received'): (None, None, (_do_remember_check_time, _do_handshake)),
+    ('CONNECTED', 'ping-failed'): (None, 'OFFLINE', ()),
+    ('CONNECTED', 'timer-1min'): (lambda peer: not _is_recent_inbox(peer), None, (_do_handshake, )),
+    ('CONNECTED', 'inbox-packet'): (None, None, (_do_remember_time, )),
+    ('CONNECTED', 'shook-up-hands'): (None, None, (_do_remember_time, )),
+    ('CONNECTED', 'ack-receieved'): (None, None, (_do_remember_time, )),
+}
+
+_StateTimers = {
+    'CONNECTED': 'timer-1min',
+    'PING?': 'timer-20sec',
+}
+
+
+def _dispatch(peer, event, *args, **kwargs):
+    """
+    Passes the event to the ``online_status()`` state machine if it was already created for that peer,
+    otherwise only the record in the table is updated.
+    """
+    if peer.instance is not None:
+        peer.instance.automat(event, *args, **kwargs)
+        return
+    transition = _PassiveTransitions.get((peer.state, event))
+    if not transition:
+        return
+    condition, newstate, actions = transition
+    if condition and not condition(peer):
+        return
+    oldstate = peer.state
+    if newstate:
+        peer.state = newstate
+    for action in actions:
+        action(peer, event, *args, **kwargs)
+    if newstate and newstate != oldstate:
+        if _Debug:
+            lg.out(_DebugLevel, 'online_%s : [%s]->[%s]' % (peer.idurl, oldstate, newstate))
+        _on_state_changed(peer, oldstate, newstate)
+
+
+#------------------------------------------------------------------------------
+
+
+def _schedule(peer, delay):
+    global _ScheduleTask
+    global _ScheduleCounter
+    _ScheduleCounter += 1
+    peer.due = _clock().seconds() + delay
+    heapq.heappush(_ScheduleHeap, (peer.due, _ScheduleCounter, peer))
+    if _ScheduleTask is None or not _ScheduleTask.active():
+        _ScheduleTask = _clock().callLater(delay, RunSchedule)
+    elif _ScheduleTask.getTime() > peer.due:
+        _ScheduleTask.reset(delay)
+
+
+def _schedule_by_state(peer):
+    if peer.state == 'CONNECTED':
+        _schedule(peer, CONNECTED_CHECK_INTERVAL)
+    elif peer.state == 'PING?':
+        _schedule(peer, PING_TIMEOUT)
+    elif peer.state == 'OFFLINE':
+        delay = OFFLINE_CHECK_PERIOD
+        if peer.latest_check_time and not _is_offline_check_needed(peer):
+            delay = max(delay, peer.latest_check_time + OFFLINE_CHECK_INTERVAL - utime.utcnow_to_sec1970())
+            if peer.latest_inbox_time:
+                delay = min(delay, max(OFFLINE_CHECK_PERIOD, peer.latest_inbox_time + RECENT_INBOX_INTERVAL - utime.utcnow_to_sec1970()))
+        _schedule(peer, delay)
+    else:
+        peer.due = None
+
+
+def RunSchedule():
+    """
+    Single timer for all known peers: fires "timer-1min", "timer-20sec" and "offline-check" events
+    only for those peers which are due now.
+    """
+    global _ScheduleTask
+    _ScheduleTask = None
+    now = _clock().seconds()
+    fired = 0
+    while _ScheduleHeap and _ScheduleHeap[0][0] <= now:
+        due, _, peer = heapq.heappop(_ScheduleHeap)
+        if peer.due != due:
+            # peer was re-scheduled after that entry was added
             continue
-        if o_status.latest_inbox_time and utime.utcnow_to_sec1970() - o_status.latest_inbox_time < 60:
-            # user is offline, but we know that he was online recently: lets try to ping him again
-            o_status.automat('offline-check')
+        peer.due = None
+        if _PeersTable.get(peer.idurl) is not peer:
             continue
-    return True
+        fired += 1
+        try:
+            if peer.state == 'OFFLINE':
+                if _is_offline_check_needed(peer):
+                    _dispatch(peer, 'offline-check')
+            elif peer.state in _StateTimers:
+                _dispatch(peer, _StateTimers[peer.state])
+        except:
+            lg.exc()
+        if peer.due is None:
+            _schedule_by_state(peer)
+    if _ScheduleHeap:
+        delay = max(0, _ScheduleHeap[0][0] - now)
+        if _ScheduleTask is None or not _ScheduleTask.active():
+            _ScheduleTask = _clock().callLater(delay, RunSchedule)
+        elif _ScheduleTask.getTime() > _ScheduleHeap[0][0]:
+            _ScheduleTask.reset(delay)
+    if _Debug:
+        lg.args(_DebugLevel, fired=fired, scheduled=len(_ScheduleHeap), peers=len(_PeersTable))
+    return fired
 
 
 #------------------------------------------------------------------------------
@@ -567,24 +835,74 @@ def A(idurl, event=None, *args, **kwargs):
     Access method to interact with a state machine created for given contact.
     """
     global _ShutdownFlag
-    global _OnlineStatusDict
     idurl = id_url.field(idurl)
-    if idurl not in _OnlineStatusDict:
+    peer = _PeersTable.get(idurl)
+    if peer is None:
         if _ShutdownFlag:
             return None
         if not event:
             return None
-        _OnlineStatusDict[idurl] = OnlineStatus(
-            idurl=idurl,
-            name='online_%s' % global_id.UrlToGlobalID(idurl),
-            state='AT_STARTUP',
-            debug_level=_DebugLevel,
-            log_events=False,
-            log_transitions=_Debug,
-        )
+        peer = PeerStatus(idurl)
+        _PeersTable[idurl] = peer
+        _schedule_by_state(peer)
+    inst = _get_instance(peer)
     if event is not None:
-        _OnlineStatusDict[idurl].automat(event, *args, **kwargs)
-    return _OnlineStatusDict[idurl]
+        inst.automat(event, *args, **kwargs)
+    return inst
+
+
+#------------------------------------------------------------------------------
+
+
+def _idurl_to_json(idurl):
+    glob_id = global_id.ParseIDURL(idurl)
+    return {
+        'idurl': idurl.to_text(),
+        'global_id': glob_id['customer'],
+        'idhost': glob_id['idhost'],
+        'username': glob_id['user'],
+    }
+
+
+class PeerStatus(object):
+
+    """
+    Compact record about remote peer, one for every known contact.
+    """
+
+    __slots__ = (
+        'idurl',
+        'state',
+        'latest_inbox_time',
+        'latest_check_time',
+        'keep_alive',
+        'due',
+        'instance',
+    )
+
+    def __init__(self, idurl, keep_alive=True):
+        self.idurl = idurl
+        self.state = 'OFFLINE'
+        self.latest_inbox_time = None
+        self.latest_check_time = None
+        self.keep_alive = keep_alive
+        self.due = None
+        self.instance = None
+
+    def __repr__(self):
+        return 'PeerStatus(%s)[%s]' % (self.idurl, self.state)
+
+    def to_json(self, short=True):
+        if self.instance is not None:
+            return self.instance.to_json(short=short)
+        j = {
+            'index': None,
+            'id': 'online_%s' % global_id.UrlToGlobalID(self.idurl),
+            'name': 'OnlineStatus',
+            'state': self.state,
+        }
+        j.update(_idurl_to_json(self.idurl))
+        return j
 
 
 #------------------------------------------------------------------------------
@@ -594,34 +912,51 @@ class OnlineStatus(automat.Automat):
 
     """
     This class implements all the functionality of ``online_status()`` state machine.
+    The state and all other values are stored in the ``PeerStatus`` record.
+    Timer events "timer-1min" and "timer-20sec" are fired by ``RunSchedule()``.
     """
 
-    timers = {
-        'timer-1min': (60, ['CONNECTED']),
-        'timer-20sec': (20.0, ['PING?']),
-    }
-
-    def __init__(self, idurl, name, state, debug_level=0, log_events=False, log_transitions=False, **kwargs):
+    def __init__(self, peer, name, state, debug_level=0, log_events=False, log_transitions=False, **kwargs):
         """
         Builds `online_status()` state machine.
         """
-        self.idurl = idurl
-        self.latest_inbox_time = None
-        self.latest_check_time = None
-        self.keep_alive = False
+        self.peer = peer
+        self.handshake_callbacks = []
         super(OnlineStatus, self).__init__(name=name, state=state, debug_level=debug_level, log_events=log_events, log_transitions=log_transitions, **kwargs)
         if _Debug:
-            lg.out(_DebugLevel, 'online_status.ContactStatus %s %s %s' % (name, state, idurl))
+            lg.out(_DebugLevel, 'online_status.ContactStatus %s %s %s' % (name, state, peer.idurl))
+
+    @property
+    def state(self):
+        return self.peer.state
+
+    @state.setter
+    def state(self, value):
+        self.peer.state = value
+
+    @property
+    def idurl(self):
+        return self.peer.idurl
+
+    @idurl.setter
+    def idurl(self, value):
+        self.peer.idurl = value
+
+    @property
+    def latest_inbox_time(self):
+        return self.peer.latest_inbox_time
+
+    @property
+    def latest_check_time(self):
+        return self.peer.latest_check_time
+
+    @property
+    def keep_alive(self):
+        return self.peer.keep_alive
 
     def to_json(self, short=True):
         j = super().to_json(short=short)
-        glob_id = global_id.ParseIDURL(self.idurl)
-        j.update({
-            'idurl': self.idurl.to_text(),
-            'global_id': glob_id['customer'],
-            'idhost': glob_id['idhost'],
-            'username': glob_id['user'],
-        })
+        j.update(_idurl_to_json(self.idurl))
         return j
 
     def init(self):
@@ -636,26 +971,7 @@ class OnlineStatus(automat.Automat):
         """
         if _Debug:
             lg.out(_DebugLevel, '%s : [%s]->[%s]' % (self.name, oldstate, newstate))
-        if newstate == 'CONNECTED':
-            lg.info('remote node connected : %s' % self.idurl)
-            events.send('node-connected', data=dict(
-                global_id=self.idurl.to_id(),
-                idurl=self.idurl,
-                old_state=oldstate,
-                new_state=newstate,
-            ))
-            listeners.push_snapshot('online_status', snap_id=self.idurl.to_text(), data=self.to_json())
-        if newstate == 'OFFLINE' and oldstate != 'AT_STARTUP':
-            lg.info('remote node disconnected : %s' % self.idurl)
-            events.send('node-disconnected', data=dict(
-                global_id=self.idurl.to_id(),
-                idurl=self.idurl,
-                old_state=oldstate,
-                new_state=newstate,
-            ))
-            listeners.push_snapshot('online_status', snap_id=self.idurl.to_text(), data=self.to_json())
-        if newstate == 'PING?' and oldstate != 'AT_STARTUP':
-            listeners.push_snapshot('online_status', snap_id=self.idurl.to_text(), data=self.to_json())
+        _on_state_changed(self.peer, oldstate, newstate)
 
     def A(self, event, *args, **kwargs):
         """
@@ -726,18 +1042,14 @@ class OnlineStatus(automat.Automat):
         """
         Condition method.
         """
-        if handshaker.is_running(self.idurl.to_bin()):
-            return True
-        if not self.latest_inbox_time:
-            return False
-        return utime.utcnow_to_sec1970() - self.latest_inbox_time > 60
+        return _is_recent_inbox(self.peer)
 
     def doInit(self, *args, **kwargs):
         """
         Action method.
         """
         self.handshake_callbacks = []
-        self.keep_alive = kwargs.get('keep_alive', True)
+        self.peer.keep_alive = kwargs.get('keep_alive', True)
 
     def doSetCallback(self, *args, **kwargs):
         """
@@ -750,69 +1062,19 @@ class OnlineStatus(automat.Automat):
         """
         Action method.
         """
-        channel = kwargs.get('channel', None)
-        ack_timeout = kwargs.get('ack_timeout', 15)
-        ping_retries = kwargs.get('ping_retries', 2)
-        original_idurl = kwargs.get('original_idurl', self.idurl.to_bin())
-        d = None
-        if event == 'ping-now':
-            d = handshaker.ping(
-                idurl=original_idurl,
-                ack_timeout=ack_timeout,
-                ping_retries=ping_retries,
-                channel=channel or 'ping',
-                cancel_running=True,
-            )
-        elif event == 'handshake':
-            d = handshaker.ping(
-                idurl=original_idurl,
-                ack_timeout=ack_timeout,
-                ping_retries=ping_retries,
-                force_cache=True,
-                channel=channel or 'handshake',
-                cancel_running=True,
-            )
-        elif event == 'offline-ping':
-            if self.keep_alive:
-                d = handshaker.ping(
-                    idurl=original_idurl,
-                    ack_timeout=ack_timeout,
-                    cache_timeout=15,
-                    ping_retries=ping_retries,
-                    force_cache=True,
-                    channel='offline_ping',
-                )
-        else:
-            if self.keep_alive:
-                d = handshaker.ping(
-                    idurl=original_idurl,
-                    ack_timeout=ack_timeout,
-                    cache_timeout=15,
-                    ping_retries=ping_retries,
-                    force_cache=True,
-                    channel='idle_ping',
-                )
-        if d:
-            d.addCallback(self._on_ping_success)
-            d.addErrback(self._on_ping_failed)
+        _do_handshake(self.peer, event, *args, **kwargs)
 
     def doRememberTime(self, *args, **kwargs):
         """
         Action method.
         """
-        to_be_remembered = True
-        if self.latest_inbox_time:
-            if utime.utcnow_to_sec1970() - self.latest_inbox_time < 5*60:
-                to_be_remembered = False
-        if to_be_remembered:
-            ratings.remember_connected_time(self.idurl.to_bin())
-        self.latest_inbox_time = utime.utcnow_to_sec1970()
+        _do_remember_time(self.peer, None)
 
     def doRememberCheckTime(self, *args, **kwargs):
         """
         Action method.
         """
-        self.latest_check_time = utime.utcnow_to_sec1970()
+        _do_remember_check_time(self.peer, None)
 
     def doReportAlreadyConnected(self, *args, **kwargs):
         """
@@ -866,33 +1128,102 @@ class OnlineStatus(automat.Automat):
         """
         Remove all references to the state machine object to destroy it.
         """
-        global _OnlineStatusDict
-        _OnlineStatusDict.pop(self.idurl)
-        self.idurl = None
-        self.latest_inbox_time = None
+        _PeersTable.pop(self.idurl, None)
+        self.peer.instance = None
+        self.peer.due = None
         self.handshake_callbacks = None
         self.destroy()
 
-    def _on_ping_success(self, result):
-        try:
-            response = result[0]
-            info = result[1]
-        except:
-            lg.exc()
-        if _Debug:
-            lg.out(_DebugLevel, 'online_status._on_ping_success %r : %r' % (self.idurl, result))
-        self.automat('shook-up-hands', (
-            response,
-            info,
-        ))
-        return None
 
-    def _on_ping_failed(self, err):
-        try:
-            msg = err.getErrorMessage()
-        except:
-            msg = str(err)
-        if _Debug:
-            lg.out(_DebugLevel, 'online_status._on_ping_failed %r : %s' % (self.idurl, msg))
-        self.automat('ping-failed', err)
-        return None
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Compares old approach (one ``online_status()`` machine with own LoopingCall timers for every peer)
+    with the table of ``PeerStatus`` records and single scheduler on 10k simulated peers.
+    """
+    import time
+    import tracemalloc
+
+    class _LegacyOnlineStatus(OnlineStatus):
+        timers = {
+            'timer-1min': (60, ['CONNECTED']),
+            'timer-20sec': (20.0, ['PING?']),
+        }
+
+    class _SimulatedIDURL(bytes):
+
+        def to_bin(self):
+            return bytes(self)
+
+    peers_count = 10000
+    packets_count = 200000
+    idurls = [_SimulatedIDURL(b'http://host%d.net/peer%d.xml' % (i % 100, i)) for i in range(peers_count)]
+
+    def _make_peers():
+        peers = []
+        for idurl in idurls:
+            peer = PeerStatus(idurl)
+            peer.state = 'CONNECTED'
+            peer.latest_inbox_time = utime.utcnow_to_sec1970()
+            peers.append(peer)
+        return peers
+
+    # legacy: automat with own timers for every peer and every packet goes through automat event
+    tracemalloc.start()
+    dt = time.time()
+    legacy = [_LegacyOnlineStatus(peer=p, name='online_%d' % i, state='CONNECTED') for i, p in enumerate(_make_peers())]
+    legacy_create_time = time.time() - dt
+    legacy_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    legacy_timers = sum([len(inst.getTimers()) for inst in legacy])
+    dt = time.time()
+    for i in range(packets_count):
+        legacy[i % peers_count].automat('inbox-packet', (None, None, None, None))
+    legacy_inbox_time = time.time() - dt
+    dt = time.time()
+    for inst in legacy:
+        inst.state == 'OFFLINE'
+    legacy_scan_time = time.time() - dt
+    for inst in legacy:
+        inst.destroy()
+    del legacy
+    # table: one record per peer, O(1) update on inbox, single scheduler
+    _PeersTable.clear()
+    del _ScheduleHeap[:]
+    tracemalloc.start()
+    dt = time.time()
+    for peer in _make_peers():
+        _PeersTable[peer.idurl] = peer
+        _schedule_by_state(peer)
+    table_create_time = time.time() - dt
+    table_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    peers = list(_PeersTable.values())
+    dt = time.time()
+    for i in range(packets_count):
+        peer = peers[i % peers_count]
+        if peer.state == 'CONNECTED':
+            _do_remember_time(peer, 'inbox-packet')
+        else:
+            _dispatch(peer, 'inbox-packet', (None, None, None, None))
+    table_inbox_time = time.time() - dt
+    dt = time.time()
+    RunSchedule()
+    table_scan_time = time.time() - dt
+    print('%d peers, %d incoming packets' % (peers_count, packets_count))
+    print('    legacy: created in %.3f sec, %.1f MB, %d running timers, inbox %.1f packets/sec, offline checks loop %.4f sec' % (
+        legacy_create_time, legacy_memory/1024.0/1024.0, legacy_timers, packets_count/legacy_inbox_time, legacy_scan_time,
+    ))
+    print('    table:  created in %.3f sec, %.1f MB, %d running timers, inbox %.1f packets/sec, scheduler run %.4f sec' % (
+        table_create_time, table_memory/1024.0/1024.0, 1 if _ScheduleTask else 0, packets_count/table_inbox_time, table_scan_time,
+    ))
+    if _ScheduleTask and _ScheduleTask.active():
+        _ScheduleTask.cancel()
+    _PeersTable.clear()
+    del _ScheduleHeap[:]
+
+
+if __name__ == '__main__':
+    main()
@@ -25,12 +25,26 @@
 #
 #
 
+"""
+.. module:: ratings.
+
+Keeps track of how often known users are online.
+
+Every hour all remote contacts are checked and one uptime sample is stored for every one of them.
+Samples and monthly/total counters are kept in a single SQLite database, so one pass over
+all contacts is one transaction. Monthly and total counters are also kept in memory.
+
+Earlier versions kept two small text files for every contact: ``ratings/<idurl>/<month>`` and ``ratings/<idurl>/total``,
+they are imported into the database when it is created for the first time.
+"""
+
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
 import os
 import sys
 import time
+import sqlite3
 
 #------------------------------------------------------------------------------
 
@@ -51,6 +65,7 @@ from bitdust.logs import lg
 from bitdust.system import bpio
 
 from bitdust.lib import nameurl
+from bitdust.lib import strng
 
 from bitdust.main import settings
 
@@ -58,20 +73,30 @@ from bitdust.contacts import contactsdb
 
 #-------------------------------------------------------------------------------
 
+SAMPLES_HISTORY_DAYS = 90
+
+#-------------------------------------------------------------------------------
+
 _LoopCountRatingsTask = None
 _IndexMonth = {}
+_IndexMonthStr = None
 _IndexTotal = {}
+_ConnectedTime = {}
+_PeerIDs = {}
+_RatingsDB = None
+_LastCleanupTime = 0
 _InitDone = False
 
 #-------------------------------------------------------------------------------
 
 
-def init():
+def init(filepath=None):
     global _InitDone
     if _InitDone:
         return
     if _Debug:
         lg.out(_DebugLevel, 'ratings.init')
+    open_db(filepath)
     read_index()
     run()
     _InitDone = True
@@ -82,6 +107,7 @@ def shutdown():
     if _Debug:
         lg.out(_DebugLevel, 'ratings.shutdown')
     stop()
+    close_db()
     _InitDone = False
 
 
@@ -120,6 +146,117 @@ def stop():
             lg.out(_DebugLevel, 'ratings.stop task finished')
 
 
+#-------------------------------------------------------------------------------
+
+
+def db():
+    global _RatingsDB
+    return _RatingsDB
+
+
+def open_db(filepath=None):
+    global _RatingsDB
+    if not filepath:
+        filepath = settings.RatingsDatabaseFile()
+    if not os.path.isdir(os.path.dirname(filepath)):
+        bpio._dirs_make(os.path.dirname(filepath))
+    created = not os.path.isfile(filepath)
+    _RatingsDB = sqlite3.connect(filepath, timeout=1)
+    _RatingsDB.execute('PRAGMA journal_mode = WAL;')
+    _RatingsDB.execute('PRAGMA synchronous = NORMAL;')
+    _RatingsDB.execute('''CREATE TABLE IF NOT EXISTS "peers" (
+        "peer_id" INTEGER PRIMARY KEY,
+        "idurl" TEXT UNIQUE,
+        "connected_time" INTEGER)''')
+    _RatingsDB.execute(
+        '''CREATE TABLE IF NOT EXISTS "counters" (
+        "peer_id" INTEGER,
+        "period" TEXT,
+        "all_count" INTEGER,
+        "alive_count" INTEGER,
+        PRIMARY KEY ("peer_id", "period")) WITHOUT ROWID'''
+    )
+    _RatingsDB.execute(
+        '''CREATE TABLE IF NOT EXISTS "samples" (
+        "peer_id" INTEGER,
+        "sample_time" INTEGER,
+        "alive" INTEGER,
+        PRIMARY KEY ("peer_id", "sample_time")) WITHOUT ROWID'''
+    )
+    _RatingsDB.execute('CREATE INDEX IF NOT EXISTS "samples time" on samples(sample_time)')
+    _RatingsDB.commit()
+    _PeerIDs.clear()
+    _ConnectedTime.clear()
+    for pid, idurl, connected in _RatingsDB.execute('SELECT peer_id, idurl, connected_time FROM peers'):
+        _PeerIDs[idurl] = pid
+        if connected is not None:
+            _ConnectedTime[idurl] = connected
+    if created:
+        import_rating_files()
+    if _Debug:
+        lg.args(_DebugLevel, filepath=filepath, created=created, peers=len(_PeerIDs))
+
+
+def close_db():
+    global _RatingsDB
+    global _IndexMonthStr
+    if _RatingsDB is None:
+        return
+    _RatingsDB.commit()
+    _RatingsDB.close()
+    _RatingsDB = None
+    _PeerIDs.clear()
+    _ConnectedTime.clear()
+    _IndexMonth.clear()
+    _IndexTotal.clear()
+    _IndexMonthStr = None
+
+
+def peer_id(idurl, create=True):
+    """
+    Returns integer ID of the user in the database, creates a new record if needed.
+    Changes are not committed here.
+    """
+    idurl = strng.to_text(idurl)
+    result = _PeerIDs.get(idurl)
+    if result is None and create:
+        result = db().execute('INSERT INTO peers (idurl) VALUES (?)', (idurl, )).lastrowid
+        _PeerIDs[idurl] = result
+    return result
+
+
+def import_rating_files():
+    """
+    Reads ratings files created by previous versions and writes all of them into the database.
+    """
+    counters = []
+    connected = []
+    for idurl_filename in os.listdir(settings.RatingsDir()):
+        idurl = nameurl.FilenameUrl(idurl_filename)
+        if idurl is None or not exist_rating_dir(idurl):
+            continue
+        for period in os.listdir(rating_dir(idurl)):
+            if period == 'connected':
+                tm = read_connected_file(idurl)
+                if tm is not None:
+                    connected.append((int(tm), peer_id(idurl)))
+                    _ConnectedTime[strng.to_text(idurl)] = int(tm)
+                continue
+            rating_dict = bpio._read_dict(os.path.join(rating_dir(idurl), period))
+            try:
+                counters.append((peer_id(idurl), period, int(rating_dict['all']), int(rating_dict['alive'])))
+            except:
+                continue
+    db().executemany('INSERT OR REPLACE INTO counters (peer_id, period, all_count, alive_count) VALUES (?, ?, ?, ?)', counters)
+    db().executemany('UPDATE peers SET connected_time=? WHERE peer_id=?', connected)
+    db().commit()
+    if counters:
+        lg.info('imported %d rating records of %d users from the files' % (len(counters), len(_PeerIDs)))
+
+
+#-------------------------------------------------------------------------------
+
+
 def rating_dir(idurl):
     return os.path.join(settings.RatingsDir(), nameurl.UrlFilename(idurl))
 
@@ -138,70 +275,67 @@ def exist_rating_dir(idurl):
     return bpio._dir_exist(rating_dir(idurl))
 
 
-def make_rating_dir(idurl):
-    bpio._dir_make(rating_dir(idurl))
-
-
-def read_month_rating_dict(idurl, monthstr=None):
-    if monthstr is None:
-        monthstr = time.strftime('%m%y')
-    return bpio._read_dict(rating_month_file(idurl, monthstr))
-
-
-def write_month_rating_dict(idurl, rating_dict, monthstr=None):
-    if monthstr is None:
-        monthstr = time.strftime('%m%y')
-    return bpio._write_dict(rating_month_file(idurl, monthstr), rating_dict)
+def read_connected_file(idurl):
+    s = bpio.ReadTextFile(os.path.join(rating_dir(idurl), 'connected'))
+    if not s:
+        return None
+    try:
+        return time.mktime(time.strptime(s, '%d%m%y %H:%M:%S'))
+    except:
+        lg.exc()
+        return None
 
 
-def read_total_rating_dict(idurl):
-    return bpio._read_dict(rating_total_file(idurl))
+def make_blank_rating_dict():
+    return {'all': '0', 'alive': '0'}
 
 
-def write_total_rating_dict(idurl, rating_dict):
-    return bpio._write_dict(rating_total_file(idurl), rating_dict)
+#-------------------------------------------------------------------------------
 
 
-def make_blank_rating_dict():
-    return {'all': '0', 'alive': '0'}
+def increase_ratings(alive_states, now=None):
+    """
+    Stores one uptime sample for every user in ``alive_states`` dictionary: ``{idurl: True/False}``.
+    All changes are written in a single transaction.
+    Returns updated counters for every user: ``{idurl: (month_all, month_alive, total_all, total_alive)}``.
+    """
+    global _LastCleanupTime
+    if now is None:
+        now = time.time()
+    monthstr = time.strftime('%m%y', time.localtime(now))
+    if monthstr != _IndexMonthStr:
+        read_index(monthstr)
+    counters = []
+    samples = []
+    result = {}
+    for idurl, alive_state in alive_states.items():
+        idurl = strng.to_text(idurl)
+        pid = peer_id(idurl)
+        alive = 1 if alive_state else 0
+        counters.append((pid, monthstr, alive))
+        counters.append((pid, 'total', alive))
+        samples.append((pid, int(now), alive))
+        month_rating = _IndexMonth.setdefault(idurl, make_blank_rating_dict())
+        total_rating = _IndexTotal.setdefault(idurl, make_blank_rating_dict())
+        for rating in (month_rating, total_rating):
+            rating['all'] = str(int(rating['all']) + 1)
+            rating['alive'] = str(int(rating['alive']) + alive)
+        result[idurl] = (int(month_rating['all']), int(month_rating['alive']), int(total_rating['all']), int(total_rating['alive']))
+    db().executemany(
+        'INSERT INTO counters (peer_id, period, all_count, alive_count) VALUES (?, ?, 1, ?) '
+        'ON CONFLICT (peer_id, period) DO UPDATE SET all_count=all_count+1, alive_count=alive_count+excluded.alive_count',
+        counters,
+    )
+    db().executemany('INSERT OR REPLACE INTO samples (peer_id, sample_time, alive) VALUES (?, ?, ?)', samples)
+    if now - _LastCleanupTime > 24*60*60:
+        db().execute('DELETE FROM samples WHERE sample_time<?', (int(now - SAMPLES_HISTORY_DAYS*24*60*60), ))
+        _LastCleanupTime = now
+    db().commit()
+    return result
 
 
 def increase_rating(idurl, alive_state):
-    if not exist_rating_dir(idurl):
-        make_rating_dir(idurl)
-
-    month_rating = read_month_rating_dict(idurl)
-    if month_rating is None:
-        month_rating = make_blank_rating_dict()
-    try:
-        mallI = int(month_rating['all'])
-        maliveI = int(month_rating['alive'])
-    except:
-        mallI = 0
-        maliveI = 0
-    mallI += 1
-    if alive_state:
-        maliveI += 1
-    month_rating['all'] = str(mallI)
-    month_rating['alive'] = str(maliveI)
-    write_month_rating_dict(idurl, month_rating)
-
-    total_rating = read_total_rating_dict(idurl)
-    if total_rating is None:
-        total_rating = make_blank_rating_dict()
-    try:
-        tallI = int(total_rating['all'])
-        taliveI = int(total_rating['alive'])
-    except:
-        tallI = 0
-        taliveI = 0
-    tallI += 1
-    if alive_state:
-        taliveI += 1
-    total_rating['all'] = str(tallI)
-    total_rating['alive'] = str(taliveI)
-    write_total_rating_dict(idurl, total_rating)
-    return mallI, maliveI, tallI, taliveI
+    return increase_ratings({idurl: alive_state})[strng.to_text(idurl)]
 
 
 def rate_all_users():
@@ -216,78 +350,77 @@ def rate_all_users():
     if _Debug:
         lg.out(_DebugLevel, 'ratings.rate_all_users')
     monthStr = time.strftime('%B')
+    alive_states = {}
     for idurl in contactsdb.contacts_remote(include_all=True):
         if not idurl:
             continue
-        isalive = online_status.isOnline(idurl)
-        mall, malive, tall, talive = increase_rating(idurl, isalive)
-        month_percent = 100.0*float(malive)/float(mall)
-        total_percent = 100.0*float(talive)/float(tall)
-        if _Debug:
+        alive_states[idurl] = online_status.isOnline(idurl)
+    result = increase_ratings(alive_states)
+    if _Debug:
+        for idurl, (mall, malive, tall, talive) in result.items():
+            month_percent = 100.0*float(malive)/float(mall)
+            total_percent = 100.0*float(talive)/float(tall)
             lg.out(_DebugLevel, '[%6.2f%%: %s/%s] in %s and [%6.2f%%: %s/%s] total - %s' % (month_percent, malive, mall, monthStr, total_percent, talive, tall, nameurl.GetName(idurl)))
-    read_index()
 
 
 def remember_connected_time(idurl):
-    if not exist_rating_dir(idurl):
-        make_rating_dir(idurl)
-    bpio.WriteTextFile(os.path.join(rating_dir(idurl), 'connected'), time.strftime('%d%m%y %H:%M:%S'))
+    idurl = strng.to_text(idurl)
+    now = int(time.time())
+    _ConnectedTime[idurl] = now
+    if db() is None:
+        return
+    db().execute('UPDATE peers SET connected_time=? WHERE peer_id=?', (now, peer_id(idurl)))
+    db().commit()
 
 
 def connected_time(idurl):
-    s = bpio.ReadTextFile(os.path.join(rating_dir(idurl), 'connected'))
-    if not s:
-        return None
-    try:
-        return time.mktime(time.strptime(s, '%d%m%y %H:%M:%S'))
-    except:
-        lg.exc()
-        return None
+    return _ConnectedTime.get(strng.to_text(idurl))
 
 
 def read_all_monthly_ratings(idurl):
-    if not exist_rating_dir(idurl):
+    pid = peer_id(idurl, create=False)
+    if pid is None:
         return None
     d = {}
-    for monthstr in os.listdir(rating_dir(idurl)):
-        if monthstr == 'total':
-            continue
-        if monthstr == 'last':
+    for period, all_count, alive_count in db().execute('SELECT period, all_count, alive_count FROM counters WHERE peer_id=?', (pid, )):
+        if period == 'total':
             continue
-        month_rating = read_month_rating_dict(idurl, monthstr)
-        if month_rating is None:
-            continue
-        d[monthstr] = month_rating
+        d[period] = {'all': str(all_count), 'alive': str(alive_count)}
     return d
 
 
 def read_index(monthstr=None):
     global _IndexMonth
+    global _IndexMonthStr
     global _IndexTotal
-    #out(4, 'ratings.read_index')
     if monthstr is None:
         monthstr = time.strftime('%m%y')
     _IndexMonth.clear()
     _IndexTotal.clear()
-    for idurl_filename in os.listdir(settings.RatingsDir()):
-        idurl = nameurl.FilenameUrl(idurl_filename)
-        if idurl is None:
+    _IndexMonthStr = monthstr
+    if db() is None:
+        return
+    idurls = dict((pid, idurl) for idurl, pid in _PeerIDs.items())
+    for pid, period, all_count, alive_count in db().execute(
+        'SELECT peer_id, period, all_count, alive_count FROM counters WHERE period IN (?, ?)',
+        (monthstr, 'total'),
+    ):
+        if pid not in idurls:
             continue
-        month = read_month_rating_dict(idurl, monthstr)
-        total = read_total_rating_dict(idurl)
-        _IndexMonth[idurl] = {'all': '0', 'alive': '0'} if month is None else month
-        _IndexTotal[idurl] = {'all': '0', 'alive': '0'} if total is None else total
-        #out(4, '    [%s]: %s, %s' % (nameurl.GetName(idurl), _IndexMonth[idurl], _IndexTotal[idurl]))
+        if period == 'total':
+            _IndexTotal[idurls[pid]] = {'all': str(all_count), 'alive': str(alive_count)}
+        else:
+            _IndexMonth[idurls[pid]] = {'all': str(all_count), 'alive': str(alive_count)}
 
 
 def month(idurl):
     global _IndexMonth
-    return _IndexMonth.get(idurl, {'all': '0', 'alive': '0'})
+    return _IndexMonth.get(strng.to_text(idurl), make_blank_rating_dict())
 
 
 def total(idurl):
     global _IndexTotal
-    return _IndexTotal.get(idurl, {'all': '0', 'alive': '0'})
+    return _IndexTotal.get(strng.to_text(idurl), make_blank_rating_dict())
 
 
 def month_percent(idurl):
@@ -306,11 +439,102 @@ def total_percent(idurl):
         return 0.0
 
 
+def uptime_percent(idurl, window=7*24*60*60, now=None):
+    """
+    How many percents of the uptime samples stored during last ``window`` seconds found the user online.
+    Returns None if there are no samples for that period.
+    """
+    pid = peer_id(idurl, create=False)
+    if pid is None:
+        return None
+    if now is None:
+        now = time.time()
+    all_count, alive_count = db().execute(
+        'SELECT COUNT(*), SUM(alive) FROM samples WHERE peer_id=? AND sample_time>=?',
+        (pid, int(now - window)),
+    ).fetchone()
+    if not all_count:
+        return None
+    return round(100.0*float(alive_count)/float(all_count), 2)
+
+
+def uptime_percents(idurls=None, window=7*24*60*60, now=None):
+    """
+    Same as ``uptime_percent()``, but for many users with a single query, returns ``{idurl: percent}``.
+    If ``idurls`` is None all known users are returned.
+    """
+    if now is None:
+        now = time.time()
+    known = dict((pid, idurl) for idurl, pid in _PeerIDs.items())
+    query = 'SELECT peer_id, COUNT(*), SUM(alive) FROM samples WHERE sample_time>=?'
+    params = [int(now - window)]
+    if idurls is not None:
+        pids = [_PeerIDs[strng.to_text(idurl)] for idurl in idurls if strng.to_text(idurl) in _PeerIDs]
+        if not pids:
+            return {}
+        query += ' AND peer_id IN (%s)' % ','.join('?'*len(pids))
+        params.extend(pids)
+    result = {}
+    for pid, all_count, alive_count in db().execute(query + ' GROUP BY peer_id', params):
+        if pid in known:
+            result[known[pid]] = round(100.0*float(alive_count)/float(all_count), 2)
+    return result
+
+
 #-------------------------------------------------------------------------------
 
 
 def main():
-    pass
+    """
+    Rates 2000 contacts 24 times, as it happens during one day.
+    Previous way of storing ratings is reproduced here as well: two text files for every contact,
+    every file is read and written back on every pass and then all of them are read again to build the index.
+    """
+    import random
+    import shutil
+    import tempfile
+    temp_dir = tempfile.mkdtemp(prefix='ratings_')
+    contacts = ['http://127.0.0.1:8084/peer%d.xml' % i for i in range(2000)]
+    passes = 24
+    start_time = time.time() - passes*60*60
+
+    # previous implementation
+    files_dir = os.path.join(temp_dir, 'files')
+    os.makedirs(files_dir)
+    t = time.time()
+    for _ in range(passes):
+        for idurl in contacts:
+            peer_dir = os.path.join(files_dir, nameurl.UrlFilename(idurl))
+            if not bpio._dir_exist(peer_dir):
+                bpio._dir_make(peer_dir)
+            for filename in ('month', 'total'):
+                rating = bpio._read_dict(os.path.join(peer_dir, filename)) or make_blank_rating_dict()
+                rating['all'] = str(int(rating['all']) + 1)
+                rating['alive'] = str(int(rating['alive']) + random.randint(0, 1))
+                bpio._write_dict(os.path.join(peer_dir, filename), rating)
+        index = {}
+        for peer_dirname in os.listdir(files_dir):
+            index[peer_dirname] = (
+                bpio._read_dict(os.path.join(files_dir, peer_dirname, 'month')),
+                bpio._read_dict(os.path.join(files_dir, peer_dirname, 'total')),
+            )
+    files_time = (time.time() - t)/passes
+
+    # single database
+    open_db(os.path.join(temp_dir, 'ratings.db'))
+    t = time.time()
+    for i in range(passes):
+        increase_ratings(dict((idurl, random.randint(0, 1)) for idurl in contacts), now=start_time + i*60*60)
+    db_time = (time.time() - t)/passes
+    t = time.time()
+    percents = uptime_percents(contacts[:10], window=12*60*60)
+    query_time = time.time() - t
+    print('%d contacts, %d passes' % (len(contacts), passes))
+    print('    two files per contact:  %.3f sec per pass' % files_time)
+    print('    single database:        %.3f sec per pass' % db_time)
+    print('    uptime of 10 suppliers during last 12 hours:  %.2f ms, %r' % (query_time*1000.0, sorted(percents.values())))
+    close_db()
+    shutil.rmtree(temp_dir)
 
 
 if __name__ == '__main__':
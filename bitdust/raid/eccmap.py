@@ -58,6 +58,7 @@ from io import open
 import os
 import re
 import traceback
+import itertools
 
 #------------------------------------------------------------------------------
 
@@ -605,6 +606,37 @@ class eccmap:
         AllFixed = stillMissing == 0  # If nothing else missing we are good
         return AllFixed
 
+    def FixableMargin(self, data_segs, parity_segs, kept_data=None, kept_parity=None, limit=3):
+        """
+        How many more nodes we can lose before the block becomes not fixable.
+
+        Returns 0 if ``Fixable()`` already fails, otherwise the smallest
+        number of nodes which being lost together would make it fail.
+        A lost node takes away both its Data and Parity segments, except those
+        marked in ``kept_data`` and ``kept_parity`` - we have copies of them on hands.
+        The search is stopped at ``limit`` and that value is returned if block survives any smaller loss.
+        """
+        if not self.Fixable(data_segs, parity_segs):
+            return 0
+        kept_data = kept_data or [0]*len(data_segs)
+        kept_parity = kept_parity or [0]*len(parity_segs)
+        nodes = []
+        for i in range(len(data_segs)):
+            if (data_segs[i] == 1 and kept_data[i] != 1) or (parity_segs[i] == 1 and kept_parity[i] != 1):
+                nodes.append(i)
+        for failures in range(1, limit):
+            for lost in itertools.combinations(nodes, failures):
+                DataSegs = list(data_segs)
+                ParitySegs = list(parity_segs)
+                for i in lost:
+                    if kept_data[i] != 1:
+                        DataSegs[i] = 0
+                    if kept_parity[i] != 1:
+                        ParitySegs[i] = 0
+                if not self.Fixable(DataSegs, ParitySegs):
+                    return failures
+        return limit
+
     def CanMakeProgress(self, DataSegs, ParitySegs):
         """
         Another method to check if we can do some data reconstruction.
@@ -126,6 +126,10 @@ _VALID_TASKS = {
         ),
     ),
     'rebuild': (rebuild.rebuild, ()),
+    'rebuild_many': (
+        rebuild.rebuild_many,
+        (rebuild.rebuild_block, ),
+    ),
 }
 
 #------------------------------------------------------------------------------
@@ -60,11 +60,54 @@ def rebuild(backupID, blockNum, eccMap, availableSuppliers, remoteMatrix, localM
                     blockNum,
                     eccMap,
                 ))
+        myeccmap = bitdust.raid.eccmap.eccmap(eccMap)
+        return rebuild_block(myeccmap, backupID, blockNum, availableSuppliers, remoteMatrix, localMatrix, localBackupsDir, threshold_control=threshold_control)
+    except:
+        bitdust.logs.lg.exc()
+        return None
+
+
+def rebuild_many(backupID, blocks, eccMap, availableSuppliers, localBackupsDir, block_done=None, threshold_control=None):
+    """
+    Rebuild a batch of blocks of same backup in one task, ``blocks`` is a list of tuples:
+    (blockNum, remoteMatrix, localMatrix).
+
+    The ecc map is prepared only once for the whole batch.
+    Result for every block is passed to ``block_done(blockNum, result)`` as soon as it is ready,
+    so reconstructed pieces can be sent out while other blocks are still processed.
+    Returns a list of (blockNum, result) tuples, same as ``rebuild()`` returns for a single block.
+    """
+    try:
+        if _Debug:
+            with open('/tmp/raid.log', 'a') as logfile:
+                logfile.write(u'rebuild_many backupID=%r blocks=%r eccMap=%r\n' % (
+                    backupID,
+                    [b[0] for b in blocks],
+                    eccMap,
+                ))
+        myeccmap = bitdust.raid.eccmap.eccmap(eccMap)
+        results = []
+        for blockNum, remoteMatrix, localMatrix in blocks:
+            if threshold_control and not threshold_control(0):
+                # task was cancelled
+                break
+            result = rebuild_block(myeccmap, backupID, blockNum, availableSuppliers, remoteMatrix, localMatrix, localBackupsDir, threshold_control=threshold_control)
+            results.append((blockNum, result))
+            if block_done:
+                block_done(blockNum, result)
+            if result is None:
+                break
+        return results
+    except:
+        bitdust.logs.lg.exc()
+        return None
+
 
+def rebuild_block(myeccmap, backupID, blockNum, availableSuppliers, remoteMatrix, localMatrix, localBackupsDir, threshold_control=None):
+    try:
         customer, _, localPath = backupID.rpartition(':')
         if '$' not in customer:
             customer = 'master$' + customer
-        myeccmap = bitdust.raid.eccmap.eccmap(eccMap)
         supplierCount = len(availableSuppliers)
         missingData = [0]*supplierCount
         missingParity = [0]*supplierCount
@@ -28,6 +28,12 @@
 ..
 
 module:: driver
+
+Services are started by ``StartupScheduler`` following the dependency graph:
+a service receives "start" event only after all of its dependencies finished starting,
+so independent branches of the graph are starting at the same time.
+Start time of every service is recorded and printed as a "waterfall" when all services are started,
+see ``startup_report()``.
 """
 
 #------------------------------------------------------------------------------
@@ -44,6 +50,7 @@ _DebugLevel = 14
 
 import os
 import sys
+import time
 import importlib
 
 from twisted.internet import reactor  # @UnresolvedImport
@@ -76,6 +83,9 @@ _EnabledServices = set()
 _DisabledServices = set()
 _StartingDeferred = None
 _StopingDeferred = None
+_StartupBeginTime = None
+_StartupTimes = {}
+_ActiveScheduler = None
 
 #------------------------------------------------------------------------------
 
@@ -346,6 +356,7 @@ def find_root_distance(service_name):
 def start(services_list=[]):
     global _StartingDeferred
     global _StopingDeferred
+    global _ActiveScheduler
     if _Debug:
         lg.args(_DebugLevel, services_list=services_list, starting=bool(_StartingDeferred), stoping=bool(_StopingDeferred))
     if _StartingDeferred:
@@ -355,11 +366,12 @@ def start(services_list=[]):
         d = Deferred()
         d.errback(Exception('currently another service is stopping'))
         return d
+    full_startup = not services_list
     if not services_list:
-        services_list.extend(boot_up_order())
+        services_list = list(boot_up_order())
     if _Debug:
         lg.out(_DebugLevel, 'driver.start with %d services' % len(services_list))
-    dl = []
+    to_start = []
     for name in services_list:
         svc = services().get(name, None)
         if not svc:
@@ -368,12 +380,13 @@ def start(services_list=[]):
             continue
         if svc.state == 'ON':
             continue
-        d = Deferred()
-        dl.append(d)
-        svc.automat('start', d)
-    if len(dl) == 0:
+        to_start.append(name)
+    if len(to_start) == 0:
         return succeed(1)
-    _StartingDeferred = DeferredList(dl)
+    if full_startup or _StartupBeginTime is None:
+        reset_startup_times()
+    _ActiveScheduler = StartupScheduler(to_start)
+    _StartingDeferred = _ActiveScheduler.run()
     _StartingDeferred.addCallback(on_started_all_services)
     _StartingDeferred.addErrback(on_services_failed_to_start, services_list)
     return _StartingDeferred
@@ -392,7 +405,7 @@ def stop(services_list=[]):
         d.errback(Exception('currently another service is starting'))
         return d
     if not services_list:
-        services_list.extend(reversed(boot_up_order()))
+        services_list = list(reversed(boot_up_order()))
     if _Debug:
         lg.out(_DebugLevel, 'driver.stop with %d services' % len(services_list))
     dl = []
@@ -409,6 +422,166 @@ def stop(services_list=[]):
     return _StopingDeferred
 
 
+class StartupScheduler(object):
+
+    """
+    Sends "start" event to every service from the given list only when all of its dependencies
+    from the same list already finished starting (successfully or not).
+    Services which do not depend on each other are starting at the same time.
+    """
+
+    def __init__(self, services_list, clock=None):
+        self.clock = clock or reactor
+        self.services_list = list(services_list)
+        self.results = {}
+        self.waiting = {}
+        self.dependents = {}
+        self.started = set()
+        positions = dict((name, pos) for pos, name in enumerate(self.services_list))
+        for name in self.services_list:
+            self.results[name] = Deferred()
+            self.results[name].addBoth(self._on_service_finished, name)
+            self.waiting[name] = set()
+            for depend_name in services()[name].dependent_on():
+                # only services placed before in the boot up order are taken in account, that protects from cycles
+                if positions.get(depend_name, len(self.services_list)) < positions[name]:
+                    self.waiting[name].add(depend_name)
+                    self.dependents.setdefault(depend_name, []).append(name)
+
+    def run(self):
+        result = DeferredList([self.results[name] for name in self.services_list])
+        for name in self.services_list:
+            if not self.waiting[name]:
+                self._start_service(name)
+        return result
+
+    def is_pending(self, name):
+        return name in self.waiting and name not in self.started
+
+    def _start_service(self, name):
+        svc = services()[name]
+        self.started.add(name)
+        on_service_scheduled(name)
+        if svc.state == 'ON':
+            self.results[name].callback('started')
+            return
+        svc.automat('start', self.results[name])
+
+    def _on_service_finished(self, result, name):
+        # result deferred is fired before driver.on_service_callback(), so the end time must be recorded here
+        on_service_finished(name, result if isinstance(result, str) else 'failed')
+        for dependent_name in self.dependents.get(name, []):
+            self.waiting[dependent_name].discard(name)
+            if not self.waiting[dependent_name]:
+                # start in the next reactor iteration to not go too deep in the call stack
+                self.clock.callLater(0, self._start_service, dependent_name)  # @UndefinedVariable
+        return result
+
+
+#------------------------------------------------------------------------------
+
+
+def reset_startup_times():
+    global _StartupBeginTime
+    _StartupBeginTime = time.time()
+    _StartupTimes.clear()
+
+
+def on_service_scheduled(service_name):
+    _StartupTimes[service_name] = {
+        'scheduled': time.time(),
+    }
+
+
+def on_service_starting(service_name):
+    times = _StartupTimes.setdefault(service_name, {})
+    times.setdefault('scheduled', time.time())
+    times['begin'] = time.time()
+    times.pop('prepared', None)
+    times.pop('end', None)
+    times.pop('result', None)
+
+
+def on_service_prepared(service_name):
+    times = _StartupTimes.get(service_name)
+    if times is not None:
+        times['prepared'] = time.time()
+
+
+def on_service_finished(service_name, result):
+    times = _StartupTimes.get(service_name)
+    if times is not None and 'end' not in times:
+        times['end'] = time.time()
+        times['result'] = result
+
+
+def startup_report():
+    """
+    Returns start time and duration of every service (in seconds, relative to the moment when starting began)
+    and the "critical path": the longest chain of dependent services which defines total startup time.
+    """
+    if _StartupBeginTime is None:
+        return {
+            'total': None,
+            'services': [],
+            'critical_path': [],
+        }
+    items = []
+    latest_name = None
+    latest_end = None
+    for name, times in _StartupTimes.items():
+        begin = times.get('begin', times['scheduled'])
+        end = times.get('end')
+        items.append({
+            'name': name,
+            'scheduled': round(times['scheduled'] - _StartupBeginTime, 3),
+            'begin': round(begin - _StartupBeginTime, 3),
+            'duration': round(end - begin, 3) if end else None,
+            'waiting': round(begin - times['scheduled'], 3),
+            'prepare': round(times['prepared'] - begin, 3) if 'prepared' in times else None,
+            'result': times.get('result'),
+        })
+        if end and (latest_end is None or end > latest_end):
+            latest_end = end
+            latest_name = name
+    items.sort(key=lambda i: (i['begin'], i['name']))
+    critical_path = []
+    name = latest_name
+    while name:
+        critical_path.insert(0, name)
+        next_name = None
+        next_end = None
+        for depend_name in dependent(name):
+            depend_end = _StartupTimes.get(depend_name, {}).get('end')
+            if depend_end and (next_end is None or depend_end > next_end):
+                next_end = depend_end
+                next_name = depend_name
+        name = next_name
+    return {
+        'total': round(latest_end - _StartupBeginTime, 3) if latest_end else None,
+        'services': items,
+        'critical_path': critical_path,
+    }
+
+
+def print_startup_report(width=40):
+    report = startup_report()
+    if not report['services'] or not report['total']:
+        return
+    scale = float(width)/report['total']
+    lines = ['services started in %.3f seconds:' % report['total']]
+    for item in report['services']:
+        duration = item['duration'] or 0.0
+        offset = int(item['begin']*scale)
+        bar = ' '*offset + '#'*max(1, int(duration*scale))
+        lines.append('    %-36s %8.3f %8.3f  |%s|  %s' % (item['name'], item['begin'], duration, bar.ljust(width + 1), item['result']))
+    lines.append('    critical path: %s' % ' > '.join(report['critical_path']))
+    lg.info('\n'.join(lines))
+
+
+#------------------------------------------------------------------------------
+
+
 def suspend(service_name, *args, **kwargs):
     svc = services().get(service_name, None)
     if not svc:
@@ -722,9 +895,12 @@ def populate_services():
 
 def do_finish_starting():
     global _StartingDeferred
+    global _ActiveScheduler
     if _Debug:
         lg.args(_DebugLevel, starting=bool(_StartingDeferred))
     _StartingDeferred = None
+    _ActiveScheduler = None
+    print_startup_report()
 
 
 def do_finish_stoping():
@@ -743,6 +919,8 @@ def on_service_callback(result, service_name):
     svc = services().get(service_name, None)
     if not svc:
         raise ServiceNotFound(service_name)
+    if result in ('started', 'failed', 'not_installed', 'depends_off'):
+        on_service_finished(service_name, result)
     if result == 'started':
         if _Debug:
             lg.out(_DebugLevel, '[%s] STARTED' % service_name)
@@ -765,6 +943,9 @@ def on_service_callback(result, service_name):
                     continue
                 if relative_service.state == 'ON':
                     continue
+                if _ActiveScheduler and _ActiveScheduler.is_pending(relative_service.service_name):
+                    # that service will be started by the scheduler when all of its dependencies are ready
+                    continue
                 if _Debug:
                     lg.out(_DebugLevel, '    making attempt to start relative service %r' % relative_service)
                 relative_service.automat('start')
@@ -63,7 +63,7 @@ import os
 
 #------------------------------------------------------------------------------
 
-from twisted.internet.defer import Deferred  # @UnresolvedImport
+from twisted.internet.defer import Deferred, maybeDeferred  # @UnresolvedImport
 
 #------------------------------------------------------------------------------
 
@@ -134,6 +134,16 @@ class LocalService(automat.Automat):
         from bitdust.main import config
         return config.conf().getBool(self.config_path)
 
+    def prepare(self):
+        """
+        Blocking work (scanning folders, reading and parsing files) to be done before ``start()``.
+        Called in the main thread and can return ``Deferred``: the blocking part should be executed with
+        ``threads.deferToThread()`` and must not touch the reactor, events or other services,
+        the result is applied to the shared state in a callback which runs in the main thread again.
+        Subclass should override that method only if such work can be separated from ``start()``.
+        """
+        return None
+
     def start(self):
         raise driver.RequireSubclass()
 
@@ -337,6 +347,29 @@ class LocalService(automat.Automat):
             return
         if _Debug:
             lg.out(_DebugLevel, '[%s] STARTING' % self.service_name)
+        driver.on_service_starting(self.service_name)
+        if type(self).prepare is not LocalService.prepare:
+            d = maybeDeferred(self.prepare)
+            d.addCallback(self._on_prepared)
+            d.addErrback(self._on_prepare_failed)
+            return
+        self._do_start_service()
+
+    def _on_prepared(self, result):
+        driver.on_service_prepared(self.service_name)
+        if self.state != 'STARTING':
+            lg.warn('service %r state changed to %r while it was preparing to start' % (self.service_name, self.state))
+            return None
+        self._do_start_service()
+        return None
+
+    def _on_prepare_failed(self, err):
+        lg.err('failed to prepare %r: %r' % (self.service_name, err))
+        if self.state == 'STARTING':
+            self.automat('service-failed', err)
+        return None
+
+    def _do_start_service(self):
         self.suspended = bool(self.start_suspended)
         try:
             result = self._do_start()
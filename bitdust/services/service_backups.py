@@ -49,6 +49,15 @@ class BackupsService(LocalService):
             'service_backup_db',
         ]
 
+    def prepare(self):
+        from twisted.internet import threads  # @UnresolvedImport
+        from bitdust.main import settings
+        from bitdust.storage import backup_matrix
+        backups_dir = settings.getLocalBackupsDir()
+        d = threads.deferToThread(backup_matrix.ScanLocalFiles, backups_dir)
+        d.addCallback(backup_matrix.ApplyLocalFiles, backups_dir)
+        return d
+
     def start(self):
         from bitdust.storage import backup_control
         from bitdust.storage import backup_matrix
@@ -59,7 +68,7 @@ class BackupsService(LocalService):
         from bitdust.transport import callback
         from bitdust.p2p import p2p_connector
         backup_control.init()
-        backup_matrix.init()
+        backup_matrix.ReadLatestRawListFiles()
         backup_monitor.A('init')
         backup_monitor.A('restart')
         conf().addConfigNotifier('services/backups/keep-local-copies-enabled', self._on_keep_local_copies_modified)
@@ -56,12 +56,14 @@ class EmployerService(LocalService):
         from bitdust.raid import eccmap
         from bitdust.services import driver
         from bitdust.customer import fire_hire
+        from bitdust.customer import supplier_pool
         self.starting_deferred = Deferred()
         self.starting_deferred.addErrback(lambda err: lg.warn('service %r was not started: %r' % (self.service_name, err.getErrorMessage() if err else 'unknown reason')))
         self.all_suppliers_hired_event_sent = False
         if driver.is_on('service_entangled_dht'):
             self._do_join_suppliers_dht_layer()
         eccmap.Update()
+        supplier_pool.init()
         fire_hire.A('init')
         fire_hire.A().addStateChangedCallback(self._on_fire_hire_ready, None, 'READY')
         conf().addConfigNotifier('services/customer/suppliers-number', self._on_suppliers_number_modified)
@@ -80,12 +82,14 @@ class EmployerService(LocalService):
         from bitdust.main.config import conf
         from bitdust.main import events
         from bitdust.customer import fire_hire
+        from bitdust.customer import supplier_pool
         fire_hire.A().removeStateChangedCallback(self._on_fire_hire_ready)
         events.remove_subscriber(self._on_dht_layer_connected, 'dht-layer-connected')
         events.remove_subscriber(self._on_supplier_modified, 'supplier-modified')
         conf().removeConfigNotifier('services/customer/suppliers-number')
         conf().removeConfigNotifier('services/customer/needed-space')
         fire_hire.Destroy()
+        supplier_pool.shutdown()
         return True
 
     def health_check(self):
@@ -64,15 +64,25 @@ class GatewayService(LocalService):
         from bitdust.transport import packet_out
         from bitdust.transport import packet_in
         from bitdust.transport import gateway
+        from bitdust.transport import callback
+        from bitdust.transport import bandwidth
         packet_out.init()
         packet_in.init()
         gateway.init()
+        bandwidth.init()
+        callback.insert_inbox_callback(0, bandwidth.INfile)
+        callback.add_finish_file_sending_callback(bandwidth.OUTfile)
         return True
 
     def stop(self):
         from bitdust.transport import packet_out
         from bitdust.transport import packet_in
         from bitdust.transport import gateway
+        from bitdust.transport import callback
+        from bitdust.transport import bandwidth
+        callback.remove_finish_file_sending_callback(bandwidth.OUTfile)
+        callback.remove_inbox_callback(bandwidth.INfile)
+        bandwidth.shutdown()
         gateway.stop()
         gateway.shutdown()
         packet_out.shutdown()
@@ -129,19 +129,8 @@ class P2PHookupsService(LocalService):
                 p2p_connector.A('network_connector.state', newstate)
 
     def _on_identity_url_changed(self, evt):
-        from twisted.internet import reactor  # @UnresolvedImport
-        from bitdust.logs import lg
-        from bitdust.userid import id_url
-        from bitdust.userid import global_id
         from bitdust.p2p import online_status
-        for idurl, inst in online_status.online_statuses().items():
-            if idurl == id_url.field(evt.data['old_idurl']):
-                idurl.refresh(replace_original=True)
-                inst.idurl.refresh(replace_original=True)
-                inst.name = 'online_%s' % global_id.UrlToGlobalID(idurl)
-                inst.automat('shook-up-hands')
-                reactor.callLater(0, inst.automat, 'ping-now')  # @UndefinedVariable
-                lg.info('found %r with rotated identity and refreshed: %r' % (inst, idurl))
+        online_status.on_identity_url_changed(evt.data['old_idurl'])
 
     def _on_my_identity_url_changed(self, evt):
         from bitdust.services import driver
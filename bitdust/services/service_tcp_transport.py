@@ -55,10 +55,14 @@ class TCPTransportService(LocalService):
         from twisted.internet.defer import Deferred
         from bitdust.transport.tcp import tcp_interface
         from bitdust.transport import network_transport
+        from bitdust.transport import transport_worker
         from bitdust.transport import gateway
         from bitdust.main.config import conf
         self.starting_deferred = Deferred()
-        self.interface = tcp_interface.GateInterface()
+        if conf().getBool('services/tcp-transport/worker-process-enabled') and transport_worker.is_supported('tcp'):
+            self.interface = transport_worker.WorkerInterface('tcp', tcp_interface.GateInterface())
+        else:
+            self.interface = tcp_interface.GateInterface()
         self.transport = network_transport.NetworkTransport('tcp', self.interface)
         self.transport.automat('init', (gateway.listener(), self._on_transport_state_changed))
         reactor.callLater(0, self.transport.automat, 'start')  # @UndefinedVariable
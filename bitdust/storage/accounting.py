@@ -64,6 +64,7 @@ from bitdust.main import settings
 from bitdust.contacts import contactsdb
 
 from bitdust.userid import id_url
+from bitdust.userid import global_id
 
 from bitdust.storage import backup_fs
 
@@ -160,6 +161,43 @@ def update_customers_usage(new_space_usage_dict):
     return bpio._write_dict(settings.CustomersUsedSpaceFile(), jsn.dict_keys_to_text(usage_dict))
 
 
+def read_usage_ledger():
+    """
+    Returns the ledger of the space used by customers: ``{customer_id: (bytes, pieces)}``.
+    It is kept by ``supplier.pieces_manifest`` and only available while the supplier service is running,
+    otherwise None is returned.
+    """
+    from bitdust.supplier import pieces_manifest
+    if pieces_manifest.db() is None:
+        return None
+    return pieces_manifest.customers_usage()
+
+
+def get_customer_usage(customer_idurl):
+    """
+    Returns number of bytes used by given customer on my disk without scanning the customer folder.
+    """
+    from bitdust.supplier import pieces_manifest
+    customer_idurl = id_url.field(customer_idurl)
+    if pieces_manifest.db() is not None:
+        return pieces_manifest.customer_usage(global_id.UrlToGlobalID(customer_idurl))[0]
+    try:
+        return int(read_customers_usage().get(customer_idurl.to_bin(), 0))
+    except:
+        lg.exc()
+        return 0
+
+
+def get_customer_real_usage(customer_idurl, ledger=None):
+    """
+    Returns tuple ``(bytes, pieces)`` of the files stored for given customer.
+    Only when the ledger is not available the customer folder is scanned, pieces are not counted then.
+    """
+    if ledger is not None:
+        return ledger.get(global_id.UrlToGlobalID(customer_idurl), (0, 0))
+    return bpio.getDirectorySize(settings.getCustomerFilesDir(customer_idurl)), None
+
+
 def calculate_customers_usage_ratio(space_dict=None, used_dict=None):
     if space_dict is None:
         space_dict, _ = read_customers_quotas()
@@ -225,6 +263,7 @@ def report_consumed_storage():
 def report_donated_storage():
     space_dict, free_space = read_customers_quotas()
     used_space_dict = read_customers_usage()
+    ledger = read_usage_ledger()
     r = {}
     r['customers_num'] = contactsdb.num_customers()
     r['customers'] = []
@@ -233,7 +272,11 @@ def report_donated_storage():
     r['consumed'] = 0
     r['donated'] = settings.getDonatedBytes()
     # r['donated_str'] = diskspace.MakeStringFromBytes(r['donated'])
-    r['real'] = bpio.getDirectorySize(settings.getCustomersFilesDir())
+    if ledger is not None:
+        r['real'] = sum(used_bytes for used_bytes, _ in ledger.values())
+        r['pieces'] = sum(used_pieces for _, used_pieces in ledger.values())
+    else:
+        r['real'] = bpio.getDirectorySize(settings.getCustomersFilesDir())
     try:
         r['free'] = int(free_space)
     except:
@@ -266,7 +309,7 @@ def report_donated_storage():
         # c['used_str'] = diskspace.MakeStringFromBytes(c['used'])
         c['consumed'] = consumed_by_customer
         # c['consumed_str'] = diskspace.MakeStringFromBytes(c['consumed'])
-        c['real'] = bpio.getDirectorySize(settings.getCustomerFilesDir(idurl))
+        c['real'], c['pieces'] = get_customer_real_usage(idurl, ledger)
         # c['real_str'] = diskspace.MakeStringFromBytes(c['real'])
         r['customers'].append(c)
     r['used'] = used
@@ -283,7 +326,7 @@ def report_donated_storage():
     old_customers_used = 0
     old_customers_real = 0
     for idurl in used_space_dict.keys():
-        real = bpio.getDirectorySize(settings.getCustomerFilesDir(idurl))
+        real, _ = get_customer_real_usage(idurl, ledger)
         try:
             used = int(used_space_dict[idurl])
         except:
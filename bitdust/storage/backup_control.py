@@ -71,6 +71,7 @@ from bitdust.lib import misc
 from bitdust.lib import packetid
 from bitdust.lib import nameurl
 from bitdust.lib import strng
+from bitdust.lib import serialization
 
 from bitdust.main import settings
 from bitdust.main import events
@@ -80,6 +81,7 @@ from bitdust.raid import eccmap
 from bitdust.crypt import encrypted
 from bitdust.crypt import key
 from bitdust.crypt import my_keys
+from bitdust.crypt import hashes
 
 from bitdust.userid import global_id
 from bitdust.userid import id_url
@@ -89,6 +91,7 @@ from bitdust.services import driver
 from bitdust.contacts import contactsdb
 
 from bitdust.p2p import p2p_service
+from bitdust.p2p import commands
 
 from bitdust.stream import data_sender
 
@@ -457,6 +460,80 @@ def DeletePathBackups(pathID, removeLocalFilesToo=True, saveDB=True, calculate=T
 #------------------------------------------------------------------------------
 
 
+def AuditVersion(backupID, supplierNum):
+    """
+    Asks one of my suppliers for a Merkle root of all pieces of given backup version it is keeping
+    and compares it with the root calculated from my local copies of the same pieces.
+    The data itself is not downloaded, result is a dictionary with "match" field.
+    Returns Deferred object.
+    """
+    backupID = global_id.CanonicalID(backupID)
+    customerGlobalID, remotePath, version = packetid.SplitBackupID(backupID)
+    customer_idurl = global_id.GlobalUserToIDURL(customerGlobalID)
+    supplier_idurl = contactsdb.supplier(supplierNum, customer_idurl=customer_idurl)
+    result = Deferred()
+    if not supplier_idurl:
+        result.errback(Exception('supplier at position %d is unknown' % supplierNum))
+        return result
+
+    def _on_ack(response, info):
+        try:
+            json_response = serialization.BytesToDict(response.Payload, keys_to_text=True, values_to_text=True)
+            remote_root = json_response['merkle_root']
+            pieces = json_response['pieces']
+            unverified = json_response.get('unverified') or []
+        except Exception as exc:
+            lg.exc()
+            result.errback(exc)
+            return
+        leaves = []
+        missing_locally = []
+        for piece_name in pieces:
+            local_file = os.path.join(settings.getLocalBackupsDir(), customerGlobalID, remotePath, version, piece_name)
+            data = bpio.ReadBinaryFile(local_file)
+            if not data:
+                missing_locally.append(piece_name)
+                continue
+            leaves.append(hashes.sha256(data))
+        local_root = None if missing_locally else hashes.merkle_root(leaves)
+        if _Debug:
+            lg.args(_DebugLevel, backup_id=backupID, supplier=supplier_idurl, remote_root=remote_root, local_root=local_root)
+        result.callback(dict(
+            backup_id=backupID,
+            supplier_idurl=supplier_idurl,
+            merkle_root=remote_root,
+            local_merkle_root=local_root,
+            pieces=len(pieces),
+            unverified=len(unverified),
+            missing_locally=missing_locally,
+            match=(local_root is not None and local_root == remote_root),
+        ))
+
+    def _on_fail(response, info):
+        result.errback(Exception(strng.to_text(response.Payload) or 'audit request failed'))
+
+    def _on_timeout(pkt_out):
+        result.errback(Exception('audit request timed out'))
+
+    p2p_service.SendContacts(
+        remote_idurl=supplier_idurl,
+        json_payload={
+            'type': 'merkle_root',
+            'space': 'integrity',
+            'backup_id': backupID,
+        },
+        callbacks={
+            commands.Ack(): _on_ack,
+            commands.Fail(): _on_fail,
+            None: _on_timeout,
+        },
+    )
+    return result
+
+
+#------------------------------------------------------------------------------
+
+
 def NewTaskNumber():
     """
     A method to create a unique number for new task.
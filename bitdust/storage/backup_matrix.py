@@ -876,21 +876,25 @@ def ReadLocalFiles():
     """
     This method scans local backups and build the whole "local" matrix.
     """
-    global _LocalFilesNotifyCallback
-    local_files().clear()
-    local_max_block_numbers().clear()
-    local_backup_size().clear()
-    _counter = [
-        0,
-    ]
+    backups_dir = settings.getLocalBackupsDir()
+    ApplyLocalFiles(ScanLocalFiles(backups_dir), backups_dir)
+
 
-    def visit(key_id, realpath, subpath, name):
+def ScanLocalFiles(backups_dir):
+    """
+    Only walks the local backups folder and returns a list of ``(key_id, [subpath, ...])`` tuples.
+    Nothing else is touched here, so that can be executed in a thread.
+    """
+    result = []
+    index_file_name = settings.BackupIndexFileName()
+
+    def visit(subpaths, realpath, subpath, name):
         # subpath is something like 0/0/1/0/F20131120053803PM/0-1-Data
         if not os.path.isfile(realpath):
             return True
         if realpath.startswith('newblock-'):
             return False
-        if subpath == settings.BackupIndexFileName() or packetid.IsIndexFileName(subpath):
+        if subpath == index_file_name or packetid.IsIndexFileName(subpath):
             return False
         try:
             version = subpath.split('/')[-2]
@@ -898,16 +902,32 @@ def ReadLocalFiles():
             return False
         if not packetid.IsCanonicalVersion(version):
             return True
-        LocalFileReport(packetID=packetid.MakeBackupID(key_id, subpath))
-        _counter[0] += 1
+        subpaths.append(subpath)
         return False
 
-    all_keys = os.listdir(settings.getLocalBackupsDir())
-    for key_id in all_keys:
+    for key_id in os.listdir(backups_dir):
+        subpaths = []
+        backup_path = os.path.join(backups_dir, key_id)
+        if os.path.isdir(backup_path):
+            bpio.traverse_dir_recursive(lambda r, s, n: visit(subpaths, r, s, n), backup_path)
+        result.append((key_id, subpaths))
+    return result
+
+
+def ApplyLocalFiles(scanned, backups_dir):
+    """
+    Builds the whole "local" matrix from the results of ``ScanLocalFiles()``, must be called in the main thread.
+    """
+    global _LocalFilesNotifyCallback
+    local_files().clear()
+    local_max_block_numbers().clear()
+    local_backup_size().clear()
+    counter = 0
+    for key_id, subpaths in scanned:
         latest_key_id = my_keys.latest_key_id(key_id)
         if key_id != latest_key_id:
-            old_path = os.path.join(settings.getLocalBackupsDir(), key_id)
-            new_path = os.path.join(settings.getLocalBackupsDir(), my_keys.latest_key_id(key_id))
+            old_path = os.path.join(backups_dir, key_id)
+            new_path = os.path.join(backups_dir, latest_key_id)
             if os.path.isdir(old_path):
                 try:
                     bpio.move_dir_recursive(old_path, new_path)
@@ -919,17 +939,18 @@ def ReadLocalFiles():
                             lg.dbg(_DebugLevel, 'removed %r' % old_path)
                 except:
                     lg.exc()
-        backup_path = os.path.join(settings.getLocalBackupsDir(), latest_key_id)
+        backup_path = os.path.join(backups_dir, latest_key_id)
         if not global_id.IsValidGlobalUser(latest_key_id):
             lg.warn('found incorrect folder name, not a customer: %s' % backup_path)
             continue
-        if os.path.isdir(backup_path):
-            bpio.traverse_dir_recursive(lambda r, s, n: visit(latest_key_id, r, s, n), backup_path)
-        else:
+        if not os.path.isdir(backup_path):
             lg.warn('not a folder: %s' % backup_path)
-
+            continue
+        for subpath in subpaths:
+            LocalFileReport(packetID=packetid.MakeBackupID(latest_key_id, subpath))
+            counter += 1
     if _Debug:
-        lg.out(_DebugLevel, 'backup_matrix.ReadLocalFiles %d files indexed' % _counter[0])
+        lg.out(_DebugLevel, 'backup_matrix.ApplyLocalFiles %d files indexed' % counter)
     if _LocalFilesNotifyCallback is not None:
         _LocalFilesNotifyCallback()
 
@@ -41,6 +41,16 @@ so need to request the missing segments.
 The ``backup_rebuilder()`` machine works on backups one by one (keep them in queue)
 and can be stopped and started at any time.
 
+Blocks are rebuilt in order of risk: for every missing block we calculate how many
+more suppliers we can lose before the block becomes unfixable (see ``eccmap.FixableMargin()``).
+The backup with the most endangered blocks is opened first and blocks with a bigger margin
+are postponed while other backups in the queue still have blocks closer to data loss.
+
+In batch mode (``services/rebuilding/batch-mode-enabled`` option) requests of missing pieces
+to every supplier are combined into multi-file Retrieve() packets and up to ``BATCH_MAX_BLOCKS`` blocks
+are reconstructed in one ``raid_worker()`` task. Every reconstructed block is reported
+as soon as it is ready, so ``data_sender()`` starts delivering new pieces while other blocks are still processed.
+
 The whole process here may be stopped from ``backup_monitor()`` by
 setting a flag in the ``isStopped()`` condition.
 This is need to be able to stop the rebuilding process -
@@ -92,6 +102,7 @@ from bitdust.automats import automat
 from bitdust.system import bpio
 
 from bitdust.main import settings
+from bitdust.main import config
 
 from bitdust.main import listeners
 
@@ -114,6 +125,18 @@ _StoppedFlag = True
 _BackupIDsExclude = set()
 _BackupIDsQueue = []
 _BlockRebuildersQueue = []
+_BlocksRisk = {}
+_MarginsCache = {}
+_StalledPasses = {}
+
+#------------------------------------------------------------------------------
+
+MAX_RISK_MARGIN = 3
+MAX_MARGINS_CACHE_SIZE = 10000
+
+MAX_REQUESTS_PER_SUPPLIER = 16
+BATCH_MAX_REQUESTS_PER_SUPPLIER = 128
+BATCH_MAX_BLOCKS = 16
 
 #------------------------------------------------------------------------------
 
@@ -168,8 +191,13 @@ class BackupRebuilder(automat.Automat):
         self.currentCustomerIDURL = None  # stored by this customer
         # list of missing blocks we work on for current backup
         self.workingBlocksQueue = []
+        # number of blocks of current backup postponed because other backups are in more danger
+        self.deferredBlocks = 0
+        # number of blocks rebuilt since current backup was opened
+        self.passRebuiltBlocks = 0
         self.backupsWasRebuilt = []
         self.missingPackets = 0
+        self.batchFailed = False
         self.log_transitions = _Debug
         from bitdust.stream import data_sender
         data_sender.A().addStateChangedCallback(self._on_data_sender_state_changed)
@@ -344,9 +372,13 @@ class BackupRebuilder(automat.Automat):
             if _Debug:
                 lg.out(_DebugLevel, 'backup_rebuilder.doOpenNextBackup SKIP, queue is empty')
             return
-        # take a first backup from queue to work on it
-        self.currentBackupID = list(more_backups)[0]
+        # take a backup with the most endangered blocks to work on it
+        for backupID in more_backups:
+            if backupID not in _BlocksRisk:
+                ScanBlocksRisk(backupID)
+        self.currentBackupID = min(more_backups, key=lambda b: (BackupQueuePriority(b) or MAX_RISK_MARGIN + 2, _BackupIDsQueue.index(b)))
         # _BackupIDsQueue.pop(self.currentBackupID)
+        self.passRebuiltBlocks = 0
         self.currentCustomerIDURL = packetid.CustomerIDURL(self.currentBackupID)
         if _Debug:
             lg.out(_DebugLevel, 'backup_rebuilder.doOpenNextBackup %s started, queue length: %d' % (self.currentBackupID, len(_BackupIDsQueue)))
@@ -359,14 +391,20 @@ class BackupRebuilder(automat.Automat):
         global _BackupIDsExclude
         self.workingBlocksQueue = []
         if _Debug:
-            lg.out(_DebugLevel, 'backup_rebuilder.doCloseThisBackup %s about to finish, queue length: %d' % (self.currentBackupID, len(_BackupIDsQueue)))
+            lg.out(_DebugLevel, 'backup_rebuilder.doCloseThisBackup %s about to finish, queue length: %d, deferred blocks: %d' % (self.currentBackupID, len(_BackupIDsQueue), self.deferredBlocks))
         if self.currentBackupID:
-            RemoveBackupToWork(self.currentBackupID)
+            if not self.deferredBlocks:
+                RemoveBackupToWork(self.currentBackupID)
+            else:
+                # risk of the blocks was changed during that pass, do not keep the old priority
+                ScanBlocksRisk(self.currentBackupID)
+                PostponeBackup(self.currentBackupID, progress=self.passRebuiltBlocks > 0)
             # clear requesting queue from previous task
             from bitdust.stream import io_throttle
             io_throttle.DeleteBackupRequests(self.currentBackupID)
         self.currentBackupID = None
         self.currentCustomerIDURL = None
+        self.deferredBlocks = 0
 
     def doScanBrokenBlocks(self, *args, **kwargs):
         """
@@ -383,6 +421,23 @@ class BackupRebuilder(automat.Automat):
                 backup_matrix.remote_files()[self.currentBackupID][blockNum] = {'D': [0]*contactsdb.num_suppliers(), 'P': [0]*contactsdb.num_suppliers()}
         # detect missing blocks from remote info
         self.workingBlocksQueue = backup_matrix.ScanMissingBlocks(self.currentBackupID)
+        # most endangered blocks are placed at the end of the queue, they are requested and rebuilt first
+        risk = ScanBlocksRisk(self.currentBackupID, self.workingBlocksQueue)
+        self.workingBlocksQueue = SortBlocksByRisk(self.workingBlocksQueue, risk)
+        # other backups may have blocks closer to data loss, those must be rebuilt before the rest of that backup
+        threshold = None
+        for backupID in _BackupIDsQueue:
+            if backupID == self.currentBackupID or backupID in _BackupIDsExclude:
+                continue
+            priority = BackupQueuePriority(backupID)
+            if priority is not None and (threshold is None or priority < threshold):
+                threshold = priority
+        self.deferredBlocks = 0
+        if threshold is not None:
+            stalled = _StalledPasses.get(self.currentBackupID, 0)
+            urgent_blocks = [blockNum for blockNum in self.workingBlocksQueue if RiskPriority(risk[blockNum]) + stalled <= threshold]
+            self.deferredBlocks = len(self.workingBlocksQueue) - len(urgent_blocks)
+            self.workingBlocksQueue = urgent_blocks
         # find the correct max block number for this backup
         # we can have remote and local files
         # will take biggest block number from both
@@ -399,7 +454,7 @@ class BackupRebuilder(automat.Automat):
         from bitdust.stream import io_throttle
         io_throttle.DeleteBackupRequests(self.currentBackupID)
         if _Debug:
-            lg.out(_DebugLevel, 'backup_rebuilder.doScanBrokenBlocks for %s : %s' % (self.currentBackupID, str(self.workingBlocksQueue)))
+            lg.out(_DebugLevel, 'backup_rebuilder.doScanBrokenBlocks for %s : %s, deferred: %d' % (self.currentBackupID, str(self.workingBlocksQueue), self.deferredBlocks))
         self.automat('backup-ready')
 
     def doRequestAvailablePieces(self, *args, **kwargs):
@@ -416,12 +471,16 @@ class BackupRebuilder(automat.Automat):
         if len(self.workingBlocksQueue) == 0:
             self.automat('rebuilding-finished')
             return
-        # rebuild the backup blocks in reverse order, take last blocks first
+        # rebuild the backup blocks in reverse order, the queue is sorted by risk so most endangered blocks go first,
+        # among blocks with same risk we take last blocks first
         # in such way we can propagate information about how big is the whole backup as soon as possible!
         # remote machine can use simple formula [total size] = [file size] * [block number]
         # and calculate the whole size to be received
         self.blockIndex = len(self.workingBlocksQueue) - 1
-        reactor.callLater(0, self._start_one_block)  # @UndefinedVariable
+        if IsBatchModeEnabled():
+            reactor.callLater(0, self._start_blocks_batch)  # @UndefinedVariable
+        else:
+            reactor.callLater(0, self._start_one_block)  # @UndefinedVariable
 
     def doKillRebuilders(self, *args, **kwargs):
         """
@@ -429,6 +488,7 @@ class BackupRebuilder(automat.Automat):
         """
         lg.warn('aborting raid worker for rebuilding %s' % self.currentBackupID)
         raid_worker.cancel_task('rebuild', self.currentBackupID)
+        raid_worker.cancel_task('rebuild_many', self.currentBackupID)
 
     def doClearStoppedFlag(self, *args, **kwargs):
         """
@@ -458,6 +518,8 @@ class BackupRebuilder(automat.Automat):
         # remember how many requests we did on this iteration
         total_requests_count = 0
         # at the moment I do download everything I have available and needed
+        batch_mode = IsBatchModeEnabled()
+        max_requests = BATCH_MAX_REQUESTS_PER_SUPPLIER if batch_mode else MAX_REQUESTS_PER_SUPPLIER
         if id_url.is_some_empty(contactsdb.suppliers(customer_idurl=self.currentCustomerIDURL)):
             if _Debug:
                 lg.out(_DebugLevel, 'backup_rebuilder._request_files SKIP - empty supplier')
@@ -473,10 +535,10 @@ class BackupRebuilder(automat.Automat):
             for blockIndex in range(len(self.workingBlocksQueue) - 1, -1, -1):
                 blockNum = self.workingBlocksQueue[blockIndex]
                 # do not keep too many requests in the queue
-                if io_throttle.GetRequestQueueLength(supplierID) >= 16:
+                if io_throttle.GetRequestQueueLength(supplierID) >= max_requests:
                     break
                 # also don't do too many requests at once
-                if requests_count > 16:
+                if requests_count > max_requests:
                     break
                 remoteData = backup_matrix.GetRemoteDataArray(self.currentBackupID, blockNum)
                 remoteParity = backup_matrix.GetRemoteParityArray(self.currentBackupID, blockNum)
@@ -503,6 +565,8 @@ class BackupRebuilder(automat.Automat):
                                         PacketID,
                                         my_id.getIDURL(),
                                         supplierID,
+                                        priority=io_throttle.PRIORITY_REBUILD,
+                                        batch=batch_mode,
                                     ):
                                         requests_count += 1
                     else:
@@ -528,6 +592,8 @@ class BackupRebuilder(automat.Automat):
                                         PacketID,
                                         my_id.getIDURL(),
                                         supplierID,
+                                        priority=io_throttle.PRIORITY_REBUILD,
+                                        batch=batch_mode,
                                     ):
                                         requests_count += 1
                     else:
@@ -617,16 +683,23 @@ class BackupRebuilder(automat.Automat):
                 lg.out(_DebugLevel, 'backup_rebuilder._block_finished FAILED, blockIndex=%d' % self.blockIndex)
             reactor.callLater(0, self._finish_rebuilding)  # @UndefinedVariable
             return
+        if self._block_rebuilt(params[0], params[1], result) is None:
+            reactor.callLater(0, self._finish_rebuilding)  # @UndefinedVariable
+            return
+        self.blockIndex -= 1
+        reactor.callLater(0, self._start_one_block)  # @UndefinedVariable
+
+    def _block_rebuilt(self, _backupID, _blockNumber, result):
+        """
+        Marks reconstructed pieces of a single block as available locally, returns None if result was not valid.
+        """
         try:
             newData, localData, localParity, reconstructedData, reconstructedParity = result
-            _backupID = params[0]
-            _blockNumber = params[1]
         except:
             lg.exc()
-            reactor.callLater(0, self._finish_rebuilding)  # @UndefinedVariable
-            return
+            return None
         if _Debug:
-            lg.out(_DebugLevel, 'backup_rebuilder._block_finished   backupID=%r  blockNumber=%r  newData=%r' % (_backupID, _blockNumber, newData))
+            lg.out(_DebugLevel, 'backup_rebuilder._block_rebuilt   backupID=%r  blockNumber=%r  newData=%r' % (_backupID, _blockNumber, newData))
         if _Debug:
             lg.out(_DebugLevel, '        localData=%r  localParity=%r' % (localData, localParity))
         err = False
@@ -643,7 +716,7 @@ class BackupRebuilder(automat.Automat):
                     reconstructedParity[supplierNum]
                 except:
                     err = True
-                    lg.err('invalid result from the task: %s' % repr(params))
+                    lg.err('invalid result from the task for block %r of %r' % (_blockNumber, _backupID))
                     if _Debug:
                         lg.out(_DebugLevel, 'result is %s' % repr(result))
                     break
@@ -655,17 +728,61 @@ class BackupRebuilder(automat.Automat):
                     count += 1
             if err:
                 lg.err('seems suppliers were changed, stop rebuilding')
-                reactor.callLater(0, self._finish_rebuilding)  # @UndefinedVariable
-                return
+                return None
             self.blocksSucceed.append(_blockNumber)
             data_sender.A('new-data')
             if _Debug:
                 lg.out(_DebugLevel, '        !!!!!! %d NEW DATA segments reconstructed, blockIndex=%d' % (count, self.blockIndex))
-        else:
+            return True
+        if _Debug:
+            lg.out(_DebugLevel, '        NO CHANGES, blockIndex=%d' % self.blockIndex)
+        return False
+
+    def _start_blocks_batch(self):
+        from bitdust.storage import backup_matrix
+        if self.blockIndex < 0:
             if _Debug:
-                lg.out(_DebugLevel, '        NO CHANGES, blockIndex=%d' % self.blockIndex)
-        self.blockIndex -= 1
-        reactor.callLater(0, self._start_one_block)  # @UndefinedVariable
+                lg.out(_DebugLevel, 'backup_rebuilder._start_blocks_batch finish all blocks blockIndex=%d' % self.blockIndex)
+            reactor.callLater(0, self._finish_rebuilding)  # @UndefinedVariable
+            return
+        # same order as for single blocks: from the end of the working queue
+        blocks = []
+        for blockIndex in range(self.blockIndex, max(-1, self.blockIndex - BATCH_MAX_BLOCKS), -1):
+            BlockNumber = self.workingBlocksQueue[blockIndex]
+            blocks.append((
+                BlockNumber,
+                backup_matrix.GetRemoteMatrix(self.currentBackupID, BlockNumber),
+                backup_matrix.GetLocalMatrix(self.currentBackupID, BlockNumber),
+            ))
+        if _Debug:
+            lg.out(_DebugLevel, 'backup_rebuilder._start_blocks_batch %d blocks to rebuild, blockIndex=%d' % (len(blocks), self.blockIndex))
+        self.batchFailed = False
+        backupID = self.currentBackupID
+        task_params = (
+            backupID,
+            blocks,
+            eccmap.Current().name,
+            backup_matrix.GetActiveArray(),
+            settings.getLocalBackupsDir(),
+            # executed in the worker thread, every block is reported right away to start sending new pieces
+            lambda blockNum, result: reactor.callFromThread(self._batch_block_finished, backupID, blockNum, result),  # @UndefinedVariable
+        )
+        raid_worker.add_task('rebuild_many', task_params, lambda cmd, params, result: self._batch_finished(result, params))
+
+    def _batch_block_finished(self, backupID, blockNum, result):
+        if backupID != self.currentBackupID or self.batchFailed:
+            return
+        if not result or self._block_rebuilt(backupID, blockNum, result) is None:
+            self.batchFailed = True
+
+    def _batch_finished(self, result, params):
+        if result is None or self.batchFailed or len(result) < len(params[1]):
+            if _Debug:
+                lg.out(_DebugLevel, 'backup_rebuilder._batch_finished FAILED, blockIndex=%d' % self.blockIndex)
+            reactor.callLater(0, self._finish_rebuilding)  # @UndefinedVariable
+            return
+        self.blockIndex -= len(params[1])
+        reactor.callLater(0, self._start_blocks_batch)  # @UndefinedVariable
 
     def _finish_rebuilding(self):
         for blockNum in self.blocksSucceed:
@@ -677,6 +794,7 @@ class BackupRebuilder(automat.Automat):
             lg.out(_DebugLevel, 'backup_rebuilder._finish_rebuilding succeed:%s working:%s' % (str(self.blocksSucceed), str(self.workingBlocksQueue)))
         if len(self.blocksSucceed):
             self.backupsWasRebuilt.append(self.currentBackupID)
+            self.passRebuiltBlocks += len(self.blocksSucceed)
         self.blocksSucceed = []
         self.automat('rebuilding-finished')
 
@@ -701,6 +819,8 @@ def RemoveBackupToWork(backupID):
     Remove single backup from the working queue.
     """
     global _BackupIDsQueue
+    _BlocksRisk.pop(backupID, None)
+    _StalledPasses.pop(backupID, None)
     if backupID in _BackupIDsQueue:
         _BackupIDsQueue.remove(backupID)
         if _Debug:
@@ -736,10 +856,181 @@ def RemoveAllBackupsToWork():
     global _BackupIDsQueue
     current_queue_length = len(_BackupIDsQueue)
     _BackupIDsQueue = []
+    _BlocksRisk.clear()
+    _StalledPasses.clear()
     if _Debug:
         lg.out(_DebugLevel, 'RemoveAllBackupsToWork %d items cleaned' % current_queue_length)
 
 
+#------------------------------------------------------------------------------
+
+
+def BlockRiskMargin(backupID, blockNum, ecc_map=None, active_array=None):
+    """
+    Returns how many more suppliers can be lost before given block becomes unfixable.
+
+    Pieces stored on suppliers which are currently offline are not counted,
+    pieces we have on hands locally are not lost together with the supplier.
+    Result is between 0 (can not be fixed right now) and ``MAX_RISK_MARGIN``.
+    """
+    from bitdust.storage import backup_matrix
+    ecc_map = ecc_map or eccmap.Current()
+    if active_array is None:
+        active_array = backup_matrix.GetActiveArray(customer_idurl=packetid.CustomerIDURL(backupID))
+    localData = backup_matrix.GetLocalDataArray(backupID, blockNum)
+    localParity = backup_matrix.GetLocalParityArray(backupID, blockNum)
+    remoteData = backup_matrix.GetRemoteDataArray(backupID, blockNum)
+    remoteParity = backup_matrix.GetRemoteParityArray(backupID, blockNum)
+    keptData = [0]*ecc_map.datasegments
+    keptParity = [0]*ecc_map.paritysegments
+    dataSegs = [0]*ecc_map.datasegments
+    paritySegs = [0]*ecc_map.paritysegments
+    for supplierNum in range(min(ecc_map.datasegments, len(active_array), len(localData), len(remoteData))):
+        keptData[supplierNum] = 1 if localData[supplierNum] == 1 else 0
+        dataSegs[supplierNum] = 1 if keptData[supplierNum] or (remoteData[supplierNum] == 1 and active_array[supplierNum]) else 0
+    for supplierNum in range(min(ecc_map.paritysegments, len(active_array), len(localParity), len(remoteParity))):
+        keptParity[supplierNum] = 1 if localParity[supplierNum] == 1 else 0
+        paritySegs[supplierNum] = 1 if keptParity[supplierNum] or (remoteParity[supplierNum] == 1 and active_array[supplierNum]) else 0
+    # after a supplier was lost all blocks of a backup usually look exactly the same, calculate only once
+    key = (ecc_map.name, tuple(dataSegs), tuple(paritySegs), tuple(keptData), tuple(keptParity))
+    if key not in _MarginsCache:
+        if len(_MarginsCache) >= MAX_MARGINS_CACHE_SIZE:
+            _MarginsCache.clear()
+        _MarginsCache[key] = ecc_map.FixableMargin(dataSegs, paritySegs, kept_data=keptData, kept_parity=keptParity, limit=MAX_RISK_MARGIN)
+    return _MarginsCache[key]
+
+
+def ScanBlocksRisk(backupID, blocks=None):
+    """
+    Calculates risk margin for missing blocks of given backup and stores it in the rebuild queue.
+
+    If ``blocks`` is not provided, missing blocks are detected with ``backup_matrix.ScanMissingBlocks()``.
+    Returns a dictionary: block number -> risk margin.
+    """
+    from bitdust.storage import backup_matrix
+    if blocks is None:
+        blocks = backup_matrix.ScanMissingBlocks(backupID)
+    ecc_map = eccmap.Current()
+    active_array = backup_matrix.GetActiveArray(customer_idurl=packetid.CustomerIDURL(backupID))
+    _BlocksRisk[backupID] = {blockNum: BlockRiskMargin(backupID, blockNum, ecc_map=ecc_map, active_array=active_array) for blockNum in blocks}
+    return _BlocksRisk[backupID]
+
+
+def RiskPriority(margin):
+    """
+    Lower value means the block must be rebuilt earlier.
+
+    Blocks which can not be fixed right now are placed after all others,
+    we still keep trying them because missing pieces may appear later.
+    """
+    if margin <= 0:
+        return MAX_RISK_MARGIN + 1
+    return margin
+
+
+def BackupRiskPriority(backupID):
+    """
+    Returns priority of the most endangered block of given backup or None if nothing to rebuild there.
+    """
+    risk = _BlocksRisk.get(backupID)
+    if not risk:
+        return None
+    return min(RiskPriority(margin) for margin in risk.values())
+
+
+def BackupQueuePriority(backupID):
+    """
+    Same as ``BackupRiskPriority()``, but aged by number of passes in a row which did not rebuild anything.
+
+    Otherwise a backup with urgent blocks which can not be rebuilt right now is opened again and again
+    and all other backups in the queue starve.
+    """
+    priority = BackupRiskPriority(backupID)
+    if priority is None:
+        return None
+    return priority + _StalledPasses.get(backupID, 0)
+
+
+def PostponeBackup(backupID, progress):
+    """
+    Called after a pass over given backup when some of its blocks were deferred.
+
+    Backup is moved to the end of the queue, so other backups with the same priority go first.
+    If nothing was rebuilt during that pass its priority is aged, otherwise the aging is reset.
+    """
+    global _BackupIDsQueue
+    if progress:
+        _StalledPasses.pop(backupID, None)
+    else:
+        _StalledPasses[backupID] = _StalledPasses.get(backupID, 0) + 1
+    if backupID in _BackupIDsQueue:
+        _BackupIDsQueue.remove(backupID)
+        _BackupIDsQueue.append(backupID)
+    if _Debug:
+        lg.out(_DebugLevel, 'backup_rebuilder.PostponeBackup %s progress=%r stalled passes: %d' % (backupID, progress, _StalledPasses.get(backupID, 0)))
+
+
+def SortBlocksByRisk(blocks, risk):
+    """
+    Blocks are processed from the end of the working queue,
+    so the most endangered blocks and blocks with higher numbers are placed last.
+    """
+    return sorted(blocks, key=lambda blockNum: (-RiskPriority(risk.get(blockNum, 0)), blockNum))
+
+
+def RebuildQueueStats():
+    """
+    Returns info about rebuilding queue: how many backups and blocks are waiting
+    and the histogram of blocks by number of suppliers we can lose before the data loss.
+    """
+    at_risk = {'lost': 0}
+    for margin in range(1, MAX_RISK_MARGIN):
+        at_risk[str(margin)] = 0
+    at_risk['%d+' % MAX_RISK_MARGIN] = 0
+    backups = []
+    queue_depth = 0
+    for backupID in _BackupIDsQueue:
+        if backupID in _BackupIDsExclude:
+            continue
+        backups.append(backupID)
+        for margin in _BlocksRisk.get(backupID, {}).values():
+            queue_depth += 1
+            if margin <= 0:
+                at_risk['lost'] += 1
+            elif margin >= MAX_RISK_MARGIN:
+                at_risk['%d+' % MAX_RISK_MARGIN] += 1
+            else:
+                at_risk[str(margin)] += 1
+    ret = {
+        'backups': len(backups),
+        'scanned_backups': len([b for b in backups if b in _BlocksRisk]),
+        'queue_depth': queue_depth,
+        'at_risk': at_risk,
+        'state': None,
+        'current_backup_id': None,
+        'current_blocks': 0,
+        'deferred_blocks': 0,
+    }
+    if _BackupRebuilder:
+        ret.update({
+            'state': _BackupRebuilder.state,
+            'current_backup_id': _BackupRebuilder.currentBackupID,
+            'current_blocks': len(_BackupRebuilder.workingBlocksQueue),
+            'deferred_blocks': _BackupRebuilder.deferredBlocks,
+        })
+    return ret
+
+
+#------------------------------------------------------------------------------
+
+
+def IsBatchModeEnabled():
+    return config.conf().getBool('services/rebuilding/batch-mode-enabled')
+
+
+#------------------------------------------------------------------------------
+
+
 def SetStoppedFlag():
     """
     To stop backup_rebuilder() you need to call this method, it will set
@@ -764,3 +1055,119 @@ def ReadStoppedFlag():
     """
     global _StoppedFlag
     return _StoppedFlag
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Local simulation of a full supplier replacement: all Data and Parity pieces of one supplier must be rebuilt
+    from pieces of all other suppliers which were already downloaded.
+    Compares requesting every piece in a separate Retrieve() packet and rebuilding blocks one by one
+    with multi-file requests and rebuilding in batches.
+    Network latency is the same in both cases because number of files in flight is limited by same window,
+    so only the processing of request packets is counted: signing on one side and verification on another side.
+    """
+    import time
+    import math
+    import shutil
+    import tempfile
+    from bitdust.raid import make
+    from bitdust.crypt import rsa_key
+    num_blocks = 64
+    block_size = 256*1024
+    window = 8
+    replaced = 5
+    ecc_name = 'ecc/18x18'
+    num_suppliers = eccmap.eccmap(ecc_name).NumSuppliers()
+    backup_id = 'master$alice@127.0.0.1_8084:0/F20230101010101AM'
+    backups_dir = tempfile.mkdtemp()
+    version_dir = os.path.join(backups_dir, 'master$alice@127.0.0.1_8084', '0', 'F20230101010101AM')
+    source_path = os.path.join(backups_dir, 'source')
+    for blockNum in range(num_blocks):
+        bpio.WriteBinaryFile(source_path, os.urandom(block_size))
+        make.do_in_memory(source_path, ecc_name, 'F20230101010101AM', blockNum, version_dir)
+    originals = {}
+    for blockNum in range(num_blocks):
+        for dataOrParity in ('Data', 'Parity'):
+            filename = os.path.join(version_dir, '%d-%d-%s' % (blockNum, replaced, dataOrParity))
+            originals[filename] = bpio.ReadBinaryFile(filename)
+    matrix = {'D': [1]*num_suppliers, 'P': [1]*num_suppliers}
+    matrix['D'][replaced] = 0
+    matrix['P'][replaced] = 0
+    active = [1]*num_suppliers
+
+    def _drop_replaced():
+        for filename in originals.keys():
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def _check_rebuilt():
+        return all([bpio.ReadBinaryFile(filename) == data for filename, data in originals.items()])
+
+    # every supplier must send 2 pieces for every block
+    pieces_per_supplier = 2*num_blocks
+    single_packets = (num_suppliers - 1)*pieces_per_supplier
+    # one multi-file Retrieve() and one Ack() for every window of files
+    batch_packets = (num_suppliers - 1)*int(math.ceil(pieces_per_supplier/float(window)))*2
+    key = rsa_key.RSAKey()
+    key.generate(2048)
+    t = time.time()
+    for _ in range(20):
+        message = os.urandom(300)
+        key.verify(key.sign(message), message)
+    packet_cost = (time.time() - t)/20.0
+    timings = {}
+
+    def _single(blockNum, started):
+        if blockNum >= num_blocks:
+            timings['single'] = time.time() - started
+            timings['single_ok'] = _check_rebuilt()
+            _drop_replaced()
+            reactor.callLater(0, _batch, 0, time.time())  # @UndefinedVariable
+            return
+
+        def _done(cmd, params, result):
+            timings.setdefault('single_first', time.time() - started)
+            reactor.callLater(0, _single, blockNum + 1, started)  # @UndefinedVariable
+
+        raid_worker.add_task('rebuild', (backup_id, blockNum, ecc_name, active, matrix, matrix, backups_dir), _done)
+
+    def _batch(blockNum, started):
+        if blockNum >= num_blocks:
+            timings['batch'] = time.time() - started
+            timings['batch_ok'] = _check_rebuilt()
+            raid_worker.A('shutdown')
+            reactor.stop()  # @UndefinedVariable
+            return
+        blocks = [(b, matrix, matrix) for b in range(blockNum, min(num_blocks, blockNum + BATCH_MAX_BLOCKS))]
+
+        def _block_done(b, result):
+            if 'batch_first' not in timings:
+                timings['batch_first'] = time.time() - started
+
+        raid_worker.add_task('rebuild_many', (backup_id, blocks, ecc_name, active, backups_dir, _block_done), lambda cmd, params, result: reactor.callLater(0, _batch, blockNum + len(blocks), started))  # @UndefinedVariable
+
+    _drop_replaced()
+    reactor.callWhenRunning(raid_worker.A, 'init')  # @UndefinedVariable
+    reactor.callLater(0.1, _single, 0, time.time())  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+    shutil.rmtree(backups_dir)
+    single_total = single_packets*packet_cost + timings['single']
+    batch_total = batch_packets*packet_cost + timings['batch']
+    print('replaced supplier %d of %d, %d blocks of %d KB' % (replaced, num_suppliers, num_blocks, block_size/1024))
+    print('request packets:  one by one %d (%.2f sec)  batched %d (%.2f sec)' % (single_packets, single_packets*packet_cost, batch_packets, batch_packets*packet_cost))
+    print('rebuilding:  one by one %.2f sec (first block after %.3f sec, valid: %s)  batched %.2f sec (first block after %.3f sec, valid: %s)' % (
+        timings['single'],
+        timings['single_first'],
+        timings['single_ok'],
+        timings['batch'],
+        timings['batch_first'],
+        timings['batch_ok'],
+    ))
+    print('total:  one by one %.2f sec  batched %.2f sec  speedup %.1fx' % (single_total, batch_total, single_total/batch_total))
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,7 @@
 BitDust file_down() Automat
 
 EVENTS:
+    * :red:`deadline`
     * :red:`fail-received`
     * :red:`file-already-exists`
     * :red:`init`
@@ -118,6 +119,8 @@ class FileDown(automat.Automat):
         self.fileName = fileName
         self.ownerID = ownerID
         self.remoteID = remoteID
+        # PacketID of multi-file Retrieve() packet if that file was requested together with others
+        self.batchID = None
         self.requestTime = None
         self.fileReceivedTime = None
         self.requestTimeout = max(30, 2*int(settings.getBackupBlockSize()/settings.SendingSpeedLimit()))
@@ -155,6 +158,12 @@ class FileDown(automat.Automat):
                 self.doReportStopped(*args, **kwargs)
                 self.doQueueNext(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
+            elif event == 'deadline':
+                self.state = 'FAILED'
+                self.doQueueRemove(*args, **kwargs)
+                self.doReportFailed(event, *args, **kwargs)
+                self.doQueueNext(*args, **kwargs)
+                self.doDestroyMe(*args, **kwargs)
         #---STARTED---
         elif self.state == 'STARTED':
             if event == 'stop':
@@ -234,11 +243,19 @@ class FileDown(automat.Automat):
             raise Exception('file %r not found in downloading queue for %r' % (self.packetID, self.remoteID))
         self.parent.fileRequestQueue.remove(self.packetID)
         del self.parent.fileRequestDict[self.packetID]
+        self.parent.requestScheduler.remove(self.packetID)
 
     def doSendRetreive(self, *args, **kwargs):
         """
         Action method.
         """
+        if self.parent.AddToRequestsBatch(self):
+            # will be requested together with other files from same supplier
+            self.requestTime = time.time()
+            return
+        self.SendRetreive()
+
+    def SendRetreive(self):
         if _Debug:
             lg.args(_DebugLevel, packetID=self.packetID, remoteID=self.remoteID)
         p2p_service.SendRetreive(
@@ -260,6 +277,9 @@ class FileDown(automat.Automat):
         Action method.
         """
         packetsToCancel = packet_out.search_by_packet_id(self.packetID)
+        batchID = self.batchID
+        if self.parent.CancelBatchedRequest(self):
+            packetsToCancel.extend(packet_out.search_by_packet_id(batchID))
         for pkt_out in packetsToCancel:
             if pkt_out.outpacket.Command == commands.Retrieve():
                 if _Debug:
@@ -41,6 +41,7 @@ BitDust file_up() Automat
 EVENTS:
     * :red:`ack-received`
     * :red:`data-sent`
+    * :red:`deadline`
     * :red:`error`
     * :red:`fail-received`
     * :red:`file-not-exist`
@@ -165,6 +166,12 @@ class FileUp(automat.Automat):
                 self.doReportFailed(event, *args, **kwargs)
                 self.doQueueNext(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
+            elif event == 'deadline':
+                self.state = 'FAILED'
+                self.doQueueRemove(*args, **kwargs)
+                self.doReportFailed(event, *args, **kwargs)
+                self.doQueueNext(*args, **kwargs)
+                self.doDestroyMe(*args, **kwargs)
         #---UPLOADING---
         elif self.state == 'UPLOADING':
             if event == 'stop':
@@ -252,6 +259,7 @@ class FileUp(automat.Automat):
             raise Exception('file %r not found in uploading queue for %r' % (self.packetID, self.remoteID))
         self.parent.fileSendQueue.remove(self.packetID)
         del self.parent.fileSendDict[self.packetID]
+        self.parent.sendScheduler.remove(self.packetID)
 
     def doSendData(self, *args, **kwargs):
         """
@@ -0,0 +1,370 @@
+#!/usr/bin/python
+# io_scheduler.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (io_scheduler.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+"""
+.. module:: io_scheduler.
+
+Event-driven scheduler of file transfers with a single remote supplier, used by ``io_throttle.SupplierQueue``.
+
+Nothing is polled: the scheduler wakes up only when a new item was queued, when some item was acknowledged or failed,
+or when the nearest timeout or deadline is reached.
+
+Items are taken in order of priority classes:
+
+    + ``PRIORITY_RESTORE`` - user is waiting for the data to be restored
+    + ``PRIORITY_REBUILD`` - missing pieces are downloaded to rebuild a backup
+    + ``PRIORITY_UPLOAD`` - background uploading of a fresh backup
+
+Number of items "in flight" is limited by ``InFlightWindow`` which is adjusted
+from measured acknowledgement latency and throughput of the supplier:
+window grows while latency stays close to the lowest observed value and shrinks
+when latency is growing or items are timed out.
+
+An item can have a deadline: it is failed right away if it is not possible to deliver it in time
+instead of waiting in the queue.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 14
+
+#------------------------------------------------------------------------------
+
+import heapq
+
+from collections import deque
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+#------------------------------------------------------------------------------
+
+PRIORITY_RESTORE = 0
+PRIORITY_REBUILD = 1
+PRIORITY_UPLOAD = 2
+
+PRIORITIES = (
+    PRIORITY_RESTORE,
+    PRIORITY_REBUILD,
+    PRIORITY_UPLOAD,
+)
+
+#------------------------------------------------------------------------------
+
+
+class InFlightWindow(object):
+
+    """
+    Keeps number of items allowed to be transferred at same time with one supplier.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.size = float(min(max(initial, minimum), self.maximum))
+        self.latency = None
+        self.min_latency = None
+        self.throughput = None
+        self._acked_bytes = 0
+        self._measure_started = None
+
+    def limit(self):
+        return int(self.size)
+
+    def on_success(self, latency, size, now):
+        latency = max(latency, 0.001)
+        if self.latency is None:
+            self.latency = latency
+            self.min_latency = latency
+        else:
+            self.latency = 0.875*self.latency + 0.125*latency
+            # slowly forget the lowest latency, so the window can adapt if the route was changed
+            self.min_latency = min(latency, self.min_latency + (latency - self.min_latency)*0.01)
+        if self.latency <= 2.0*self.min_latency:
+            # latency is stable: one more item per window of acks
+            self.size = min(float(self.maximum), self.size + 1.0/self.size)
+        elif self.latency >= 4.0*self.min_latency:
+            # supplier's link is saturated, items are waiting somewhere in the queues
+            self.size = max(float(self.minimum), self.size*0.9)
+        self._acked_bytes += size
+        if self._measure_started is None:
+            self._measure_started = now - latency
+        elapsed = now - self._measure_started
+        if elapsed >= 1.0:
+            rate = self._acked_bytes/elapsed
+            self.throughput = rate if self.throughput is None else 0.75*self.throughput + 0.25*rate
+            self._acked_bytes = 0
+            self._measure_started = now
+
+    def on_failure(self):
+        self.size = max(float(self.minimum), self.size/2.0)
+
+    def estimate(self, size, bytes_in_flight=0):
+        """
+        Returns expected time in seconds needed to deliver an item of given size, or None if nothing was measured yet.
+        """
+        if self.latency is None:
+            return None
+        if not self.throughput:
+            return self.latency
+        return self.latency + (bytes_in_flight + size)/self.throughput
+
+    def to_json(self):
+        return {
+            'window': self.limit(),
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'min_latency': round(self.min_latency, 3) if self.min_latency is not None else None,
+            'throughput': int(self.throughput) if self.throughput is not None else None,
+        }
+
+
+class _Item(object):
+
+    __slots__ = ('item_id', 'generation', 'priority', 'deadline', 'size', 'timeout', 'started')
+
+    def __init__(self, item_id, generation, priority, deadline, size, timeout):
+        self.item_id = item_id
+        self.generation = generation
+        self.priority = priority
+        self.deadline = deadline
+        self.size = size
+        self.timeout = timeout
+        self.started = None
+
+
+class TransferScheduler(object):
+
+    """
+    Calls ``start_callback(item_id)`` when the item must be started
+    and ``expire_callback(item_id, reason)`` when the item is failed by the scheduler,
+    ``reason`` is ``'timeout'`` or ``'deadline'``.
+
+    Owner must report the result of every started item with ``acked()`` or ``failed()``,
+    and call ``remove()`` when item was removed from the queue for any other reason.
+    """
+
+    def __init__(self, name, start_callback, expire_callback, window=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor  # @UnresolvedImport
+            clock = reactor
+        self.name = name
+        self.clock = clock
+        self.start_callback = start_callback
+        self.expire_callback = expire_callback
+        self.window = window or InFlightWindow()
+        self.items = {}
+        self.pending = [deque() for _ in PRIORITIES]
+        self.pending_count = 0
+        # every enqueued item gets a new number, so stale entries in the pending queues can be recognized
+        self.generation = 0
+        self.in_flight = {}
+        self.deadlines = []
+        self.task = None
+        self.task_time = None
+        self.running = False
+        self.stopped = False
+
+    def __repr__(self):
+        return 'TransferScheduler(%s|%d/%d|%d)' % (self.name, len(self.in_flight), self.window.limit(), self.pending_count)
+
+    def enqueue(self, item_id, priority=PRIORITY_UPLOAD, deadline=None, size=0, timeout=None):
+        if item_id in self.items:
+            return False
+        priority = min(max(priority, PRIORITIES[0]), PRIORITIES[-1])
+        self.generation += 1
+        item = _Item(item_id, self.generation, priority, deadline, size, timeout)
+        self.items[item_id] = item
+        self.pending[priority].append((self.generation, item_id))
+        self.pending_count += 1
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, item_id))
+        self.wake()
+        return True
+
+    def acked(self, item_id, size=None):
+        item = self.items.get(item_id)
+        if item is None or item.started is None:
+            return False
+        now = self.clock.seconds()
+        self.window.on_success(now - item.started, item.size if size is None else size, now)
+        return self.remove(item_id)
+
+    def failed(self, item_id, timeout=False):
+        item = self.items.get(item_id)
+        if item is None:
+            return False
+        if timeout and item.started is not None:
+            self.window.on_failure()
+        return self.remove(item_id)
+
+    def remove(self, item_id):
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return False
+        if item.started is None:
+            # item stays in the pending queue and will be skipped there
+            self.pending_count -= 1
+        else:
+            self.in_flight.pop(item_id, None)
+        self.wake()
+        return True
+
+    def is_pending(self, item_id):
+        item = self.items.get(item_id)
+        return item is not None and item.started is None
+
+    def stop(self):
+        self.stopped = True
+        self._cancel()
+        self.items.clear()
+        self.in_flight.clear()
+        for queue in self.pending:
+            queue.clear()
+        self.pending_count = 0
+        del self.deadlines[:]
+
+    def wake(self, delay=0):
+        """
+        Schedule next pass, only one reactor call is kept for every scheduler.
+        """
+        if self.stopped or self.running:
+            return
+        when = self.clock.seconds() + delay
+        if self.task is not None and self.task.active():
+            if self.task_time <= when:
+                return
+            self.task.reset(delay)
+        else:
+            self.task = self.clock.callLater(delay, self.run)
+        self.task_time = when
+
+    def _cancel(self):
+        if self.task is not None and self.task.active():
+            self.task.cancel()
+        self.task = None
+        self.task_time = None
+
+    def run(self):
+        self.task = None
+        self.task_time = None
+        if self.stopped:
+            return 0
+        now = self.clock.seconds()
+        expired = []
+        for item_id, item in self.in_flight.items():
+            if item.timeout and now - item.started > item.timeout:
+                expired.append((item_id, 'timeout'))
+        for item_id, _ in expired:
+            self.items[item_id].timeout = None
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, item_id = heapq.heappop(self.deadlines)
+            item = self.items.get(item_id)
+            if item is not None and item.started is None and item.deadline == deadline:
+                expired.append((item_id, 'deadline'))
+        bytes_in_flight = sum([item.size for item in self.in_flight.values()])
+        limit = self.window.limit()
+        started = []
+        for queue in self.pending:
+            while queue and len(self.in_flight) < limit:
+                generation, item_id = queue.popleft()
+                item = self.items.get(item_id)
+                if item is None or item.started is not None or item.generation != generation:
+                    # was removed or was queued again with another priority
+                    continue
+                self.pending_count -= 1
+                if item.deadline is not None:
+                    estimated = self.window.estimate(item.size, bytes_in_flight)
+                    if item.deadline <= now or (estimated is not None and now + estimated > item.deadline):
+                        item.started = now
+                        self.in_flight[item_id] = item
+                        expired.append((item_id, 'deadline'))
+                        continue
+                item.started = now
+                self.in_flight[item_id] = item
+                bytes_in_flight += item.size
+                started.append(item_id)
+        self.running = True
+        try:
+            for item_id in started:
+                try:
+                    self.start_callback(item_id)
+                except:
+                    lg.exc()
+                    self.remove(item_id)
+            for item_id, reason in expired:
+                if item_id not in self.items:
+                    continue
+                if _Debug:
+                    lg.args(_DebugLevel, s=self, item_id=item_id, reason=reason)
+                if reason == 'timeout':
+                    self.window.on_failure()
+                try:
+                    self.expire_callback(item_id, reason)
+                except:
+                    lg.exc()
+                self.remove(item_id)
+        finally:
+            self.running = False
+        self._schedule_next()
+        return len(started)
+
+    def _schedule_next(self):
+        if self.stopped:
+            return
+        if self.pending_count and len(self.in_flight) < self.window.limit():
+            self.wake()
+            return
+        now = self.clock.seconds()
+        nearest = None
+        for item in self.in_flight.values():
+            if item.timeout:
+                if nearest is None or item.started + item.timeout < nearest:
+                    nearest = item.started + item.timeout
+        while self.deadlines:
+            deadline, item_id = self.deadlines[0]
+            item = self.items.get(item_id)
+            if item is not None and item.started is None and item.deadline == deadline:
+                if nearest is None or deadline < nearest:
+                    nearest = deadline
+                break
+            heapq.heappop(self.deadlines)
+        if nearest is not None:
+            # a small gap, so the timeout is already passed when the call is executed
+            self.wake(delay=max(0, nearest - now) + 0.01)
+
+    def to_json(self):
+        j = self.window.to_json()
+        j.update({
+            'name': self.name,
+            'in_flight': len(self.in_flight),
+            'pending': [len([i for i in q if i in self.items and self.items[i].started is None]) for q in self.pending],
+        })
+        return j
@@ -33,11 +33,12 @@ and make it so no other packets can go out.
 This just tries to limit how much we are sending out or receiving at any time
 so that we still have control.
 
-Before requesting another file or sending another one out
-I check to see how much stuff I have waiting.
-
 Keep track of every supplier, store packets send/request in many queues.
 
+Every queue is driven by ``io_scheduler.TransferScheduler``: restore requests go first,
+then rebuild traffic and then background uploads. Number of files being transferred at the same time
+with every supplier depends on measured latency and throughput of that supplier.
+
 TODO:
 We probably want to be able to send not only to suppliers but to any contacts.
 In future we can use that to do "overlay" communications to hide users.
@@ -46,7 +47,6 @@ In future we can use that to do "overlay" communications to hide users.
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
-from six.moves import range
 
 #------------------------------------------------------------------------------
 
@@ -57,7 +57,6 @@ _DebugLevel = 12
 
 import os
 import sys
-import time
 
 #------------------------------------------------------------------------------
 
@@ -70,9 +69,9 @@ except:
 
 from bitdust.logs import lg
 
-from bitdust.lib import misc
 from bitdust.lib import nameurl
 from bitdust.lib import packetid
+from bitdust.lib import serialization
 
 from bitdust.main import settings
 from bitdust.main import config
@@ -88,6 +87,14 @@ from bitdust.crypt import signed
 
 from bitdust.transport import callback
 
+from bitdust.stream import io_scheduler
+
+#------------------------------------------------------------------------------
+
+PRIORITY_RESTORE = io_scheduler.PRIORITY_RESTORE
+PRIORITY_REBUILD = io_scheduler.PRIORITY_REBUILD
+PRIORITY_UPLOAD = io_scheduler.PRIORITY_UPLOAD
+
 #------------------------------------------------------------------------------
 
 _IOThrottle = None
@@ -116,11 +123,13 @@ def init():
     throttle()
     callback.add_queue_item_status_callback(OutboxStatus)
     callback.add_finish_file_sending_callback(FileSendingFinished)
+    callback.append_inbox_callback(_on_inbox_packet_received)
 
 
 def shutdown():
     if _Debug:
         lg.out(_DebugLevel, 'io_throttle.shutdown')
+    callback.remove_inbox_callback(_on_inbox_packet_received)
     callback.remove_finish_file_sending_callback(FileSendingFinished)
     callback.remove_queue_item_status_callback(OutboxStatus)
     throttle().DeleteBackupRequests('')
@@ -154,22 +163,26 @@ def PacketReport(sendORrequest, supplier_idurl, packetID, result):
 #------------------------------------------------------------------------------
 
 
-def QueueSendFile(fileName, packetID, remoteID, ownerID, callOnAck=None, callOnFail=None):
+def QueueSendFile(fileName, packetID, remoteID, ownerID, callOnAck=None, callOnFail=None, priority=PRIORITY_UPLOAD, deadline=None):
     """
     Most used method - add an outgoing file to send to given remote peer.
+    If ``deadline`` (absolute time in seconds) is given and file can not be delivered before that moment it is failed right away.
     """
-    return throttle().QueueSendFile(fileName, packetID, remoteID, ownerID, callOnAck, callOnFail)
+    return throttle().QueueSendFile(fileName, packetID, remoteID, ownerID, callOnAck, callOnFail, priority=priority, deadline=deadline)
 
 
-def QueueRequestFile(callOnReceived, creatorID, packetID, ownerID, remoteID):
+def QueueRequestFile(callOnReceived, creatorID, packetID, ownerID, remoteID, priority=PRIORITY_RESTORE, deadline=None, batch=False):
     """
     Place a request to download a single data packet from given remote supplier
     Remote user will verify our identity and decide to send the Data or not.
     Two scenarios possible when executing a `callOnReceived` callback:
 
         callOnReceived(newpacket, result)  or  callOnReceived(packetID, result)
+
+    With ``batch=True`` the request can be combined with other requests to same supplier
+    started at same moment and sent in a single multi-file Retrieve() packet.
     """
-    return throttle().QueueRequestFile(callOnReceived, creatorID, packetID, ownerID, remoteID)
+    return throttle().QueueRequestFile(callOnReceived, creatorID, packetID, ownerID, remoteID, priority=priority, deadline=deadline, batch=batch)
 
 
 def DeleteBackupSendings(backupName):
@@ -218,6 +231,21 @@ def IsSendingQueueEmpty():
     return throttle().IsSendingQueueEmpty()
 
 
+def _on_inbox_packet_received(newpacket, info, status, error_message):
+    # files requested with multi-file Retrieve() are not matching any outgoing packet, catch them here
+    if newpacket.Command != commands.Data():
+        return False
+    supplierQueue = throttle().GetSupplierQueue(newpacket.CreatorID)
+    if not supplierQueue or not supplierQueue.batchedRequests:
+        return False
+    packetID = global_id.CanonicalID(newpacket.PacketID)
+    if packetID not in supplierQueue.batchedRequests:
+        return False
+    supplierQueue.batchedRequests.discard(packetID)
+    supplierQueue.OnDataReceived(newpacket, status)
+    return True
+
+
 def HasPacketInSendQueue(supplierIDURL, packetID):
     return throttle().HasPacketInSendQueue(supplierIDURL, packetID)
 
@@ -287,6 +315,17 @@ class SupplierQueue:
         # FileDown's, indexed by PacketIDs
         self.fileRequestDict = {}
 
+        # requests allowed to be combined into one multi-file Retrieve() packet
+        self.batchableRequests = set()
+        # requests started during current reactor iteration and waiting to be sent together
+        self.requestsBatch = []
+        # multi-file Retrieve() packets sent, indexed by PacketID
+        self.requestsBatches = {}
+        # requested with multi-file Retrieve() and waiting for Data() to arrive
+        self.batchedRequests = set()
+        # remote node does not support multi-file Retrieve(), request files one by one
+        self.batchRefused = False
+
         self.shutdown = False
 
         self.ackedCount = 0
@@ -295,15 +334,23 @@ class SupplierQueue:
         self.uploadingTimeoutCount = 0
         self.downloadingTimeoutCount = 0
 
-        self._runSend = False
-        self.sendTask = None
-        self.sendTaskDelay = 0.1
-        self.requestTask = None
-        self.requestTaskDelay = 0.1
+        # the fixed queue sizes above are only initial windows now, they will be adjusted from measured latency
+        self.sendScheduler = io_scheduler.TransferScheduler(
+            name='send:%s' % self.remoteName,
+            start_callback=self.StartSending,
+            expire_callback=self.ExpireSending,
+            window=io_scheduler.InFlightWindow(initial=self.fileSendMaxLength, maximum=self.fileSendMaxLength*4),
+        )
+        self.requestScheduler = io_scheduler.TransferScheduler(
+            name='request:%s' % self.remoteName,
+            start_callback=self.StartRequest,
+            expire_callback=self.ExpireRequest,
+            window=io_scheduler.InFlightWindow(initial=self.fileRequestMaxLength, maximum=self.fileRequestMaxLength*4),
+        )
 
     #------------------------------------------------------------------------------
 
-    def SupplierSendFile(self, fileName, packetID, ownerID, callOnAck=None, callOnFail=None):
+    def SupplierSendFile(self, fileName, packetID, ownerID, callOnAck=None, callOnFail=None, priority=PRIORITY_UPLOAD, deadline=None):
         if self.shutdown:
             if _Debug:
                 lg.out(_DebugLevel, 'io_throttle.SupplierSendFile finishing to %s, shutdown is True' % self.remoteName)
@@ -334,7 +381,7 @@ class SupplierQueue:
         f_up.event('init')
         if _Debug:
             lg.out(_DebugLevel, 'io_throttle.SupplierSendFile %s to %s, %d queued items' % (packetID, self.remoteName, len(self.fileSendQueue)))
-        self.DoSend()
+        self.sendScheduler.enqueue(f_up.packetID, priority=priority, deadline=deadline, size=f_up.fileSize, timeout=f_up.sendTimeout)
         return True
 
     def StopAllSindings(self):
@@ -387,8 +434,10 @@ class SupplierQueue:
             return
         f_up = self.fileSendDict[packetID]
         if newpacket.Command == commands.Ack():
+            self.sendScheduler.acked(packetID)
             f_up.event('ack-received', newpacket)
         elif newpacket.Command == commands.Fail():
+            self.sendScheduler.failed(packetID)
             f_up.event('fail-received', newpacket)
         else:
             raise Exception('wrong command received in response: %r' % newpacket)
@@ -407,96 +456,38 @@ class SupplierQueue:
         if _Debug:
             lg.out(_DebugLevel, 'io_throttle.OnFileSendAckReceived %s from %s, queue=%d' % (str(newpacket), self.remoteName, len(self.fileSendQueue)))
 
-    def RunSend(self):
-        if self._runSend:
-            return -1
-        self._runSend = True
-        if _Debug:
-            lg.out(_DebugLevel*2, 'io_throttle.RunSend  fileSendQueue=%d' % len(self.fileSendQueue))
-        packetsToBeFailed = {}
-        packetsToRemove = set()
-        packetsSent = 0
-        # let's check only beginning of the queue and try to process it.
-        # once we finish and remove some items from the queue we can take more items
-        for i in range(0, min(self.fileSendMaxLength, len(self.fileSendQueue))):
-            try:
-                packetID = self.fileSendQueue[i]
-            except:
-                lg.warn('item at position %d not exist in send queue' % i)
-                continue
-
-            f_up = self.fileSendDict[packetID]
-
-            if f_up.state != 'IN_QUEUE':
-                # we are sending that file at the moment
-                packetsSent += 1
-                # and we got ack
-                if f_up.ackTime is None:
-                    # if we did not get an ack yet we do not want to wait to long
-                    if time.time() - f_up.sendTime > f_up.sendTimeout:
-                        # so this packet is failed because no response for too long
-                        packetsToBeFailed[packetID] = 'timeout'
-                        lg.warn('uploading %r failed because of timeout %d src' % (packetID, f_up.sendTimeout))
-                # this packet already in progress - check next one
-                continue
-
-            # the data file to send no longer exists - it is failed situation
-            if not os.path.exists(f_up.fileName):
-                lg.warn('file %s not exist' % (f_up.fileName))
-                packetsToBeFailed[packetID] = 'not exist'
-                continue
-
-            # item is in the queue, but not started yet
-            f_up.event('start')
-
-        # process failed packets
-        for packetID, why in packetsToBeFailed.items():
-            f_up = self.fileSendDict[packetID]
-            if why == 'timeout':
-                f_up.event('timeout')
-            elif why == 'not exist':
-                f_up.event('file-not-exist')
-            else:
-                raise Exception('unknown result %r for %r' % (why, packetID))
-        # remember results
-        result = max(len(packetsToRemove), packetsSent)
-        # erase temp lists
-        del packetsToBeFailed
-        del packetsToRemove
-        self._runSend = False
-        return result
-
-    def SendingTask(self):
-        if self.shutdown:
-            self.StopAllSindings()
+    def StartSending(self, packetID):
+        """
+        Called by the scheduler when it is a time to start uploading of that file.
+        """
+        f_up = self.fileSendDict.get(packetID)
+        if not f_up or f_up.state != 'IN_QUEUE':
+            self.sendScheduler.remove(packetID)
             return
-        try:
-            sends = self.RunSend()
-        except:
-            lg.exc()
-            sends = -1
-        if sends == -1:
-            if _Debug:
-                lg.dbg(_DebugLevel, 'sending task complete %r' % self)
+        # the data file to send no longer exists - it is failed situation
+        if not os.path.exists(f_up.fileName):
+            lg.warn('file %s not exist' % f_up.fileName)
+            f_up.event('file-not-exist')
             return
-        self.sendTaskDelay = misc.LoopAttenuation(self.sendTaskDelay, sends > 0, settings.MinimumSendingDelay(), settings.MaximumSendingDelay())
-        # attenuation
-        self.sendTask = reactor.callLater(self.sendTaskDelay, self.SendingTask)  # @UndefinedVariable
+        f_up.event('start')
 
-    def DoSend(self):
-        if self.sendTask is None:
-            self.SendingTask()
+    def ExpireSending(self, packetID, reason):
+        f_up = self.fileSendDict.get(packetID)
+        if not f_up:
             return
-        if self._runSend:
-            return
-        if self.sendTaskDelay > 1.0:
-            self.sendTask.cancel()
-            self.sendTask = None
-            reactor.callLater(0, self.SendingTask)  # @UndefinedVariable
+        if reason == 'timeout':
+            lg.warn('uploading %r failed because of timeout %d sec' % (packetID, f_up.sendTimeout))
+            f_up.event('timeout')
+        else:
+            lg.warn('uploading %r to %s failed, deadline is reached' % (packetID, self.remoteName))
+            f_up.event('deadline')
+
+    def DoSend(self):
+        self.sendScheduler.wake()
 
     #------------------------------------------------------------------------------
 
-    def SupplierRequestFile(self, callOnReceived, creatorID, packetID, ownerID):
+    def SupplierRequestFile(self, callOnReceived, creatorID, packetID, ownerID, priority=PRIORITY_RESTORE, deadline=None, batch=False):
         if self.shutdown:
             if _Debug:
                 lg.out(_DebugLevel, 'io_throttle.SupplierRequestFile finishing to %s, shutdown is True' % self.remoteName)
@@ -514,7 +505,116 @@ class SupplierQueue:
         f_down.event('init')
         if _Debug:
             lg.out(_DebugLevel, 'io_throttle.SupplierRequestFile %s from %s, %d queued items' % (packetID, self.remoteName, len(self.fileRequestQueue)))
-        self.DoRequest()
+        if batch and not self.batchRefused:
+            self.batchableRequests.add(f_down.packetID)
+        self.requestScheduler.enqueue(f_down.packetID, priority=priority, deadline=deadline)
+        return True
+
+    def AddToRequestsBatch(self, f_down):
+        """
+        Called by ``file_down()`` instead of sending Retrieve() packet,
+        returns False if that file must be requested separately.
+        """
+        if self.batchRefused or f_down.packetID not in self.batchableRequests:
+            return False
+        self.batchableRequests.discard(f_down.packetID)
+        if not self.requestsBatch:
+            # scheduler starts multiple items at once, collect all of them first
+            reactor.callLater(0, self.SendRequestsBatch)  # @UndefinedVariable
+        self.requestsBatch.append(f_down.packetID)
+        return True
+
+    def SendRequestsBatch(self):
+        packetIDs = [packetID for packetID in self.requestsBatch if packetID in self.fileRequestDict]
+        self.requestsBatch = []
+        if self.shutdown or not packetIDs:
+            return
+        if len(packetIDs) == 1:
+            self.fileRequestDict[packetIDs[0]].SendRetreive()
+            return
+        from bitdust.p2p import p2p_service
+        # forget about batches which were not confirmed, but all of the files were already received or cancelled
+        for oldBatchID in list(self.requestsBatches.keys()):
+            if not any([packetID in self.fileRequestDict for packetID in self.requestsBatches[oldBatchID]]):
+                self.requestsBatches.pop(oldBatchID)
+        self.batchedRequests.intersection_update(self.fileRequestDict.keys())
+        batchID = packetid.UniqueID()
+        self.requestsBatches[global_id.CanonicalID(batchID)] = packetIDs
+        self.batchedRequests.update(packetIDs)
+        for packetID in packetIDs:
+            self.fileRequestDict[packetID].batchID = global_id.CanonicalID(batchID)
+        if _Debug:
+            lg.out(_DebugLevel, 'io_throttle.SendRequestsBatch %s with %d files from %s' % (batchID, len(packetIDs), self.remoteName))
+        p2p_service.SendRetreive(
+            self.fileRequestDict[packetIDs[0]].ownerID,
+            self.creatorID,
+            batchID,
+            self.remoteID,
+            payload=serialization.DictToBytes({'items': packetIDs}),
+            callbacks={
+                commands.Ack(): self.OnRequestsBatchAck,
+                commands.Fail(): self.OnRequestsBatchFail,
+            },
+        )
+
+    def OnRequestsBatchAck(self, response, info):
+        # supplier already sent all files he found, the rest are missing there
+        packetIDs = self.requestsBatches.pop(global_id.CanonicalID(response.PacketID), None)
+        if packetIDs is None:
+            return
+        try:
+            missing = serialization.BytesToDict(response.Payload, keys_to_text=True, values_to_text=True).get('missing') or []
+        except:
+            lg.exc()
+            return
+        for packetID in packetIDs:
+            f_down = self.fileRequestDict.get(packetID)
+            if f_down:
+                f_down.batchID = None
+        for packetID in missing:
+            packetID = global_id.CanonicalID(packetID)
+            self.batchedRequests.discard(packetID)
+            f_down = self.fileRequestDict.get(packetID)
+            if f_down and packetID in packetIDs:
+                self.requestScheduler.failed(packetID)
+                # response is addressed to the whole batch, report the file itself
+                f_down.event('fail-received', packetID)
+
+    def OnRequestsBatchFail(self, response, info):
+        packetIDs = self.requestsBatches.pop(global_id.CanonicalID(response.PacketID), None)
+        if packetIDs is None:
+            return
+        lg.warn('multi-file Retrieve() was rejected by %s, will request %d files one by one' % (self.remoteName, len(packetIDs)))
+        self.batchRefused = True
+        self.batchableRequests.clear()
+        for packetID in packetIDs:
+            self.batchedRequests.discard(packetID)
+            f_down = self.fileRequestDict.get(packetID)
+            if f_down and f_down.state in ['STARTED', 'REQUESTED']:
+                f_down.batchID = None
+                f_down.SendRetreive()
+
+    def CancelBatchedRequest(self, f_down):
+        """
+        Called by ``file_down()`` when downloading was cancelled, the file is not expected to arrive anymore.
+
+        Returns True if nothing else is waiting from the multi-file Retrieve() packet of that file,
+        so the packet itself can be cancelled.
+        """
+        if f_down.packetID in self.requestsBatch:
+            self.requestsBatch.remove(f_down.packetID)
+        self.batchableRequests.discard(f_down.packetID)
+        self.batchedRequests.discard(f_down.packetID)
+        batchID = f_down.batchID
+        f_down.batchID = None
+        packetIDs = self.requestsBatches.get(batchID)
+        if not packetIDs:
+            return False
+        if f_down.packetID in packetIDs:
+            packetIDs.remove(f_down.packetID)
+        if packetIDs:
+            return False
+        self.requestsBatches.pop(batchID, None)
         return True
 
     def StopAllRequests(self):
@@ -573,68 +673,43 @@ class SupplierQueue:
                 wrapped_packet = signed.Unserialize(newpacket.Payload)
                 if not wrapped_packet or not wrapped_packet.Valid():
                     lg.err('incoming Data() packet is not valid')
+                    self.requestScheduler.failed(packetID)
                     f_down.event('fail-received', newpacket)
                     return
+                self.requestScheduler.acked(packetID, size=len(newpacket.Payload))
                 f_down.event('valid-data-received', wrapped_packet)
             elif newpacket.Command == commands.Fail():
+                self.requestScheduler.failed(packetID)
                 f_down.event('fail-received', newpacket)
             else:
                 lg.err('incorrect response command: %r' % newpacket)
 
-    def RunRequest(self):
-        packetsToRemove = {}
-        for i in range(0, min(self.fileRequestMaxLength, len(self.fileRequestQueue))):
-            packetID = self.fileRequestQueue[i]
-            # must never happen, but just in case
-            if packetID not in self.fileRequestDict:
-                packetsToRemove[packetID] = 'broken'
-                lg.err('file %r not found in downloading queue for %r' % (packetID, self.remoteID))
-                continue
-            f_down = self.fileRequestDict[packetID]
-            if f_down.state == 'IN_QUEUE':
-                customer, pathID = packetid.SplitPacketID(packetID)
-                if os.path.exists(os.path.join(settings.getLocalBackupsDir(), customer, pathID)):
-                    # we have the data file, no need to request it
-                    packetsToRemove[packetID] = 'exist'
-                else:
-                    f_down.event('start')
-        # remember requests results
-        result = len(packetsToRemove)
-        # remove finished requests
-        for packetID, why in packetsToRemove.items():
+    def StartRequest(self, packetID):
+        """
+        Called by the scheduler when it is a time to request that file from the supplier.
+        """
+        f_down = self.fileRequestDict.get(packetID)
+        if not f_down or f_down.state != 'IN_QUEUE':
+            self.requestScheduler.remove(packetID)
+            return
+        customer, pathID = packetid.SplitPacketID(packetID)
+        if os.path.exists(os.path.join(settings.getLocalBackupsDir(), customer, pathID)):
+            # we have the data file, no need to request it
             if _Debug:
-                lg.out(_DebugLevel, 'io_throttle.RunRequest %r to be removed from [%s] downloading queue because %r, %d more items' % (packetID, self.remoteID, why, len(self.fileRequestQueue)))
-            if packetID in self.fileRequestQueue:
-                f_down = self.fileRequestDict[packetID]
-                if why == 'exist':
-                    f_down.event('file-already-exists')
-                else:
-                    lg.warn('unexpected result "%r" for %r in downloading queue for %s' % (why, packetID, self.remoteID))
-                    f_down.event('stop')
-            else:
-                lg.warn('packet %r not found in request queue for [%s]' % (packetID, self.remoteID))
-        del packetsToRemove
-        if result:
-            self.DoRequest()
-        return result
+                lg.out(_DebugLevel, 'io_throttle.StartRequest %r already exist locally, %d more items' % (packetID, len(self.fileRequestQueue)))
+            f_down.event('file-already-exists')
+            return
+        f_down.event('start')
 
-    def RequestTask(self):
-        if self.shutdown:
-            self.StopAllRequests()
+    def ExpireRequest(self, packetID, reason):
+        f_down = self.fileRequestDict.get(packetID)
+        if not f_down:
             return
-        requests = self.RunRequest()
-        self.requestTaskDelay = misc.LoopAttenuation(self.requestTaskDelay, requests > 0, settings.MinimumReceivingDelay(), settings.MaximumReceivingDelay())
-        # attenuation
-        self.requestTask = reactor.callLater(self.requestTaskDelay, self.RequestTask)  # @UndefinedVariable
+        lg.warn('downloading %r from %s failed, deadline is reached' % (packetID, self.remoteName))
+        f_down.event('deadline')
 
     def DoRequest(self):
-        if self.requestTask is None:
-            self.RequestTask()
-        else:
-            if self.requestTaskDelay > 1.0:
-                self.requestTask.cancel()
-                self.requestTask = None
-                self.RequestTask()
+        self.requestScheduler.wake()
 
     #------------------------------------------------------------------------------
 
@@ -646,6 +721,14 @@ class SupplierQueue:
             lg.warn('skip, outpacket is already None')
             return
         packetID = global_id.CanonicalID(pkt_out.outpacket.PacketID)
+        if pkt_out.outpacket.Command == commands.Retrieve() and packetID in self.requestsBatches:
+            for batchedPacketID in self.requestsBatches[packetID]:
+                f_down = self.fileRequestDict.get(batchedPacketID)
+                if f_down:
+                    f_down.event('retrieve-sent' if status == 'finished' else 'request-failed', pkt_out.outpacket)
+            if status != 'finished':
+                self.requestsBatches.pop(packetID, None)
+            return
         if status == 'finished':
             if pkt_out.outpacket.Command == commands.Retrieve():
                 if packetID in self.fileRequestQueue:
@@ -685,6 +768,7 @@ class SupplierQueue:
                     if _Debug:
                         lg.args(_DebugLevel, obj=f_up, status=status, packetID=packetID, event='data-sent')
                     if error == 'unanswered':
+                        self.sendScheduler.failed(packetID, timeout=True)
                         f_up.event('timeout', pkt_out.outpacket)
                     else:
                         f_up.event('data-sent', pkt_out.outpacket)
@@ -705,6 +789,8 @@ class SupplierQueue:
             lg.out(_DebugLevel, 'io_throttle.RemoveSupplierWork for %r' % self.remoteID)
         self.DeleteBackupSendings(backupName=None)
         self.DeleteBackupRequests(backupName=None)
+        self.sendScheduler.stop()
+        self.requestScheduler.stop()
 
     #------------------------------------------------------------------------------
 
@@ -727,10 +813,10 @@ class SupplierQueue:
         return len(self.fileRequestQueue) > 0
 
     def OkToSend(self):
-        return len(self.fileSendQueue) < self.fileSendMaxLength
+        return len(self.fileSendQueue) < self.sendScheduler.window.limit() + self.fileSendMaxLength
 
     def OkToRequest(self):
-        return len(self.fileRequestQueue) < self.fileRequestMaxLength
+        return len(self.fileRequestQueue) < self.requestScheduler.window.limit() + self.fileRequestMaxLength
 
     def GetSendQueueLength(self):
         return len(self.fileSendQueue)
@@ -738,6 +824,13 @@ class SupplierQueue:
     def GetRequestQueueLength(self):
         return len(self.fileRequestQueue)
 
+    def to_json(self):
+        return {
+            'supplier': self.remoteID,
+            'sending': self.sendScheduler.to_json(),
+            'requesting': self.requestScheduler.to_json(),
+        }
+
 
 #------------------------------------------------------------------------------
 
@@ -781,7 +874,7 @@ class IOThrottle:
         for supplierQueue in self.supplierQueues.values():
             supplierQueue.DeleteBackupRequests(backupName)
 
-    def QueueSendFile(self, fileName, packetID, remoteID, ownerID, callOnAck=None, callOnFail=None):
+    def QueueSendFile(self, fileName, packetID, remoteID, ownerID, callOnAck=None, callOnFail=None, priority=PRIORITY_UPLOAD, deadline=None):
         #out(10, "io_throttle.QueueSendFile %s to %s" % (packetID, nameurl.GetName(remoteID)))
         remoteID = id_url.field(remoteID)
         ownerID = id_url.field(ownerID)
@@ -799,11 +892,13 @@ class IOThrottle:
             ownerID,
             callOnAck,
             callOnFail,
+            priority=priority,
+            deadline=deadline,
         )
 
     # return result in the callback: callOnReceived(packet or packetID, state)
     # state is: received, exist, in queue, shutdown
-    def QueueRequestFile(self, callOnReceived, creatorID, packetID, ownerID, remoteID):
+    def QueueRequestFile(self, callOnReceived, creatorID, packetID, ownerID, remoteID, priority=PRIORITY_RESTORE, deadline=None, batch=False):
         # make sure that we don't actually already have the file
         remoteID = id_url.field(remoteID)
         ownerID = id_url.field(ownerID)
@@ -821,7 +916,7 @@ class IOThrottle:
             self.supplierQueues[remoteID] = SupplierQueue(remoteID, self.creatorID)
             lg.info('made a new receiving queue for %s' % nameurl.GetName(remoteID))
         # lg.out(10, "io_throttle.QueueRequestFile asking for %s from %s" % (packetID, nameurl.GetName(remoteID)))
-        return self.supplierQueues[remoteID].SupplierRequestFile(callOnReceived, creatorID, packetID, ownerID)
+        return self.supplierQueues[remoteID].SupplierRequestFile(callOnReceived, creatorID, packetID, ownerID, priority=priority, deadline=deadline, batch=batch)
 
     def OutboxStatus(self, pkt_out, status, error):
         """
@@ -52,6 +52,7 @@ from twisted.internet.defer import Deferred
 from bitdust.logs import lg
 
 from bitdust.main import config
+from bitdust.main import events
 from bitdust.main import settings
 
 from bitdust.p2p import commands
@@ -65,6 +66,7 @@ from bitdust.lib import jsn
 from bitdust.lib import strng
 
 from bitdust.crypt import key
+from bitdust.crypt import hashes
 from bitdust.crypt import my_keys
 
 from bitdust.contacts import identitycache
@@ -90,6 +92,12 @@ _MessageQueuePerConsumer = {}
 _LastUserPingTime = {}
 _PingTrustIntervalSeconds = 60*5
 
+_OutgoingSessionKeys = {}
+_IncomingSessionKeys = {}
+_SessionKeyRotateSeconds = 60*10
+_SessionKeyRotateMessages = 1000
+_MaxCachedSessionKeys = 1000
+
 #------------------------------------------------------------------------------
 
 
@@ -98,13 +106,18 @@ def init():
         lg.out(_DebugLevel, 'message.init')
     AddIncomingMessageCallback(push_incoming_message)
     AddOutgoingMessageCallback(push_outgoing_message)
+    events.add_subscriber(on_key_changed, 'key-registered')
+    events.add_subscriber(on_key_changed, 'key-erased')
 
 
 def shutdown():
     if _Debug:
         lg.out(_DebugLevel, 'message.shutdown')
+    events.remove_subscriber(on_key_changed, 'key-erased')
+    events.remove_subscriber(on_key_changed, 'key-registered')
     RemoveOutgoingMessageCallback(push_outgoing_message)
     RemoveIncomingMessageCallback(push_incoming_message)
+    forget_session_keys()
 
 
 #------------------------------------------------------------------------------
@@ -134,6 +147,82 @@ def ConnectCorrespondent(idurl):
     pass
 
 
+#------------------------------------------------------------------------------
+
+
+def forget_session_keys(key_id=None):
+    """
+    Erase cached session keys, new keys will be generated for every correspondent.
+    If ``key_id`` is provided only session keys related to that key are erased.
+    """
+    if key_id is None:
+        _OutgoingSessionKeys.clear()
+        _IncomingSessionKeys.clear()
+        return
+    for cache_key in list(_OutgoingSessionKeys.keys()):
+        if cache_key[0] == 'key' and cache_key[1] == key_id:
+            _OutgoingSessionKeys.pop(cache_key)
+    for cache_key in list(_IncomingSessionKeys.keys()):
+        if cache_key[0] == key_id:
+            _IncomingSessionKeys.pop(cache_key)
+
+
+def registered_key_cache_key(key_id):
+    """
+    Outgoing session keys encrypted with a registered key are cached together with the fingerprint of that key,
+    so the cached session is not used anymore when another key is registered under the same ``key_id``.
+    """
+    key_id = my_keys.latest_key_id(key_id)
+    return ('key', key_id, my_keys.key_field(key_id, 'fingerprint'))
+
+
+def get_outgoing_session_key(cache_key, encrypt_session_func):
+    """
+    Returns session key and its encrypted form for given correspondent.
+    The same session key is re-used for many messages, so RSA encryption is only
+    executed when the key is rotated: after some time or after number of messages.
+    """
+    session = _OutgoingSessionKeys.get(cache_key)
+    if session:
+        if time.time() - session['created'] > _SessionKeyRotateSeconds or session['counter'] >= _SessionKeyRotateMessages:
+            session = None
+    if not session:
+        if len(_OutgoingSessionKeys) >= _MaxCachedSessionKeys:
+            _OutgoingSessionKeys.pop(min(_OutgoingSessionKeys, key=lambda k: _OutgoingSessionKeys[k]['created']))
+        new_sessionkey = key.NewSessionKey(session_key_type=key.SessionKeyType())
+        session = {
+            'session_key': new_sessionkey,
+            'encrypted_session': encrypt_session_func(new_sessionkey),
+            'created': time.time(),
+            'counter': 0,
+        }
+        _OutgoingSessionKeys[cache_key] = session
+        if _Debug:
+            lg.dbg(_DebugLevel, 'new session key generated for %r' % (cache_key, ))
+    session['counter'] += 1
+    return session['session_key'], session['encrypted_session']
+
+
+def get_incoming_session_key(recipient, encrypted_session, decrypt_session_func):
+    """
+    Decrypt the session key of the incoming message, the result is kept in memory
+    so the RSA decryption is executed only once for every session key.
+    """
+    cache_key = (recipient, hashes.sha1(strng.to_bin(encrypted_session)))
+    session_key = _IncomingSessionKeys.get(cache_key)
+    if session_key is not None:
+        return session_key
+    session_key = decrypt_session_func(encrypted_session)
+    if len(_IncomingSessionKeys) >= _MaxCachedSessionKeys:
+        _IncomingSessionKeys.pop(next(iter(_IncomingSessionKeys)))
+    _IncomingSessionKeys[cache_key] = session_key
+    return session_key
+
+
+def on_key_changed(evt):
+    forget_session_keys(key_id=evt.data['key_id'])
+
+
 def UniqueID():
     return str(int(time.time()*100.0))
 
@@ -229,12 +318,14 @@ class PrivateMessage(object):
     def encrypt(self, message_body, encrypt_session_func=None):
         if _Debug:
             lg.args(_DebugLevel, encrypt_session_func=encrypt_session_func, recipient=self.recipient)
-        new_sessionkey = key.NewSessionKey(session_key_type=key.SessionKeyType())
+        # session key is only cached when we know exactly which public key is used to encrypt it
+        cache_key = None
         if not encrypt_session_func:
             if my_keys.is_key_registered(self.recipient):
                 if _Debug:
                     lg.dbg(_DebugLevel, 'with registered key %r' % self.recipient)
                 encrypt_session_func = lambda inp: my_keys.encrypt(self.recipient, inp)
+                cache_key = registered_key_cache_key(self.recipient)
         if not encrypt_session_func:
             glob_id = global_id.NormalizeGlobalID(self.recipient)
             if glob_id['key_alias'] == 'master':
@@ -248,16 +339,22 @@ class PrivateMessage(object):
                     if _Debug:
                         lg.dbg(_DebugLevel, 'with remote identity public key %r' % glob_id['idurl'])
                     encrypt_session_func = remote_identity.encrypt
+                    cache_key = ('identity', self.recipient, remote_identity.publickey)
             else:
                 own_key = global_id.MakeGlobalID(idurl=my_id.getIDURL(), key_alias=glob_id['key_alias'])
                 if my_keys.is_key_registered(own_key):
                     if _Debug:
                         lg.dbg(_DebugLevel, 'with registered key (found by alias) %r' % own_key)
                     encrypt_session_func = lambda inp: my_keys.encrypt(own_key, inp)
+                    cache_key = registered_key_cache_key(own_key)
         if not encrypt_session_func:
             raise Exception('can not find key for given recipient')
-        self.encrypted_session = encrypt_session_func(new_sessionkey)
-        self.encrypted_body = key.EncryptWithSessionKey(new_sessionkey, message_body, session_key_type=key.SessionKeyType())
+        if cache_key:
+            sessionkey, self.encrypted_session = get_outgoing_session_key(cache_key, encrypt_session_func)
+        else:
+            sessionkey = key.NewSessionKey(session_key_type=key.SessionKeyType())
+            self.encrypted_session = encrypt_session_func(sessionkey)
+        self.encrypted_body = key.EncryptWithSessionKey(sessionkey, message_body, session_key_type=key.SessionKeyType())
         return self.encrypted_session, self.encrypted_body
 
     def decrypt(self, decrypt_session_func=None):
@@ -277,7 +374,7 @@ class PrivateMessage(object):
                     decrypt_session_func = lambda inp: my_keys.decrypt('master', inp)
         if not decrypt_session_func:
             raise Exception('can not find key for given recipient: %s' % self.recipient)
-        decrypted_sessionkey = decrypt_session_func(self.encrypted_session)
+        decrypted_sessionkey = get_incoming_session_key(self.recipient, self.encrypted_session, decrypt_session_func)
         return key.DecryptWithSessionKey(decrypted_sessionkey, self.encrypted_body, session_key_type=key.SessionKeyType())
 
     def serialize(self):
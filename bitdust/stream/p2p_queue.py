@@ -36,6 +36,8 @@ Methods to establish a messages queue between two or more nodes.:
     + Queue is only stored on given node: both producer and consumer must be connected to that machine
     + Global queue ID is unique : queue_alias&alice@somehost.net&bob@anotherhost.com
     + Queue size is limited by a parameter, you can not publish when queue is overloaded
+    + Messages and acknowledgments of every consumer are written to the on-disk log, see ``queue_log``
+    + Consumers are woken up only when a new message is pushed to the queue they subscribed on
 
 """
 
@@ -51,6 +53,7 @@ _DebugLevel = 10
 
 #------------------------------------------------------------------------------
 
+import os
 import sys
 import time
 
@@ -83,6 +86,7 @@ from bitdust.lib import jsn
 from bitdust.lib import serialization
 
 from bitdust.main import events
+from bitdust.main import settings
 
 from bitdust.crypt import my_keys
 from bitdust.crypt import signed
@@ -90,6 +94,8 @@ from bitdust.crypt import signed
 from bitdust.p2p import commands
 from bitdust.p2p import p2p_service
 
+from bitdust.stream import queue_log
+
 from bitdust.userid import global_id
 from bitdust.userid import my_id
 from bitdust.userid import id_url
@@ -110,6 +116,9 @@ _ProcessQueuesLastTime = 0
 
 _ActiveQueues = {}
 
+_WakeUpConsumers = {}
+_WakeUpTask = None
+
 _LastMessageID = None
 
 _Producers = {}
@@ -121,9 +130,12 @@ _MessageProcessedCallbacks = []
 #------------------------------------------------------------------------------
 
 
-def init():
+def init(queues_dir=None):
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.init')
+    if queues_dir is None:
+        queues_dir = os.path.join(settings.ServiceDir('service_p2p_notifications'), 'queues')
+    queue_log.init(queues_dir)
     add_event_handler(do_handle_event_packet)
     start()
 
@@ -133,6 +145,7 @@ def shutdown():
         lg.out(_DebugLevel, 'p2p_queue.shutdown')
     remove_event_handler(do_handle_event_packet)
     stop()
+    queue_log.shutdown()
 
 
 #------------------------------------------------------------------------------
@@ -193,6 +206,12 @@ def stop():
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.stop')
     global _ProcessQueuesTask
+    global _WakeUpTask
+    if _WakeUpTask:
+        if _WakeUpTask.active():
+            _WakeUpTask.cancel()
+        _WakeUpTask = None
+    _WakeUpConsumers.clear()
     if _ProcessQueuesTask:
         if _ProcessQueuesTask.active():
             _ProcessQueuesTask.cancel()
@@ -205,35 +224,49 @@ def process_queues(interested_consumers=None):
     global _ProcessQueuesDelay
     global _ProcessQueuesTask
     global _ProcessQueuesLastTime
-    has_activity = do_consume(interested_consumers=interested_consumers)
+    do_consume(interested_consumers=interested_consumers)
     _ProcessQueuesLastTime = time.time()
     if _ProcessQueuesTask is None or _ProcessQueuesTask.called:
-        _ProcessQueuesDelay = misc.LoopAttenuation(
-            _ProcessQueuesDelay,
-            has_activity,
-            MIN_PROCESS_QUEUES_DELAY,
-            MAX_PROCESS_QUEUES_DELAY,
-        )
-        # attenuation
+        # consumers are woken up by wake_up_consumers() when there is something to read,
+        # so full scan of all queues is only a safety net and runs rarely
+        _ProcessQueuesDelay = MAX_PROCESS_QUEUES_DELAY
         _ProcessQueuesTask = reactor.callLater(_ProcessQueuesDelay, process_queues)  # @UndefinedVariable
 
 
 def touch_queues(interested_consumers=None):
-    global _ProcessQueuesDelay
-    global _ProcessQueuesTask
-    global _ProcessQueuesLastTime
-    if time.time() - _ProcessQueuesLastTime < MIN_PROCESS_QUEUES_DELAY:
-        return False
-    reactor.callLater(0, process_queues, interested_consumers=interested_consumers)  # @UndefinedVariable
+    if interested_consumers is None:
+        interested_consumers = list(consumer().keys())
+    wake_up_consumers(interested_consumers)
     return True
 
 
+def wake_up_consumers(consumer_ids, queue_id=None):
+    """
+    Remember which consumers might have new messages in given queue (or in all of their queues)
+    and process only them in the next reactor iteration.
+    The periodic ``process_queues()`` loop is only a safety net now.
+    """
+    global _WakeUpTask
+    for consumer_id in consumer_ids:
+        if consumer_id not in consumer():
+            continue
+        if queue_id is None:
+            _WakeUpConsumers.setdefault(consumer_id, set()).update(consumer(consumer_id).queues)
+        else:
+            _WakeUpConsumers.setdefault(consumer_id, set()).add(queue_id)
+    if _WakeUpConsumers and (_WakeUpTask is None or _WakeUpTask.called or _WakeUpTask.cancelled):
+        _WakeUpTask = reactor.callLater(0, do_wake_up)  # @UndefinedVariable
+
+
 #------------------------------------------------------------------------------
 
 
 def valid_queue_id(queue_id):
     if not queue_id:
         return False
+    if queue_id in _ActiveQueues:
+        # already verified when the queue was opened
+        return True
     try:
         str(queue_id)
     except:
@@ -263,10 +296,39 @@ def open_queue(queue_id):
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id)
     _ActiveQueues[queue_id] = OrderedDict()
+    restore_messages(queue_id)
     lg.info('new queue opened: %s' % queue_id)
     return True
 
 
+def restore_messages(queue_id):
+    """
+    Loads back messages from the on-disk log which were not yet acknowledged by all of the consumers.
+    """
+    global _LastMessageID
+    records = list(queue_log.open_log(queue_id).items())
+    if len(records) > MAX_QUEUE_LENGTH:
+        lg.warn('%d old messages were not restored in the queue %s' % (len(records) - MAX_QUEUE_LENGTH, queue_id))
+        records = records[-MAX_QUEUE_LENGTH:]
+    for message_id, record in records:
+        restored_message = QueueMessage(
+            producer_id=record['p'],
+            queue_id=queue_id,
+            json_data=record['d'],
+            created=record['t'],
+            message_id=message_id,
+            consumers=record['u'],
+        )
+        restored_message.state = 'PUSHED'
+        queue(queue_id)[message_id] = restored_message
+        if _LastMessageID is None or _LastMessageID < message_id:
+            _LastMessageID = message_id
+    if records:
+        lg.info('restored %d messages in the queue %s' % (len(records), queue_id))
+        wake_up_consumers(list_subscribed_consumers(queue_id), queue_id)
+    return len(records)
+
+
 def close_queue(queue_id, remove_empty_consumers=False, remove_empty_producers=False):
     global _ActiveQueues
     if not valid_queue_id(queue_id):
@@ -275,6 +337,8 @@ def close_queue(queue_id, remove_empty_consumers=False, remove_empty_producers=F
         raise Exception('queue not exist')
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id)
+    # stop writing to the log first: canceled notifications must not be recorded as processed
+    queue_log.close_log(queue_id)
     for producer_id in list(producer().keys()):
         if is_producer_connected(producer_id, queue_id):
             disconnect_producer(producer_id, queue_id, remove_empty=remove_empty_producers)
@@ -308,6 +372,7 @@ def rename_queue(old_queue_id, new_queue_id):
     if _Debug:
         lg.args(_DebugLevel, old=old_queue_id, new=new_queue_id)
     stored_messages = queue().pop(old_queue_id)
+    queue_log.rename_log(old_queue_id, new_queue_id)
     for message_id, msg_obj in stored_messages.items():
         for consumer_id, callback_object in list(msg_obj.notifications.items()):
             if not callback_object.called:
@@ -372,6 +437,7 @@ def add_callback_method(consumer_id, callback_method, interested_queues_list=Non
     consumer(consumer_id).commands[callback_method] = interested_queues_list
     if _Debug:
         lg.args(_DebugLevel, c=consumer_id, cb=callback_method)
+    wake_up_consumers([consumer_id])
     return True
 
 
@@ -416,6 +482,7 @@ def subscribe_consumer(consumer_id, queue_id):
         raise Exception('consumer is already subscribed')
     consumer(consumer_id).queues.append(queue_id)
     lg.info('consumer %s subscribed to read queue %s' % (consumer_id, queue_id))
+    wake_up_consumers([consumer_id], queue_id)
     return True
 
 
@@ -593,8 +660,11 @@ def finish_notification(consumer_id, queue_id, message_id, success):
         lg.info('canceling non-finished notification in the queue %s' % queue_id)
         defer_result.cancel()
     del defer_result
+    queue_log.append_ack(queue_id, consumer_id, message_id)
     if _Debug:
         lg.args(_DebugLevel, consumer_id=consumer_id, queue_id=queue_id, message_id=message_id, success=success, notifications=len(queue(queue_id)[message_id].notifications))
+    # consumer is ready to receive next message from that queue
+    wake_up_consumers([consumer_id], queue_id)
     return True
 
 
@@ -650,9 +720,10 @@ def write_message(producer_id, queue_id, data, creation_time=None):
     new_message = QueueMessage(producer_id, queue_id, data, created=creation_time)
     queue(queue_id)[new_message.message_id] = new_message
     queue(queue_id)[new_message.message_id].state = 'PUSHED'
+    queue_log.append_message(queue_id, new_message.message_id, producer_id, new_message.created, new_message.payload, new_message.consumers)
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.write_message  %r added to queue %s' % (new_message.message_id, queue_id))
-    touch_queues()
+    wake_up_consumers(new_message.consumers, queue_id)
     return new_message
 
 
@@ -671,6 +742,7 @@ def pull_message(queue_id, message_id=None):
         return None
     existing_message = queue(queue_id).pop(message_id)
     existing_message.state = 'PULLED'
+    queue_log.append_removed(queue_id, message_id)
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.pull_message  %r removed from queue %s' % (message_id, queue_id))
     return existing_message
@@ -920,6 +992,55 @@ def do_notify(callback_method, consumer_id, queue_id, message_id):
     return ret
 
 
+def do_notify_consumer(consumer_id, queue_id, message_id):
+    for callback_method, interested_queues_list in consumer(consumer_id).commands.items():
+        if interested_queues_list:
+            matching = False
+            for interested_queue in interested_queues_list:
+                if queue_id.startswith(interested_queue):
+                    matching = True
+                    break
+            if not matching:
+                continue
+        do_notify(callback_method, consumer_id, queue_id, message_id)
+        return True
+    return False
+
+
+def do_wake_up():
+    """
+    Only consumers which were woken up by ``wake_up_consumers()`` are processed here,
+    so idle queues and consumers do not cost anything.
+    """
+    global _WakeUpTask
+    _WakeUpTask = None
+    notifications_count = 0
+    for consumer_id in list(_WakeUpConsumers.keys()):
+        queue_ids = _WakeUpConsumers[consumer_id]
+        if consumer_id not in consumer() or not consumer(consumer_id).commands:
+            _WakeUpConsumers.pop(consumer_id)
+            continue
+        finished_queues = []
+        for queue_id in queue_ids:
+            message_id = None
+            if queue_id in queue():
+                message_id = lookup_pending_message(consumer_id, queue_id)
+            if message_id is None or queue_id not in consumer(consumer_id).queues:
+                finished_queues.append(queue_id)
+                continue
+            if do_notify_consumer(consumer_id, queue_id, message_id):
+                # only one message per consumer at a time, other queues will be checked later
+                notifications_count += 1
+                break
+            finished_queues.append(queue_id)
+        queue_ids.difference_update(finished_queues)
+        if not queue_ids:
+            _WakeUpConsumers.pop(consumer_id)
+    if _Debug:
+        lg.args(_DebugLevel, consumers=len(_WakeUpConsumers), notifications_count=notifications_count)
+    return notifications_count
+
+
 def do_consume(interested_consumers=None):
     if not interested_consumers:
         interested_consumers = list(consumer().keys())
@@ -962,19 +1083,9 @@ def do_consume(interested_consumers=None):
         if _message_id is None:
             # no new messages found for that consumer
             continue
-        for callback_method, interested_queues_list in consumer(_consumer_id).commands.items():
-            if interested_queues_list:
-                matching = False
-                for interested_queue in interested_queues_list:
-                    if _queue_id.startswith(interested_queue):
-                        matching = True
-                        break
-                if not matching:
-                    continue
-            do_notify(callback_method, _consumer_id, _queue_id, _message_id)
+        if do_notify_consumer(_consumer_id, _queue_id, _message_id):
             notifications_count += 1
             consumers_affected.append(_consumer_id)
-            break
     if _Debug:
         lg.args(_DebugLevel, notifications_count=notifications_count, consumers_affected=consumers_affected)
     del to_be_consumed
@@ -1027,8 +1138,8 @@ def do_cleanup(target_queues=None):
 
 class QueueMessage(object):
 
-    def __init__(self, producer_id, queue_id, json_data, created=None):
-        self.message_id = make_message_id()
+    def __init__(self, producer_id, queue_id, json_data, created=None, message_id=None, consumers=None):
+        self.message_id = message_id or make_message_id()
         self.producer_id = producer_id
         self.queue_id = queue_id
         self.created = created or utime.utcnow_to_sec1970()
@@ -1038,9 +1149,12 @@ class QueueMessage(object):
         self.success_notifications = []
         self.failed_notifications = []
         self.consumers = []
-        for consumer_id in consumer():
-            if queue_id in consumer(consumer_id).queues:
-                self.consumers.append(consumer_id)
+        if consumers is not None:
+            self.consumers.extend(consumers)
+        else:
+            for consumer_id in consumer():
+                if queue_id in consumer(consumer_id).queues:
+                    self.consumers.append(consumer_id)
         if len(self.consumers) == 0:
             if _Debug:
                 lg.warn('message %r from %r in queue %r will have no consumers' % (self.message_id, self.producer_id, self.queue_id))
@@ -1165,5 +1279,79 @@ def test():
     reactor.run()  # @UndefinedVariable
 
 
+def speed_test(queues_count=1000, consumers_count=100, messages_per_queue=1):
+    """
+    Every consumer is subscribed to every queue, producer writes messages to all of the queues.
+    Measures delivery throughput and latency, then checks that unacknowledged messages are restored from the log.
+    """
+    import tempfile
+    import shutil
+    queues_dir = tempfile.mkdtemp(prefix='p2p_queue_speed_test_')
+    init(queues_dir=queues_dir)
+    latencies = []
+    expected = queues_count*consumers_count*messages_per_queue
+    result = {}
+
+    def _on_message(message_json):
+        latencies.append(time.time() - message_json['payload']['sent'])
+        if len(latencies) >= expected:
+            result['finished'] = time.time()
+            reactor.callLater(0, reactor.stop)  # @UndefinedVariable
+        return True
+
+    queue_ids = ['event-speed%d&alice@host-one.com&bob@server-second.com' % i for i in range(queues_count)]
+    for queue_id in queue_ids:
+        open_queue(queue_id)
+    for c in range(consumers_count):
+        consumer_id = 'consumer%d@host-two.com' % c
+        add_consumer(consumer_id)
+        add_callback_method(consumer_id, _on_message)
+        for queue_id in queue_ids:
+            subscribe_consumer(consumer_id, queue_id)
+    add_producer('alice@host-one.com')
+    for queue_id in queue_ids:
+        connect_producer('alice@host-one.com', queue_id)
+
+    def _produce():
+        result['started'] = time.time()
+        for m in range(messages_per_queue):
+            for queue_id in queue_ids:
+                write_message('alice@host-one.com', queue_id, data=dict(counter=m, sent=time.time()))
+        result['produced'] = time.time()
+
+    reactor.callLater(0, _produce)  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+    dt = result['finished'] - result['started']
+    latencies.sort()
+    print('%d queues x %d consumers, %d messages per queue' % (queues_count, consumers_count, messages_per_queue))
+    print('    produced %d messages in %.3f sec' % (queues_count*messages_per_queue, result['produced'] - result['started']))
+    print('    delivered %d notifications in %.3f sec, %.1f per sec' % (len(latencies), dt, len(latencies)/dt))
+    print('    latency p50=%.3f p99=%.3f max=%.3f sec' % (latencies[int(len(latencies)*0.5)], latencies[int(len(latencies)*0.99)], latencies[-1]))
+    dt = time.time()
+    do_consume()
+    print('    one full scan of idle queues (periodic loop) : %.3f sec' % (time.time() - dt))
+    dt = time.time()
+    do_wake_up()
+    print('    one wake up with no pending consumers : %.6f sec' % (time.time() - dt))
+    # write one more message into every queue and "restart" before it is consumed
+    for queue_id in queue_ids:
+        write_message('alice@host-one.com', queue_id, data=dict(counter=-1, sent=time.time()))
+    stop()
+    queue_log.shutdown()
+    queue().clear()
+    queue_log.init(queues_dir)
+    dt = time.time()
+    for queue_id in queue_ids:
+        open_queue(queue_id)
+    restored = sum([len(queue(queue_id)) for queue_id in queue_ids])
+    print('    restored %d unconsumed messages from the log in %.3f sec' % (restored, time.time() - dt))
+    print('    %r' % queue_log.stats())
+    queue_log.shutdown()
+    shutil.rmtree(queues_dir)
+
+
 if __name__ == '__main__':
-    test()
+    if len(sys.argv) > 1 and sys.argv[1] == 'speed_test':
+        speed_test()
+    else:
+        test()
@@ -0,0 +1,447 @@
+#!/usr/bin/python
+# queue_log.py
+#
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (queue_log.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+"""
+.. module:: queue_log.
+
+Append-only on-disk log for every queue opened in ``p2p_queue``.
+
+Every line in the log file is a JSON record of one of those types:
+
+    + ``{"m": <message_id>, "p": <producer_id>, "t": <created>, "u": [<consumers>], "d": <payload>}`` - new message
+    + ``{"a": <consumer_id>, "m": <message_id>}`` - consumer acknowledged given message
+    + ``{"r": <message_id>}`` - message was removed from the queue
+
+Acknowledgments can arrive in any order, so every one of them is kept until the log is compacted.
+When the queue is opened again after restart only messages which are still pending for at least one consumer are restored.
+
+Records are collected in memory and written to disk in batches.
+Log file is compacted when most of the records in it are not needed anymore.
+Messages older than ``MAX_MESSAGE_AGE`` or beyond ``MAX_LOG_SIZE`` are dropped during compaction.
+Logs of the queues which were closed and not opened again are erased by ``sweep_logs()`` after ``MAX_MESSAGE_AGE``.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import time
+
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.lib import strng
+from bitdust.lib import jsn
+from bitdust.lib import utime
+
+from bitdust.system import local_fs
+
+#------------------------------------------------------------------------------
+
+MAX_LOG_SIZE = 1024*1024*10
+MAX_MESSAGE_AGE = 60*60*24*7
+
+COMPACT_MIN_RECORDS = 1000
+
+#------------------------------------------------------------------------------
+
+_LogsDir = None
+
+_PendingRecords = {}
+_PendingRecordsCount = 0
+_MaxPendingRecords = 1000
+
+_FlushTask = None
+_FlushIntervalSeconds = 0.5
+
+_SweepTask = None
+_SweepIntervalSeconds = 60*60
+
+_OpenedLogs = set()
+_WrittenRecords = {}
+_LiveMessages = {}
+
+#------------------------------------------------------------------------------
+
+
+def init(logs_dir):
+    """
+    Enables persistence of the queues, log files will be stored in ``logs_dir``.
+    """
+    global _LogsDir
+    _LogsDir = logs_dir
+    if not os.path.isdir(_LogsDir):
+        os.makedirs(_LogsDir)
+    schedule_sweep(delay=0)
+    if _Debug:
+        lg.args(_DebugLevel, logs_dir=_LogsDir)
+
+
+def shutdown():
+    global _LogsDir
+    global _FlushTask
+    global _SweepTask
+    if _FlushTask and _FlushTask.active():
+        _FlushTask.cancel()
+    _FlushTask = None
+    if _SweepTask and _SweepTask.active():
+        _SweepTask.cancel()
+    _SweepTask = None
+    flush()
+    _OpenedLogs.clear()
+    _WrittenRecords.clear()
+    _LiveMessages.clear()
+    _LogsDir = None
+    if _Debug:
+        lg.out(_DebugLevel, 'queue_log.shutdown')
+
+
+def enabled():
+    return _LogsDir is not None
+
+
+def log_filepath(queue_id):
+    return os.path.join(_LogsDir, strng.to_text(queue_id) + '.log')
+
+
+#------------------------------------------------------------------------------
+
+
+def append_message(queue_id, message_id, producer_id, created, payload, consumers):
+    if queue_id not in _OpenedLogs:
+        return False
+    _LiveMessages.setdefault(queue_id, set()).add(message_id)
+    return _append(queue_id, {
+        'm': message_id,
+        'p': producer_id,
+        't': created,
+        'u': list(consumers),
+        'd': payload,
+    })
+
+
+def append_ack(queue_id, consumer_id, message_id):
+    if queue_id not in _OpenedLogs:
+        return False
+    return _append(queue_id, {
+        'a': consumer_id,
+        'm': message_id,
+    })
+
+
+def append_removed(queue_id, message_id):
+    if queue_id not in _OpenedLogs:
+        return False
+    _LiveMessages.get(queue_id, set()).discard(message_id)
+    return _append(queue_id, {
+        'r': message_id,
+    })
+
+
+def _append(queue_id, record):
+    global _PendingRecordsCount
+    _PendingRecords.setdefault(queue_id, []).append(jsn.dumps(record, keys_to_text=True, values_to_text=True))
+    _PendingRecordsCount += 1
+    if _PendingRecordsCount >= _MaxPendingRecords:
+        flush()
+    else:
+        schedule_flush()
+    return True
+
+
+def schedule_flush():
+    global _FlushTask
+    if _FlushTask and _FlushTask.active():
+        return
+    _FlushTask = reactor.callLater(_FlushIntervalSeconds, flush)  # @UndefinedVariable
+
+
+def flush(queue_id=None):
+    """
+    Writes all collected records to the log files, only one disk write per queue.
+    """
+    global _PendingRecordsCount
+    if not enabled():
+        _PendingRecords.clear()
+        _PendingRecordsCount = 0
+        return 0
+    if queue_id is None:
+        target_queues = list(_PendingRecords.keys())
+    else:
+        target_queues = [
+            queue_id,
+        ]
+    total = 0
+    for _queue_id in target_queues:
+        lines = _PendingRecords.pop(_queue_id, None)
+        if not lines:
+            continue
+        _PendingRecordsCount -= len(lines)
+        try:
+            # no fsync() here: records must survive a restart of the process, not a power loss
+            with open(log_filepath(_queue_id), 'ab') as f:
+                f.write(strng.to_bin('\n'.join(lines) + '\n'))
+        except:
+            lg.exc('failed writing %d records to the queue log %r' % (len(lines), _queue_id))
+            continue
+        total += len(lines)
+        _WrittenRecords[_queue_id] = _WrittenRecords.get(_queue_id, 0) + len(lines)
+        if _WrittenRecords[_queue_id] > COMPACT_MIN_RECORDS + 4*len(_LiveMessages.get(_queue_id, [])):
+            compact(_queue_id)
+    _PendingRecordsCount = max(0, _PendingRecordsCount)
+    if _Debug:
+        lg.args(_DebugLevel, queues=len(target_queues), records=total)
+    return total
+
+
+#------------------------------------------------------------------------------
+
+
+def read_log(queue_id):
+    """
+    Replays the log file of given queue and returns a tuple ``(messages, cursors)``.
+    ``messages`` is ordered dictionary of the records still pending for at least one consumer,
+    ``cursors`` keeps for every known consumer the message ID up to which all messages were acknowledged.
+    """
+    messages = OrderedDict()
+    cursors = {}
+    if not enabled():
+        return messages, cursors
+    flush(queue_id)
+    filepath = log_filepath(queue_id)
+    if not os.path.isfile(filepath):
+        return messages, cursors
+    removed = set()
+    acked = {}
+    with open(filepath, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = jsn.loads_text(line)
+            except:
+                lg.warn('skip broken record in the queue log %r' % queue_id)
+                continue
+            if 'a' in record:
+                acked.setdefault(record['a'], set()).add(int(record['m']))
+            elif 'r' in record:
+                removed.add(int(record['r']))
+            elif 'm' in record:
+                messages[int(record['m'])] = record
+    now = utime.utcnow_to_sec1970()
+    blocked_consumers = set()
+    for message_id in sorted(messages.keys()):
+        record = messages[message_id]
+        consumers = record.get('u') or []
+        pending_consumers = [c for c in consumers if message_id not in acked.get(c, ())]
+        dropped = message_id in removed or now - float(record.get('t') or 0) > MAX_MESSAGE_AGE
+        for consumer_id in consumers:
+            if consumer_id in blocked_consumers:
+                continue
+            if consumer_id in pending_consumers and not dropped:
+                # cursor is not moved beyond the first message which is still not acknowledged
+                blocked_consumers.add(consumer_id)
+            else:
+                cursors[consumer_id] = message_id
+        if dropped or not pending_consumers:
+            messages.pop(message_id)
+            continue
+        record['u'] = pending_consumers
+    return messages, cursors
+
+
+def compact(queue_id):
+    """
+    Re-writes the log file of given queue and keeps only messages that are still needed.
+    Applies retention rules: too old messages are dropped and total size of the log is limited.
+    Returns ordered dictionary of the messages kept in the log.
+    """
+    if not enabled():
+        return OrderedDict()
+    messages, cursors = read_log(queue_id)
+    lines = []
+    total_size = 0
+    for message_id in reversed(list(messages.keys())):
+        line = jsn.dumps(messages[message_id], keys_to_text=True, values_to_text=True)
+        total_size += len(line) + 1
+        if total_size > MAX_LOG_SIZE:
+            lg.warn('queue log %r is too big, older messages were dropped' % queue_id)
+            for old_message_id in list(messages.keys()):
+                if old_message_id == message_id:
+                    break
+                messages.pop(old_message_id)
+            messages.pop(message_id)
+            break
+        lines.insert(0, line)
+    filepath = log_filepath(queue_id)
+    _WrittenRecords[queue_id] = len(lines)
+    _LiveMessages[queue_id] = set(messages.keys())
+    if lines:
+        local_fs.WriteBinaryFile(filepath, strng.to_bin('\n'.join(lines) + '\n'))
+    elif os.path.isfile(filepath):
+        os.remove(filepath)
+    if _Debug:
+        lg.args(_DebugLevel, queue_id=queue_id, records=len(lines), cursors=len(cursors))
+    return messages
+
+
+def open_log(queue_id):
+    """
+    Starts writing records for given queue.
+    Compacts existing log file and returns messages to be loaded back into the queue.
+    """
+    if not enabled():
+        return OrderedDict()
+    _OpenedLogs.add(queue_id)
+    return compact(queue_id)
+
+
+def rename_log(old_queue_id, new_queue_id):
+    if not enabled():
+        return False
+    flush(old_queue_id)
+    if old_queue_id in _OpenedLogs:
+        _OpenedLogs.discard(old_queue_id)
+        _OpenedLogs.add(new_queue_id)
+    old_filepath = log_filepath(old_queue_id)
+    if not os.path.isfile(old_filepath):
+        return False
+    new_filepath = log_filepath(new_queue_id)
+    if os.path.isfile(new_filepath):
+        flush(new_queue_id)
+        local_fs.AppendBinaryFile(new_filepath, local_fs.ReadBinaryFile(old_filepath), mode='ab')
+        os.remove(old_filepath)
+    else:
+        os.rename(old_filepath, new_filepath)
+    _WrittenRecords[new_queue_id] = _WrittenRecords.get(new_queue_id, 0) + _WrittenRecords.pop(old_queue_id, 0)
+    _LiveMessages.setdefault(new_queue_id, set()).update(_LiveMessages.pop(old_queue_id, set()))
+    return True
+
+
+def close_log(queue_id):
+    """
+    Called when the queue is closed, log file is kept on disk and will be restored when queue is opened again.
+    """
+    if queue_id not in _OpenedLogs:
+        return False
+    _OpenedLogs.discard(queue_id)
+    flush(queue_id)
+    compact(queue_id)
+    _WrittenRecords.pop(queue_id, None)
+    _LiveMessages.pop(queue_id, None)
+    return True
+
+
+def erase_log(queue_id):
+    if not enabled():
+        return False
+    _OpenedLogs.discard(queue_id)
+    _PendingRecords.pop(queue_id, None)
+    _WrittenRecords.pop(queue_id, None)
+    _LiveMessages.pop(queue_id, None)
+    filepath = log_filepath(queue_id)
+    if os.path.isfile(filepath):
+        os.remove(filepath)
+    return True
+
+
+#------------------------------------------------------------------------------
+
+
+def schedule_sweep(delay=None):
+    global _SweepTask
+    if _SweepTask and _SweepTask.active():
+        return
+    _SweepTask = reactor.callLater(_SweepIntervalSeconds if delay is None else delay, _on_sweep_task)  # @UndefinedVariable
+
+
+def _on_sweep_task():
+    global _SweepTask
+    _SweepTask = None
+    if not enabled():
+        return
+    try:
+        sweep_logs()
+    except:
+        lg.exc()
+    schedule_sweep()
+
+
+def sweep_logs():
+    """
+    Erases log files of the queues which are not opened and were not modified for ``MAX_MESSAGE_AGE``.
+    Log file is compacted when the queue is closed and is not written after that,
+    so all of the messages there are already too old to be restored.
+    Returns list of erased queue IDs.
+    """
+    if not enabled():
+        return []
+    erased = []
+    now = time.time()
+    for filename in os.listdir(_LogsDir):
+        if not filename.endswith('.log'):
+            continue
+        queue_id = filename[:-4]
+        if queue_id in _OpenedLogs or queue_id in _PendingRecords:
+            continue
+        try:
+            modified = os.path.getmtime(os.path.join(_LogsDir, filename))
+        except OSError:
+            continue
+        if now - modified > MAX_MESSAGE_AGE:
+            erase_log(queue_id)
+            erased.append(queue_id)
+    if erased:
+        lg.info('erased %d expired queue logs' % len(erased))
+    return erased
+
+
+#------------------------------------------------------------------------------
+
+
+def stats():
+    return {
+        'queues': len(_OpenedLogs),
+        'pending_records': _PendingRecordsCount,
+        'live_messages': sum([len(v) for v in _LiveMessages.values()]),
+    }
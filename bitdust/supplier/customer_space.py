@@ -79,6 +79,7 @@ from bitdust.dht import known_nodes
 
 from bitdust.supplier import list_files
 from bitdust.supplier import local_tester
+from bitdust.supplier import pieces_manifest
 
 from bitdust.userid import global_id
 from bitdust.userid import id_url
@@ -91,8 +92,14 @@ _SupplierFileModifiedNotifyTasks = {}
 
 #------------------------------------------------------------------------------
 
+MAX_RETRIEVE_BATCH_ITEMS = 256
+RETRIEVE_BATCH_CHUNK_SIZE = 4
+
+#------------------------------------------------------------------------------
+
 
 def init():
+    pieces_manifest.init()
     callback.append_inbox_callback(on_inbox_packet_received)
     events.add_subscriber(on_identity_url_changed, 'identity-url-changed')
     events.add_subscriber(on_customer_accepted, 'existing-customer-accepted')
@@ -127,6 +134,7 @@ def shutdown():
     events.remove_subscriber(on_customer_terminated, 'existing-customer-terminated')
     events.remove_subscriber(on_identity_url_changed, 'identity-url-changed')
     callback.remove_inbox_callback(on_inbox_packet_received)
+    pieces_manifest.shutdown()
 
 
 #------------------------------------------------------------------------------
@@ -391,18 +399,16 @@ def on_data(newpacket):
         lg.err('customer space is broken, no info about donated space can be found for %s' % newpacket)
         p2p_service.SendFail(newpacket, 'customer space is broken, no info found about donated space', remote_idurl=authorized_idurl)
         return False
-    used_space_dict = accounting.read_customers_usage()
-    known_customers_usage = list(used_space_dict.keys())
-    if id_url.is_in(customer_idurl, known_customers_usage, as_field=False, as_bin=True):
-        try:
-            bytes_used_by_customer = int(used_space_dict[customer_idurl.to_bin()])
-            bytes_donated_to_customer = int(space_dict[customer_idurl.to_bin()])
-            if bytes_donated_to_customer - bytes_used_by_customer < len(new_data):
-                lg.warn('no free space left for customer data for %s' % customer_idurl)
-                p2p_service.SendFail(newpacket, 'no free space left for customer data', remote_idurl=authorized_idurl)
-                return False
-        except:
-            lg.exc()
+    bytes_donated_to_customer = None
+    try:
+        bytes_used_by_customer = accounting.get_customer_usage(customer_idurl)
+        bytes_donated_to_customer = int(space_dict[customer_idurl.to_bin()])
+        if bytes_donated_to_customer - bytes_used_by_customer < len(new_data):
+            lg.warn('no free space left for customer data for %s' % customer_idurl)
+            p2p_service.SendFail(newpacket, 'no free space left for customer data', remote_idurl=authorized_idurl)
+            return False
+    except:
+        lg.exc()
     data_existed = os.path.exists(filename)
     # data_changed = True
     # if data_exists:
@@ -424,11 +430,14 @@ def on_data(newpacket):
             lg.err('can not write to %s' % str(filename))
             p2p_service.SendFail(newpacket, 'write error', remote_idurl=authorized_idurl)
             return False
+        pieces_manifest.record_piece(filename, new_data, newpacket.Payload)
     # Here Data() packet was stored as it is on supplier node (current machine)
     del new_data
     sz = len(newpacket.Payload)
     p2p_service.SendAck(newpacket, response=strng.to_text(sz), remote_idurl=authorized_idurl)
-    reactor.callLater(0, local_tester.TestSpaceTime)  # @UndefinedVariable
+    if bytes_donated_to_customer is None or accounting.get_customer_usage(customer_idurl) > bytes_donated_to_customer:
+        # only need to clean up customer folder when the quota is exceeded
+        reactor.callLater(0, local_tester.TestSpaceTime)  # @UndefinedVariable
     if key_alias != 'master':  # and data_changed:
         if remote_path == settings.BackupIndexFileName() or packetid.IsIndexFileName(remote_path):
             do_notify_supplier_file_modified(key_alias, settings.BackupIndexFileName(), 'write', customer_idurl, authorized_idurl)
@@ -447,6 +456,13 @@ def on_retrieve(newpacket):
     #     lg.err("had unknown customer %s" % newpacket.OwnerID)
     #     p2p_service.SendFail(newpacket, 'not a customer')
     #     return False
+    if newpacket.Payload and id_url.is_the_same(newpacket.CreatorID, newpacket.OwnerID):
+        try:
+            batch_items = serialization.BytesToDict(newpacket.Payload, keys_to_text=True, values_to_text=True).get('items')
+        except:
+            batch_items = None
+        if batch_items is not None:
+            return on_retrieve_batch(newpacket, batch_items)
     glob_path = global_id.ParseGlobalID(newpacket.PacketID)
     if not glob_path['path']:
         # backward compatible check
@@ -648,6 +664,7 @@ def on_delete_file(newpacket):
                 lg.exc()
         else:
             lg.warn('path was not found %s' % filename)
+        pieces_manifest.forget(filename)
         do_notify_supplier_file_modified(glob_path['key_alias'], glob_path['path'], 'delete', newpacket.OwnerID, newpacket.CreatorID)
     p2p_service.SendAck(newpacket)
     if _Debug:
@@ -701,6 +718,7 @@ def on_delete_backup(newpacket):
         else:
             if _Debug:
                 lg.dbg(_DebugLevel, 'path not found %s' % filename)
+        pieces_manifest.forget(filename)
         do_notify_supplier_file_modified(glob_path['key_alias'], glob_path['path'], 'delete', newpacket.OwnerID, newpacket.CreatorID)
     p2p_service.SendAck(newpacket)
     if _Debug:
@@ -708,6 +726,107 @@ def on_delete_backup(newpacket):
     return True
 
 
+def on_contacts(newpacket):
+    try:
+        json_payload = serialization.BytesToDict(newpacket.Payload, keys_to_text=True, values_to_text=True)
+        contacts_type = json_payload['type']
+        contacts_space = json_payload['space']
+    except:
+        lg.exc()
+        return False
+    if contacts_space != 'integrity':
+        return False
+    if contacts_type == 'merkle_root':
+        return on_merkle_root_request(newpacket, json_payload)
+    lg.warn('unexpected integrity request %r received in %r' % (contacts_type, newpacket))
+    return False
+
+
+def on_retrieve_batch(newpacket, packet_ids):
+    """
+    Customer is asking for many of his files at once, every file is sent back in a separate Data() packet
+    exactly like for a regular Retrieve() and at the end the request is confirmed with an Ack()
+    which contains the list of files not found here.
+
+    Files are read and sent in small chunks, one chunk per reactor iteration.
+    """
+    # SECURITY
+    # only the owner can request multiple files at once, shared data must be requested one by one
+    if not isinstance(packet_ids, list) or len(packet_ids) > MAX_RETRIEVE_BATCH_ITEMS:
+        lg.warn('incorrect multi-file retrieve request from %r' % newpacket.OwnerID)
+        p2p_service.SendFail(newpacket, 'incorrect retrieve request')
+        return True
+    reactor.callLater(0, _send_retrieve_batch_chunk, newpacket, packet_ids, 0, [])  # @UndefinedVariable
+    return True
+
+
+def _send_retrieve_batch_chunk(newpacket, packet_ids, position, missing):
+    for packet_id in packet_ids[position:position + RETRIEVE_BATCH_CHUNK_SIZE]:
+        if not _send_stored_packet(newpacket, packet_id):
+            missing.append(packet_id)
+    position += RETRIEVE_BATCH_CHUNK_SIZE
+    if position < len(packet_ids):
+        reactor.callLater(0, _send_retrieve_batch_chunk, newpacket, packet_ids, position, missing)  # @UndefinedVariable
+        return
+    sent = len(packet_ids) - len(missing)
+    p2p_service.SendAck(newpacket, response=serialization.DictToBytes({
+        'sent': sent,
+        'missing': missing,
+    }))
+    if _Debug:
+        lg.args(_DebugLevel, customer=newpacket.OwnerID, requested=len(packet_ids), sent=sent, missing=len(missing))
+
+
+def _send_stored_packet(newpacket, packet_id):
+    glob_path = global_id.ParseGlobalID(packet_id)
+    if not glob_path['path'] or not glob_path['idurl'] or not id_url.is_the_same(glob_path['idurl'], newpacket.OwnerID):
+        return False
+    filename = make_valid_filename(newpacket.OwnerID, glob_path)
+    if not filename or not os.path.isfile(filename):
+        return False
+    stored_packet = signed.Unserialize(bpio.ReadBinaryFile(filename))
+    if stored_packet is None or not stored_packet.Valid():
+        lg.warn('stored packet is not valid %s' % filename)
+        return False
+    gateway.outbox(signed.Packet(
+        Command=commands.Data(),
+        OwnerID=stored_packet.OwnerID,
+        CreatorID=my_id.getIDURL(),
+        PacketID=stored_packet.PacketID,
+        Payload=stored_packet.Serialize(),
+        RemoteID=newpacket.OwnerID,
+    ))
+    return True
+
+
+def on_merkle_root_request(newpacket, json_payload):
+    # SECURITY
+    backup_id = json_payload.get('backup_id') or ''
+    glob_path = global_id.ParseGlobalID(backup_id)
+    if not glob_path['path'] or not glob_path['idurl']:
+        lg.warn('got incorrect backup ID: %r' % backup_id)
+        p2p_service.SendFail(newpacket, 'incorrect backup ID')
+        return True
+    if not id_url.is_the_same(glob_path['idurl'], newpacket.OwnerID) or not contactsdb.is_customer(newpacket.OwnerID):
+        lg.warn('%r is not authorized to audit %r' % (newpacket.OwnerID, backup_id))
+        p2p_service.SendFail(newpacket, 'not authorized')
+        return True
+    version_dir = make_valid_filename(newpacket.OwnerID, glob_path)
+    if not version_dir:
+        p2p_service.SendFail(newpacket, 'incorrect backup ID')
+        return True
+    merkle_root, pieces, unverified = pieces_manifest.version_merkle_root(version_dir)
+    p2p_service.SendAck(newpacket, response=serialization.DictToBytes({
+        'backup_id': backup_id,
+        'merkle_root': merkle_root,
+        'pieces': pieces,
+        'unverified': unverified,
+    }))
+    if _Debug:
+        lg.args(_DebugLevel, backup_id=backup_id, merkle_root=merkle_root, pieces=len(pieces), unverified=len(unverified))
+    return True
+
+
 #------------------------------------------------------------------------------
 
 
@@ -850,6 +969,8 @@ def on_identity_url_changed(evt):
                 lg.warn('removed %r' % old_owner_dir)
         except:
             lg.exc()
+        # moved pieces will be discovered again and registered in the manifest by the local tester
+        pieces_manifest.forget(old_owner_dir)
     # update customer idurl in "spaceused" file
     local_tester.TestSpaceTime()
     # TODO: reconnect "supplier-file-modified" consumers & producers
@@ -1092,6 +1213,8 @@ def on_inbox_packet_received(newpacket, info, status, error_message):
         return on_data(newpacket)
     elif newpacket.Command == commands.ListFiles():
         return on_list_files(newpacket)
+    elif newpacket.Command == commands.Contacts():
+        return on_contacts(newpacket)
     return False
 
 
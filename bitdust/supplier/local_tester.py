@@ -28,6 +28,11 @@
 
 Checks that customer packets on the local disk still have good signatures and are valid.
 
+Every stored piece is fully validated only once, after that ``supplier.pieces_manifest`` keeps its hash.
+The "scrub" action re-reads a limited amount of pieces, oldest checked first, and compares hashes.
+The "validate" action reconciles the manifest and the ledger of used space with the files on the disk.
+Corrupted pieces are removed and the owner receives an updated list of files, so the data can be rebuilt.
+
 """
 
 #------------------------------------------------------------------------------
@@ -43,6 +48,7 @@ _DebugLevel = 8
 
 import os
 import sys
+import time
 
 #------------------------------------------------------------------------------
 
@@ -63,8 +69,18 @@ except:
 
 from bitdust.system import bpio
 
+from bitdust.lib import packetid
+
 from bitdust.main import settings
 
+from bitdust.crypt import my_keys
+
+from bitdust.contacts import contactsdb
+
+from bitdust.userid import global_id
+
+from bitdust.supplier import pieces_manifest
+
 #-------------------------------------------------------------------------------
 
 _TesterQueue = []
@@ -73,12 +89,14 @@ _Loop = None
 _LoopValidate = None
 _LoopUpdateCustomers = None
 _LoopSpaceTime = None
+_LoopScrub = None
 
 #------------------------------------------------------------------------------
 
 TesterUpdateCustomers = 'update_customers'
 TesterValidate = 'validate'
 TesterSpaceTime = 'space_time'
+TesterScrub = 'scrub'
 
 #------------------------------------------------------------------------------
 
@@ -118,17 +136,20 @@ def start():
     global _LoopValidate
     global _LoopUpdateCustomers
     global _LoopSpaceTime
+    global _LoopScrub
     if _Debug:
         lg.out(_DebugLevel, 'local_tester.start')
     _LoopValidate = reactor.callLater(0, loop_validate)  # @UndefinedVariable
     _LoopUpdateCustomers = reactor.callLater(0, loop_update_customers)  # @UndefinedVariable
     _LoopSpaceTime = reactor.callLater(0, loop_space_time)  # @UndefinedVariable
+    _LoopScrub = reactor.callLater(settings.DefaultLocaltesterLoop(), loop_scrub)  # @UndefinedVariable
 
 
 def stop():
     global _LoopValidate
     global _LoopUpdateCustomers
     global _LoopSpaceTime
+    global _LoopScrub
     if _Debug:
         lg.out(_DebugLevel, 'local_tester.stop')
     if _LoopValidate:
@@ -143,6 +164,10 @@ def stop():
         if _LoopSpaceTime.active():
             _LoopSpaceTime.cancel()
             _LoopSpaceTime = None
+    if _LoopScrub:
+        if _LoopScrub.active():
+            _LoopScrub.cancel()
+            _LoopScrub = None
 
 
 #------------------------------------------------------------------------------
@@ -174,18 +199,67 @@ def on_thread_finished(ret, cmd):
         lg.out(_DebugLevel, 'local_tester.on_thread_finished %r with %r' % (cmd, ret))
 
 
+def on_pieces_compared(result, started_time):
+    new_pieces, resized_pieces, missing_paths = result
+    return pieces_manifest.reconcile(new_pieces, resized_pieces, missing_paths, started_time)
+
+
+def on_files_removed(ret, removed_paths):
+    for path in removed_paths:
+        pieces_manifest.forget(path)
+    return ret
+
+
+def on_pieces_checked(results, customers_dir):
+    corrupted = pieces_manifest.apply_results(results, customers_dir)
+    for customer_id in set(pieces_manifest.customer_id(path) for path in corrupted):
+        report_corrupted_pieces(customer_id)
+    return len(results)
+
+
+def report_corrupted_pieces(customer_id):
+    """
+    Proactively sends an updated list of files to the customer, corrupted pieces are not there anymore.
+    """
+    from bitdust.supplier import list_files
+    customer_idurl = global_id.GlobalUserToIDURL(customer_id)
+    if not customer_idurl or not contactsdb.is_customer(customer_idurl):
+        lg.warn('corrupted pieces of unknown customer %r were removed' % customer_id)
+        return False
+    key_id = my_keys.make_key_id(alias='master', creator_idurl=customer_idurl)
+    list_files.send(
+        customer_idurl=customer_idurl,
+        packet_id='%s:%s' % (key_id, packetid.UniqueID()),
+        format_type=settings.ListFilesFormat(),
+        key_id=key_id,
+        remote_idurl=customer_idurl,
+    )
+    lg.info('sent updated list of files to %r after corrupted pieces were removed' % customer_idurl)
+    return True
+
+
 def run_in_thread(cmd):
     global _CurrentProcess
     from bitdust.main import bptester
     if _CurrentProcess:
         raise Exception('another thread already started')
     _CurrentProcess = cmd
-    command = {
-        TesterUpdateCustomers: bptester.UpdateCustomers,
-        TesterValidate: bptester.Validate,
-        TesterSpaceTime: bptester.SpaceTime,
-    }[cmd]
-    d = threads.deferToThread(command)  # @UndefinedVariable
+    customers_dir = settings.getCustomersFilesDir()
+    if cmd == TesterValidate:
+        d = threads.deferToThread(pieces_manifest.compare_pieces, customers_dir)  # @UndefinedVariable
+        d.addCallback(on_pieces_compared, int(time.time()))
+    elif cmd == TesterScrub:
+        pieces = pieces_manifest.pieces_to_check(settings.getScrubBudgetBytes())
+        d = threads.deferToThread(pieces_manifest.check_pieces, pieces, customers_dir)  # @UndefinedVariable
+        d.addCallback(on_pieces_checked, customers_dir)
+    else:
+        command = {
+            TesterUpdateCustomers: bptester.UpdateCustomers,
+            TesterSpaceTime: bptester.SpaceTime,
+        }[cmd]
+        removed_paths = []
+        d = threads.deferToThread(command, removed_paths)  # @UndefinedVariable
+        d.addCallback(on_files_removed, removed_paths)
     d.addBoth(on_thread_finished, cmd)
     if _Debug:
         lg.out(_DebugLevel, 'local_tester.run_in_thread started %r' % cmd)
@@ -216,6 +290,12 @@ def loop_validate():
     _LoopValidate = reactor.callLater(settings.DefaultLocaltesterValidateTimeout(), loop_validate)  # @UndefinedVariable
 
 
+def loop_scrub():
+    global _LoopScrub
+    TestScrub()
+    _LoopScrub = reactor.callLater(settings.DefaultLocaltesterScrubTimeout(), loop_scrub)  # @UndefinedVariable
+
+
 def loop_update_customers():
     global _LoopUpdateCustomers
     TestUpdateCustomers()
@@ -243,6 +323,10 @@ def TestSpaceTime():
     _pushTester(TesterSpaceTime)
 
 
+def TestScrub():
+    _pushTester(TesterScrub)
+
+
 #-------------------------------------------------------------------------------
 
 if __name__ == '__main__':
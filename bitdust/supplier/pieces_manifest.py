@@ -0,0 +1,535 @@
+#!/usr/bin/python
+# pieces_manifest.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (pieces_manifest.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+"""
+.. module:: pieces_manifest.
+
+Keeps SHA256 hashes of all customers pieces stored on that supplier.
+
+Hashes are recorded when ``customer_space.on_data()`` writes a Data() packet to the disk.
+This way ``local_tester`` does not need to parse every stored packet and verify its signature again and again:
+the scrubber re-reads only a limited amount of pieces per pass, oldest checked first, and compares hashes.
+Pieces stored by previous versions are discovered on the disk and fully validated only once.
+
+Hashes of the Data() payloads are also used to build a Merkle root of a single backup version,
+so customer is able to audit stored data without downloading it.
+
+The same database keeps a ledger of the space used by every customer: number of bytes and pieces.
+It is maintained by SQLite triggers in the same transaction with every change of the "pieces" table,
+so ``storage.accounting`` does not need to walk the customers folder to check quotas.
+Once in a while ``local_tester`` reconciles the manifest with the files on the disk in a separate thread.
+
+The database is kept outside of the customers folder, because ``bptester.SpaceTime()``
+removes all unknown files from there.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import sqlite3
+import binascii
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import os.path as _p
+    sys.path.insert(0, _p.abspath(_p.join(_p.dirname(_p.abspath(sys.argv[0])), '..', '..')))
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.system import bpio
+
+from bitdust.lib import strng
+from bitdust.lib import packetid
+
+from bitdust.main import settings
+
+from bitdust.crypt import hashes
+
+#------------------------------------------------------------------------------
+
+MAX_PIECES_PER_PASS = 1000
+
+# name of the top level folder is the customer global ID
+_CUSTOMER_SQL = "substr({0}.path, 1, instr({0}.path, '/')-1)"
+
+#------------------------------------------------------------------------------
+
+_ManifestDB = None
+_ManifestFilePath = None
+
+#------------------------------------------------------------------------------
+
+
+def init(filepath=None):
+    if _Debug:
+        lg.out(_DebugLevel, 'pieces_manifest.init')
+    open_db(filepath)
+
+
+def shutdown():
+    if _Debug:
+        lg.out(_DebugLevel, 'pieces_manifest.shutdown')
+    close_db()
+
+
+#------------------------------------------------------------------------------
+
+
+def db():
+    global _ManifestDB
+    return _ManifestDB
+
+
+def open_db(filepath=None):
+    global _ManifestDB
+    global _ManifestFilePath
+    if _ManifestDB is not None:
+        return
+    if not filepath:
+        filepath = settings.SupplierPiecesManifestFile()
+    if not os.path.isdir(os.path.dirname(filepath)):
+        bpio._dirs_make(os.path.dirname(filepath))
+    _ManifestFilePath = filepath
+    _ManifestDB = sqlite3.connect(filepath, timeout=1)
+    _ManifestDB.execute('PRAGMA journal_mode = WAL;')
+    _ManifestDB.execute('PRAGMA synchronous = NORMAL;')
+    _ManifestDB.execute(
+        '''CREATE TABLE IF NOT EXISTS "pieces" (
+        "path" TEXT PRIMARY KEY,
+        "size" INTEGER,
+        "file_hash" TEXT,
+        "payload_hash" TEXT,
+        "stored_time" INTEGER,
+        "checked_time" INTEGER) WITHOUT ROWID'''
+    )
+    _ManifestDB.execute('CREATE INDEX IF NOT EXISTS "pieces checked time" on pieces(checked_time)')
+    ledger_created = not _ManifestDB.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='usage'").fetchone()[0]
+    _ManifestDB.execute('''CREATE TABLE IF NOT EXISTS "usage" (
+        "customer" TEXT PRIMARY KEY,
+        "bytes" INTEGER,
+        "pieces" INTEGER) WITHOUT ROWID''')
+    _ManifestDB.execute(
+        '''CREATE TRIGGER IF NOT EXISTS "usage piece added" AFTER INSERT ON pieces BEGIN
+        INSERT OR IGNORE INTO usage (customer, bytes, pieces) VALUES ({customer}, 0, 0);
+        UPDATE usage SET bytes=bytes+NEW.size, pieces=pieces+1 WHERE customer={customer};
+        END'''.format(customer=_CUSTOMER_SQL.format('NEW'))
+    )
+    _ManifestDB.execute(
+        '''CREATE TRIGGER IF NOT EXISTS "usage piece removed" AFTER DELETE ON pieces BEGIN
+        UPDATE usage SET bytes=bytes-OLD.size, pieces=pieces-1 WHERE customer={customer};
+        DELETE FROM usage WHERE customer={customer} AND pieces<=0;
+        END'''.format(customer=_CUSTOMER_SQL.format('OLD'))
+    )
+    _ManifestDB.execute(
+        '''CREATE TRIGGER IF NOT EXISTS "usage piece resized" AFTER UPDATE OF size ON pieces BEGIN
+        UPDATE usage SET bytes=bytes+NEW.size-OLD.size WHERE customer={customer};
+        END'''.format(customer=_CUSTOMER_SQL.format('NEW'))
+    )
+    if ledger_created:
+        _ManifestDB.execute('INSERT INTO usage (customer, bytes, pieces) SELECT {customer} AS c, SUM(size), COUNT(*) FROM pieces GROUP BY c'.format(customer=_CUSTOMER_SQL.format('pieces')))
+    _ManifestDB.commit()
+    if _Debug:
+        lg.args(_DebugLevel, filepath=filepath, ledger_created=ledger_created)
+
+
+def close_db():
+    global _ManifestDB
+    if _ManifestDB is None:
+        return
+    _ManifestDB.commit()
+    _ManifestDB.close()
+    _ManifestDB = None
+
+
+#------------------------------------------------------------------------------
+
+
+def relative_path(filename, customers_dir=None):
+    """
+    Pieces are identified in the manifest by the path relative to the customers folder,
+    for example: ``alice@idhost.org/master/0/0/1/0/F20131120053803PM/0-1-Data``.
+    """
+    if customers_dir is None:
+        customers_dir = settings.getCustomersFilesDir()
+    return os.path.relpath(filename, customers_dir).replace(os.sep, '/')
+
+
+def full_path(path, customers_dir=None):
+    if customers_dir is None:
+        customers_dir = settings.getCustomersFilesDir()
+    return os.path.join(customers_dir, *path.split('/'))
+
+
+def customer_id(path):
+    """
+    Returns global ID of the customer who owns given piece: the name of the top level folder.
+    """
+    return path.split('/')[0]
+
+
+def count():
+    if db() is None:
+        return 0
+    return db().execute('SELECT COUNT(*) FROM pieces').fetchone()[0]
+
+
+def customers_usage():
+    """
+    Returns the ledger of the used space: ``{customer_id: (bytes, pieces)}``.
+    """
+    if db() is None:
+        return {}
+    return {customer: (used_bytes, used_pieces) for customer, used_bytes, used_pieces in db().execute('SELECT customer, bytes, pieces FROM usage')}
+
+
+def customer_usage(customer_id):
+    """
+    Returns tuple ``(bytes, pieces)`` of the space used by given customer.
+    """
+    if db() is None:
+        return 0, 0
+    row = db().execute('SELECT bytes, pieces FROM usage WHERE customer=?', (customer_id, )).fetchone()
+    if row is None:
+        return 0, 0
+    return row[0], row[1]
+
+
+#------------------------------------------------------------------------------
+
+
+def record_piece(filename, file_data, payload, customers_dir=None):
+    """
+    Called right after a Data() packet was written to the local disk.
+    """
+    if db() is None:
+        return False
+    now = int(time.time())
+    path = relative_path(filename, customers_dir)
+    # not using "INSERT OR REPLACE" here, it would also override conflict resolution of the statements inside the triggers
+    db().execute('DELETE FROM pieces WHERE path=?', (path, ))
+    db().execute(
+        'INSERT INTO pieces (path, size, file_hash, payload_hash, stored_time, checked_time) VALUES (?, ?, ?, ?, ?, ?)',
+        (path, len(file_data), strng.to_text(hashes.sha256(file_data, hexdigest=True)), strng.to_text(hashes.sha256(payload, hexdigest=True)), now, now),
+    )
+    db().commit()
+    if _Debug:
+        lg.args(_DebugLevel, path=path, size=len(file_data))
+    return True
+
+
+def forget(filename, customers_dir=None):
+    """
+    Removes given piece from the manifest, if ``filename`` is a folder all pieces inside are removed.
+    """
+    if db() is None:
+        return 0
+    path = relative_path(filename, customers_dir)
+    # '0' goes right after '/' in the ASCII table, so that range covers the whole sub-tree
+    removed = db().execute('DELETE FROM pieces WHERE path=? OR (path>? AND path<?)', (path, path + '/', path + '0')).rowcount
+    db().commit()
+    if _Debug:
+        lg.args(_DebugLevel, path=path, removed=removed)
+    return removed
+
+
+def reconcile(new_pieces, resized_pieces, missing_paths, started_time):
+    """
+    Applies results of the ``compare_pieces()`` call in one transaction.
+    New pieces do not have hashes yet and will be fully validated first by the scrubber.
+    Pieces which were written after the folder walk was started are not touched.
+    """
+    if db() is None:
+        return 0, 0, 0
+    known_before = count()
+    db().executemany(
+        'INSERT OR IGNORE INTO pieces (path, size, file_hash, payload_hash, stored_time, checked_time) VALUES (?, ?, NULL, NULL, ?, 0)',
+        new_pieces,
+    )
+    added = count() - known_before
+    resized = 0
+    for size, path in resized_pieces:
+        resized += db().execute('UPDATE pieces SET size=? WHERE path=? AND stored_time<?', (size, path, started_time)).rowcount
+    removed = 0
+    for path in missing_paths:
+        removed += db().execute('DELETE FROM pieces WHERE path=? AND stored_time<?', (path, started_time)).rowcount
+    db().commit()
+    if added or resized or removed:
+        lg.info('manifest reconciled with the disk: %d pieces added, %d resized and %d removed' % (added, resized, removed))
+    return added, resized, removed
+
+
+def pieces_to_check(budget_bytes, limit=MAX_PIECES_PER_PASS):
+    """
+    Returns list of ``(path, file_hash)`` tuples to be verified during the next scrubbing pass.
+    Pieces which were checked long time ago go first, total size of the selected pieces fits into ``budget_bytes``.
+    """
+    result = []
+    if db() is None:
+        return result
+    total_bytes = 0
+    for path, size, file_hash in db().execute('SELECT path, size, file_hash FROM pieces ORDER BY checked_time ASC LIMIT ?', (limit, )):
+        if result and total_bytes + (size or 0) > budget_bytes:
+            break
+        result.append((path, file_hash))
+        total_bytes += size or 0
+    return result
+
+
+#------------------------------------------------------------------------------
+
+
+def find_pieces(customers_dir):
+    """
+    Walks the customers folder and returns list of ``(path, size, modified_time)`` tuples for every stored file.
+    Only reads the folders structure, executed in a separate thread.
+    """
+    result = []
+    if not os.path.isdir(customers_dir):
+        return result
+    for dirpath, _, filenames in os.walk(customers_dir):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(filepath)
+            except:
+                continue
+            result.append((relative_path(filepath, customers_dir), st.st_size, int(st.st_mtime)))
+    return result
+
+
+def compare_pieces(customers_dir, db_filepath=None):
+    """
+    Walks the customers folder and compares found files with the manifest, executed in a separate thread.
+    Uses its own connection to the database, so the main thread is not blocked.
+    Returns three lists: new pieces ``(path, size, modified_time)``, resized pieces ``(size, path)`` and missing paths.
+    """
+    db_filepath = db_filepath or _ManifestFilePath
+    if not db_filepath:
+        return [], [], []
+    found_pieces = find_pieces(customers_dir)
+    conn = sqlite3.connect(db_filepath, timeout=10)
+    try:
+        known_pieces = dict(conn.execute('SELECT path, size FROM pieces'))
+    finally:
+        conn.close()
+    new_pieces = []
+    resized_pieces = []
+    for path, size, modified_time in found_pieces:
+        if path not in known_pieces:
+            new_pieces.append((path, size, modified_time))
+            continue
+        if known_pieces.pop(path) != size:
+            resized_pieces.append((size, path))
+    return new_pieces, resized_pieces, list(known_pieces.keys())
+
+
+def check_pieces(pieces, customers_dir):
+    """
+    Reads given pieces from the disk and verifies them, executed in a separate thread and does not touch the database.
+    Pieces with known hash are only hashed again, new pieces are fully validated with ``signed.Unserialize()``.
+    Returns list of ``(path, status, expected_hash, file_hash, payload_hash, size)`` tuples,
+    where status is one of "ok", "missing" or "corrupted".
+    """
+    from bitdust.crypt import signed
+    results = []
+    for path, expected_hash in pieces:
+        filepath = full_path(path, customers_dir)
+        if not os.path.isfile(filepath):
+            results.append((path, 'missing', expected_hash, None, None, 0))
+            continue
+        data = bpio.ReadBinaryFile(filepath)
+        if not data:
+            results.append((path, 'corrupted', expected_hash, None, None, 0))
+            continue
+        file_hash = strng.to_text(hashes.sha256(data, hexdigest=True))
+        if expected_hash:
+            results.append((path, 'ok' if file_hash == expected_hash else 'corrupted', expected_hash, file_hash, None, len(data)))
+            continue
+        p = signed.Unserialize(data)
+        if p is None or not p.Valid():
+            results.append((path, 'corrupted', expected_hash, file_hash, None, len(data)))
+            continue
+        payload_hash = strng.to_text(hashes.sha256(strng.to_bin(p.Payload), hexdigest=True))
+        results.append((path, 'ok', expected_hash, file_hash, payload_hash, len(data)))
+    return results
+
+
+def apply_results(results, customers_dir=None):
+    """
+    Stores results of the ``check_pieces()`` call in the manifest and erases corrupted files.
+    Pieces which were re-written by the customer in the meantime are skipped.
+    Returns list of paths of removed corrupted pieces.
+    """
+    corrupted = []
+    if db() is None:
+        return corrupted
+    now = int(time.time())
+    for path, status, expected_hash, file_hash, payload_hash, size in results:
+        row = db().execute('SELECT file_hash FROM pieces WHERE path=?', (path, )).fetchone()
+        if row is None or row[0] != expected_hash:
+            continue
+        if status == 'ok':
+            db().execute(
+                'UPDATE pieces SET checked_time=?, size=?, file_hash=?, payload_hash=COALESCE(?, payload_hash) WHERE path=?',
+                (now, size, file_hash, payload_hash, path),
+            )
+            continue
+        db().execute('DELETE FROM pieces WHERE path=?', (path, ))
+        if status == 'corrupted':
+            filepath = full_path(path, customers_dir)
+            try:
+                os.remove(filepath)  # if it is no good it is of no use to anyone
+            except:
+                lg.exc()
+            corrupted.append(path)
+    db().commit()
+    if corrupted:
+        lg.warn('found and removed %d corrupted pieces: %r' % (len(corrupted), corrupted))
+    if _Debug:
+        lg.args(_DebugLevel, checked=len(results), corrupted=len(corrupted))
+    return corrupted
+
+
+#------------------------------------------------------------------------------
+
+
+def version_pieces(version_dir, customers_dir=None):
+    """
+    Returns sorted list of ``(piece_name, payload_hash)`` tuples of all known pieces of given backup version.
+    Pieces are sorted by block number, supplier position and "Data" goes before "Parity".
+    """
+    if db() is None:
+        return []
+    prefix = relative_path(version_dir, customers_dir)
+    result = []
+    for path, payload_hash in db().execute('SELECT path, payload_hash FROM pieces WHERE path>? AND path<?', (prefix + '/', prefix + '0')):
+        piece_name = path[len(prefix) + 1:]
+        if not packetid.IsPacketNameCorrect(piece_name):
+            continue
+        block_num, supplier_num, data_or_parity = piece_name.split('-')
+        result.append(((int(block_num), int(supplier_num), data_or_parity), piece_name, payload_hash))
+    result.sort()
+    return [(piece_name, payload_hash) for _, piece_name, payload_hash in result]
+
+
+def version_merkle_root(version_dir, customers_dir=None):
+    """
+    Builds a Merkle root of the payload hashes of all verified pieces of given backup version.
+    Returns tuple ``(merkle_root, pieces, unverified)``, both lists contain piece names.
+    Pieces in "unverified" list were discovered on the disk, but not yet checked by the scrubber.
+    """
+    leaves = []
+    pieces = []
+    unverified = []
+    for piece_name, payload_hash in version_pieces(version_dir, customers_dir):
+        if not payload_hash:
+            unverified.append(piece_name)
+            continue
+        pieces.append(piece_name)
+        leaves.append(binascii.unhexlify(payload_hash))
+    return hashes.merkle_root(leaves), pieces, unverified
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Compares one full validation pass over all stored pieces (how ``bptester.Validate()`` works)
+    with one incremental scrubbing pass limited by the default I/O budget.
+    """
+    import shutil
+    import tempfile
+    from bitdust.crypt import rsa_key
+    pieces_count = 200
+    piece_size = 1024*1024
+    tmp_dir = tempfile.mkdtemp()
+    customers_dir = os.path.join(tmp_dir, 'customers')
+    open_db(os.path.join(tmp_dir, 'pieces.db'))
+    signing_key = rsa_key.RSAKey()
+    signing_key.generate(2048)
+    pieces = []
+    for i in range(pieces_count):
+        filepath = os.path.join(customers_dir, 'alice@127.0.0.1_8084', 'master', '0', 'F20230101010101AM', '%d-0-Data' % i)
+        payload = os.urandom(piece_size)
+        signature = strng.to_bin(signing_key.sign(hashes.sha1(payload)))
+        file_data = payload + signature
+        if not os.path.isdir(os.path.dirname(filepath)):
+            bpio._dirs_make(os.path.dirname(filepath))
+        bpio.WriteBinaryFile(filepath, file_data)
+        record_piece(filepath, file_data, payload, customers_dir)
+        pieces.append((filepath, len(signature)))
+    t = time.time()
+    bytes_read = 0
+    for filepath, signature_size in pieces:
+        data = bpio.ReadBinaryFile(filepath)
+        bytes_read += len(data)
+        signing_key.verify(data[-signature_size:], hashes.sha1(data[:-signature_size]))
+    full_pass = time.time() - t
+    print('full validation: %d pieces, %d bytes read in %.3f sec' % (len(pieces), bytes_read, full_pass))
+    t = time.time()
+    batch = pieces_to_check(settings.DefaultScrubBudgetBytes())
+    results = check_pieces(batch, customers_dir)
+    apply_results(results, customers_dir)
+    incremental_pass = time.time() - t
+    print('incremental scrubbing: %d pieces, %d bytes read in %.3f sec' % (len(results), sum(r[5] for r in results), incremental_pass))
+    print('Merkle root of the version: %s' % version_merkle_root(os.path.dirname(pieces[0][0]), customers_dir)[0])
+    # small pieces of another customer were written by previous version, so the manifest does not know them yet
+    for i in range(20000):
+        filepath = os.path.join(customers_dir, 'bob@127.0.0.1_8084', 'master', '0', 'F20230101010101AM', '%d-1-Data' % i)
+        if not os.path.isdir(os.path.dirname(filepath)):
+            bpio._dirs_make(os.path.dirname(filepath))
+        bpio.WriteBinaryFile(filepath, b'x'*1024)
+    t = time.time()
+    reconcile(*compare_pieces(customers_dir), started_time=int(time.time()))
+    print('reconcile with the disk: %d pieces in %.3f sec' % (count(), time.time() - t))
+    t = time.time()
+    scanned_bytes = bpio.getDirectorySize(customers_dir)
+    scan_time = time.time() - t
+    t = time.time()
+    ledger_bytes = sum(used_bytes for used_bytes, _ in customers_usage().values())
+    ledger_time = time.time() - t
+    print('used space: %d bytes from folder scan in %.4f sec, %d bytes from the ledger in %.4f sec' % (scanned_bytes, scan_time, ledger_bytes, ledger_time))
+    close_db()
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,17 +34,28 @@ Statistics are saved on the user's disk in the
 folders /bandin and /bandout in the BitDust local data dir.
 This is a daily stats - a single file for every day.
 
-THIS MODULE IS CURRENTLY DISABLED
+Counting a packet does not touch the disk: every peer has in-memory counters
+in fixed time slots - per minute for the last few hours and per day for the last month.
+Daily totals are written to the disk by a timer.
 
+Use ``bytes_received()``, ``bytes_sent()``, ``throughput_in()`` and ``throughput_out()``
+to check how much traffic was exchanged with given peer during any period of time.
 """
 
 from __future__ import absolute_import
 import os
 import time
+import array
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
 
 #------------------------------------------------------------------------------
 
 from twisted.internet import reactor  # @UnresolvedImport
+from twisted.internet import task  # @UnresolvedImport
 
 #------------------------------------------------------------------------------
 
@@ -57,6 +68,7 @@ from bitdust.p2p import commands
 from bitdust.system import bpio
 
 from bitdust.lib import misc
+from bitdust.lib import strng
 
 from bitdust.main import settings
 
@@ -64,40 +76,145 @@ from bitdust.userid import id_url
 
 #------------------------------------------------------------------------------
 
+FLUSH_INTERVAL = 60
+MINUTE_SLOTS = 3*60
+DAY_SLOTS = 31
+
+#------------------------------------------------------------------------------
+
 BandInDict = {}
 BandOutDict = {}
-CountTimeIn = 0
-CountTimeOut = 0
+
+_TrafficIn = {}
+_TrafficOut = {}
+_CurrentDay = None
+_NextDayStarts = 0
+_ChangedIN = False
+_ChangedOUT = False
+_FlushTask = None
+_ShutdownTrigger = None
+
+#------------------------------------------------------------------------------
+
+
+class RingCounter(object):
+
+    """
+    Fixed number of time slots of same length.
+    The oldest slot is re-used when the time goes forward, so no need to clean up anything.
+    """
+
+    __slots__ = ('slot_length', 'slots_count', 'slots', 'values')
+
+    def __init__(self, slot_length, slots_count):
+        self.slot_length = slot_length
+        self.slots_count = slots_count
+        self.slots = array.array('q', [-1]*slots_count)
+        self.values = array.array('q', [0]*slots_count)
+
+    def add(self, value, now):
+        slot = int(now//self.slot_length)
+        pos = slot % self.slots_count
+        if self.slots[pos] != slot:
+            self.slots[pos] = slot
+            self.values[pos] = 0
+        self.values[pos] += value
+
+    def covers(self, window):
+        return window <= self.slot_length*(self.slots_count - 1)
+
+    def total(self, start, end):
+        """
+        Sum of the values in between ``start`` and ``end`` moments.
+        The first slot is counted partially, proportionally to its part inside of the period.
+        """
+        if end < start:
+            return 0
+        first = int(start//self.slot_length)
+        last = int(end//self.slot_length)
+        if last - first >= self.slots_count:
+            first = last - self.slots_count + 1
+            start = first*self.slot_length
+        result = 0.0
+        for slot in range(first, last + 1):
+            pos = slot % self.slots_count
+            if self.slots[pos] != slot:
+                continue
+            if slot == first:
+                result += self.values[pos]*(((first + 1)*self.slot_length - start)/float(self.slot_length))
+            else:
+                result += self.values[pos]
+        return int(result)
+
+
+class PeerTraffic(object):
+
+    """
+    Traffic counters of a single peer in one direction.
+    """
+
+    __slots__ = ('total_bytes', 'total_packets', 'last_time', 'minutes', 'days')
+
+    def __init__(self):
+        self.total_bytes = 0
+        self.total_packets = 0
+        self.last_time = 0
+        self.minutes = RingCounter(60, MINUTE_SLOTS)
+        self.days = RingCounter(24*60*60, DAY_SLOTS)
+
+    def add(self, size, now):
+        self.total_bytes += size
+        self.total_packets += 1
+        self.last_time = now
+        self.minutes.add(size, now)
+        self.days.add(size, now)
+
+    def bytes_in_window(self, window, now):
+        if self.minutes.covers(window):
+            return self.minutes.total(now - window, now)
+        return self.days.total(now - window, now)
+
 
 #------------------------------------------------------------------------------
 
 
 def init():
     """
-    Got a filename for today, check if already exists, read today file, start
-    counting.
+    Read today's stats and history of few last days from the disk, start counting.
     """
-    global CountTimeIn
-    global CountTimeOut
+    global _FlushTask
+    global _ShutdownTrigger
     lg.out(4, 'bandwidth.init')
-    fin = filenameIN()
-    fout = filenameOUT()
-    if not os.path.isfile(fin):
-        bpio.WriteTextFile(fin, '')
-    if not os.path.isfile(fout):
-        bpio.WriteTextFile(fout, '')
+    for dirpath in (settings.BandwidthInDir(), settings.BandwidthOutDir()):
+        if not os.path.isdir(dirpath):
+            bpio._dirs_make(dirpath)
+    _start_day(time.time())
     read_bandwidthIN()
     read_bandwidthOUT()
-    CountTimeIn = time.time()
-    CountTimeOut = time.time()
-    reactor.addSystemEventTrigger('before', 'shutdown', save)  # @UndefinedVariable
+    read_history()
+    _FlushTask = task.LoopingCall(flush)
+    _FlushTask.start(FLUSH_INTERVAL, now=False)
+    _ShutdownTrigger = reactor.addSystemEventTrigger('before', 'shutdown', save)  # @UndefinedVariable
 
 
 def shutdown():
     """
-
+    Stop the timer and write stats to the disk.
     """
+    global _FlushTask
+    global _ShutdownTrigger
     lg.out(4, 'bandwidth.shutdown')
+    if _FlushTask:
+        if _FlushTask.running:
+            _FlushTask.stop()
+        _FlushTask = None
+    if _ShutdownTrigger:
+        reactor.removeSystemEventTrigger(_ShutdownTrigger)  # @UndefinedVariable
+        _ShutdownTrigger = None
+        save()
+    clear()
+    _TrafficIn.clear()
+    _TrafficOut.clear()
 
 
 def filenameIN(basename=None):
@@ -123,18 +240,31 @@ def save():
     Writes today stats on disk.
     """
     lg.out(6, 'bandwidth.save')
-    bpio._write_dict(filenameIN(), getBandwidthIN())
-    bpio._write_dict(filenameOUT(), getBandwidthOUT())
+    saveIN()
+    saveOUT()
+
+
+def flush():
+    """
+    Writes today stats on disk, only if something was counted since last time.
+    Called by the timer every ``FLUSH_INTERVAL`` seconds.
+    """
+    if _ChangedIN:
+        saveIN()
+    if _ChangedOUT:
+        saveOUT()
 
 
 def saveIN(basename=None):
     """
     Writes incoming stats for today on disk.
     """
+    global _ChangedIN
     if basename is None:
-        basename = misc.gmtime2str('%d%m%y')
+        basename = _day_basename(_CurrentDay)
     ret = os.path.isfile(filenameIN(basename))
     bpio._write_dict(filenameIN(basename), getBandwidthIN())
+    _ChangedIN = False
     if not ret:
         lg.out(4, 'bandwidth.saveIN to new file ' + basename)
     else:
@@ -146,10 +276,12 @@ def saveOUT(basename=None):
     """
     Writes outgoing stats for today on disk.
     """
+    global _ChangedOUT
     if basename is None:
-        basename = misc.gmtime2str('%d%m%y')
+        basename = _day_basename(_CurrentDay)
     ret = os.path.isfile(filenameOUT(basename))
     bpio._write_dict(filenameOUT(basename), getBandwidthOUT())
+    _ChangedOUT = False
     if not ret:
         lg.out(4, 'bandwidth.saveOUT to new file ' + basename)
     else:
@@ -177,6 +309,26 @@ def read_bandwidthOUT():
         BandOutDict[idurl] = int(bytesout)
 
 
+def read_history():
+    """
+    Fills daily counters of every peer from the files saved during last ``DAY_SLOTS`` days.
+    """
+    today = int(time.time()//(24*60*60))
+    for day in range(today - DAY_SLOTS + 1, today + 1):
+        basename = _day_basename(day)
+        for filename, traffic in ((filenameIN(basename), _TrafficIn), (filenameOUT(basename), _TrafficOut)):
+            for fname in (filename, filename + '.sent'):
+                if not os.path.isfile(fname):
+                    continue
+                for idurl, value in bpio._read_dict(fname, {}).items():
+                    try:
+                        value = int(value)
+                    except:
+                        continue
+                    _peer(traffic, idurl).days.add(value, day*24*60*60)
+                break
+
+
 def clear_bandwidthIN():
     """
     Erase all incoming stats from memory.
@@ -282,21 +434,14 @@ def IN(idurl, size):
     ``size`` - how many incoming bytes received from user with ``idurl``.
     Typically called when incoming packet arrives.
     """
-    global BandInDict
-    global CountTimeIn
-    if not isExistIN():
-        currentFileName = time.strftime('%d%m%y', time.localtime(CountTimeIn))
-        if currentFileName != misc.gmtime2str('%d%m%y'):
-            saveIN(currentFileName)
-            clear_bandwidthIN()
-            CountTimeIn = time.time()
-    currentV = int(BandInDict.get(idurl, 0))
-    newV = currentV + size
-    BandInDict[idurl] = newV
-    curMB = int(currentV/(1024.0*1024.0))
-    newMB = int(newV/(1024.0*1024.0))
-    if curMB == 0 or curMB != newMB:
-        saveIN()
+    global _ChangedIN
+    now = time.time()
+    if now >= _NextDayStarts:
+        _start_day(now)
+    idurl = strng.to_text(idurl)
+    BandInDict[idurl] = BandInDict.get(idurl, 0) + size
+    _peer(_TrafficIn, idurl).add(size, now)
+    _ChangedIN = True
 
 
 def OUT(idurl, size):
@@ -306,21 +451,14 @@ def OUT(idurl, size):
     ``size`` - how many bytes sent to user with ``idurl``.
     Typically called when outgoing packet were sent.
     """
-    global BandOutDict
-    global CountTimeOut
-    if not isExistOUT():
-        currentFileName = time.strftime('%d%m%y', time.localtime(CountTimeOut))
-        if currentFileName != misc.gmtime2str('%d%m%y'):
-            saveOUT(currentFileName)
-            clear_bandwidthOUT()
-            CountTimeOut = time.time()
-    currentV = int(BandOutDict.get(idurl, 0))
-    newV = currentV + size
-    BandOutDict[idurl] = newV
-    curMB = int(currentV/(1024.0*1024.0))
-    newMB = int(newV/(1024.0*1024.0))
-    if curMB == 0 or curMB != newMB:
-        saveOUT()
+    global _ChangedOUT
+    now = time.time()
+    if now >= _NextDayStarts:
+        _start_day(now)
+    idurl = strng.to_text(idurl)
+    BandOutDict[idurl] = BandOutDict.get(idurl, 0) + size
+    _peer(_TrafficOut, idurl).add(size, now)
+    _ChangedOUT = True
 
 
 def INfile(newpacket, pkt_in, status, error_message):
@@ -353,3 +491,167 @@ def OUTfile(pkt_out, item, status, size, error_message):
         OUT(pkt_out.remote_idurl, pkt_out.filesize)
     # OUT(workitem.remoteid, workitem.payloadsize)
     return False
+
+
+#------------------------------------------------------------------------------
+
+
+def bytes_received(idurl, window=60*60, now=None):
+    """
+    How many bytes were received from given user during last ``window`` seconds.
+    Windows longer than ``MINUTE_SLOTS`` minutes are counted with a precision of one day.
+    """
+    traffic = _TrafficIn.get(strng.to_text(idurl))
+    if not traffic:
+        return 0
+    return traffic.bytes_in_window(window, now or time.time())
+
+
+def bytes_sent(idurl, window=60*60, now=None):
+    """
+    How many bytes were sent to given user during last ``window`` seconds.
+    """
+    traffic = _TrafficOut.get(strng.to_text(idurl))
+    if not traffic:
+        return 0
+    return traffic.bytes_in_window(window, now or time.time())
+
+
+def throughput_in(idurl, window=60*60, now=None):
+    """
+    Average incoming traffic from given user in bytes per second during last ``window`` seconds.
+    """
+    return bytes_received(idurl, window, now)/float(window)
+
+
+def throughput_out(idurl, window=60*60, now=None):
+    """
+    Average outgoing traffic to given user in bytes per second during last ``window`` seconds.
+    """
+    return bytes_sent(idurl, window, now)/float(window)
+
+
+def last_received_time(idurl):
+    """
+    When the last packet from given user was counted, 0 if nothing received since the start.
+    """
+    traffic = _TrafficIn.get(strng.to_text(idurl))
+    return traffic.last_time if traffic else 0
+
+
+def last_sent_time(idurl):
+    """
+    When the last packet to given user was counted, 0 if nothing sent since the start.
+    """
+    traffic = _TrafficOut.get(strng.to_text(idurl))
+    return traffic.last_time if traffic else 0
+
+
+def peers_stats(window=60*60, now=None):
+    """
+    Returns traffic of every known peer during last ``window`` seconds.
+    """
+    now = now or time.time()
+    result = {}
+    for direction, traffic_dict in (('in', _TrafficIn), ('out', _TrafficOut)):
+        for idurl, traffic in traffic_dict.items():
+            if idurl not in result:
+                result[idurl] = {
+                    'bytes_in': 0,
+                    'bytes_out': 0,
+                    'bps_in': 0.0,
+                    'bps_out': 0.0,
+                    'last_in': 0,
+                    'last_out': 0,
+                }
+            value = traffic.bytes_in_window(window, now)
+            result[idurl]['bytes_' + direction] = value
+            result[idurl]['bps_' + direction] = value/float(window)
+            result[idurl]['last_' + direction] = traffic.last_time
+    return result
+
+
+#------------------------------------------------------------------------------
+
+
+def _peer(traffic_dict, idurl):
+    traffic = traffic_dict.get(idurl)
+    if traffic is None:
+        traffic = traffic_dict[idurl] = PeerTraffic()
+    return traffic
+
+
+def _day_basename(day):
+    return time.strftime('%d%m%y', time.gmtime(day*24*60*60))
+
+
+def _start_day(now):
+    """
+    Called when the first packet of a new day is counted: stats of the previous day are written to its own file.
+    """
+    global _CurrentDay
+    global _NextDayStarts
+    today = int(now//(24*60*60))
+    if _CurrentDay is not None and _CurrentDay != today:
+        if _ChangedIN or BandInDict:
+            saveIN()
+        if _ChangedOUT or BandOutDict:
+            saveOUT()
+        clear()
+    _CurrentDay = today
+    _NextDayStarts = (today + 1)*24*60*60
+    if _Debug:
+        lg.args(_DebugLevel, day=_day_basename(today))
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Counts 200000 incoming packets from 50 peers.
+    Previous way of counting is reproduced here as well: checking existence of today's file and
+    writing whole daily stats to the disk every time a counter of one peer crosses a megabyte boundary.
+    """
+    import random
+    import shutil
+    import tempfile
+    temp_dir = tempfile.mkdtemp(prefix='bandwidth_')
+    peers = ['http://127.0.0.1:8084/peer%d.xml' % i for i in range(50)]
+    packets = [(random.choice(peers), random.randint(100, 64*1024)) for _ in range(200000)]
+    total_size = sum(size for _, size in packets)
+
+    # previous implementation
+    counters = {}
+    t = time.time()
+    for idurl, size in packets:
+        filename = os.path.join(temp_dir, misc.gmtime2str('%d%m%y'))
+        os.path.isfile(filename)
+        current_value = int(counters.get(idurl, 0))
+        new_value = current_value + size
+        counters[idurl] = new_value
+        current_mb = int(current_value/(1024.0*1024.0))
+        if current_mb == 0 or current_mb != int(new_value/(1024.0*1024.0)):
+            bpio._write_dict(filename, counters)
+    previous_time = time.time() - t
+
+    # in-memory counters
+    t = time.time()
+    for idurl, size in packets:
+        IN(idurl, size)
+    counting_time = time.time() - t
+    t = time.time()
+    for idurl in peers:
+        throughput_in(idurl, window=5*60)
+        throughput_in(idurl, window=7*24*60*60)
+    query_time = time.time() - t
+    print('%d packets, %d MB from %d peers' % (len(packets), total_size//(1024*1024), len(peers)))
+    print('    check file and write at every megabyte:  %.3f sec, %.2f usec per packet' % (previous_time, previous_time*1000000.0/len(packets)))
+    print('    in-memory time slots:                    %.3f sec, %.2f usec per packet' % (counting_time, counting_time*1000000.0/len(packets)))
+    print('    throughput of one peer for 5 minutes and for 7 days:  %.2f usec' % (query_time*1000000.0/len(peers)))
+    print('    counted correctly: %r' % (sum(bytes_received(idurl) for idurl in peers) == total_size))
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -58,7 +58,6 @@ EVENTS:
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
-from io import BytesIO
 
 #------------------------------------------------------------------------------
 
@@ -89,9 +88,7 @@ from bitdust.automats import automat
 from bitdust.main import config
 from bitdust.main import settings
 
-from bitdust.crypt import key
 from bitdust.crypt import signed
-from bitdust.crypt import encrypted
 
 from bitdust.p2p import commands
 from bitdust.p2p import lookup
@@ -107,6 +104,7 @@ from bitdust.transport import packet_out
 
 from bitdust.transport import gateway
 from bitdust.transport.proxy import proxy_interface
+from bitdust.transport.proxy import relay_channel
 
 from bitdust.userid import identity
 from bitdust.userid import global_id
@@ -148,6 +146,13 @@ def GetRouterProtoHost():
     return _ProxyReceiver.router_proto_host
 
 
+def IsRelayChannelEnabled():
+    global _ProxyReceiver
+    if not _ProxyReceiver:
+        return False
+    return _ProxyReceiver.router_relay_channel
+
+
 def ReadMyOriginalIdentitySource():
     return config.conf().getData('services/proxy-transport/my-original-identity').strip()
 
@@ -223,6 +228,7 @@ class ProxyReceiver(automat.Automat):
         self.request_service_packet_id = []
         self.latest_packet_received = 0
         self.router_connection_info = None
+        self.router_relay_channel = False
         self.traffic_in = 0
         super(ProxyReceiver, self).__init__(
             name='proxy_receiver',
@@ -411,6 +417,7 @@ class ProxyReceiver(automat.Automat):
         self.router_id = global_id.idurl2glob(self.router_idurl)
         self.router_identity = None
         self.router_proto_host = None
+        self.router_relay_channel = False
         if _Debug:
             lg.out(_DebugLevel, 'proxy_receiver.doRememberNode %r' % self.router_idurl)
 
@@ -546,6 +553,8 @@ class ProxyReceiver(automat.Automat):
         self.router_proto_host = None
         self.request_service_packet_id = []
         self.router_connection_info = None
+        self.router_relay_channel = False
+        relay_channel.clear()
         my_id.rebuildLocalIdentity()
 
     def doUpdateRouterID(self, *args, **kwargs):
@@ -622,6 +631,7 @@ class ProxyReceiver(automat.Automat):
         self.request_service_packet_id = []
         self.latest_packet_received = 0
         self.router_connection_info = None
+        self.router_relay_channel = False
         self.traffic_in = 0
         self.destroy()
         del _ProxyReceiver
@@ -629,24 +639,14 @@ class ProxyReceiver(automat.Automat):
 
     def _do_process_inbox_packet(self, *args, **kwargs):
         newpacket, info, _, _ = args[0]
-        block = encrypted.Unserialize(newpacket.Payload)
-        if block is None:
-            lg.err('reading data from %s' % newpacket.CreatorID)
-            return
         try:
-            session_key = key.DecryptLocalPrivateKey(block.EncryptedSessionKey)
-            padded_data = key.DecryptWithSessionKey(session_key, block.EncryptedData, session_key_type=block.SessionKeyType)
-            inpt = BytesIO(padded_data[:int(block.Length)])
-            data = inpt.read()
+            data = relay_channel.decrypt(newpacket.Payload, newpacket.CreatorID)
         except:
-            lg.err('reading data from %s' % newpacket.CreatorID)
             lg.exc()
-            try:
-                inpt.close()
-            except:
-                pass
+            data = None
+        if data is None:
+            lg.err('reading data from %s' % newpacket.CreatorID)
             return
-        inpt.close()
 
         if newpacket.Command == commands.RelayAck():
             try:
@@ -736,11 +736,7 @@ class ProxyReceiver(automat.Automat):
 
         self.traffic_in += len(data)
         packet_in.process(routed_packet, info)
-        del block
         del data
-        del padded_data
-        del inpt
-        del session_key
         del routed_packet
 
     def _do_send_identity_to_router(self, identity_source, failed_event):
@@ -786,6 +782,7 @@ class ProxyReceiver(automat.Automat):
             'name': 'service_proxy_server',
             'payload': {
                 'identity': orig_identity,
+                'relay_channel': True,
             },
         }
         newpacket = signed.Packet(
@@ -870,6 +867,7 @@ class ProxyReceiver(automat.Automat):
         if service_ack_info.startswith('rejected'):
             self.automat('service-refused', (response, info))
             return
+        self.router_relay_channel = 'relay-channel' in service_ack_info.split(' ')
         active_router_sessions = gateway.find_active_session(info.proto, host=info.host)
         if not active_router_sessions:
             active_router_sessions = gateway.find_active_session(info.proto, idurl=id_url.to_bin(response.CreatorID))
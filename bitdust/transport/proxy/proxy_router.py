@@ -53,7 +53,6 @@ EVENTS:
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
-from io import BytesIO
 
 #------------------------------------------------------------------------------
 
@@ -104,6 +103,8 @@ from bitdust.transport import packet_out
 from bitdust.transport import packet_in
 from bitdust.transport import gateway
 
+from bitdust.transport.proxy import relay_channel
+
 from bitdust.p2p import p2p_service
 from bitdust.p2p import commands
 from bitdust.p2p import network_connector
@@ -435,6 +436,7 @@ class ProxyRouter(automat.Automat):
                 else:
                     oldnew = 'OLD'
                 self._do_register_route(user_idurl, cached_ident)
+                self.routes[user_idurl.original()]['relay_channel'] = bool(json_payload.get('relay_channel'))
                 active_user_sessions = gateway.find_active_session(info.proto, info.host)
                 if not active_user_sessions:
                     active_user_sessions = gateway.find_active_session(info.proto, idurl=user_idurl.original())
@@ -463,7 +465,7 @@ class ProxyRouter(automat.Automat):
                     if _Debug:
                         lg.dbg(_DebugLevel, 'active connection with user %s at %s:%s not yet exist' % (user_idurl.original(), info.proto, info.host))
                         lg.dbg(_DebugLevel, 'current active sessions: %d' % len(gateway.list_active_sessions(info.proto)))
-                out_ack = p2p_service.SendAck(request, 'accepted', wide=True)
+                out_ack = p2p_service.SendAck(request, 'accepted relay-channel' if json_payload.get('relay_channel') else 'accepted', wide=True)
                 self.acks[out_ack.PacketID] = out_ack.RemoteID
                 if _Debug:
                     lg.out(_DebugLevel, 'proxy_server.doProcessRequest !!!!!!! ACCEPTED %s ROUTE for %r  contacts=%s' % (oldnew.upper(), user_idurl, self.routes.get(user_idurl.original(), {}).get('contacts')))
@@ -616,18 +618,13 @@ class ProxyRouter(automat.Automat):
         newpacket, info = outpacket_info_tuple
         if _Debug:
             lg.args(_DebugLevel, newpacket=newpacket, info=info)
-        block = encrypted.Unserialize(newpacket.Payload)
-        if block is None:
+        raw_data = relay_channel.decrypt(newpacket.Payload, newpacket.CreatorID)
+        if raw_data is None:
             lg.err('failed reading data from %s' % newpacket.RemoteID)
             return
-        inpt = None
         try:
-            session_key = key.DecryptLocalPrivateKey(block.EncryptedSessionKey)
-            padded_data = key.DecryptWithSessionKey(session_key, block.EncryptedData, session_key_type=block.SessionKeyType)
-            inpt = BytesIO(padded_data[:int(block.Length)])
-            # see proxy_sender.ProxySender : _on_first_outbox_packet() for sending part
-            json_payload = serialization.BytesToDict(inpt.read(), keys_to_text=True)
-            inpt.close()
+            # see proxy_sender.ProxySender : _do_send_packet_to_router() for sending part
+            json_payload = serialization.BytesToDict(raw_data, keys_to_text=True)
             sender_idurl = strng.to_bin(json_payload['f'])  # from
             receiver_idurl = strng.to_bin(json_payload['t'])  # to
             wide = json_payload['w']  # wide
@@ -638,15 +635,8 @@ class ProxyRouter(automat.Automat):
         except:
             lg.err('failed reading data from %s' % newpacket.RemoteID)
             lg.exc()
-            try:
-                inpt.close()
-            except:
-                pass
             return
-        del session_key
-        del padded_data
-        del inpt
-        del block
+        del raw_data
         if identitycache.HasKey(sender_idurl) and identitycache.HasKey(receiver_idurl) and not is_retry:
             return self._do_verify_routed_data(newpacket, info, sender_idurl, receiver_idurl, routed_data, wide, response_timeout, keep_alive, is_retry)
         lg.warn('will send routed data after caching, is_retry=%s sender_idurl=%r receiver_idurl=%r' % (is_retry, sender_idurl, receiver_idurl))
@@ -870,17 +860,24 @@ class ProxyRouter(automat.Automat):
     def _do_send_relay_packet(self, relay_cmd, inbox_packet, data, publickey, receiver_idurl, receiver_proto=None, receiver_host=None, failed_callback=None, error=None):
         if _Debug:
             lg.args(_DebugLevel, relay_cmd=relay_cmd, inbox_packet=inbox_packet, receiver_idurl=receiver_idurl, receiver_proto=receiver_proto, receiver_host=receiver_host)
-        block = encrypted.Block(
-            CreatorID=my_id.getIDURL(),
-            BackupID='routed incoming data',
-            BlockNumber=0,
-            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
-            SessionKeyType=key.SessionKeyType(),
-            LastBlock=True,
-            Data=data,
-            EncryptKey=lambda inp: key.EncryptOpenSSHPublicKey(publickey, inp),
-        )
-        raw_data = block.Serialize()
+        receiver_idurl = id_url.field(receiver_idurl)
+        route_info = self.routes.get(receiver_idurl.original(), None) or self.routes.get(receiver_idurl.to_bin(), None) or {}
+        if route_info.get('relay_channel'):
+            # routed user supports symmetric channel keys, RSA is used only when channel key is rotated
+            block = None
+            raw_data = relay_channel.encrypt(receiver_idurl.to_bin(), publickey, data)
+        else:
+            block = encrypted.Block(
+                CreatorID=my_id.getIDURL(),
+                BackupID='routed incoming data',
+                BlockNumber=0,
+                SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
+                SessionKeyType=key.SessionKeyType(),
+                LastBlock=True,
+                Data=data,
+                EncryptKey=lambda inp: key.EncryptOpenSSHPublicKey(publickey, inp),
+            )
+            raw_data = block.Serialize()
         routed_packet = signed.Packet(
             Command=relay_cmd,
             OwnerID=inbox_packet.OwnerID,
@@ -980,6 +977,7 @@ class ProxyRouter(automat.Automat):
         self.routes.pop(idurl.to_bin(), None)
         self.closed_routes[idurl.original()] = time.time()
         self.closed_routes[idurl.to_bin()] = time.time()
+        relay_channel.close_channel(idurl.to_bin())
         lg.admin('removed route for %r' % idurl.original())
 
     def _on_routed_in_packet_failed(self, pkt_out, msg, newpacket, info, receiver_idurl):
@@ -91,6 +91,7 @@ from bitdust.transport import callback
 from bitdust.transport import packet_out
 
 from bitdust.transport.proxy import proxy_receiver
+from bitdust.transport.proxy import relay_channel
 
 from bitdust.userid import id_url
 from bitdust.userid import global_id
@@ -351,17 +352,22 @@ class ProxySender(automat.Automat):
         if not json_payload['t']:
             raise ValueError('receiver idurl was not set')
         raw_bytes = serialization.DictToBytes(json_payload)
-        block = encrypted.Block(
-            CreatorID=my_id.getIDURL(),
-            BackupID='routed outgoing data',
-            BlockNumber=0,
-            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
-            SessionKeyType=key.SessionKeyType(),
-            LastBlock=True,
-            Data=raw_bytes,
-            EncryptKey=lambda inp: key.EncryptOpenSSHPublicKey(publickey, inp),
-        )
-        block_encrypted = block.Serialize()
+        if proxy_receiver.IsRelayChannelEnabled():
+            # router supports symmetric channel keys, RSA is used only when channel key is rotated
+            block = None
+            block_encrypted = relay_channel.encrypt(router_idurl.to_bin(), publickey, raw_bytes)
+        else:
+            block = encrypted.Block(
+                CreatorID=my_id.getIDURL(),
+                BackupID='routed outgoing data',
+                BlockNumber=0,
+                SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
+                SessionKeyType=key.SessionKeyType(),
+                LastBlock=True,
+                Data=raw_bytes,
+                EncryptKey=lambda inp: key.EncryptOpenSSHPublicKey(publickey, inp),
+            )
+            block_encrypted = block.Serialize()
         newpacket = signed.Packet(
             Command=commands.RelayOut(),
             OwnerID=outpacket.OwnerID,
@@ -0,0 +1,354 @@
+#!/usr/bin/python
+# relay_channel.py
+#
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (relay_channel.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+"""
+.. module:: relay_channel.
+
+Symmetric "channel" keys for the traffic relayed via proxy router.
+
+Before that every routed packet was wrapped into a fresh ``encrypted.Block``:
+a new random session key was encrypted with RSA for the remote side and the block
+was signed with our private key, then on the other side the session key was
+decrypted with RSA private key again. For a node which is doing backups via proxy
+router that means two or more RSA private key operations for every relayed packet.
+
+Here a single channel key is generated for every remote node and wrapped with RSA
+only once. The same wrapped key is attached to every packet in the channel, so the
+receiving side can decrypt it only once and then keep it in memory.
+Every packet is then encrypted with the channel key and authenticated with HMAC-SHA256.
+Sequence number of the packet is covered by HMAC, receiving side keeps a window of recent
+sequence numbers for every channel and rejects packets which were already seen.
+Channel key is rotated after some time or after given amount of bytes were sent.
+
+The outer ``signed.Packet`` is still signed as usual, so the sender is authenticated
+exactly the same way as before.
+
+Both sides must support that format, this is negotiated when proxy route is established:
+see ``proxy_receiver._do_send_request_service()`` and ``proxy_router._do_process_request()``.
+Old format made by ``encrypted.Block`` is still accepted by ``decrypt()``.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 18
+
+#------------------------------------------------------------------------------
+
+import time
+import hmac
+import base64
+import hashlib
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.lib import strng
+from bitdust.lib import serialization
+
+from bitdust.crypt import key
+from bitdust.crypt import hashes
+
+#------------------------------------------------------------------------------
+
+_ChannelVersion = 1
+_ChannelRotateSeconds = 60*30
+_ChannelRotateBytes = 1024*1024*512
+_MaxIncomingChannels = 2048
+_ReplayWindow = 256
+
+_OutgoingChannels = {}
+_IncomingChannels = {}
+
+_Counters = {
+    'channels_opened': 0,
+    'channels_accepted': 0,
+    'packets_encrypted': 0,
+    'packets_decrypted': 0,
+    'packets_legacy': 0,
+    'mac_failed': 0,
+    'replay_rejected': 0,
+}
+
+#------------------------------------------------------------------------------
+
+
+def clear():
+    """
+    Forget all known channel keys, new keys will be generated and negotiated again.
+    """
+    _OutgoingChannels.clear()
+    _IncomingChannels.clear()
+
+
+def close_channel(remote_idurl):
+    """
+    Forget outgoing channel key for given remote node, next packet will open a new channel.
+    """
+    return _OutgoingChannels.pop(strng.to_bin(remote_idurl), None) is not None
+
+
+def counters():
+    return dict(_Counters)
+
+
+#------------------------------------------------------------------------------
+
+
+def _mac_key(secret):
+    return hashes.sha256(secret + b'relay-channel-mac')
+
+
+def _mac(secret, channel_id, sequence, length, encrypted_data):
+    h = hmac.new(_mac_key(secret), digestmod=hashlib.sha256)
+    h.update(strng.to_bin(channel_id))
+    h.update(strng.to_bin('%d:%d:' % (sequence, length)))
+    h.update(strng.to_bin(encrypted_data))
+    return h.hexdigest()
+
+
+def _open_channel(remote_key, publickey, encrypt_key=None):
+    session_key_type = key.SessionKeyType()
+    secret = key.NewSessionKey(session_key_type=session_key_type)
+    if encrypt_key is None:
+        wrapped = key.EncryptOpenSSHPublicKey(publickey, secret)
+    else:
+        wrapped = encrypt_key(secret)
+    channel = {
+        'secret': secret,
+        'wrapped': strng.to_text(base64.b64encode(wrapped)),
+        'id': strng.to_text(hashes.sha256(wrapped, hexdigest=True)),
+        'type': session_key_type,
+        'publickey': publickey,
+        'created': time.time(),
+        'bytes': 0,
+        'sequence': 0,
+    }
+    _OutgoingChannels[remote_key] = channel
+    _Counters['channels_opened'] += 1
+    if _Debug:
+        lg.args(_DebugLevel, remote=remote_key, channel_id=channel['id'])
+    return channel
+
+
+def _get_outgoing_channel(remote_idurl, publickey, encrypt_key=None):
+    remote_key = strng.to_bin(remote_idurl)
+    channel = _OutgoingChannels.get(remote_key)
+    if channel:
+        if channel['publickey'] != publickey:
+            channel = None
+        elif time.time() - channel['created'] > _ChannelRotateSeconds:
+            channel = None
+        elif channel['bytes'] > _ChannelRotateBytes:
+            channel = None
+    if not channel:
+        channel = _open_channel(remote_key, publickey, encrypt_key=encrypt_key)
+    return channel
+
+
+def _accept_channel(sender_key, wrapped_text, channel_id, decrypt_key=None):
+    cache_key = (sender_key, channel_id)
+    channel = _IncomingChannels.get(cache_key)
+    if channel:
+        channel['used'] = time.time()
+        return channel
+    wrapped = base64.b64decode(strng.to_bin(wrapped_text))
+    if strng.to_text(hashes.sha256(wrapped, hexdigest=True)) != channel_id:
+        raise ValueError('channel id does not match to the channel key')
+    if decrypt_key is None:
+        secret = key.DecryptLocalPrivateKey(wrapped)
+    else:
+        secret = decrypt_key(wrapped)
+    if len(_IncomingChannels) >= _MaxIncomingChannels:
+        oldest = sorted(_IncomingChannels.items(), key=lambda i: i[1]['used'])
+        for old_key, _ in oldest[:len(oldest) - _MaxIncomingChannels + 1]:
+            _IncomingChannels.pop(old_key, None)
+    channel = {
+        'secret': secret,
+        'used': time.time(),
+        'highest': 0,
+        'seen': set(),
+    }
+    _IncomingChannels[cache_key] = channel
+    _Counters['channels_accepted'] += 1
+    if _Debug:
+        lg.args(_DebugLevel, sender=sender_key, channel_id=channel_id)
+    return channel
+
+
+#------------------------------------------------------------------------------
+
+
+def encrypt(remote_idurl, publickey, data, encrypt_key=None):
+    """
+    Encrypt ``data`` to be relayed to ``remote_idurl`` and return serialized payload.
+    Channel key is wrapped with ``publickey`` only when a new channel is opened.
+    """
+    channel = _get_outgoing_channel(remote_idurl, publickey, encrypt_key=encrypt_key)
+    channel['sequence'] += 1
+    encrypted_data = key.EncryptWithSessionKey(channel['secret'], data, session_key_type=channel['type'])
+    channel['bytes'] += len(data)
+    dct = {
+        'v': _ChannelVersion,
+        'c': channel['id'],
+        'k': channel['wrapped'],
+        't': channel['type'],
+        'n': channel['sequence'],
+        'l': len(data),
+        'p': encrypted_data,
+        'h': _mac(channel['secret'], channel['id'], channel['sequence'], len(data), encrypted_data),
+    }
+    _Counters['packets_encrypted'] += 1
+    return serialization.DictToBytes(dct, encoding='utf-8')
+
+
+def is_channel_payload(dct):
+    return 'v' in dct and 'h' in dct and 'c' in dct
+
+
+def _accept_sequence(channel, sequence):
+    """
+    Packets may arrive out of order, so a window of recent sequence numbers is kept for every incoming channel.
+    Returns False if that packet was already accepted or is too old to be checked.
+    """
+    if sequence <= 0 or sequence <= channel['highest'] - _ReplayWindow or sequence in channel['seen']:
+        return False
+    channel['seen'].add(sequence)
+    if sequence > channel['highest']:
+        channel['highest'] = sequence
+        lowest = sequence - _ReplayWindow
+        channel['seen'] = set(n for n in channel['seen'] if n > lowest)
+    return True
+
+
+def decrypt(payload, sender_idurl, decrypt_key=None):
+    """
+    Decrypt payload received from ``sender_idurl`` and return original data.
+    Accepts both channel payload made by ``encrypt()`` and legacy ``encrypted.Block``.
+    Returns None if payload can not be decrypted.
+    """
+    try:
+        dct = serialization.BytesToDict(payload, keys_to_text=True, encoding='utf-8')
+    except:
+        lg.exc()
+        return None
+    if not isinstance(dct, dict):
+        lg.warn('relayed packet from %r is not valid' % sender_idurl)
+        return None
+    if not is_channel_payload(dct):
+        return _decrypt_legacy(dct, decrypt_key=decrypt_key)
+    try:
+        channel_id = strng.to_text(dct['c'])
+        sequence = int(dct['n'])
+        length = int(dct['l'])
+        encrypted_data = strng.to_bin(dct['p'])
+        channel = _accept_channel(strng.to_bin(sender_idurl), dct['k'], channel_id, decrypt_key=decrypt_key)
+    except:
+        lg.exc()
+        return None
+    expected_mac = _mac(channel['secret'], channel_id, sequence, length, encrypted_data)
+    if not hmac.compare_digest(strng.to_text(dct['h']), expected_mac):
+        _Counters['mac_failed'] += 1
+        lg.warn('relayed packet from %r failed authentication in channel %r' % (sender_idurl, channel_id))
+        return None
+    if not _accept_sequence(channel, sequence):
+        _Counters['replay_rejected'] += 1
+        lg.warn('relayed packet from %r with sequence %d was rejected in channel %r' % (sender_idurl, sequence, channel_id))
+        return None
+    try:
+        padded_data = key.DecryptWithSessionKey(channel['secret'], encrypted_data, session_key_type=strng.to_text(dct['t']))
+    except:
+        lg.exc()
+        return None
+    _Counters['packets_decrypted'] += 1
+    return padded_data[:length]
+
+
+def _decrypt_legacy(dct, decrypt_key=None):
+    try:
+        encrypted_session_key = base64.b64decode(strng.to_bin(dct['k']))
+        if decrypt_key is None:
+            session_key = key.DecryptLocalPrivateKey(encrypted_session_key)
+        else:
+            session_key = decrypt_key(encrypted_session_key)
+        padded_data = key.DecryptWithSessionKey(session_key, dct['p'], session_key_type=strng.to_text(dct['t']))
+    except:
+        lg.exc()
+        return None
+    _Counters['packets_legacy'] += 1
+    return padded_data[:int(dct['l'])]
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Compares relayed throughput of the legacy ``encrypted.Block`` format and the channel format.
+    Router and sender are local stand-ins, each side owns its own RSA key.
+    """
+    from bitdust.crypt import rsa_key
+    sender_key = rsa_key.RSAKey()
+    sender_key.generate(2048)
+    router_key = rsa_key.RSAKey()
+    router_key.generate(2048)
+    router_publickey = router_key.toPublicString()
+    packets = 500
+    packet_size = 1024*16
+    data = b'x'*packet_size
+    # legacy: new session key + RSA encrypt + RSA sign on sender, RSA decrypt on router
+    dt = time.time()
+    for _ in range(packets):
+        session_key = key.NewSessionKey(session_key_type=key.SessionKeyType())
+        encrypted_data = key.EncryptWithSessionKey(session_key, data, session_key_type=key.SessionKeyType())
+        sender_key.sign(hashes.sha1(encrypted_data))
+        encrypted_session_key = key.EncryptOpenSSHPublicKey(router_publickey, session_key)
+        received_key = router_key.decrypt(encrypted_session_key)
+        key.DecryptWithSessionKey(received_key, encrypted_data, session_key_type=key.SessionKeyType())
+    legacy_time = time.time() - dt
+    # channel: RSA operations only when the channel is opened
+    clear()
+    dt = time.time()
+    for _ in range(packets):
+        payload = encrypt(b'router', router_publickey, data)
+        if decrypt(payload, b'sender', decrypt_key=router_key.decrypt) != data:
+            raise Exception('relay channel decrypt failed')
+    channel_time = time.time() - dt
+    total_mb = packets*packet_size/(1024.0*1024.0)
+    print('relayed %d packets of %d bytes' % (packets, packet_size))
+    print('    legacy:  %.3f sec, %.2f MB/sec' % (legacy_time, total_mb/legacy_time))
+    print('    channel: %.3f sec, %.2f MB/sec' % (channel_time, total_mb/channel_time))
+    print('    %r' % counters())
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,7 @@ _DebugLevel = 16
 
 import os
 import time
+import struct
 
 from twisted.protocols import basic  # @UnresolvedImport
 
@@ -441,10 +442,17 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
             addr = self.getTransportAddress()
         return net_misc.normalize_address(addr)
 
+    def frameHeader(self, command, payload_length):
+        """
+        Returns bytes which must be written right before the payload of given length,
+        so the payload itself can be written to the transport without concatenation.
+        """
+        return struct.pack(self.structFormat, payload_length + 2) + self.SoftwareVersion + strng.to_bin(command.lower()[0:1])
+
     def sendData(self, command, payload):
         try:
-            data = self.SoftwareVersion + strng.to_bin(command.lower()[0:1]) + strng.to_bin(payload)
-            self.sendString(data)
+            payload = strng.to_bin(payload)
+            self.transport.writeSequence([self.frameHeader(command, len(payload)), payload])
         except:
             lg.exc()
             return False
@@ -455,7 +463,6 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
         try:
             version = data[0:1]
             command = data[1:2]
-            payload = data[2:]
             if version != self.SoftwareVersion:
                 raise Exception('different software version')
             if command not in CMD_LIST:
@@ -470,6 +477,11 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
                 except:
                     lg.exc()
             return
+        if command == CMD_DATA:
+            # file chunks are written to the disk right away, so do not copy them here
+            payload = memoryview(data)[2:]
+        else:
+            payload = data[2:]
         self.automat('data-received', (command, payload))
 
     def append_outbox_file(self, filename, description='', result_defer=None, keep_alive=True):
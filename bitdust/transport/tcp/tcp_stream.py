@@ -38,6 +38,9 @@ _DebugLevel = 24
 
 import os
 import time
+import heapq
+import errno
+import socket
 import struct
 import random
 
@@ -64,8 +67,15 @@ MAX_PROCESS_STREAMS_DELAY = 5
 
 MAX_SIMULTANEOUS_OUTGOING_FILES = 20
 
+SHORT_FILE_WEIGHT = 8
+SERVICE_FILE_WEIGHT = 4
+DATA_FILE_WEIGHT = 1
+
+CHUNK_HEADER = struct.Struct('ii')
+
 #------------------------------------------------------------------------------
 
+_SendFileEnabled = hasattr(os, 'sendfile')
 _LastFileID = None
 _ProcessStreamsDelay = 0.1
 _ProcessStreamsTask = None
@@ -183,6 +193,19 @@ def make_file_id():
     return _LastFileID
 
 
+def file_weight(description, size):
+    """
+    Share of the connection bandwidth given to the outgoing file comparing to other files sent at same time.
+    Short files and service packets should not wait behind big data files.
+    """
+    from bitdust.transport.tcp import tcp_connection
+    if size <= tcp_connection.FIRST_PRIORITY_SHORT_FILE_SIZE:
+        return SHORT_FILE_WEIGHT
+    if not strng.to_text(description or '').startswith('Data'):
+        return SERVICE_FILE_WEIGHT
+    return DATA_FILE_WEIGHT
+
+
 #------------------------------------------------------------------------------
 
 
@@ -223,16 +246,12 @@ class TCPFileStream():
         """
         """
         from bitdust.transport.tcp import tcp_connection
-        inp = BytesIO(payload)
         try:
-            file_id = int(struct.unpack('i', inp.read(4))[0])
-            file_size = int(struct.unpack('i', inp.read(4))[0])
+            file_id, file_size = CHUNK_HEADER.unpack_from(payload, 0)
         except:
-            inp.close()
             lg.exc()
             return
-        inp_data = inp.read()
-        inp.close()
+        inp_data = payload[CHUNK_HEADER.size:]
         if file_id not in self.inboxFiles:
             if len(self.inboxFiles) >= 2*MAX_SIMULTANEOUS_OUTGOING_FILES:
                 # too many incoming files, seems remote guy is cheating - drop
@@ -460,6 +479,7 @@ class OutboxFile():
         self.bytes_out = 0
         self.started = time.time()
         self.timeout = max(int(self.size/settings.SendingSpeedLimit()), 6)
+        self.weight = file_weight(description, filesize)
         self.fout = open(self.filename, 'rb')
         if _Debug:
             lg.out(_DebugLevel, '>>>TCP-OUT %s with %d bytes reading from %s' % (self.file_id, self.size, self.filename))
@@ -475,7 +495,7 @@ class OutboxFile():
         self.result_defer = None
 
     def start(self):
-        d = self.stream.sender.startFileTransfer(self.file_id, self.fout, self.send_chunk, self.transform_data)
+        d = self.stream.sender.startFileTransfer(self.file_id, self.fout, self.size, self.chunk_header, self.chunk_sent, self.weight)
         d.addCallback(self.transfer_finished)
         d.addErrback(self.transfer_failed)
 
@@ -513,106 +533,130 @@ class OutboxFile():
         self.stream.outbox_file_done(self.file_id, 'failed', e)
         return None
 
-    def send_chunk(self, chunk):
+    def chunk_header(self, length):
         from bitdust.transport.tcp import tcp_connection
-        self.stream.connection.sendData(tcp_connection.CMD_DATA, chunk)
+        header = self.stream.connection.frameHeader(tcp_connection.CMD_DATA, CHUNK_HEADER.size + length)
+        return header + CHUNK_HEADER.pack(self.file_id, self.size)
 
-    def transform_data(self, data):
-        data = strng.to_bin(data)
-        datalength = len(data)
-        datagram = b''
-        datagram += struct.pack('i', self.file_id)
-        datagram += struct.pack('i', self.size)
-        datagram += data
-        self.bytes_sent += datalength
-        self.stream.connection.total_bytes_sent += datalength
-        return datagram
+    def chunk_sent(self, length):
+        self.bytes_sent += length
+        self.stream.connection.total_bytes_sent += length
 
 
 #------------------------------------------------------------------------------
 
 
+class _ActiveFile(object):
+
+    __slots__ = ('deferred', 'file_object', 'size', 'offset', 'header', 'sent', 'weight', 'tag', 'sequence')
+
+    def __init__(self, deferred, file_object, size, header, sent, weight):
+        self.deferred = deferred
+        self.file_object = file_object
+        self.size = size
+        self.offset = 0
+        self.header = header
+        self.sent = sent
+        self.weight = max(1, weight)
+        self.tag = 0.0
+        self.sequence = 0
+
+
 @implementer(interfaces.IProducer)
 class MultipleFilesSender:
 
-    CHUNK_SIZE = 2**14
+    """
+    Sends many files over one connection at same time.
+
+    Files are multiplexed with self-clocked weighted fair queueing: every file has a virtual finish
+    time of its next chunk, which grows by ``CHUNK_SIZE/weight`` after every chunk, and the file with
+    the lowest finish time is served first. So a file with weight 8 gets 8 times more bandwidth than a file with weight 1.
+
+    Chunk headers are generated by the caller and written together with the file body.
+    When the transport buffer is empty the body goes to the socket with ``os.sendfile()``
+    and is never read into the memory, otherwise it is read and added to the transport buffer.
+    """
+
+    CHUNK_SIZE = 2**16
+    BURST_SIZE = 2**18
 
     def __init__(self, consumer):
         self.active_files = {}
+        self.queue = []
+        self.virtual_time = 0.0
+        self.sequence = 0
+        self.resume_task = None
+        self.bytes_sent_directly = 0
         self.consumer = consumer
         self.consumer.registerProducer(self, False)
 
     def close(self):
+        if self.resume_task and self.resume_task.active():
+            self.resume_task.cancel()
+        self.resume_task = None
         self.consumer.unregisterProducer()
         self.consumer = None
         self.active_files.clear()
+        del self.queue[:]
 
     def is_sending(self, file_id):
         return file_id in self.active_files
 
-    def startFileTransfer(self, file_id, file_object, writer, transform):
+    def startFileTransfer(self, file_id, file_object, size, header, sent, weight=1):
         """
+        Calls ``header(length)`` to get bytes to be written before every chunk of the file
+        and ``sent(length)`` after the chunk was passed to the transport.
         """
         if file_id in self.active_files:
             raise ValueError('file_id=%r already registered for transfer' % file_id)
         deferred = defer.Deferred()
-        self.active_files[file_id] = (deferred, file_object, writer, transform)
+        item = _ActiveFile(deferred, file_object, size, header, sent, weight)
+        self.active_files[file_id] = item
+        self._push(file_id, item, self.virtual_time)
         if _Debug:
             lg.args(_DebugLevel*2, file_id, file_object, [fid for fid in self.active_files.keys()])
-        if not self.consumer.producerPaused:
-            self.resumeProducing()
+        self._schedule_resume()
         return deferred
 
     def stopFileTransfer(self, file_id, reason='cancelled'):
         if file_id not in self.active_files:
             raise ValueError('file_id=%r is not registered for transfer' % file_id)
-        deferred, _, _, _ = self.active_files.pop(file_id, (
-            None,
-            None,
-            None,
-            None,
-        ))
+        item = self.active_files.pop(file_id)
         if _Debug:
             lg.args(_DebugLevel*2, file_id, [fid for fid in self.active_files.keys()])
-        if deferred:
-            deferred.errback(Exception(reason))
+        item.deferred.errback(Exception(reason))
 
     def resumeProducing(self):
         if _Debug:
             lg.args(_DebugLevel*2, [fid for fid in self.active_files.keys()])
-        files_to_be_removed = []
-        for file_id in self.active_files.keys():
-            deferred, file_object, writer, transform = self.active_files.get(file_id, (
-                None,
-                None,
-                None,
-                None,
-            ))
-            if not file_object:
-                lg.warn('did not found file object for file_id=%r' % file_id)
-                files_to_be_removed.append(file_id)
+        budget = self.BURST_SIZE
+        while self.queue and budget > 0 and self.consumer is not None:
+            tag, sequence, file_id = heapq.heappop(self.queue)
+            item = self.active_files.get(file_id)
+            if item is None or item.sequence != sequence:
+                # file was stopped
                 continue
-            chunk = b''
-            err = False
-            if file_object:
+            self.virtual_time = tag
+            length = min(self.CHUNK_SIZE, item.size - item.offset)
+            if length > 0:
                 try:
-                    chunk = file_object.read(self.CHUNK_SIZE)
+                    self._write_chunk(item, length)
                 except Exception as exc:
                     lg.exc()
-                    chunk = None
-                    err = exc
-            if not chunk:
-                files_to_be_removed.append(file_id)
-                if deferred:
-                    if err:
-                        deferred.errback(err)
-                    else:
-                        deferred.callback(True)
+                    self.active_files.pop(file_id, None)
+                    item.deferred.errback(exc)
+                    continue
+                item.offset += length
+                budget -= length
+                item.sent(length)
+            if item.offset >= item.size:
+                self.active_files.pop(file_id, None)
+                item.deferred.callback(True)
                 continue
-            chunk = transform(chunk)
-            writer(chunk)
-        for file_id in files_to_be_removed:
-            self.active_files.pop(file_id)
+            self._push(file_id, item, tag)
+        if self.queue and self.consumer is not None and self._buffer_is_empty():
+            # all data went directly to the socket, the transport will not ask for more
+            self._schedule_resume()
 
     def pauseProducing(self):
         if _Debug:
@@ -621,3 +665,191 @@ class MultipleFilesSender:
     def stopProducing(self):
         if _Debug:
             lg.args(_DebugLevel*2, [fid for fid in self.active_files.keys()])
+
+    def _push(self, file_id, item, start_tag):
+        self.sequence += 1
+        item.sequence = self.sequence
+        item.tag = start_tag + float(self.CHUNK_SIZE)/item.weight
+        heapq.heappush(self.queue, (item.tag, item.sequence, file_id))
+
+    def _schedule_resume(self):
+        if self.resume_task is None or not self.resume_task.active():
+            self.resume_task = reactor.callLater(0, self._on_resume)  # @UndefinedVariable
+
+    def _on_resume(self):
+        self.resume_task = None
+        if self.consumer is not None and self._buffer_is_empty():
+            self.resumeProducing()
+
+    def _buffer_is_empty(self):
+        try:
+            return self.consumer._tempDataLen == 0 and len(self.consumer.dataBuffer) == self.consumer.offset
+        except AttributeError:
+            # not a Twisted file descriptor
+            return not getattr(self.consumer, 'producerPaused', False)
+
+    def _direct_socket(self):
+        if not _SendFileEnabled:
+            return None
+        consumer = self.consumer
+        if getattr(consumer, 'TLS', False) or not getattr(consumer, 'connected', False) or getattr(consumer, 'disconnecting', False):
+            return None
+        if not self._buffer_is_empty():
+            return None
+        try:
+            return consumer.getHandle()
+        except Exception:
+            return None
+
+    def _read(self, item, offset, length):
+        fd = item.file_object.fileno()
+        if hasattr(os, 'pread'):
+            data = os.pread(fd, length, offset)
+        else:
+            item.file_object.seek(offset)
+            data = item.file_object.read(length)
+        if len(data) != length:
+            raise IOError('file was truncated while sending')
+        return data
+
+    def _write_chunk(self, item, length):
+        global _SendFileEnabled
+        header = item.header(length)
+        sent = 0
+        sock = self._direct_socket()
+        if sock is not None:
+            try:
+                sent = sock.send(header, getattr(socket, 'MSG_MORE', 0))
+                if sent == len(header):
+                    sent += os.sendfile(sock.fileno(), item.file_object.fileno(), item.offset, length)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as exc:
+                if exc.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, getattr(errno, 'EOPNOTSUPP', errno.EINVAL)):
+                    lg.warn('os.sendfile() is not supported here: %r' % exc)
+                    _SendFileEnabled = False
+                # otherwise the transport will find that connection is broken
+            body_sent = max(0, sent - len(header))
+            self.bytes_sent_directly += body_sent
+            if body_sent == length:
+                return
+        if sent < len(header):
+            self.consumer.writeSequence([header[sent:], self._read(item, item.offset, length)])
+        else:
+            body_sent = sent - len(header)
+            self.consumer.writeSequence([self._read(item, item.offset + body_sent, length - body_sent)])
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Sends 100 files of 1 MB each with ``MultipleFilesSender`` to a loopback TCP socket, which is read by a child process.
+    Measures the throughput and CPU time of the sending process with ``os.sendfile()`` enabled and disabled
+    and also how long a short service packet, started after the big files, waits until it is sent.
+    """
+    import sys
+    import shutil
+    import tempfile
+    import resource
+    import subprocess
+    from twisted.internet import protocol
+    from bitdust.transport.tcp import tcp_connection
+
+    global _SendFileEnabled
+    files_count = 100
+    file_size = 1024*1024
+    mode = sys.argv[1] if len(sys.argv) > 1 else ''
+    if mode not in ('sendfile', 'buffer'):
+        # every mode runs in a separate process to measure CPU usage separately
+        for mode in ('sendfile', 'buffer'):
+            print('%d files of %d bytes, %s:' % (files_count, file_size, 'os.sendfile()' if mode == 'sendfile' else 'transport buffer'))
+            sys.stdout.flush()
+            subprocess.call([sys.executable, '-m', 'bitdust.transport.tcp.tcp_stream', mode])
+        return
+    temp_dir = tempfile.mkdtemp(prefix='tcp_stream_')
+    filenames = []
+    for i in range(files_count):
+        filenames.append(os.path.join(temp_dir, str(i)))
+        with open(filenames[-1], 'wb') as f:
+            f.write(os.urandom(file_size))
+    short_filename = os.path.join(temp_dir, 'short')
+    with open(short_filename, 'wb') as f:
+        f.write(os.urandom(1024))
+    sink_code = 'import socket, sys\n' \
+        's = socket.socket()\n' \
+        's.bind(("127.0.0.1", 0))\n' \
+        's.listen(1)\n' \
+        'sys.stdout.write("%d\\n" % s.getsockname()[1])\n' \
+        'sys.stdout.flush()\n' \
+        'c, _ = s.accept()\n' \
+        'buf = bytearray(1024*1024)\n' \
+        'while c.recv_into(buf):\n' \
+        '    pass\n'
+
+    class _Sender(protocol.Protocol):
+
+        def connectionMade(self):
+            self.usage = resource.getrusage(resource.RUSAGE_SELF)
+            self.started = time.time()
+            self.short_started = None
+            self.short_delay = None
+            self.files_left = files_count
+            self.opened = []
+            self.sender = MultipleFilesSender(self.transport)
+            for i, filename in enumerate(filenames):
+                self._start(i + 1, filename, 'Data', file_size).addCallback(self._on_file_sent)
+            reactor.callLater(0.01, self._start_short)  # @UndefinedVariable
+
+        def _start(self, file_id, filename, description, size):
+
+            def _header(length):
+                return self.frameHeader(CHUNK_HEADER.size + length) + CHUNK_HEADER.pack(file_id, size)
+
+            self.opened.append(open(filename, 'rb'))
+            return self.sender.startFileTransfer(file_id, self.opened[-1], size, _header, lambda length: None, file_weight(description, size))
+
+        def frameHeader(self, length):
+            return struct.pack('!I', length + 2) + b'1' + tcp_connection.CMD_DATA
+
+        def _start_short(self):
+            self.short_started = time.time()
+            self._start(files_count + 1, short_filename, 'Identity', 1024).addCallback(self._on_short_sent)
+
+        def _on_short_sent(self, result):
+            self.short_delay = time.time() - self.short_started
+
+        def _on_file_sent(self, result):
+            self.files_left -= 1
+            if not self.files_left:
+                self.sent_directly = self.sender.bytes_sent_directly
+                self.sender.close()
+                self.transport.loseConnection()
+
+        def connectionLost(self, reason):
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            cpu = usage.ru_utime - self.usage.ru_utime + usage.ru_stime - self.usage.ru_stime
+            megabytes = files_count*file_size/(1024.0*1024.0)
+            duration = time.time() - self.started
+            print('    %.1f MB/sec, %.2f ms CPU per MB, %d%% sent directly, short packet waited %s' % (
+                megabytes/duration,
+                cpu*1000.0/megabytes,
+                self.sent_directly*100.0/(files_count*file_size),
+                ('%.1f ms' % (self.short_delay*1000.0)) if self.short_delay is not None else 'until the end',
+            ))
+            for f in self.opened:
+                f.close()
+            reactor.stop()  # @UndefinedVariable
+
+    _SendFileEnabled = (mode == 'sendfile')
+    sink = subprocess.Popen([sys.executable, '-c', sink_code], stdout=subprocess.PIPE)
+    port = int(sink.stdout.readline())
+    protocol.ClientCreator(reactor, _Sender).connectTCP('127.0.0.1', port)  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+    sink.wait()
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
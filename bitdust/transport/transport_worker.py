@@ -0,0 +1,821 @@
+#!/usr/bin/python
+# transport_worker.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (transport_worker.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+"""
+.. module:: transport_worker.
+
+Runs a transport plug-in in a separate worker process, so network I/O of the transport
+is handled on another CPU core and does not compete with the main process.
+
+``WorkerInterface`` is used by ``network_transport()`` in place of the regular ``GateInterface``
+of the plug-in, it forwards all calls to the worker process.
+Inside of the worker the regular ``GateInterface`` is running and all of its calls to the gateway
+(``transport_initialized``, ``register_file_receiving``, ...) are forwarded back to the main process.
+
+Parent and worker are talking over a pair of pipes (file descriptors 3 and 4 of the worker)
+with a compact binary protocol: every frame is a fixed ``FRAME_HEADER`` followed by a body
+encoded with ``pack()``, no XML-RPC and no text parsing is involved.
+
+Packet payloads never go through the pipes: the transports are already spooling every
+outgoing and incoming packet into a file inside of the ``tmpfile`` folder, so only the file path is passed
+and the worker reads and writes the data directly from and to the same folder.
+
+Only TCP transport can run in the worker process at the moment:
+UDP transport shares its socket with the DHT layer and must stay in the main process.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import struct
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import os.path as _p
+    sys.path.insert(0, _p.abspath(_p.join(_p.dirname(_p.abspath(sys.argv[0])), '..', '..')))
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import protocol  # @UnresolvedImport
+from twisted.internet.defer import Deferred, maybeDeferred, fail  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.lib import strng
+
+#------------------------------------------------------------------------------
+
+SUPPORTED_PROTOCOLS = ('tcp', )
+
+PARENT_TO_WORKER_FD = 3
+WORKER_TO_PARENT_FD = 4
+
+FRAME_HEADER = struct.Struct('!IBI')
+FRAME_CALL = 1
+FRAME_EVENT = 2
+FRAME_RESULT = 3
+FRAME_ERROR = 4
+
+MAX_FRAME_SIZE = 16*1024*1024
+
+#------------------------------------------------------------------------------
+
+_Int = struct.Struct('!q')
+_Float = struct.Struct('!d')
+_Length = struct.Struct('!I')
+
+_SessionFields = (
+    'id',
+    'index',
+    'state',
+    'peer_idurl',
+    'peer_address',
+    'peer_external_address',
+    'connection_address',
+    'total_bytes_sent',
+    'total_bytes_received',
+)
+
+_StreamFields = (
+    'started',
+    'file_id',
+    'transfer_id',
+    'size',
+    'typ',
+    'bytes_received',
+    'bytes_sent',
+)
+
+#------------------------------------------------------------------------------
+
+
+def is_supported(proto=None):
+    """
+    Worker processes need pipes passed to a child process by file descriptors, this is not available on Windows.
+    """
+    if proto is not None and strng.to_text(proto) not in SUPPORTED_PROTOCOLS:
+        return False
+    if sys.platform.startswith('win') or getattr(sys, 'frozen', False):
+        return False
+    if 'ANDROID_ARGUMENT' in os.environ or 'ANDROID_ROOT' in os.environ:
+        return False
+    return True
+
+
+#------------------------------------------------------------------------------
+
+
+def pack(value):
+    """
+    Serialize ``None``, booleans, numbers, bytes, strings, tuples, lists and dictionaries into bytes.
+    Objects which have ``to_bin()`` method (like ``id_url.ID_URL_FIELD``) are stored as bytes.
+    """
+    parts = []
+    _pack(value, parts)
+    return b''.join(parts)
+
+
+def _pack(value, parts):
+    if value is None:
+        parts.append(b'N')
+    elif value is True:
+        parts.append(b'T')
+    elif value is False:
+        parts.append(b'F')
+    elif isinstance(value, int):
+        if -0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF:
+            parts.append(b'i')
+            parts.append(_Int.pack(value))
+        else:
+            raw = str(value).encode('ascii')
+            parts.append(b'L')
+            parts.append(_Length.pack(len(raw)))
+            parts.append(raw)
+    elif isinstance(value, float):
+        parts.append(b'd')
+        parts.append(_Float.pack(value))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        parts.append(b'b')
+        parts.append(_Length.pack(len(value)))
+        parts.append(bytes(value))
+    elif isinstance(value, str):
+        raw = value.encode('utf-8')
+        parts.append(b's')
+        parts.append(_Length.pack(len(raw)))
+        parts.append(raw)
+    elif isinstance(value, (tuple, list)):
+        parts.append(b't' if isinstance(value, tuple) else b'l')
+        parts.append(_Length.pack(len(value)))
+        for item in value:
+            _pack(item, parts)
+    elif isinstance(value, dict):
+        parts.append(b'm')
+        parts.append(_Length.pack(len(value)))
+        for k, v in value.items():
+            _pack(k, parts)
+            _pack(v, parts)
+    elif hasattr(value, 'to_bin'):
+        _pack(value.to_bin(), parts)
+    else:
+        raise TypeError('can not serialize %r' % type(value))
+
+
+def unpack(data):
+    value, offset = _unpack(data, 0)
+    if offset != len(data):
+        raise ValueError('%d extra bytes after serialized value' % (len(data) - offset))
+    return value
+
+
+def _unpack(data, offset):
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'i':
+        return _Int.unpack_from(data, offset)[0], offset + _Int.size
+    if tag == b'd':
+        return _Float.unpack_from(data, offset)[0], offset + _Float.size
+    if tag in (b'b', b's', b'L'):
+        length = _Length.unpack_from(data, offset)[0]
+        offset += _Length.size
+        raw = bytes(data[offset:offset + length])
+        if len(raw) != length:
+            raise ValueError('serialized value is truncated')
+        offset += length
+        if tag == b's':
+            return raw.decode('utf-8'), offset
+        if tag == b'L':
+            return int(raw), offset
+        return raw, offset
+    if tag in (b't', b'l'):
+        count = _Length.unpack_from(data, offset)[0]
+        offset += _Length.size
+        items = []
+        for _ in range(count):
+            item, offset = _unpack(data, offset)
+            items.append(item)
+        return (tuple(items) if tag == b't' else items), offset
+    if tag == b'm':
+        count = _Length.unpack_from(data, offset)[0]
+        offset += _Length.size
+        result = {}
+        for _ in range(count):
+            k, offset = _unpack(data, offset)
+            v, offset = _unpack(data, offset)
+            result[k] = v
+        return result, offset
+    raise ValueError('unknown type tag %r at position %d' % (tag, offset - 1))
+
+
+#------------------------------------------------------------------------------
+
+
+def make_frame(kind, call_id, value):
+    body = pack(value)
+    return FRAME_HEADER.pack(len(body), kind, call_id) + body
+
+
+class FrameChannel(object):
+
+    """
+    Both sides of the pipe: sends calls and waits for results, receives calls from the other side and replies.
+    Sub-classes must implement ``write(data)`` and ``handle(kind, method, args)``.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pending = {}
+        self.last_call_id = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+
+    def write(self, data):
+        raise NotImplementedError()
+
+    def handle(self, kind, method, args):
+        raise NotImplementedError()
+
+    def send_call(self, kind, method, *args):
+        self.last_call_id = (self.last_call_id + 1) & 0xFFFFFFFF
+        call_id = self.last_call_id
+        try:
+            frame = make_frame(kind, call_id, (method, args))
+        except Exception as exc:
+            lg.exc()
+            return fail(exc)
+        result = Deferred()
+        self.pending[call_id] = result
+        self.frames_sent += 1
+        self.write(frame)
+        return result
+
+    def send_reply(self, call_id, value):
+        try:
+            frame = make_frame(FRAME_RESULT, call_id, value)
+        except TypeError as exc:
+            frame = make_frame(FRAME_ERROR, call_id, str(exc))
+        self.frames_sent += 1
+        self.write(frame)
+
+    def send_error(self, call_id, err):
+        try:
+            message = err.getErrorMessage()
+        except:
+            message = str(err)
+        self.frames_sent += 1
+        self.write(make_frame(FRAME_ERROR, call_id, message))
+
+    def fail_pending(self, reason):
+        pending = self.pending
+        self.pending = {}
+        for d in pending.values():
+            d.errback(Exception(reason))
+
+    def data_received(self, data):
+        buf = self.buffer
+        buf.extend(data)
+        offset = 0
+        while len(buf) - offset >= FRAME_HEADER.size:
+            length, kind, call_id = FRAME_HEADER.unpack_from(buf, offset)
+            if length > MAX_FRAME_SIZE:
+                lg.err('frame of %d bytes is too big, connection is broken' % length)
+                del buf[:]
+                self.fail_pending('broken frame')
+                return
+            end = offset + FRAME_HEADER.size + length
+            if len(buf) < end:
+                break
+            body = bytes(buf[offset + FRAME_HEADER.size:end])
+            offset = end
+            self.frames_received += 1
+            try:
+                self.frame_received(kind, call_id, unpack(body))
+            except:
+                lg.exc()
+        if offset:
+            del buf[:offset]
+
+    def frame_received(self, kind, call_id, value):
+        if kind in (FRAME_RESULT, FRAME_ERROR):
+            d = self.pending.pop(call_id, None)
+            if d is None:
+                lg.warn('unexpected reply for call %d' % call_id)
+                return
+            if kind == FRAME_RESULT:
+                d.callback(value)
+            else:
+                d.errback(Exception(value))
+            return
+        method, args = value
+        if _Debug:
+            lg.args(_DebugLevel, kind=kind, call_id=call_id, method=method)
+        d = maybeDeferred(self.handle, kind, method, args)
+        d.addCallback(lambda result: self.send_reply(call_id, result))
+        d.addErrback(lambda err: self.send_error(call_id, err))
+
+
+#------------------------------------------------------------------------------
+
+
+class _Snapshot(object):
+
+    """
+    Copy of a session or stream object from the worker process, only keeps the attributes.
+    """
+
+    def __init__(self, info):
+        self._json = info.pop('json', None) or {}
+        self.__dict__.update(info)
+
+    def __repr__(self):
+        return '_Snapshot(%r)' % self._json
+
+    def to_json(self):
+        return dict(self._json)
+
+
+class WorkerInterface(protocol.ProcessProtocol, FrameChannel):
+
+    """
+    Runs in the main process and replaces ``GateInterface`` of the transport plug-in.
+    ``local_interface`` is the regular ``GateInterface``, it is only used to build identity contacts.
+
+    Lists of sessions and streams are requested from the worker in background and
+    the most recent copy is returned, because callers expect them right away.
+    """
+
+    def __init__(self, proto, local_interface):
+        FrameChannel.__init__(self)
+        self.proto = strng.to_text(proto)
+        self.local_interface = local_interface
+        self.listener = None
+        self.process_transport = None
+        self.exited = False
+        self.stopping = False
+        self.contacts = None
+        self.sessions = []
+        self.streams = []
+
+    def __repr__(self):
+        return 'WorkerInterface(%s|%s)' % (self.proto, getattr(self.process_transport, 'pid', None))
+
+    #------------------------------------------------------------------------------
+
+    def start_process(self):
+        from twisted.internet import reactor  # @UnresolvedImport
+        from bitdust.system import tmpfile
+        package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([package_dir] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        if tmpfile.base_dir() is None:
+            tmpfile.init()
+        args = [sys.executable, '-m', 'bitdust.transport.transport_worker', 'worker', self.proto, tmpfile.base_dir()]
+        self.exited = False
+        self.stopping = False
+        self.process_transport = reactor.spawnProcess(  # @UndefinedVariable
+            self,
+            sys.executable,
+            args,
+            env=env,
+            path=package_dir,
+            childFDs={
+                1: 1,
+                2: 2,
+                PARENT_TO_WORKER_FD: 'w',
+                WORKER_TO_PARENT_FD: 'r',
+            },
+        )
+        if _Debug:
+            lg.args(_DebugLevel, proto=self.proto, pid=self.process_transport.pid)
+
+    def stop_process(self):
+        self.stopping = True
+        if self.process_transport and not self.exited:
+            self.process_transport.closeChildFD(PARENT_TO_WORKER_FD)
+
+    def is_running(self):
+        return self.process_transport is not None and not self.exited
+
+    def call_worker(self, method, *args):
+        if not self.is_running():
+            return fail(Exception('%s worker process is not running' % self.proto))
+        return self.send_call(FRAME_CALL, method, *args)
+
+    #------------------------------------------------------------------------------
+
+    def write(self, data):
+        self.process_transport.writeToChild(PARENT_TO_WORKER_FD, data)
+
+    def handle(self, kind, method, args):
+        if kind != FRAME_EVENT or not self.listener:
+            raise Exception('unexpected call %r from the worker' % method)
+        return self.listener.callRemote(method, *args)
+
+    def childDataReceived(self, childFD, data):
+        if childFD == WORKER_TO_PARENT_FD:
+            self.data_received(data)
+
+    def processEnded(self, reason):
+        self.exited = True
+        self.fail_pending('%s worker process exited' % self.proto)
+        if self.stopping:
+            if _Debug:
+                lg.args(_DebugLevel, proto=self.proto, reason=reason.getErrorMessage())
+            return
+        lg.err('%s worker process exited unexpectedly: %s' % (self.proto, reason.getErrorMessage()))
+        if self.listener:
+            self.listener.callRemote('disconnected', self.proto, 'worker process exited')
+
+    #------------------------------------------------------------------------------
+
+    def init(self, xml_rpc_url_or_object):
+        self.listener = xml_rpc_url_or_object
+        if not self.is_running():
+            self.start_process()
+        self.call_worker('init').addErrback(lambda err: lg.err('%s worker failed to start: %s' % (self.proto, err.getErrorMessage())))
+        return True
+
+    def shutdown(self):
+        d = self.call_worker('shutdown')
+        d.addBoth(lambda _: self.stop_process())
+        self.listener = None
+        return True
+
+    def connect(self, options):
+        if not self.is_running():
+            self.start_process()
+            self.call_worker('init')
+        self.contacts = self.local_interface.build_contacts(None)
+        return self.call_worker('connect', options)
+
+    def disconnect(self):
+        return self.call_worker('disconnect')
+
+    def build_contacts(self, id_obj):
+        return self.local_interface.build_contacts(id_obj)
+
+    def verify_contacts(self, id_obj):
+        if not self.is_running():
+            return False
+        contacts = self.local_interface.build_contacts(id_obj)
+        if contacts != self.contacts:
+            # worker was started with another address or port
+            return False
+        for contact in contacts:
+            if id_obj.getContactIndex(contact=contact) < 0:
+                return False
+        return True
+
+    def send_file(self, remote_idurl, filename, host, description=''):
+        return self.call_worker('send_file', remote_idurl, filename, host, description)
+
+    def send_file_single(self, remote_idurl, filename, host, description=''):
+        return self.call_worker('send_file_single', remote_idurl, filename, host, description)
+
+    def send_keep_alive(self, host):
+        return self.call_worker('send_keep_alive', host)
+
+    def connect_to(self, host):
+        return self.call_worker('connect_to', host)
+
+    def disconnect_from(self, host):
+        return self.call_worker('disconnect_from', host)
+
+    def cancel_file_sending(self, transferID):
+        return self.call_worker('cancel_file_sending', transferID)
+
+    def cancel_file_receiving(self, transferID):
+        return self.call_worker('cancel_file_receiving', transferID)
+
+    def cancel_outbox_file(self, host, filename):
+        return self.call_worker('cancel_outbox_file', host, filename)
+
+    def list_sessions(self):
+        self.call_worker('list_sessions').addCallbacks(self._on_sessions, lambda err: None)
+        return list(self.sessions)
+
+    def list_streams(self, sorted_by_time=True):
+        self.call_worker('list_streams', sorted_by_time).addCallbacks(self._on_streams, lambda err: None)
+        return list(self.streams)
+
+    def find_session(self, host=None, idurl=None):
+        # session state machines are living in another process, callers can not attach to them
+        return []
+
+    def find_stream(self, stream_id=None, transfer_id=None):
+        for s in self.streams:
+            if stream_id is not None and getattr(s, 'file_id', None) == stream_id:
+                return s
+            if transfer_id is not None and getattr(s, 'transfer_id', None) == transfer_id:
+                return s
+        return None
+
+    def _on_sessions(self, result):
+        self.sessions = [_Snapshot(info) for info in result]
+
+    def _on_streams(self, result):
+        self.streams = [_Snapshot(info) for info in result]
+
+
+#------------------------------------------------------------------------------
+
+
+class _ParentProxy(object):
+
+    """
+    Used inside of the worker process as XML-RPC proxy of the gateway.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def callRemote(self, method, *args):
+        return self.channel.send_call(FRAME_EVENT, method, *args)
+
+
+def _portable(value):
+    """
+    Objects living in the worker process can not be passed to the main process, only their ``repr()`` is sent.
+    """
+    if value is None or isinstance(value, (bool, int, float, bytes, str)):
+        return value
+    if isinstance(value, (tuple, list)):
+        return type(value)(_portable(item) for item in value)
+    if isinstance(value, dict):
+        return {_portable(k): _portable(v) for k, v in value.items()}
+    if hasattr(value, 'to_bin'):
+        return value.to_bin()
+    return repr(value)
+
+
+def _object_info(obj, fields):
+    info = {}
+    for field in fields:
+        if hasattr(obj, field):
+            info[field] = getattr(obj, field)
+    if hasattr(obj, 'stream'):
+        info['stream'] = bool(obj.stream)
+    if hasattr(obj, 'to_json'):
+        info['json'] = obj.to_json()
+    return _portable(info)
+
+
+class WorkerChannel(protocol.Protocol, FrameChannel):
+
+    """
+    Runs inside of the worker process and executes calls from the main process with the regular ``GateInterface``.
+    """
+
+    methods = (
+        'init',
+        'shutdown',
+        'connect',
+        'disconnect',
+        'send_file',
+        'send_file_single',
+        'send_keep_alive',
+        'connect_to',
+        'disconnect_from',
+        'cancel_file_sending',
+        'cancel_file_receiving',
+        'cancel_outbox_file',
+        'list_sessions',
+        'list_streams',
+    )
+
+    def __init__(self, interface):
+        FrameChannel.__init__(self)
+        self.interface = interface
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def dataReceived(self, data):
+        self.data_received(data)
+
+    def connectionLost(self, reason):
+        from twisted.internet import reactor  # @UnresolvedImport
+        self.fail_pending('parent process closed the channel')
+        if reactor.running:  # @UndefinedVariable
+            reactor.stop()  # @UndefinedVariable
+
+    def handle(self, kind, method, args):
+        if kind != FRAME_CALL or method not in self.methods:
+            raise Exception('method %r is not supported' % method)
+        if method == 'init':
+            return self.interface.init(_ParentProxy(self))
+        if method == 'list_sessions':
+            return [_object_info(s, _SessionFields) for s in self.interface.list_sessions()]
+        if method == 'list_streams':
+            return [_object_info(s, _StreamFields) for s in self.interface.list_streams(*args)]
+        d = maybeDeferred(getattr(self.interface, method), *args)
+        d.addCallback(_portable)
+        return d
+
+
+def run_worker(proto, temp_dir):
+    """
+    Entry point of the worker process.
+    """
+    from twisted.internet import reactor  # @UnresolvedImport
+    from twisted.internet import stdio  # @UnresolvedImport
+    from bitdust.system import tmpfile
+    proto = strng.to_text(proto)
+    if proto not in SUPPORTED_PROTOCOLS:
+        raise Exception('transport %r can not run in a worker process' % proto)
+    tmpfile.init(temp_dir)
+    from bitdust.transport.tcp import tcp_interface
+    channel = WorkerChannel(tcp_interface.GateInterface())
+    stdio.StandardIO(channel, stdin=PARENT_TO_WORKER_FD, stdout=WORKER_TO_PARENT_FD)
+    reactor.run()  # @UndefinedVariable
+    tmpfile.shutdown()
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Local two-node loopback benchmark of TCP transport.
+    Node B always runs in a worker process, node A runs in the main process first and then in another worker process.
+    Reports transfer speed and CPU time used by the main process per megabyte.
+    """
+    import time
+    import resource
+    from twisted.internet import reactor  # @UnresolvedImport
+    from twisted.internet import task  # @UnresolvedImport
+    from bitdust.system import tmpfile
+    from bitdust.transport.tcp import tcp_interface
+    try:
+        from xmlrpc.client import dumps, loads, Binary
+    except ImportError:
+        from xmlrpclib import dumps, loads, Binary  # @UnresolvedImport
+
+    files_count = 200
+    file_size = 512*1024
+    port_a = 17301
+    port_b = 17302
+    tmpfile.init()
+    filenames = []
+    for _ in range(files_count):
+        fd, filename = tmpfile.make('outbox')
+        os.write(fd, os.urandom(file_size))
+        os.close(fd)
+        filenames.append(filename)
+
+    class _Listener(object):
+
+        def __init__(self, name):
+            self.name = name
+            self.transfer_id = 0
+            self.inbox = {}
+            self.received = 0
+            self.listening = Deferred()
+            self.on_received = None
+
+        def callRemote(self, method, *args):
+            if method == 'receiving_started' and not self.listening.called:
+                self.listening.callback(True)
+            # gateway is always replying asynchronously
+            result = True
+            if method in ('register_file_sending', 'register_file_receiving'):
+                self.transfer_id += 1
+                if method == 'register_file_receiving':
+                    self.inbox[self.transfer_id] = args[3]
+                result = self.transfer_id
+            if method == 'unregister_file_receiving':
+                filename = self.inbox.pop(args[0], None)
+                if filename and os.path.isfile(filename):
+                    os.remove(filename)
+                if args[1] == 'finished':
+                    self.received += 1
+                    if self.on_received:
+                        self.on_received()
+            return task.deferLater(reactor, 0, lambda: result)
+
+    def _options(name, port):
+        return {
+            'idurl': b'http://127.0.0.1/%s.xml' % name,
+            'host': b'127.0.0.1:%d' % port,
+            'tcp_port': port,
+        }
+
+    results = {}
+    listener_b = _Listener('b')
+    worker_b = WorkerInterface('tcp', tcp_interface.GateInterface())
+
+    def _run(label, interface_a, listener_a, next_step):
+        interface_a.init(listener_a)
+        interface_a.connect(_options(b'a', port_a))
+
+        def _start(_):
+            usage_before = resource.getrusage(resource.RUSAGE_SELF)
+            started = time.time()
+            listener_b.received = 0
+
+            def _check_done():
+                if listener_b.received < files_count:
+                    return
+                listener_b.on_received = None
+                elapsed = time.time() - started
+                usage_after = resource.getrusage(resource.RUSAGE_SELF)
+                cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+                megabytes = files_count*file_size/(1024.0*1024.0)
+                results[label] = (megabytes/elapsed, cpu/megabytes)
+                print('%s: %d files, %.1f MB in %.2f sec, %.1f MB/s, main process CPU time %.1f ms per MB' % (label, files_count, megabytes, elapsed, megabytes/elapsed, 1000.0*cpu/megabytes))
+                interface_a.disconnect()
+                interface_a.shutdown()
+                reactor.callLater(1, next_step)  # @UndefinedVariable
+
+            listener_b.on_received = _check_done
+            for filename in filenames:
+                interface_a.send_file(b'http://127.0.0.1/b.xml', filename, (b'127.0.0.1', port_b), 'bench')
+
+        listener_a.listening.addCallback(_start)
+
+    def _finish():
+        worker_b.disconnect()
+        worker_b.shutdown()
+        for filename in filenames:
+            os.remove(filename)
+        reactor.callLater(1, reactor.stop)  # @UndefinedVariable
+
+    def _run_worker():
+        _run('node A in worker process', WorkerInterface('tcp', tcp_interface.GateInterface()), _Listener('a'), _finish)
+
+    def _run_in_process(_):
+        _run('node A in main process', tcp_interface.GateInterface(), _Listener('a'), _run_worker)
+
+    def _start():
+        worker_b.init(listener_b)
+        worker_b.connect(_options(b'b', port_b))
+        listener_b.listening.addCallback(_run_in_process)
+
+    reactor.callWhenRunning(_start)  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+
+    call = ('register_file_receiving', ('tcp', (b'127.0.0.1', port_b), b'http://127.0.0.1/a.xml', filenames[0], file_size))
+    count = 20000
+    dt = time.time()
+    for _ in range(count):
+        unpack(make_frame(FRAME_EVENT, 1, call)[FRAME_HEADER.size:])
+    binary_time = (time.time() - dt)/count
+    dt = time.time()
+    for _ in range(count):
+        loads(dumps(call[1], call[0], allow_none=True))
+    xmlrpc_time = (time.time() - dt)/count
+    print('control message: binary frame %.1f us, XML-RPC %.1f us' % (binary_time*1e6, xmlrpc_time*1e6))
+    payload = os.urandom(file_size)
+    count = 50
+    dt = time.time()
+    for _ in range(count):
+        loads(dumps((Binary(payload), ), 'send_file', allow_none=True))
+    print('passing %d KB payload inside of XML-RPC call would take %.1f ms, with file hand-off it is not copied at all' % (file_size/1024, (time.time() - dt)*1000.0/count))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -27,7 +27,7 @@
 
 from __future__ import absolute_import
 from io import open
-from io import StringIO
+from io import BytesIO
 
 #------------------------------------------------------------------------------
 
@@ -65,6 +65,19 @@ _StreamCounter = 0
 #------------------------------------------------------------------------------
 
 
+def write_at(fd, data, offset):
+    """
+    Writes ``data`` at given position of the file, ``os.pwrite()`` is not available on Windows.
+    """
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+#------------------------------------------------------------------------------
+
+
 class FileQueue:
 
     def __init__(self, session):
@@ -74,6 +87,7 @@ class FileQueue:
         self.inboxFiles = {}
         self.outboxQueue = []
         self.dead_streams = []
+        self.finished_streams = {}
 
     def make_unique_stream_id(self):
         global _StreamCounter
@@ -107,7 +121,7 @@ class FileQueue:
         #             import random
         #             if random.randint(1, 100) > 90:
         #                 return True
-        newoutput = ''.join((struct.pack('i', stream_id), struct.pack('i', outfile.size), output))
+        newoutput = b''.join((struct.pack('i', stream_id), struct.pack('i', outfile.size), output))
         return self.session.send_packet(udp.CMD_DATA, strng.to_bin(newoutput))
 
     def do_send_ack(self, stream_id, infile, ack_data):
@@ -115,9 +129,15 @@ class FileQueue:
         #             import random
         #             if random.randint(1, 100) > 90:
         #                 return True
-        newoutput = ''.join((struct.pack('i', stream_id), ack_data))
+        newoutput = b''.join((struct.pack('i', stream_id), ack_data))
         return self.session.send_packet(udp.CMD_ACK, strng.to_bin(newoutput))
 
+    def do_send_flow_data(self, payload):
+        return self.session.send_packet(udp.CMD_FLOW_DATA, payload)
+
+    def do_send_flow_ack(self, payload):
+        return self.session.send_packet(udp.CMD_FLOW_ACK, payload)
+
     def append_outbox_file(self, filename, description='', result_defer=None, keep_alive=True):
         from bitdust.transport.udp import udp_session
         self.outboxQueue.append((filename, description, result_defer, keep_alive))
@@ -167,24 +187,32 @@ class FileQueue:
     def start_outbox_file(self, filename, filesize, description, result_defer, keep_alive):
         from bitdust.transport.udp import udp_interface
         from bitdust.transport.udp import udp_stream
+        from bitdust.transport.udp import udp_flow
         stream_id = self.make_unique_stream_id()
         if _Debug:
             lg.out(12, 'udp_file_queue.start_outbox_file %d %s %s %d %s' % (stream_id, description, os.path.basename(filename), filesize, self.session.peer_id))
         self.outboxFiles[stream_id] = OutboxFile(self, stream_id, filename, filesize, description, result_defer, keep_alive)
-        self.streams[stream_id] = udp_stream.create(stream_id, self.outboxFiles[stream_id], self)
+        if self.session.use_flow():
+            self.streams[stream_id] = udp_flow.create(stream_id, self.outboxFiles[stream_id], self)
+        else:
+            self.streams[stream_id] = udp_stream.create(stream_id, self.outboxFiles[stream_id], self)
         if keep_alive:
             d = udp_interface.interface_register_file_sending(self.session.peer_id, self.session.peer_idurl, filename, description)
             d.addCallback(self.on_outbox_file_registered, stream_id)
             d.addErrback(self.on_outbox_file_register_failed, stream_id)
             self.outboxFiles[stream_id].registration = d
 
-    def start_inbox_file(self, stream_id, data_size):
+    def start_inbox_file(self, stream_id, data_size, flow=False):
         from bitdust.transport.udp import udp_interface
         from bitdust.transport.udp import udp_stream
+        from bitdust.transport.udp import udp_flow
         if _Debug:
-            lg.out(12, 'udp_file_queue.start_inbox_file %d %d %s' % (stream_id, data_size, self.session.peer_id))
+            lg.out(12, 'udp_file_queue.start_inbox_file %d %d %s flow=%r' % (stream_id, data_size, self.session.peer_id, flow))
         self.inboxFiles[stream_id] = InboxFile(self, stream_id, data_size)
-        self.streams[stream_id] = udp_stream.create(stream_id, self.inboxFiles[stream_id], self)
+        if flow:
+            self.streams[stream_id] = udp_flow.create(stream_id, self.inboxFiles[stream_id], self)
+        else:
+            self.streams[stream_id] = udp_stream.create(stream_id, self.inboxFiles[stream_id], self)
         d = udp_interface.interface_register_file_receiving(self.session.peer_id, self.session.peer_idurl, self.inboxFiles[stream_id].filename, self.inboxFiles[stream_id].size)
         d.addCallback(self.on_inbox_file_registered, stream_id)
         d.addErrback(self.on_inbox_file_register_failed, stream_id)
@@ -194,7 +222,7 @@ class FileQueue:
         del self.streams[stream_id]
         self.dead_streams.append(stream_id)
         if len(self.dead_streams) > NUMBER_OF_STREAMS_TO_REMEMBER:
-            self.dead_streams.pop(0)
+            self.finished_streams.pop(self.dead_streams.pop(0), None)
         if _Debug:
             lg.out(18, 'udp_file_queue.erase_stream %s' % stream_id)
 
@@ -231,23 +259,18 @@ class FileQueue:
     #-------------------------------------------------------------------------
 
     def on_received_data_packet(self, payload):
-        inp = StringIO(payload)
         try:
-            stream_id = int(struct.unpack('i', inp.read(4))[0])
-            data_size = int(struct.unpack('i', inp.read(4))[0])
+            stream_id, data_size = struct.unpack_from('ii', payload)
         except:
-            inp.close()
             lg.exc()
             return
         if not self.session.peer_id:
-            inp.close()
             if _Debug:
                 lg.warn('SEND ZERO ACK, peer id is unknown yet %s' % stream_id)
             self.do_send_ack(stream_id, None, '')
             return
         if stream_id not in list(self.streams.keys()):
             if stream_id in self.dead_streams:
-                inp.close()
                 # if _Debug:
                 # lg.warn('SEND ZERO ACK, got old block %s' % stream_id)
                 self.do_send_ack(stream_id, None, '')
@@ -255,7 +278,6 @@ class FileQueue:
             if len(self.streams) >= 2*MAX_SIMULTANEOUS_STREAMS_PER_SESSION:
                 # too many incoming streams, seems remote side is cheating - drop that session!
                 # TODO: need to add some protection - keep a list of bad guys?
-                inp.close()
                 # lg.warn('too many incoming files for session %s' % str(self.session))
                 # self.session.automat('shutdown')
                 if _Debug:
@@ -264,13 +286,13 @@ class FileQueue:
                 return
             self.start_inbox_file(stream_id, data_size)
         try:
-            self.streams[stream_id].on_block_received(inp)
+            # stream will write the block directly from the datagram, without extra copies
+            self.streams[stream_id].on_block_received(memoryview(payload)[8:])
         except:
             lg.exc()
-        inp.close()
 
     def on_received_ack_packet(self, payload):
-        inp = StringIO(payload)
+        inp = BytesIO(payload)
         try:
             stream_id = int(struct.unpack('i', inp.read(4))[0])
         except:
@@ -299,9 +321,57 @@ class FileQueue:
             self.session.automat('shutdown')
         inp.close()
 
+    def on_received_flow_data_packet(self, payload):
+        from bitdust.transport.udp import udp_flow
+        try:
+            stream_id, data_size = udp_flow.read_data_header(payload)
+        except:
+            lg.exc()
+            return
+        if not self.session.peer_id:
+            # remote side will send that packet again
+            return
+        if stream_id not in self.streams:
+            if stream_id in self.dead_streams:
+                # final ACK was lost, let the remote side know that stream was already closed
+                self.do_send_flow_ack(udp_flow.make_closed_ack(stream_id, self.finished_streams.get(stream_id, udp_flow.DELIVERED_REJECTED)))
+                return
+            if len(self.streams) >= 2*MAX_SIMULTANEOUS_STREAMS_PER_SESSION:
+                if _Debug:
+                    lg.warn('too many active streams: %d  rejected: %s %s' % (len(self.streams), stream_id, self.session.peer_id))
+                self.do_send_flow_ack(udp_flow.make_closed_ack(stream_id))
+                return
+            self.start_inbox_file(stream_id, data_size, flow=True)
+        s = self.streams[stream_id]
+        if not isinstance(s, udp_flow.FlowStream):
+            lg.warn('stream %s is not a udp_flow stream' % stream_id)
+            return
+        try:
+            s.on_data_received(payload)
+        except:
+            lg.exc()
+
+    def on_received_flow_ack_packet(self, payload):
+        from bitdust.transport.udp import udp_flow
+        try:
+            stream_id = udp_flow.read_stream_id(payload)
+        except:
+            lg.exc()
+            return
+        s = self.streams.get(stream_id)
+        if not isinstance(s, udp_flow.FlowStream):
+            return
+        try:
+            s.on_ack_received(payload)
+        except:
+            lg.exc()
+            self.session.automat('shutdown')
+
     def on_inbox_file_done(self, stream_id):
         assert stream_id in list(self.inboxFiles.keys())
         infile = self.inboxFiles[stream_id]
+        if infile.status == 'finished':
+            self.finished_streams[stream_id] = infile.size
         if _Debug:
             lg.out(18, 'udp_file_queue.on_inbox_file_done %s (%d bytes) %s "%s" registration=%r' % (stream_id, infile.size, infile.status, infile.error_message, infile.registration))
         if infile.registration:
@@ -451,6 +521,12 @@ class InboxFile():
         self.fd, self.filename = tmpfile.make('udp-in', extension='.udp')
         self.size = size
         self.bytes_received = 0
+        if size > 0:
+            try:
+                # reserve the space, blocks may come in any order and will be written to their places
+                os.ftruncate(self.fd, size)
+            except:
+                lg.exc()
         self.started = time.time()
         self.cancelled = False
         self.timeout = False
@@ -484,6 +560,11 @@ class InboxFile():
         os.write(self.fd, newdata)
         self.bytes_received += len(newdata)
 
+    def write_block(self, offset, data):
+        write_at(self.fd, data, offset)
+        self.bytes_received += len(data)
+        return self.is_done()
+
     def is_done(self):
         return self.bytes_received == self.size
 
@@ -0,0 +1,1025 @@
+#!/usr/bin/env python
+# udp_flow.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (udp_flow.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+"""
+.. module:: udp_flow.
+
+Congestion controlled stream engine for UDP sessions, an alternative to ``udp_stream``.
+
+Both engines use same consumer and producer objects from ``udp_file_queue``.
+Engine is negotiated per session: every node which supports ``udp_flow`` adds ``PROTOCOL_TAG``
+to the GREETING packet and outgoing files are sent with ``udp_flow`` only if remote peer did the same,
+see ``udp_session.UDPSession.doAcceptGreeting()``. Old nodes simply ignore that extra field.
+
+Differences with ``udp_stream``:
+
+    + datagram size is not fixed: stream starts with safe 508 bytes datagrams and probes bigger sizes
+      from ``DATAGRAM_SIZES`` with real data, discovered size is remembered in the session
+    + every datagram gets a new packet number, so retransmitted data is never confused with original
+      and lost probe can be sent again with smaller datagrams
+    + receiver acknowledges largest received packet number with a bitmap of 64 previous packets (SACK)
+      and number of bytes received in order
+    + sending window is controlled by ``CongestionController`` and datagrams are paced
+      instead of being sent in bursts every ``udp_stream.POOLING_INTERVAL``
+    + every stream keeps only one reactor delayed call for pacing, retransmission and delayed ACK timers
+
+Datagrams format:
+
+    DATA packet:
+
+        bytes:
+          0        software version number
+          1        command identifier ``udp.CMD_FLOW_DATA``
+          2-5      stream_id
+          6-13     total data size to be transferred
+          14-17    packet number, counted from 0 for every stream
+          18-25    offset of the data in the stream
+          from 26  payload data
+
+    ACK packet:
+
+        bytes:
+          0        software version number
+          1        command identifier ``udp.CMD_FLOW_ACK``
+          2-5      stream_id
+          6-9      largest received packet number
+          10-17    bitmap of received packets before the largest one, bit N is packet ``largest - 1 - N``
+          18-25    number of bytes received in order, ``-1`` if stream was rejected
+          26-27    delay of that ACK since the largest packet was received, in 0.1 milliseconds
+          28       flags, ``FLAG_CLOSED`` if receiving stream is already closed
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+import struct
+
+from collections import deque
+from collections import OrderedDict
+
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.transport.udp import udp_stream
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 16
+
+#------------------------------------------------------------------------------
+
+PROTOCOL_TAG = 'flow1'
+
+DATAGRAM_SIZES = (508, 1200, 1472, 8192)  # 8192 is the default receiving buffer of twisted UDP port
+COMMAND_HEADER_SIZE = 2  # software version and command, see ``udp.CommandsProtocol``
+
+DATA_HEADER = struct.Struct('!iqIq')
+ACK_HEADER = struct.Struct('!iIQqHB')
+
+FLAG_CLOSED = 1
+DELIVERED_REJECTED = -1
+
+SACK_BITS = 64
+SACK_MASK = (1 << SACK_BITS) - 1
+
+INITIAL_WINDOW_PACKETS = 10
+MIN_WINDOW_PACKETS = 2
+MAX_WINDOW_BYTES = 16*1024*1024
+MIN_SEND_BUFFER_SIZE = 256*1024
+
+INITIAL_RTT = 0.3
+MIN_RTT_GRANULARITY = 0.001
+MAX_PTO_INTERVAL = udp_stream.RTT_MAX_LIMIT
+MAX_ACK_DELAY = 0.025
+ACK_EVERY_PACKETS = 2
+PACKET_THRESHOLD = 3  # packet is lost if 3 newer packets were acknowledged
+TIME_THRESHOLD = 9.0/8.0  # or if it was sent 9/8 RTT before the newest acknowledged packet
+
+VEGAS_ALPHA = 2.0  # less packets queued in the network - window is growing
+VEGAS_BETA = 6.0  # more packets queued - window is reduced
+LOSS_REDUCTION = 0.7
+
+PACING_GAIN_SLOW_START = 2.0
+PACING_GAIN = 1.25
+PACING_QUANTUM = 0.002  # send packets in small bursts, reactor can not wake up more often
+
+RECEIVING_TIMEOUT = udp_stream.RECEIVING_TIMEOUT
+SENDING_TIMEOUT = udp_stream.SENDING_TIMEOUT
+
+#------------------------------------------------------------------------------
+
+_Enabled = True
+_Streams = set()
+_Counters = {
+    'packets_sent': 0,
+    'packets_retransmitted': 0,
+    'packets_lost': 0,
+    'packets_received': 0,
+    'packets_duplicated': 0,
+    'acks_sent': 0,
+    'acks_received': 0,
+    'probes_sent': 0,
+    'probes_acked': 0,
+    'probes_lost': 0,
+}
+
+#------------------------------------------------------------------------------
+
+
+def enabled():
+    return _Enabled
+
+
+def set_enabled(flag):
+    """
+    When disabled ``PROTOCOL_TAG`` is not sent in the GREETING and remote peers will use ``udp_stream``.
+    """
+    global _Enabled
+    _Enabled = bool(flag)
+
+
+def streams():
+    return _Streams
+
+
+def counters():
+    return dict(_Counters, streams=len(_Streams))
+
+
+def create(stream_id, consumer, producer, clock=None):
+    """
+    Creates a new stream, ``consumer`` is ``udp_file_queue.OutboxFile`` or ``udp_file_queue.InboxFile``.
+    """
+    if _Debug:
+        lg.args(_DebugLevel, stream_id=stream_id, consumer=consumer)
+    s = FlowStream(stream_id, consumer, producer, clock=clock)
+    _Streams.add(s)
+    s.start()
+    return s
+
+
+def read_data_header(payload):
+    """
+    Returns tuple ``(stream_id, total size)`` from DATA packet.
+    """
+    stream_id, data_size, _, _ = DATA_HEADER.unpack_from(payload)
+    return stream_id, data_size
+
+
+def read_stream_id(payload):
+    return struct.unpack_from('!i', payload)[0]
+
+
+def make_closed_ack(stream_id, delivered=DELIVERED_REJECTED):
+    """
+    ACK packet sent for the stream which is not known (or not accepted) on receiving side.
+    ``delivered`` is total size of the file if it was already received completely.
+    """
+    return ACK_HEADER.pack(stream_id, 0, 0, delivered, 0, FLAG_CLOSED)
+
+
+def payload_size(datagram_size):
+    return datagram_size - COMMAND_HEADER_SIZE - DATA_HEADER.size
+
+
+#------------------------------------------------------------------------------
+
+
+class CongestionController(object):
+
+    """
+    Delay based window control with a loss fallback, similar to TCP Vegas.
+
+    Number of own packets waiting in the network queues is estimated from the growth of the RTT above
+    lowest observed RTT. Window is growing while less than ``VEGAS_ALPHA`` packets are queued
+    and reduced when more than ``VEGAS_BETA`` are queued, so the queues on the path are kept short.
+    Slow start also ends as soon as the queue starts to grow, before packets are dropped.
+
+    Loss is considered as congestion only when queueing delay was also detected:
+    random losses on the wireless links do not shrink the window, but only end the slow start.
+    Window is reduced only once per round trip.
+    """
+
+    def __init__(self, mss, initial_rtt=None):
+        self.mss = mss
+        self.cwnd = float(INITIAL_WINDOW_PACKETS*mss)
+        self.ssthresh = float(MAX_WINDOW_BYTES)
+        self.initial_rtt = initial_rtt or INITIAL_RTT
+        self.latest_rtt = None
+        self.min_rtt = None
+        self.srtt = None
+        self.rttvar = None
+        self.recovery_start = None
+
+    def set_mss(self, mss):
+        self.mss = mss
+        self.cwnd = max(self.cwnd, float(MIN_WINDOW_PACKETS*mss))
+
+    def min_window(self):
+        return float(MIN_WINDOW_PACKETS*self.mss)
+
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_rtt_sample(self, rtt, ack_delay=0.0):
+        rtt = max(rtt, MIN_RTT_GRANULARITY)
+        self.latest_rtt = rtt
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if rtt - ack_delay >= self.min_rtt:
+            rtt -= ack_delay
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt/2.0
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt - rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+
+    def queued_packets(self):
+        if self.srtt is None:
+            return 0.0
+        return (self.cwnd/self.mss)*(1.0 - self.min_rtt/max(self.srtt, self.min_rtt))
+
+    def on_acked(self, acked_bytes, sent_time):
+        if self.recovery_start is not None and sent_time <= self.recovery_start:
+            # packet was sent before the window was reduced
+            return
+        queued = self.queued_packets()
+        if self.in_slow_start():
+            if queued > VEGAS_BETA:
+                self.ssthresh = self.cwnd
+            else:
+                self.cwnd += acked_bytes
+        elif queued < VEGAS_ALPHA:
+            self.cwnd += self.mss*acked_bytes/self.cwnd
+        elif queued > VEGAS_BETA:
+            self.cwnd -= self.mss*acked_bytes/self.cwnd
+        self.cwnd = min(max(self.cwnd, self.min_window()), float(MAX_WINDOW_BYTES))
+
+    def on_lost(self, sent_time, now):
+        if self.recovery_start is not None and sent_time <= self.recovery_start:
+            return False
+        self.recovery_start = now
+        if self.queued_packets() >= VEGAS_ALPHA:
+            self.cwnd = max(self.cwnd*LOSS_REDUCTION, self.min_window())
+        self.ssthresh = self.cwnd
+        return True
+
+    def on_timeout(self, now):
+        self.ssthresh = max(self.cwnd*LOSS_REDUCTION, self.min_window())
+        self.cwnd = self.min_window()
+        self.recovery_start = now
+
+    def pto(self):
+        if self.srtt is None:
+            return 2.0*self.initial_rtt
+        return self.srtt + max(4.0*self.rttvar, MIN_RTT_GRANULARITY) + MAX_ACK_DELAY
+
+    def pacing_rate(self):
+        """
+        Returns None until first RTT sample was taken, so the initial window is sent at once.
+        """
+        if self.srtt is None:
+            return None
+        gain = PACING_GAIN_SLOW_START if self.in_slow_start() else PACING_GAIN
+        return gain*self.cwnd/max(self.srtt, MIN_RTT_GRANULARITY)
+
+    def to_json(self):
+        return {
+            'cwnd': int(self.cwnd),
+            'ssthresh': int(self.ssthresh) if self.ssthresh < MAX_WINDOW_BYTES else None,
+            'srtt': round(self.srtt, 4) if self.srtt is not None else None,
+            'min_rtt': round(self.min_rtt, 4) if self.min_rtt is not None else None,
+        }
+
+
+#------------------------------------------------------------------------------
+
+
+class FlowStream(object):
+
+    def __init__(self, stream_id, consumer, producer, clock=None):
+        self.stream_id = stream_id
+        self.consumer = consumer
+        self.producer = producer
+        self.clock = clock or reactor
+        self.sending = not hasattr(consumer, 'on_received_raw_data')
+        self.session = producer.session
+        self.created = self.clock.seconds()
+        self.task = None
+        self.task_time = None
+        self.finished = False
+        self.closed = False
+        #--- sending side
+        self.datagram_size = getattr(self.session, 'flow_datagram_size', None) or DATAGRAM_SIZES[0]
+        min_rtt = getattr(self.session, 'min_rtt', None)
+        if min_rtt is not None and not udp_stream.RTT_MIN_LIMIT <= min_rtt <= udp_stream.RTT_MAX_LIMIT:
+            min_rtt = None
+        self.cc = CongestionController(payload_size(self.datagram_size), initial_rtt=min_rtt)
+        self.buffer = bytearray()
+        self.buffer_offset = 0
+        self.next_offset = 0
+        self.delivered = 0
+        self.retransmit = deque()
+        self.sent_packets = OrderedDict()
+        self.bytes_in_flight = 0
+        self.next_pn = 0
+        self.largest_acked = -1
+        self.last_sent_time = None
+        self.last_ack_time = None
+        self.loss_time = None
+        self.pto_count = 0
+        self.pacing_next = 0.0
+        self.pacing_blocked = False
+        self.probe_pn = None
+        #--- receiving side
+        self.received_offset = 0
+        self.segments = {}
+        self.largest_pn = -1
+        self.largest_pn_time = 0.0
+        self.sack_bitmap = 0
+        self.unacked_packets = 0
+        self.last_data_time = self.created
+        #--- statistics
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_lost = 0
+
+    def __repr__(self):
+        return 'FlowStream(%s|%s|%d)' % (self.stream_id, 'out' if self.sending else 'in', self.datagram_size)
+
+    def start(self):
+        if self.sending:
+            self.consumer.set_stream_callback(self.on_consume)
+        self.wake()
+
+    #------------------------------------------------------------------------------
+
+    def on_consume(self, data):
+        """
+        Called by ``OutboxFile.process()`` to pass more data to be sent.
+        """
+        if self.closed or self.finished:
+            raise udp_stream.BufferOverflow(len(self.buffer))
+        if len(self.buffer) + len(data) > max(MIN_SEND_BUFFER_SIZE, 2*int(self.cc.cwnd)):
+            raise udp_stream.BufferOverflow(len(self.buffer))
+        self.buffer += data
+        self.wake()
+
+    def on_ack_received(self, payload):
+        if not self.sending or self.finished:
+            return
+        _, largest, bitmap, delivered, ack_delay, flags = ACK_HEADER.unpack_from(payload)
+        now = self.clock.seconds()
+        _Counters['acks_received'] += 1
+        if flags & FLAG_CLOSED:
+            if _Debug:
+                lg.args(_DebugLevel, s=self, delivered=delivered, size=self.consumer.size)
+            if delivered >= 0:
+                self._on_delivered(delivered)
+            if not self.finished:
+                self._report_send_done()
+            return
+        if largest >= self.next_pn:
+            lg.warn('wrong packet number %d acknowledged in %r' % (largest, self))
+            return
+        self.last_ack_time = now
+        self.pto_count = 0
+        rec = self.sent_packets.get(largest)
+        if rec is not None and largest > self.largest_acked:
+            self.cc.on_rtt_sample(now - rec[2], ack_delay/10000.0)
+        self._on_packet_acked(largest, now)
+        while bitmap:
+            lowest = bitmap & -bitmap
+            bitmap ^= lowest
+            pn = largest - lowest.bit_length()
+            if pn >= 0:
+                self._on_packet_acked(pn, now)
+        if largest > self.largest_acked:
+            self.largest_acked = largest
+        self._detect_lost_packets(now)
+        self._on_delivered(delivered)
+        if not self.finished:
+            self.wake()
+
+    def on_data_received(self, payload):
+        if self.sending or self.closed:
+            return
+        _, data_size, pn, offset = DATA_HEADER.unpack_from(payload)
+        now = self.clock.seconds()
+        self.last_data_time = now
+        _Counters['packets_received'] += 1
+        in_order = self._register_packet(pn, now)
+        self.unacked_packets += 1
+        if self.finished:
+            self._send_ack(now)
+            return
+        data = payload[DATA_HEADER.size:]
+        end = offset + len(data)
+        eof = False
+        if offset in self.segments or 0 < end <= self.received_offset:
+            _Counters['packets_duplicated'] += 1
+        elif offset <= self.received_offset:
+            eof = self._deliver(data[self.received_offset - offset:])
+        else:
+            self.segments[offset] = data
+            in_order = False
+        if eof or not in_order or self.unacked_packets >= ACK_EVERY_PACKETS:
+            self._send_ack(now)
+        else:
+            self.wake(MAX_ACK_DELAY)
+        if eof:
+            self._report_receive_done()
+
+    def on_close(self):
+        if _Debug:
+            lg.args(_DebugLevel, s=self, finished=self.finished, closed=self.closed)
+        if not self.closed:
+            self.closed = True
+            self._cancel()
+            reactor.callLater(0, self._destroy)  # @UndefinedVariable
+
+    #------------------------------------------------------------------------------
+
+    def wake(self, delay=0):
+        if self.closed:
+            return
+        when = self.clock.seconds() + delay
+        if self.task is not None and self.task.active():
+            if self.task_time <= when:
+                return
+            self.task.reset(delay)
+        else:
+            self.task = self.clock.callLater(delay, self._run)
+        self.task_time = when
+
+    def _cancel(self):
+        if self.task is not None and self.task.active():
+            self.task.cancel()
+        self.task = None
+        self.task_time = None
+
+    def _run(self):
+        self.task = None
+        self.task_time = None
+        if self.closed or self.finished:
+            return
+        now = self.clock.seconds()
+        if self.sending:
+            self._check_sending_timers(now)
+            if not self.finished:
+                self._send_packets(now)
+        else:
+            self._check_receiving_timers(now)
+        if self.closed or self.finished:
+            return
+        deadline = self._next_deadline()
+        if deadline is not None:
+            self.wake(max(0.0, deadline - self.clock.seconds()))
+
+    def _next_deadline(self):
+        deadlines = []
+        if self.sending:
+            if self.sent_packets:
+                deadlines.append(self.last_sent_time + min(self.cc.pto()*(2**self.pto_count), MAX_PTO_INTERVAL))
+            if self.loss_time is not None:
+                deadlines.append(self.loss_time)
+            if self.pacing_blocked:
+                deadlines.append(self.pacing_next - PACING_QUANTUM)
+        else:
+            if self.unacked_packets:
+                deadlines.append(self.largest_pn_time + MAX_ACK_DELAY)
+            deadlines.append(self.last_data_time + RECEIVING_TIMEOUT)
+        if not deadlines:
+            return None
+        return min(deadlines)
+
+    #------------------------------------------------------------------------------
+
+    def _check_sending_timers(self, now):
+        if self.loss_time is not None and now >= self.loss_time:
+            self._detect_lost_packets(now)
+        if not self.sent_packets:
+            return
+        if now < self.last_sent_time + min(self.cc.pto()*(2**self.pto_count), MAX_PTO_INTERVAL):
+            return
+        if now - (self.last_ack_time or self.created) > SENDING_TIMEOUT:
+            self._report_send_timeout()
+            return
+        # nothing was acknowledged for too long, all packets in flight are considered lost
+        self.pto_count += 1
+        self.cc.on_timeout(now)
+        for pn in list(self.sent_packets.keys()):
+            self._on_packet_lost(pn, now, timeout=True)
+        self.loss_time = None
+
+    def _detect_lost_packets(self, now):
+        self.loss_time = None
+        if self.largest_acked < 0:
+            return
+        rtt = max(self.cc.srtt or 0.0, self.cc.latest_rtt or 0.0, MIN_RTT_GRANULARITY)
+        lost_send_time = now - TIME_THRESHOLD*rtt
+        lost = []
+        for pn, rec in self.sent_packets.items():
+            if pn >= self.largest_acked:
+                break
+            if pn <= self.largest_acked - PACKET_THRESHOLD or rec[2] <= lost_send_time:
+                lost.append(pn)
+            else:
+                self.loss_time = rec[2] + TIME_THRESHOLD*rtt
+                break
+        for pn in lost:
+            self._on_packet_lost(pn, now)
+
+    def _on_packet_acked(self, pn, now):
+        rec = self.sent_packets.pop(pn, None)
+        if rec is None:
+            return
+        offset, length, sent_time, wire_size, is_probe = rec
+        self.bytes_in_flight -= wire_size
+        if is_probe:
+            self.probe_pn = None
+            _Counters['probes_acked'] += 1
+            self.datagram_size = wire_size
+            self.session.flow_datagram_size = max(wire_size, getattr(self.session, 'flow_datagram_size', None) or 0)
+            self.cc.set_mss(payload_size(wire_size))
+            if _Debug:
+                lg.args(_DebugLevel, s=self, datagram_size=wire_size)
+        self.cc.on_acked(wire_size, sent_time)
+
+    def _on_packet_lost(self, pn, now, timeout=False):
+        rec = self.sent_packets.pop(pn, None)
+        if rec is None:
+            return
+        offset, length, sent_time, wire_size, is_probe = rec
+        self.bytes_in_flight -= wire_size
+        if is_probe:
+            # probe of bigger datagram was lost, that is not a congestion signal
+            self.probe_pn = None
+            _Counters['probes_lost'] += 1
+            getattr(self.session, 'flow_failed_sizes', set()).add(wire_size)
+        else:
+            self.packets_lost += 1
+            _Counters['packets_lost'] += 1
+            if not timeout:
+                self.cc.on_lost(sent_time, now)
+        if offset + length > self.delivered or length == 0:
+            self.retransmit.append((offset, length))
+
+    def _on_delivered(self, delivered):
+        if delivered < self.delivered or (delivered == self.delivered and self.consumer.size > 0):
+            return
+        delta = delivered - self.delivered
+        self.delivered = delivered
+        if delivered > self.buffer_offset:
+            del self.buffer[:delivered - self.buffer_offset]
+            self.buffer_offset = delivered
+        done = False
+        try:
+            done = self.consumer.on_sent_raw_data(delta)
+        except:
+            lg.exc()
+        if done or self.consumer.is_done():
+            self._report_send_done()
+
+    #------------------------------------------------------------------------------
+
+    def _send_packets(self, now):
+        self.pacing_blocked = False
+        mss = payload_size(self.datagram_size)
+        while self.bytes_in_flight == 0 or self.bytes_in_flight + mss <= self.cc.cwnd:
+            if self.pacing_next > now + PACING_QUANTUM:
+                self.pacing_blocked = True
+                break
+            segment = self._next_segment(mss)
+            if segment is None:
+                break
+            self._send_segment(segment[0], segment[1], segment[2], now)
+
+    def _next_segment(self, mss):
+        while self.retransmit:
+            offset, length = self.retransmit.popleft()
+            if offset < self.delivered:
+                length -= self.delivered - offset
+                offset = self.delivered
+                if length <= 0:
+                    continue
+            if length > mss:
+                self.retransmit.appendleft((offset + mss, length - mss))
+                length = mss
+            _Counters['packets_retransmitted'] += 1
+            return offset, length, False
+        available = self.buffer_offset + len(self.buffer) - self.next_offset
+        if available <= 0:
+            if self.next_pn == 0 and self.consumer.size == 0:
+                # empty file, receiver still must get one packet
+                return 0, 0, False
+            return None
+        probe_mss = self._probe_payload_size()
+        if probe_mss and available >= probe_mss:
+            self.probe_pn = self.next_pn
+            _Counters['probes_sent'] += 1
+            length = probe_mss
+        else:
+            length = min(available, mss)
+        offset = self.next_offset
+        self.next_offset += length
+        return offset, length, self.probe_pn == self.next_pn
+
+    def _probe_payload_size(self):
+        if self.probe_pn is not None or self.largest_acked < 0:
+            return None
+        failed_sizes = getattr(self.session, 'flow_failed_sizes', set())
+        for datagram_size in DATAGRAM_SIZES:
+            if datagram_size <= self.datagram_size:
+                continue
+            if datagram_size in failed_sizes:
+                return None
+            return payload_size(datagram_size)
+        return None
+
+    def _send_segment(self, offset, length, is_probe, now):
+        start = offset - self.buffer_offset
+        pn = self.next_pn
+        self.next_pn += 1
+        payload = DATA_HEADER.pack(self.stream_id, self.consumer.size, pn, offset) + self.buffer[start:start + length]
+        wire_size = len(payload) + COMMAND_HEADER_SIZE
+        self.sent_packets[pn] = (offset, length, now, wire_size, is_probe)
+        self.bytes_in_flight += wire_size
+        self.bytes_sent += length
+        self.last_sent_time = now
+        rate = self.cc.pacing_rate()
+        if rate is not None:
+            global_limit = udp_stream.get_global_output_limit_bytes_per_sec()
+            if global_limit > 0:
+                rate = min(rate, global_limit/max(1, len(_Streams)))
+            self.pacing_next = max(self.pacing_next, now - PACING_QUANTUM) + wire_size/rate
+        _Counters['packets_sent'] += 1
+        try:
+            self.producer.do_send_flow_data(payload)
+        except:
+            lg.exc()
+
+    #------------------------------------------------------------------------------
+
+    def _register_packet(self, pn, now):
+        """
+        Updates SACK bitmap and returns True if packet came in order.
+        """
+        if pn > self.largest_pn:
+            shift = pn - self.largest_pn
+            if self.largest_pn >= 0:
+                self.sack_bitmap = ((self.sack_bitmap << shift) | (1 << (shift - 1))) & SACK_MASK
+            self.largest_pn = pn
+            self.largest_pn_time = now
+            return shift == 1
+        index = self.largest_pn - 1 - pn
+        if 0 <= index < SACK_BITS:
+            self.sack_bitmap |= 1 << index
+        return False
+
+    def _deliver(self, data):
+        pieces = [data]
+        self.received_offset += len(data)
+        while self.segments:
+            segment = self.segments.pop(self.received_offset, None)
+            if segment is None:
+                # retransmitted data may be split differently than the original packets
+                for offset in list(self.segments.keys()):
+                    end = offset + len(self.segments[offset])
+                    if end <= self.received_offset:
+                        self.segments.pop(offset)
+                    elif offset < self.received_offset:
+                        segment = self.segments.pop(offset)[self.received_offset - offset:]
+                        break
+                if segment is None:
+                    break
+            pieces.append(segment)
+            self.received_offset += len(segment)
+        newdata = b''.join(pieces) if len(pieces) > 1 else data
+        self.bytes_received += len(newdata)
+        try:
+            return self.consumer.on_received_raw_data(newdata)
+        except:
+            lg.exc()
+        return False
+
+    def _send_ack(self, now):
+        ack_delay = min(int((now - self.largest_pn_time)*10000), 65535)
+        flags = FLAG_CLOSED if self.closed else 0
+        self.unacked_packets = 0
+        _Counters['acks_sent'] += 1
+        try:
+            self.producer.do_send_flow_ack(ACK_HEADER.pack(self.stream_id, max(self.largest_pn, 0), self.sack_bitmap, self.received_offset, ack_delay, flags))
+        except:
+            lg.exc()
+
+    def _check_receiving_timers(self, now):
+        if now - self.last_data_time > RECEIVING_TIMEOUT:
+            self._report_receive_timeout()
+            return
+        if self.unacked_packets and now >= self.largest_pn_time + MAX_ACK_DELAY - MIN_RTT_GRANULARITY:
+            self._send_ack(now)
+
+    #------------------------------------------------------------------------------
+
+    def _report_send_done(self):
+        self.finished = True
+        self._cancel()
+        if self.consumer.is_done():
+            self.consumer.status = 'finished'
+        else:
+            self.consumer.status = 'failed'
+            self.consumer.error_message = 'sending was not finished correctly'
+        if _Debug:
+            lg.args(_DebugLevel, s=self, status=self.consumer.status, cc=self.cc.to_json(), lost=self.packets_lost)
+        self.producer.on_outbox_file_done(self.stream_id)
+
+    def _report_send_timeout(self):
+        self.finished = True
+        self._cancel()
+        if self.last_ack_time is None:
+            self.consumer.error_message = 'sending failed'
+        else:
+            self.consumer.error_message = 'remote side stopped responding'
+        self.consumer.status = 'failed'
+        self.consumer.timeout = True
+        self.producer.on_timeout_sending(self.stream_id)
+
+    def _report_receive_done(self):
+        self.finished = True
+        self._cancel()
+        self.consumer.status = 'finished'
+        self.producer.on_inbox_file_done(self.stream_id)
+
+    def _report_receive_timeout(self):
+        self.finished = True
+        self._cancel()
+        self.consumer.error_message = 'receiving timeout'
+        self.consumer.status = 'failed'
+        self.consumer.timeout = True
+        self.producer.on_timeout_receiving(self.stream_id)
+
+    def _destroy(self):
+        _Streams.discard(self)
+        self.buffer = bytearray()
+        self.segments.clear()
+        self.sent_packets.clear()
+        self.retransmit.clear()
+        if self.consumer:
+            self.consumer.clear_stream_callback()
+            self.producer.on_close_consumer(self.consumer)
+            self.consumer = None
+        if self.producer:
+            self.producer.on_close_stream(self.stream_id)
+            self.producer = None
+        self.session = None
+
+    def to_json(self):
+        j = self.cc.to_json()
+        j.update({
+            'stream_id': self.stream_id,
+            'direction': 'out' if self.sending else 'in',
+            'datagram_size': self.datagram_size,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'in_flight': self.bytes_in_flight,
+            'lost': self.packets_lost,
+        })
+        return j
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Sends a file over loopback UDP sockets with simulated delay and loss.
+    Compares this engine with a fixed window of 508 bytes datagrams, which is how ``udp_stream`` is configured:
+    ``udp_stream.WINDOW_SIZE*udp_stream.BLOCKS_PER_ACK`` blocks in flight.
+    """
+    import os
+    import time
+    import random
+    from twisted.internet.protocol import DatagramProtocol  # @UnresolvedImport
+
+    class _Session(object):
+
+        def __init__(self):
+            self.peer_id = 'loopback'
+            self.min_rtt = None
+            self.flow_datagram_size = None
+            self.flow_failed_sizes = set()
+
+    class _Endpoint(DatagramProtocol):
+
+        def __init__(self, loss, delay):
+            self.loss = loss
+            self.delay = delay
+            self.peer = None
+            self.stream = None
+
+        def send(self, payload):
+            if random.random() < self.loss:
+                return True
+            if self.delay:
+                reactor.callLater(self.delay, self.transport.write, payload, self.peer)  # @UndefinedVariable
+            else:
+                self.transport.write(payload, self.peer)
+            return True
+
+        def datagramReceived(self, datagram, address):
+            if self.stream is None:
+                return
+            if self.stream.sending:
+                self.stream.on_ack_received(datagram)
+            else:
+                self.stream.on_data_received(datagram)
+
+    class _Producer(object):
+
+        def __init__(self, endpoint, on_done):
+            self.session = _Session()
+            self.endpoint = endpoint
+            self.on_done = on_done
+
+        def do_send_flow_data(self, payload):
+            return self.endpoint.send(payload)
+
+        def do_send_flow_ack(self, payload):
+            return self.endpoint.send(payload)
+
+        def _done(self, stream_id):
+            self.on_done(self)
+
+        on_outbox_file_done = on_inbox_file_done = on_timeout_sending = on_timeout_receiving = _done
+
+        def on_close_consumer(self, consumer):
+            pass
+
+        def on_close_stream(self, stream_id):
+            pass
+
+    class _Source(object):
+
+        def __init__(self, data):
+            self.data = data
+            self.size = len(data)
+            self.pos = 0
+            self.bytes_delivered = 0
+            self.stream_callback = None
+            self.status = None
+            self.error_message = ''
+            self.timeout = False
+
+        def set_stream_callback(self, cb):
+            self.stream_callback = cb
+            self.process()
+
+        def clear_stream_callback(self):
+            self.stream_callback = None
+
+        def process(self):
+            while self.stream_callback and self.pos < self.size:
+                chunk = self.data[self.pos:self.pos + udp_stream.CHUNK_SIZE]
+                try:
+                    self.stream_callback(chunk)
+                except udp_stream.BufferOverflow:
+                    break
+                self.pos += len(chunk)
+
+        def is_done(self):
+            return self.bytes_delivered == self.size
+
+        def on_sent_raw_data(self, bytes_delivered):
+            self.bytes_delivered += bytes_delivered
+            self.process()
+            return self.is_done()
+
+    class _Sink(object):
+
+        def __init__(self, size):
+            self.size = size
+            self.bytes_received = 0
+            self.status = None
+            self.error_message = ''
+            self.timeout = False
+
+        def clear_stream_callback(self):
+            pass
+
+        def on_received_raw_data(self, newdata):
+            self.bytes_received += len(newdata)
+            return self.bytes_received == self.size
+
+    class _FixedWindow(CongestionController):
+
+        def on_acked(self, acked_bytes, sent_time):
+            pass
+
+        def on_lost(self, sent_time, now):
+            return False
+
+        def on_timeout(self, now):
+            pass
+
+        def pacing_rate(self):
+            return None
+
+    file_size = 1024*1024*4
+    data = os.urandom(file_size)
+    scenarios = [
+        (0.0, 0.0),
+        (0.01, 0.005),
+        (0.02, 0.02),
+        (0.05, 0.01),
+    ]
+    results = []
+
+    def _run_next():
+        if not scenarios:
+            reactor.stop()  # @UndefinedVariable
+            return
+        delay, loss = scenarios[0]
+        engine = 'fixed window' if len(results) % 2 == 0 else 'udp_flow'
+        if engine == 'udp_flow':
+            scenarios.pop(0)
+        sender_end = _Endpoint(loss, delay/2.0)
+        receiver_end = _Endpoint(loss, delay/2.0)
+        sender_port = reactor.listenUDP(0, sender_end, interface='127.0.0.1')  # @UndefinedVariable
+        receiver_port = reactor.listenUDP(0, receiver_end, interface='127.0.0.1')  # @UndefinedVariable
+        sender_end.peer = ('127.0.0.1', receiver_port.getHost().port)
+        receiver_end.peer = ('127.0.0.1', sender_port.getHost().port)
+        started = [time.time(), time.process_time()]
+
+        def _on_done(producer):
+            if producer is receiver_producer:
+                # receiving stream stays open and keeps sending ACKs until sender is finished
+                started.extend([time.time() - started[0], time.process_time() - started[1]])
+                return
+            elapsed, cpu = started[2:4]
+            results.append(engine)
+            print('%-12s delay=%3d ms loss=%4.1f%%: %6.2f MB/sec, %5.2f sec CPU per 100 MB, datagram %d bytes, %d lost, status %s' % (
+                engine,
+                delay*1000,
+                loss*100,
+                file_size/elapsed/(1024.0*1024.0),
+                cpu/(file_size/(1024.0*1024.0*100.0)),
+                sender.datagram_size,
+                sender.packets_lost,
+                sink.status,
+            ))
+            sender.on_close()
+            receiver.on_close()
+            sender_port.stopListening()
+            receiver_port.stopListening()
+            reactor.callLater(0.5, _run_next)  # @UndefinedVariable
+
+        sender_producer = _Producer(sender_end, _on_done)
+        receiver_producer = _Producer(receiver_end, _on_done)
+        sender = FlowStream(1, _Source(data), sender_producer)
+        if engine == 'fixed window':
+            sender_producer.session.flow_failed_sizes.update(DATAGRAM_SIZES)
+            sender.cc = _FixedWindow(payload_size(DATAGRAM_SIZES[0]))
+            sender.cc.cwnd = float(udp_stream.WINDOW_SIZE*udp_stream.BLOCKS_PER_ACK*DATAGRAM_SIZES[0])
+        sink = _Sink(file_size)
+        receiver = FlowStream(1, sink, receiver_producer)
+        sender_end.stream = sender
+        receiver_end.stream = receiver
+        _Streams.update([sender, receiver])
+        receiver.start()
+        sender.start()
+
+    reactor.callWhenRunning(_run_next)  # @UndefinedVariable
+    reactor.run()  # @UndefinedVariable
+    print('    %r' % counters())
+
+
+if __name__ == '__main__':
+    main()
@@ -58,6 +58,8 @@ from bitdust.lib import udp
 
 from bitdust.automats import automat
 
+from bitdust.transport.udp import udp_flow
+
 #------------------------------------------------------------------------------
 
 _Debug = False
@@ -276,6 +278,12 @@ class UDPSession(automat.Automat):
     def get_idurl(self):
         return self.peer_idurl
 
+    def use_flow(self):
+        """
+        Outgoing files are sent via ``udp_flow`` engine only if remote peer supports it.
+        """
+        return udp_flow.enabled() and udp_flow.PROTOCOL_TAG in self.peer_capabilities
+
     def msg(self, msgid, *args, **kwargs):
         return self.MESSAGES.get(msgid, '')
 
@@ -292,6 +300,9 @@ class UDPSession(automat.Automat):
         self.peer_rtt_id = '0'  # in
         self.rtts = {}
         self.min_rtt = None
+        self.peer_capabilities = set()
+        self.flow_datagram_size = None
+        self.flow_failed_sizes = set()
 
     def send_packet(self, command, payload):
         self.bytes_sent += len(payload)
@@ -388,7 +399,7 @@ class UDPSession(automat.Automat):
         Condition method.
         """
         command = args[0][0][0]
-        return (command == udp.CMD_DATA or command == udp.CMD_ACK)
+        return command in (udp.CMD_DATA, udp.CMD_ACK, udp.CMD_FLOW_DATA, udp.CMD_FLOW_ACK)
 
     def isPing(self, *args, **kwargs):
         """
@@ -458,6 +469,9 @@ class UDPSession(automat.Automat):
             str(self.peer_rtt_id),
             str(self.my_rtt_id),
         )
+        if udp_flow.enabled():
+            # remote peer will know that we are able to receive files via udp_flow
+            payload += ' ' + udp_flow.PROTOCOL_TAG
         udp.send_command(self.node.listen_port, udp.CMD_GREETING, strng.to_bin(payload), self.peer_address)
         # print 'doGreeting', self.peer_rtt_id, self.my_rtt_id
         self.peer_rtt_id = '0'
@@ -484,7 +498,7 @@ class UDPSession(automat.Automat):
         Action method.
         """
         address, command, payload = self._dispatch_datagram(args[0])
-        parts = payload.split(' ')
+        parts = strng.to_text(payload).split(' ')
         try:
             new_peer_id = parts[0]
             new_peer_idurl = parts[1]
@@ -496,6 +510,7 @@ class UDPSession(automat.Automat):
                 self.my_rtt_id = parts[2]
             else:
                 self.my_rtt_id = '0'
+            self.peer_capabilities = set(parts[4:])
         except:
             lg.exc()
             return
@@ -563,6 +578,10 @@ class UDPSession(automat.Automat):
             self.file_queue.on_received_data_packet(payload)
         elif command == udp.CMD_ACK:
             self.file_queue.on_received_ack_packet(payload)
+        elif command == udp.CMD_FLOW_DATA:
+            self.file_queue.on_received_flow_data_packet(payload)
+        elif command == udp.CMD_FLOW_ACK:
+            self.file_queue.on_received_flow_ack_packet(payload)
 #        elif command == udp.CMD_PING:
 #            pass
 #        elif command == udp.CMD_ALIVE:
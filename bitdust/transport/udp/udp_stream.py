@@ -79,8 +79,8 @@ Datagrams format:
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
+from __future__ import print_function
 from six.moves import map
-from io import StringIO
 
 #------------------------------------------------------------------------------
 
@@ -343,7 +343,9 @@ class UDPStream(automat.Automat):
         self.input_acks_counter = 0
         self.input_acks_timeouts_counter = 0
         self.input_acks_garbage_counter = 0
-        self.input_blocks = {}
+        self.input_blocks_bitmap = None
+        self.input_blocks_total = 0
+        self.input_blocks_pending = 0
         self.input_block_id_current = 0
         self.input_block_last_time = 0
         self.input_block_id_last = 0
@@ -634,7 +636,6 @@ class UDPStream(automat.Automat):
             )
             lg.out(self.debug_level, '    ACK REASONS: %r' % self.output_acks_reasons)
             del pir_id
-        self.input_blocks.clear()
         self.input_blocks_to_ack = []
         self.output_blocks.clear()
         self.output_blocks_ids = []
@@ -664,20 +665,27 @@ class UDPStream(automat.Automat):
         self.destroy()
         reactor.callLater(0, balance_streams_limits)  # @UndefinedVariable
 
-    def on_block_received(self, inpt):
-        if not (self.consumer and getattr(self.consumer, 'on_received_raw_data', None)):
+    def on_block_received(self, block):
+        """
+        ``block`` is a bytes-like object, usually a ``memoryview`` of the received datagram:
+        4 bytes of block_id followed by the block data.
+
+        Position of every block in the file is known: all blocks are ``BLOCK_SIZE`` long except the last one.
+        So every new block is written right away to its place in the file
+        and marked in a bitmap of received blocks, nothing is buffered in memory.
+        """
+        if not (self.consumer and getattr(self.consumer, 'write_block', None)):
             return
             #--- RECEIVE DATA HERE!
-        block_id = inpt.read(4)
         try:
-            block_id = int(struct.unpack('i', block_id)[0])
+            block_id = int(struct.unpack_from('i', block)[0])
         except:
             lg.exc()
             if _Debug:
                 lg.out(self.debug_level, 'ERROR receiving, stream_id=%s' % self.stream_id)
             return
             #--- read block data
-        data = inpt.read()
+        data = block[4:]
         self.input_block_last_time = time.time() - self.creation_time
         self.input_blocks_counter += 1
         if block_id != -1:
@@ -685,40 +693,40 @@ class UDPStream(automat.Automat):
             self.input_bytes_received += len(data)
             self.input_block_id_last = block_id
             eof = False
-            raw_size = 0
-            if block_id in list(self.input_blocks.keys()):
-                #--- duplicated block received
-                self.input_duplicated_blocks += 1
-                self.input_duplicated_bytes += len(data)
-                bisect.insort(self.input_blocks_to_ack, block_id)
-            else:
-                if block_id < self.input_block_id_current:
+            if self.input_blocks_bitmap is None:
+                self.input_blocks_total = (self.consumer.size + BLOCK_SIZE - 1)//BLOCK_SIZE
+                self.input_blocks_bitmap = bytearray((self.input_blocks_total + 7)//8)
+            index = block_id - 1
+            if index < 0 or index >= self.input_blocks_total or (len(data) != BLOCK_SIZE and index*BLOCK_SIZE + len(data) != self.consumer.size):
+                #--- block is not fit into the file
+                lg.warn('wrong block %d with %d bytes received in stream %d' % (block_id, len(data), self.stream_id))
+                return
+            mask = 1 << (index & 7)
+            if self.input_blocks_bitmap[index >> 3] & mask:
+                if block_id <= self.input_block_id_current:
                     #--- old block (already processed) received
                     self.input_old_blocks += 1
-                    self.input_duplicated_bytes += len(data)
-                    bisect.insort(self.input_blocks_to_ack, block_id)
                 else:
-                    #--- GOOD BLOCK RECEIVED
-                    self.input_blocks[block_id] = data
-                    bisect.insort(self.input_blocks_to_ack, block_id)
-            if block_id == self.input_block_id_current + 1:
-                #--- receiving data and check every next block one by one
-                newdata = StringIO()
-                while True:
-                    next_block_id = self.input_block_id_current + 1
-                    try:
-                        blockdata = self.input_blocks.pop(next_block_id)
-                    except KeyError:
-                        break
-                    newdata.write(blockdata)
-                    raw_size += len(blockdata)
-                    self.input_block_id_current = next_block_id
+                    #--- duplicated block received
+                    self.input_duplicated_blocks += 1
+                self.input_duplicated_bytes += len(data)
+            else:
+                #--- GOOD BLOCK RECEIVED
+                self.input_blocks_bitmap[index >> 3] |= mask
+                self.input_blocks_pending += 1
                 try:
-                    #--- consume data and get EOF state
-                    eof = self.consumer.on_received_raw_data(newdata.getvalue())
+                    #--- write data to the file and get EOF state
+                    eof = self.consumer.write_block(index*BLOCK_SIZE, data)
                 except:
                     lg.exc()
-                newdata.close()
+                #--- move current block_id over all blocks received in order
+                while self.input_block_id_current < self.input_blocks_total:
+                    next_index = self.input_block_id_current
+                    if not self.input_blocks_bitmap[next_index >> 3] & (1 << (next_index & 7)):
+                        break
+                    self.input_block_id_current += 1
+                    self.input_blocks_pending -= 1
+            bisect.insort(self.input_blocks_to_ack, block_id)
             #--- remember EOF state
             if eof and not self.eof:
                 self.eof = eof
@@ -867,18 +875,14 @@ class UDPStream(automat.Automat):
             reactor.callLater(0, self.automat, 'close')  # @UndefinedVariable
 
     def _push_blocks(self, data):
-        outp = StringIO(data)
-        while True:
-            piece = outp.read(BLOCK_SIZE)
-            if not piece:
-                break
+        for pos in range(0, len(data), BLOCK_SIZE):
+            piece = data[pos:pos + BLOCK_SIZE]
             self.output_block_id_current += 1
             #--- prepare block to be send
             bisect.insort(self.output_blocks_ids, self.output_block_id_current)
             # data, time_sent, acks missed, number of attempts
             self.output_blocks[self.output_block_id_current] = [piece, -1, 0, 0]
             self.output_buffer_size += len(piece)
-        outp.close()
         if _Debug:
             lg.out(self.debug_level + 6, 'PUSH %d [%s]' % (self.output_block_id_current, ','.join(map(str, self.output_blocks_ids))))
 
@@ -950,8 +954,8 @@ class UDPStream(automat.Automat):
                             self.output_acks_counter,
                             #--- last BLOCK received
                             round(relative_time - self.input_block_last_time, 4),
-                            #--- input buffer
-                            len(self.input_blocks),
+                            #--- blocks received out of order
+                            self.input_blocks_pending,
                             #--- number of streams
                             len(streams()),
                         )
@@ -1278,7 +1282,7 @@ class UDPStream(automat.Automat):
         #--- prepare EOF state in ACK
         ack_data = struct.pack('?', self.eof)
         #--- prepare ACKS
-        ack_data += ''.join([struct.pack('i', bid) for bid in acks])
+        ack_data += b''.join([struct.pack('i', bid) for bid in acks])
         if pause_time > 0:
             #--- add extra "PAUSE REQUIRED" ACK
             ack_data += struct.pack('i', -1)
@@ -1330,3 +1334,105 @@ class UDPStream(automat.Automat):
         if relative_time < 0.5:
             return 0.0
         return self.output_bytes_sent/relative_time
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Pushes 100 MB of DATA blocks through the receiving side of ``UDPStream``, as it happens on a lossy link:
+    blocks are shuffled within a window of 64 blocks, 1% of blocks are lost and come again 2048 blocks later
+    and 1% of blocks are duplicated.
+
+    Same blocks are also passed through the previous way of re-assembling alone, without the state machine:
+    dictionary of buffered blocks, ``list(keys())`` check and concatenation of the blocks received in order.
+    """
+    import os
+    import random
+    import shutil
+    import tempfile
+    import hashlib
+    from io import BytesIO
+    from bitdust.system import tmpfile
+    from bitdust.transport.udp import udp_file_queue
+
+    class _Session(object):
+        peer_id = 'benchmark'
+        peer_address = ('127.0.0.1', 0)
+        min_rtt = None
+
+    class _Producer(object):
+        session = _Session()
+        acks = 0
+        done = False
+
+        def do_send_ack(self, stream_id, consumer, ack_data):
+            self.acks += 1
+
+        def on_inbox_file_done(self, stream_id):
+            self.done = True
+
+        def on_timeout_receiving(self, stream_id):
+            print('receiving timeout')
+
+    file_size = 1024*1024*100
+    data = os.urandom(file_size)
+    blocks_total = (file_size + BLOCK_SIZE - 1)//BLOCK_SIZE
+    order = []
+    for index in range(blocks_total):
+        position = index - index % 64 + random.random()*64
+        if random.random() < 0.01:
+            position += 2048
+        order.append((position, index))
+        if random.random() < 0.01:
+            order.append((position + random.random()*64, index))
+    order = [index for _, index in sorted(order)]
+    blocks = [struct.pack('i', index + 1) + data[index*BLOCK_SIZE:(index + 1)*BLOCK_SIZE] for index in order]
+    temp_dir = tempfile.mkdtemp(prefix='udp_stream_')
+    tmpfile.init(temp_dir)
+
+    # previous implementation
+    fd, filename = tempfile.mkstemp(dir=temp_dir)
+    input_blocks = {}
+    input_block_id_current = 0
+    t = time.time()
+    for block in blocks:
+        block_id = struct.unpack_from('i', block)[0]
+        if block_id in list(input_blocks.keys()) or block_id <= input_block_id_current:
+            continue
+        input_blocks[block_id] = block[4:]
+        if block_id == input_block_id_current + 1:
+            newdata = BytesIO()
+            while True:
+                try:
+                    blockdata = input_blocks.pop(input_block_id_current + 1)
+                except KeyError:
+                    break
+                newdata.write(blockdata)
+                input_block_id_current += 1
+            os.write(fd, newdata.getvalue())
+            newdata.close()
+    legacy_time = time.time() - t
+    os.close(fd)
+
+    # bitmap and direct writes to the file
+    producer = _Producer()
+    infile = udp_file_queue.InboxFile(producer, 1, file_size)
+    s = create(1, infile, producer)
+    t = time.time()
+    for block in blocks:
+        s.on_block_received(memoryview(block))
+    bitmap_time = time.time() - t
+    infile.close_file()
+    with open(infile.filename, 'rb') as f:
+        received_ok = hashlib.md5(f.read()).digest() == hashlib.md5(data).digest()
+    print('%d blocks of %d bytes, %d MB in total, %d duplicated' % (len(blocks), BLOCK_SIZE, file_size//(1024*1024), len(blocks) - blocks_total))
+    print('    dictionary of blocks:  %.2f sec, %.2f MB/sec' % (legacy_time, file_size/legacy_time/(1024.0*1024.0)))
+    print('    bitmap + file writes:  %.2f sec, %.2f MB/sec, %.2f usec per block' % (bitmap_time, file_size/bitmap_time/(1024.0*1024.0), bitmap_time*1000000.0/len(blocks)))
+    print('    done=%r correct=%r acks=%d duplicated=%d old=%d' % (producer.done, received_ok, producer.acks, s.input_duplicated_blocks, s.input_old_blocks))
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
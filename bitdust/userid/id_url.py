@@ -39,6 +39,10 @@ you can understand that he is actually trying to contact you and act properly.
 
 Also if you stored some packet for user A and then his IDURL changed you must still be able to
 correctly reply to him and send stored data back when he requests.
+
+All verified historical identities are also saved in a single versioned snapshot file inside the
+identity history folder together with a hash of every file content. At startup only files which
+are not matching with the snapshot are parsed and verified again.
 """
 
 #------------------------------------------------------------------------------
@@ -68,6 +72,7 @@ from bitdust.crypt import hashes
 
 from bitdust.lib import strng
 from bitdust.lib import nameurl
+from bitdust.lib import jsn
 
 from bitdust.main import settings
 
@@ -84,6 +89,11 @@ _Ready = False
 
 #------------------------------------------------------------------------------
 
+HISTORY_SNAPSHOT_FILENAME = 'snapshot'
+HISTORY_SNAPSHOT_VERSION = 1
+
+#------------------------------------------------------------------------------
+
 
 def init():
     global _IdentityHistoryDir
@@ -93,7 +103,6 @@ def init():
     global _KnownSources
     global _KnownUniqueNames
     global _Ready
-    from bitdust.userid import identity
     if _Debug:
         lg.out(_DebugLevel, 'id_url.init')
     if not _IdentityHistoryDir:
@@ -103,6 +112,9 @@ def init():
         lg.info('created new folder %r' % _IdentityHistoryDir)
     else:
         lg.info('using existing folder %r' % _IdentityHistoryDir)
+    snapshot = read_history_snapshot()
+    new_snapshot = {}
+    verified_count = 0
     for_cleanup = []
     for one_user_dir in os.listdir(_IdentityHistoryDir):
         one_user_name = one_user_dir.split('@')[0]
@@ -122,26 +134,27 @@ def init():
         one_user_identity_files.sort()
         for one_ident_file in one_user_identity_files:
             one_ident_path = os.path.join(one_user_dir_path, strng.to_text(one_ident_file))
+            one_snapshot_key = '{}/{}'.format(one_user_dir, one_ident_file)
             try:
-                xmlsrc = local_fs.ReadTextFile(one_ident_path)
-                known_id_obj = identity.identity(xmlsrc=xmlsrc)
-                if not known_id_obj.isCorrect():
-                    raise Exception('identity history in %r is broken, identity is not correct: %r' % (one_user_dir, one_ident_path))
-                if not known_id_obj.Valid():
-                    raise Exception('identity history in %r is broken, identity is not valid: %r' % (one_user_dir, one_ident_path))
+                xmlsrc = local_fs.ReadBinaryFile(one_ident_path)
+                content_hash = strng.to_text(hashes.sha1(xmlsrc, hexdigest=True))
+                record = snapshot.get(one_snapshot_key)
+                if not record or record['hash'] != content_hash:
+                    record = verify_history_file(one_user_dir, one_ident_path, xmlsrc, content_hash)
+                    verified_count += 1
             except Exception as exc:
                 lg.err(str(exc))
                 for_cleanup.append(one_ident_path)
                 continue
-            one_pub_key = known_id_obj.getPublicKey()
-            one_revision = known_id_obj.getRevisionValue()
+            one_pub_key = strng.to_bin(record['pub_key'])
+            one_revision = record['revision']
+            known_sources = [strng.to_bin(s) for s in record['sources']]
             if one_pub_key not in _KnownUsers:
                 _KnownUsers[one_pub_key] = one_user_dir_path
             one_unique_name = '{}_{}'.format(
                 one_user_name,
                 strng.to_text(hashes.sha1(one_pub_key, hexdigest=True)),
             )
-            known_sources = known_id_obj.getSources(as_originals=True)
             name_is_matching = True
             for known_idurl in reversed(known_sources):
                 if nameurl.GetName(known_idurl) != one_user_name:
@@ -151,14 +164,15 @@ def init():
                 lg.err('identity name in one of the sources %r is not matching with %r' % (one_ident_path, one_user_name))
                 for_cleanup.append(one_ident_path)
                 continue
+            new_snapshot[one_snapshot_key] = record
             for known_idurl in reversed(known_sources):
                 if known_idurl not in _KnownIDURLs:
-                    _KnownIDURLs[known_idurl] = known_id_obj.getPublicKey()
+                    _KnownIDURLs[known_idurl] = one_pub_key
                     if _Debug:
                         lg.out(_DebugLevel, '    new IDURL added: %r' % known_idurl)
                 else:
-                    if _KnownIDURLs[known_idurl] != known_id_obj.getPublicKey():
-                        _KnownIDURLs[known_idurl] = known_id_obj.getPublicKey()
+                    if _KnownIDURLs[known_idurl] != one_pub_key:
+                        _KnownIDURLs[known_idurl] = one_pub_key
                         lg.warn('another user had same identity source: %r' % known_idurl)
                 if one_pub_key not in _MergedIDURLs:
                     _MergedIDURLs[one_pub_key] = {}
@@ -177,7 +191,7 @@ def init():
                     _KnownSources[one_pub_key] = []
                 if one_unique_name not in _KnownUniqueNames:
                     _KnownUniqueNames[one_unique_name] = []
-                for one_source in known_id_obj.getSources(as_originals=True):
+                for one_source in known_sources:
                     if one_source not in _KnownSources[one_pub_key]:
                         _KnownSources[one_pub_key].append(one_source)
                         if _Debug:
@@ -193,6 +207,9 @@ def init():
                 os.remove(one_ident_path)
             except:
                 lg.exc()
+    if new_snapshot != snapshot:
+        save_history_snapshot(new_snapshot)
+    lg.info('loaded %d historical identities, %d of them were verified' % (len(new_snapshot), verified_count))
     _Ready = True
 
 
@@ -216,6 +233,64 @@ def shutdown():
 #------------------------------------------------------------------------------
 
 
+def read_history_snapshot():
+    """
+    Reads all verified records of the identity history saved during previous start.
+    Returns empty dictionary if snapshot not exist or was not validated, then the whole history will be verified again.
+    """
+    snapshot_path = os.path.join(_IdentityHistoryDir, HISTORY_SNAPSHOT_FILENAME)
+    src = local_fs.ReadTextFile(snapshot_path)
+    if not src:
+        return {}
+    try:
+        snapshot = jsn.loads_text(src)
+        if snapshot.get('version') != HISTORY_SNAPSHOT_VERSION:
+            raise Exception('snapshot version %r is not supported' % snapshot.get('version'))
+        records = snapshot['records']
+        for record in records.values():
+            if not isinstance(record['hash'], str) or not isinstance(record['pub_key'], str):
+                raise Exception('snapshot record is not valid')
+            if not isinstance(record['revision'], int) or not isinstance(record['sources'], list):
+                raise Exception('snapshot record is not valid')
+    except Exception as exc:
+        lg.warn('identity history snapshot %r is not valid and will be rebuilt: %r' % (snapshot_path, exc))
+        return {}
+    return records
+
+
+def save_history_snapshot(records):
+    snapshot_path = os.path.join(_IdentityHistoryDir, HISTORY_SNAPSHOT_FILENAME)
+    snapshot = {
+        'version': HISTORY_SNAPSHOT_VERSION,
+        'records': records,
+    }
+    if not local_fs.WriteTextFile(snapshot_path, jsn.dumps(snapshot, separators=(',', ':'))):
+        lg.err('failed to save identity history snapshot to %r' % snapshot_path)
+        return False
+    return True
+
+
+def verify_history_file(user_dir, ident_path, xmlsrc, content_hash):
+    """
+    Parses and verifies signature of a historical identity file, returns record to be stored in the snapshot.
+    """
+    from bitdust.userid import identity
+    known_id_obj = identity.identity(xmlsrc=xmlsrc)
+    if not known_id_obj.isCorrect():
+        raise Exception('identity history in %r is broken, identity is not correct: %r' % (user_dir, ident_path))
+    if not known_id_obj.Valid():
+        raise Exception('identity history in %r is broken, identity is not valid: %r' % (user_dir, ident_path))
+    return {
+        'hash': content_hash,
+        'pub_key': strng.to_text(known_id_obj.getPublicKey()),
+        'revision': known_id_obj.getRevisionValue(),
+        'sources': [strng.to_text(s) for s in known_id_obj.getSources(as_originals=True)],
+    }
+
+
+#------------------------------------------------------------------------------
+
+
 def known():
     global _KnownIDURLs
     return _KnownIDURLs
@@ -1097,3 +1172,52 @@ class ID_URL_FIELD(object):
                 strng.to_text(hashes.sha1(self.to_public_key(raise_error=raise_error), hexdigest=True)),
             )
         return self._unique_name
+
+
+#------------------------------------------------------------------------------
+
+
+def main():
+    """
+    Writes identity history of 300 users (or given number) with 3 rotated identities each to a temporary folder
+    and measures how long it takes to start with and without the snapshot.
+    """
+    import time
+    import shutil
+    from bitdust.crypt import rsa_key
+    from bitdust.userid import identity
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    temp_dir = tempfile.mkdtemp(prefix='id_url_')
+    settings.init(base_dir=temp_dir)
+    history_dir = settings.IdentityHistoryDir()
+    os.makedirs(history_dir)
+    for i in range(users_count):
+        key_object = rsa_key.RSAKey()
+        key_object.generate(1024)
+        user_name = 'user%05d' % i
+        user_dir = tempfile.mkdtemp(prefix=user_name + '@', dir=history_dir)
+        for revision in range(3):
+            id_obj = identity.identity(xmlsrc=identity.default_identity_src)
+            id_obj.setSources(['http://server%d.com/%s.xml' % (r, user_name) for r in range(revision, 3)])
+            id_obj.setContacts(['tcp://127.0.0.1:%d' % (7000 + i)])
+            id_obj.setPublicKey(key_object.toPublicString())
+            id_obj.setRevision(revision + 1)
+            id_obj.setSignature(key_object.sign(id_obj.makehash()))
+            local_fs.WriteBinaryFile(os.path.join(user_dir, str(revision)), id_obj.serialize())
+    t = time.time()
+    init()
+    verify_time = time.time() - t
+    shutdown()
+    t = time.time()
+    init()
+    snapshot_time = time.time() - t
+    print('%d historical identities of %d users, %d known idurls' % (users_count*3, users_count, len(known())))
+    print('    parse and verify every file on start:  %.3f sec' % verify_time)
+    print('    read the snapshot on start:            %.3f sec' % snapshot_time)
+    shutdown()
+    settings.shutdown()
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
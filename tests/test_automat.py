@@ -0,0 +1,59 @@
+from unittest import TestCase
+
+from bitdust.automats import automat
+
+
+class _Switch(automat.Automat):
+
+    def A(self, event, *args, **kwargs):
+        if self.state == 'OFF':
+            if event == 'turn-on':
+                self.state = 'ON'
+                self.doTurnOn(*args, **kwargs)
+            elif event == 'break':
+                raise Exception('broken switch')
+        elif self.state == 'ON':
+            if event == 'turn-off':
+                self.state = 'OFF'
+
+    def state_changed(self, oldstate, newstate, event, *args, **kwargs):
+        if newstate == 'ON' and kwargs.get('fail'):
+            raise Exception('state callback failed')
+
+    def doTurnOn(self, *args, **kwargs):
+        pass
+
+
+class TestAutomatProfiler(TestCase):
+
+    def setUp(self):
+        automat.SetProfiling(sampling=1)
+        automat.ResetProfiling()
+        self.switch = _Switch(name='switch', state='OFF')
+
+    def tearDown(self):
+        self.switch.destroy()
+        automat.SetProfiling(sampling=0)
+        automat.ResetProfiling()
+
+    def test_exception_in_transition(self):
+        self.switch.event('break')
+        self.assertEqual(automat._ProfileDepth, 0)
+        with self.assertRaises(Exception):
+            self.switch.event('turn-on', fail=True)
+        self.assertEqual(automat._ProfileDepth, 0)
+        self.switch.event('turn-off')
+        self.switch.event('turn-on')
+        stats = automat.ProfilingStats()
+        self.assertEqual(stats['events'], 4)
+        self.assertEqual({(h['state'], h['event']): h['count'] for h in stats['handlers']}, {
+            ('OFF', 'turn-on'): 2,
+            ('OFF', 'break'): 1,
+            ('ON', 'turn-off'): 1,
+        })
+        self.assertEqual([(a['action'], a['count']) for a in stats['actions']], [('doTurnOn', 2)])
+        # actions are not measured outside of the measured events
+        automat.SetProfiling(sampling=1000)
+        self.switch.event('turn-off')
+        self.switch.event('turn-on')
+        self.assertEqual(automat.ProfilingStats()['actions'][0]['count'], 2)
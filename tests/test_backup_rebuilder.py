@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from bitdust.system import bpio
+from bitdust.raid import eccmap
+from bitdust.raid import make
+from bitdust.raid import rebuild
+from bitdust.storage import backup_matrix
+from bitdust.storage import backup_rebuilder
+
+
+class TestBackupRebuilder(TestCase):
+
+    def tearDown(self):
+        backup_matrix.local_files().clear()
+        backup_matrix.remote_files().clear()
+        backup_rebuilder.RemoveAllBackupsToWork()
+        backup_rebuilder._MarginsCache.clear()
+
+    def test_fixable_margin(self):
+        ecc_map = eccmap.eccmap('ecc/7x7')
+        self.assertEqual(ecc_map.FixableMargin([1]*7, [1]*7, limit=2), 2)
+        self.assertEqual(ecc_map.FixableMargin([0, 0, 0, 0, 1, 1, 1], [0]*7), 0)
+        data = [1, 0, 1, 1, 1, 1, 1]
+        parity = [1, 0, 1, 1, 1, 1, 1]
+        margin = ecc_map.FixableMargin(data, parity, limit=7)
+        self.assertTrue(0 < margin < 7)
+        # pieces we have on hands are not lost together with suppliers
+        self.assertEqual(ecc_map.FixableMargin(data, parity, kept_data=data, kept_parity=parity, limit=7), 7)
+
+    def test_risk_order(self):
+        ecc_map = eccmap.eccmap('ecc/4x4')
+        backup_id = 'master$alice@127.0.0.1_8084:0/F20230101010101AM'
+        backup_matrix.remote_files()[backup_id] = {
+            0: {'D': [1, 1, 1, 0], 'P': [1, 1, 1, 0]},
+            1: {'D': [1, 1, 0, 0], 'P': [1, 1, 0, 0]},
+            2: {'D': [1, 0, 0, 0], 'P': [1, 0, 0, 0]},
+        }
+        backup_matrix.local_files()[backup_id] = {
+            0: {'D': [0]*4, 'P': [0]*4},
+            1: {'D': [0]*4, 'P': [0]*4},
+            2: {'D': [0]*4, 'P': [0]*4},
+        }
+        risk = {blockNum: backup_rebuilder.BlockRiskMargin(backup_id, blockNum, ecc_map=ecc_map, active_array=[1]*4) for blockNum in range(3)}
+        self.assertEqual(risk[2], 0)
+        self.assertGreater(risk[0], risk[1])
+        self.assertGreater(risk[1], 0)
+        # offline supplier does not help to keep the data
+        self.assertEqual(backup_rebuilder.BlockRiskMargin(backup_id, 1, ecc_map=ecc_map, active_array=[1, 0, 1, 1]), 0)
+        # most endangered block is at the end of the queue, unfixable block is processed last
+        self.assertEqual(backup_rebuilder.SortBlocksByRisk([0, 1, 2], risk), [2, 0, 1])
+        backup_rebuilder.AddBackupsToWork([backup_id])
+        backup_rebuilder._BlocksRisk[backup_id] = risk
+        stats = backup_rebuilder.RebuildQueueStats()
+        self.assertEqual(stats['queue_depth'], 3)
+        self.assertEqual(stats['at_risk']['lost'], 1)
+        self.assertEqual(stats['at_risk']['1'], 1)
+        self.assertEqual(backup_rebuilder.BackupRiskPriority(backup_id), 1)
+        backup_rebuilder.RemoveAllBackupsToWork()
+
+    def test_stalled_backup_aged(self):
+        stuck_id = 'master$alice@127.0.0.1_8084:0/F20230101010101AM'
+        other_id = 'master$alice@127.0.0.1_8084:0/F20230202020202AM'
+        backup_rebuilder.AddBackupsToWork([stuck_id, other_id])
+        backup_rebuilder._BlocksRisk[stuck_id] = {0: 1}
+        backup_rebuilder._BlocksRisk[other_id] = {0: 2}
+        self.assertEqual(backup_rebuilder.BackupQueuePriority(stuck_id), 1)
+        # pass without any block rebuilt moves the backup to the end and makes it less urgent
+        backup_rebuilder.PostponeBackup(stuck_id, progress=False)
+        self.assertEqual(backup_rebuilder._BackupIDsQueue, [other_id, stuck_id])
+        self.assertEqual(backup_rebuilder.BackupQueuePriority(stuck_id), 2)
+        backup_rebuilder.PostponeBackup(stuck_id, progress=False)
+        self.assertEqual(backup_rebuilder.BackupQueuePriority(stuck_id), 3)
+        self.assertLess(backup_rebuilder.BackupQueuePriority(other_id), backup_rebuilder.BackupQueuePriority(stuck_id))
+        # any progress resets the aging
+        backup_rebuilder.PostponeBackup(stuck_id, progress=True)
+        self.assertEqual(backup_rebuilder.BackupQueuePriority(stuck_id), 1)
+        backup_rebuilder.PostponeBackup(stuck_id, progress=False)
+        backup_rebuilder.RemoveBackupToWork(stuck_id)
+        self.assertIsNone(backup_rebuilder.BackupQueuePriority(stuck_id))
+        self.assertNotIn(stuck_id, backup_rebuilder._StalledPasses)
+        backup_rebuilder.RemoveAllBackupsToWork()
+
+    def test_rebuild_many(self):
+        backups_dir = tempfile.mkdtemp()
+        version_dir = os.path.join(backups_dir, 'master$alice@127.0.0.1_8084', '0', 'F20230101010101AM')
+        source_path = os.path.join(backups_dir, 'source')
+        lost = {}
+        for blockNum in range(3):
+            bpio.WriteBinaryFile(source_path, os.urandom(1000))
+            make.do_in_memory(source_path, 'ecc/4x4', 'F20230101010101AM', blockNum, version_dir)
+            for dataOrParity in ('Data', 'Parity'):
+                filename = os.path.join(version_dir, '%d-1-%s' % (blockNum, dataOrParity))
+                lost[filename] = bpio.ReadBinaryFile(filename)
+                os.remove(filename)
+        matrix = {'D': [1, 0, 1, 1], 'P': [1, 0, 1, 1]}
+        reported = []
+        results = rebuild.rebuild_many(
+            'master$alice@127.0.0.1_8084:0/F20230101010101AM',
+            [(blockNum, matrix, matrix) for blockNum in range(3)],
+            'ecc/4x4',
+            [1]*4,
+            backups_dir,
+            lambda blockNum, result: reported.append(blockNum),
+        )
+        self.assertEqual(reported, [0, 1, 2])
+        self.assertEqual([r[0] for r in results], [0, 1, 2])
+        for _, result in results:
+            newData, localData, localParity, reconstructedData, reconstructedParity = result
+            self.assertTrue(newData)
+            self.assertEqual(reconstructedData, [0, 1, 0, 0])
+            self.assertEqual(reconstructedParity, [0, 1, 0, 0])
+        for filename, data in lost.items():
+            self.assertEqual(bpio.ReadBinaryFile(filename), data)
+        shutil.rmtree(backups_dir)
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from bitdust.transport import bandwidth
+
+
+class TestBandwidth(TestCase):
+
+    def test_ring_counter(self):
+        counter = bandwidth.RingCounter(60, 10)
+        start = 600000
+        for minute in range(15):
+            counter.add(100, start + minute*60 + 30)
+        now = start + 15*60
+        self.assertEqual(counter.total(now - 60, now), 100)
+        # the first minute is counted partially
+        self.assertEqual(counter.total(now - 90, now), 150)
+        # only last 10 minutes are counted, current minute is empty
+        self.assertEqual(counter.total(now - 3600, now), 900)
+        self.assertEqual(counter.total(now + 600, now + 660), 0)
+
+    def test_peer_traffic(self):
+        traffic = bandwidth.PeerTraffic()
+        day = 24*60*60
+        now = 1000*day + 10*60*60
+        traffic.add(5000, now - 3*day)
+        traffic.add(1000, now - 30*60)
+        traffic.add(2000, now - 60)
+        self.assertEqual(traffic.bytes_in_window(60*60, now), 3000)
+        self.assertEqual(traffic.bytes_in_window(5*60, now), 2000)
+        # long windows are counted by days
+        self.assertEqual(traffic.bytes_in_window(7*day, now), 8000)
+        self.assertEqual(traffic.total_packets, 3)
+
+    def test_counting_does_not_touch_disk(self):
+        bandwidth.IN('http://127.0.0.1/alice.xml', 1000)
+        bandwidth.IN(b'http://127.0.0.1/alice.xml', 500)
+        bandwidth.OUT('http://127.0.0.1/alice.xml', 300)
+        self.assertEqual(bandwidth.bytes_received('http://127.0.0.1/alice.xml'), 1500)
+        self.assertEqual(bandwidth.bytes_sent(b'http://127.0.0.1/alice.xml'), 300)
+        self.assertEqual(bandwidth.throughput_in('http://127.0.0.1/alice.xml', window=100), 15.0)
+        self.assertEqual(bandwidth.peers_stats()['http://127.0.0.1/alice.xml']['bytes_out'], 300)
+        bandwidth.clear()
+        bandwidth._TrafficIn.clear()
+        bandwidth._TrafficOut.clear()
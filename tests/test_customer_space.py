@@ -0,0 +1,146 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from twisted.internet.task import Clock
+
+from bitdust.main import settings
+
+from bitdust.system import bpio
+
+from bitdust.logs import lg
+
+from bitdust.lib import serialization
+
+from bitdust.p2p import commands
+from bitdust.p2p import p2p_service
+
+from bitdust.crypt import key
+from bitdust.crypt import signed
+
+from bitdust.transport import gateway
+
+from bitdust.supplier import customer_space
+
+from bitdust.userid import id_url
+from bitdust.userid import my_id
+
+from tests import test_id_url
+from tests.test_my_keys import _some_priv_key, _some_identity_xml
+
+alice = b'http://127.0.0.1:8084/alice.xml'
+bob = b'http://127.0.0.1/bob.xml'
+
+
+class TestRetrieveBatch(TestCase):
+
+    def setUp(self):
+        try:
+            bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+        except Exception:
+            pass
+        lg.set_debug_level(30)
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        id_url._IdentityHistoryDir = tempfile.mkdtemp()
+        id_url.init()
+        try:
+            os.makedirs('/tmp/.bitdust_tmp/identitycache/')
+        except:
+            pass
+        try:
+            os.makedirs('/tmp/.bitdust_tmp/default/metadata/')
+        except:
+            pass
+        fout = open(settings.KeyFileName(), 'w')
+        fout.write(_some_priv_key)
+        fout.close()
+        fout = open(settings.LocalIdentityFilename(), 'w')
+        fout.write(_some_identity_xml)
+        fout.close()
+        self.assertTrue(key.LoadMyKey())
+        self.assertTrue(my_id.loadLocalIdentity())
+        test_id_url.TestIDURL._cache_identity(self, 'alice')
+        test_id_url.TestIDURL._cache_identity(self, 'bob')
+        self.clock = Clock()
+        self.patchers = [
+            mock.patch.object(customer_space, 'reactor', self.clock),
+            mock.patch.object(p2p_service, 'SendAck'),
+            mock.patch.object(p2p_service, 'SendFail'),
+            mock.patch.object(gateway, 'outbox'),
+            mock.patch.object(signed, 'Packet'),
+            mock.patch.object(signed, 'Unserialize'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        key.ForgetMyKey()
+        my_id.forgetLocalIdentity()
+        id_url.shutdown()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+
+    def _store(self, customer_id, path):
+        filename = customer_space.make_filename(customer_id, path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        bpio.WriteBinaryFile(filename, b'stored')
+
+    def _request(self, packet_ids, creator=alice):
+        return mock.Mock(
+            Command=commands.Retrieve(),
+            OwnerID=id_url.field(alice),
+            CreatorID=id_url.field(creator),
+            PacketID='12345',
+            Payload=serialization.DictToBytes({'items': packet_ids}),
+        )
+
+    def _run_next_call(self):
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        call = self.clock.calls.pop(0)
+        call.func(*call.args, **call.kw)
+
+    def _sent_packet_ids(self):
+        return [c[1]['PacketID'] for c in signed.Packet.call_args_list]
+
+    def test_owner_only(self):
+        with mock.patch.object(customer_space, 'on_retrieve_batch') as on_retrieve_batch:
+            self.assertFalse(customer_space.on_retrieve(self._request(['master$alice@127.0.0.1_8084:0/F20230101010101AM/0-0-Data'], creator=bob)))
+            on_retrieve_batch.assert_not_called()
+        self.assertEqual(gateway.outbox.call_count, 0)
+
+    def test_too_many_items(self):
+        request = self._request(['master$alice@127.0.0.1_8084:0/F20230101010101AM/%d-0-Data' % i for i in range(customer_space.MAX_RETRIEVE_BATCH_ITEMS + 1)])
+        self.assertTrue(customer_space.on_retrieve(request))
+        self.clock.advance(0)
+        p2p_service.SendFail.assert_called_once_with(request, 'incorrect retrieve request')
+        self.assertEqual(gateway.outbox.call_count, 0)
+        p2p_service.SendAck.assert_not_called()
+
+    def test_missing_items(self):
+        stored = ['master$alice@127.0.0.1_8084:0/F20230101010101AM/%d-0-Data' % i for i in range(6)]
+        for packet_id in stored:
+            self._store('alice@127.0.0.1_8084', packet_id.split(':')[1])
+        self._store('bob@127.0.0.1', '0/F20230101010101AM/0-0-Data')
+        not_found = 'master$alice@127.0.0.1_8084:0/F20230101010101AM/7-0-Data'
+        another_customer = 'master$bob@127.0.0.1:0/F20230101010101AM/0-0-Data'
+        signed.Unserialize.side_effect = lambda data: mock.Mock(PacketID=str(len(signed.Packet.call_args_list)), Serialize=lambda: data)
+        request = self._request(stored[:3] + [not_found, another_customer] + stored[3:])
+        self.assertTrue(customer_space.on_retrieve(request))
+        # files are read and sent in small chunks, one chunk per reactor iteration
+        self.assertEqual(gateway.outbox.call_count, 0)
+        self._run_next_call()
+        self.assertEqual(gateway.outbox.call_count, 3)
+        p2p_service.SendAck.assert_not_called()
+        self._run_next_call()
+        self.assertEqual(gateway.outbox.call_count, 6)
+        p2p_service.SendAck.assert_called_once()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self._sent_packet_ids(), [str(i) for i in range(6)])
+        self.assertTrue(all(c[1]['RemoteID'] == id_url.field(alice) for c in signed.Packet.call_args_list))
+        response = serialization.BytesToDict(p2p_service.SendAck.call_args[1]['response'], keys_to_text=True, values_to_text=True)
+        self.assertEqual(response, {'sent': 6, 'missing': [not_found, another_customer]})
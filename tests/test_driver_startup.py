@@ -0,0 +1,112 @@
+from unittest import TestCase
+
+from twisted.internet import task
+from twisted.internet.defer import Deferred
+
+from bitdust.services import driver
+from bitdust.services.local_service import LocalService
+
+_Started = []
+_Pending = {}
+
+
+class _FakeService(LocalService):
+
+    fast = True
+    depends = []
+    delayed = False
+
+    def dependent_on(self):
+        return list(self.depends)
+
+    def enabled(self):
+        return True
+
+    def start(self):
+        _Started.append(self.service_name)
+        if self.delayed:
+            _Pending[self.service_name] = Deferred()
+            return _Pending[self.service_name]
+        return True
+
+    def stop(self):
+        return True
+
+
+class _ServiceA(_FakeService):
+    service_name = 'service_test_a'
+    delayed = True
+
+
+class _ServiceB(_FakeService):
+    service_name = 'service_test_b'
+
+
+class _ServiceC(_FakeService):
+    service_name = 'service_test_c'
+    depends = ['service_test_a', 'service_test_b']
+
+
+class _ServiceD(_FakeService):
+    service_name = 'service_test_d'
+    depends = ['service_test_c']
+
+
+class TestStartupScheduler(TestCase):
+
+    def setUp(self):
+        del _Started[:]
+        _Pending.clear()
+        self.names = []
+        for cls in (_ServiceA, _ServiceB, _ServiceC, _ServiceD):
+            driver.services()[cls.service_name] = cls()
+            self.names.append(cls.service_name)
+
+    def tearDown(self):
+        for name in self.names:
+            driver.services().pop(name).destroy()
+
+    def test_start_order(self):
+        clock = task.Clock()
+        driver.reset_startup_times()
+        scheduler = driver.StartupScheduler(self.names, clock=clock)
+        results = []
+        scheduler.run().addCallback(results.append)
+        # independent services are starting together, dependent services are waiting
+        self.assertEqual(_Started, ['service_test_a', 'service_test_b'])
+        self.assertTrue(scheduler.is_pending('service_test_c'))
+        clock.advance(0)
+        self.assertEqual(_Started, ['service_test_a', 'service_test_b'])
+        _Pending['service_test_a'].callback(True)
+        self.assertTrue(scheduler.is_pending('service_test_c'))
+        clock.advance(0)
+        self.assertEqual(_Started, ['service_test_a', 'service_test_b', 'service_test_c', 'service_test_d'])
+        self.assertEqual(len(results), 1)
+        self.assertEqual([r[1] for r in results[0]], ['started']*4)
+        report = driver.startup_report()
+        self.assertEqual(sorted(i['name'] for i in report['services']), sorted(self.names))
+        self.assertEqual(set(i['result'] for i in report['services']), {'started'})
+        self.assertEqual(report['critical_path'][-2:], ['service_test_c', 'service_test_d'])
+        self.assertIn(report['critical_path'][0], ('service_test_a', 'service_test_b'))
+
+    def test_prepare(self):
+        prepared = Deferred()
+
+        class _ServiceE(_FakeService):
+            service_name = 'service_test_e'
+
+            def prepare(self):
+                # the callback runs in the main thread, shared state is modified only there
+                return prepared.addCallback(_Started.append)
+
+        driver.services()['service_test_e'] = _ServiceE()
+        self.names.append('service_test_e')
+        driver.reset_startup_times()
+        scheduler = driver.StartupScheduler(['service_test_e'], clock=task.Clock())
+        results = []
+        scheduler.run().addCallback(results.append)
+        self.assertEqual(_Started, [])
+        prepared.callback('scanned')
+        self.assertEqual(_Started, ['scanned', 'service_test_e'])
+        self.assertEqual([r[1] for r in results[0]], ['started'])
+        self.assertIsNotNone(driver.startup_report()['services'][0]['prepare'])
@@ -287,6 +287,41 @@ class TestIDURL(TestCase):
         self.assertIn(alice_bin, id_url.sources(id_url.field(alice_text).to_public_key()))
         self.assertIn(alice_bin, id_url.unique_names(id_url.field(alice_text).unique_name()))
 
+    def test_history_snapshot(self):
+        self._cache_identity('alice')
+        self._cache_identity('frank')
+        history_dir = id_url._IdentityHistoryDir
+        known = dict(id_url.known())
+        merged = dict(id_url.merged())
+        verified = []
+        verify_history_file = id_url.verify_history_file
+
+        def _verify_history_file(*args):
+            verified.append(args[1])
+            return verify_history_file(*args)
+
+        id_url.verify_history_file = _verify_history_file
+        try:
+            for expected_verified in (2, 0):
+                del verified[:]
+                id_url.shutdown()
+                id_url._IdentityHistoryDir = history_dir
+                id_url.init()
+                self.assertEqual(len(verified), expected_verified)
+                self.assertEqual(id_url.known(), known)
+                self.assertEqual(id_url.merged(), merged)
+            # broken snapshot is rebuilt
+            with open(os.path.join(history_dir, id_url.HISTORY_SNAPSHOT_FILENAME), 'w') as f:
+                f.write('{"version": 1, "records": {"a/0": {}}}')
+            del verified[:]
+            id_url.shutdown()
+            id_url._IdentityHistoryDir = history_dir
+            id_url.init()
+            self.assertEqual(len(verified), 2)
+            self.assertEqual(id_url.known(), known)
+        finally:
+            id_url.verify_history_file = verify_history_file
+
     def test_identity_not_cached(self):
         self._cache_identity('alice')
         with self.assertRaises(KeyError):
@@ -0,0 +1,75 @@
+import os
+
+from unittest import TestCase
+
+from bitdust.logs import lg
+
+from bitdust.system import bpio
+
+from bitdust.main import settings
+
+from bitdust.contacts import identitydb
+
+from bitdust.userid import id_url
+
+_some_identity_xml = """<?xml version="1.0" encoding="utf-8"?>
+<identity>
+  <sources>
+    <source>http://127.0.0.1:8084/alice.xml</source>
+  </sources>
+  <contacts>
+    <contact>tcp://127.0.0.1:7103</contact>
+  </contacts>
+  <certificates/>
+  <scrubbers/>
+  <postage>0</postage>
+  <date>Oct 06, 2018</date>
+  <version></version>
+  <revision>0</revision>
+  <publickey>ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQD9mwkrIJqSoDy87avQJM4bSoTaX7jLV0iqHtULShpWRfLQKKazc34023q8nrXsfkV4wAtqxF/j7mceSV5MH4EpMoHG3h8ub0zPeaTDxT6my0l9jNIWOMbdmOzpcLgfIyM4JORgJ29BBN6oH0AsAnXRilXCUmVc5oWixzC/cuRQPhcHZDiuHqKph1Cjs1ra9jRoDD63/BOctPOv+vFC6FueDuS0+/xlTHr14fMbTuAtGmrNgfvOS+6KO16zE8gUUtpKWBA9zesgurAs//Ajp8OO09aWcbVwkn17s8GrUuRDwUmgLFpLH3/OtlxW4oWcI8atzWGOoIhT0eHfBM/FX88h</publickey>
+  <signature>906441963064925827454594808955119786427327091644004203121255573673324339896720684156436969809331302081059171001468697744607176215971850395448358447221987030255681283469602485017439100048818715591137645334649289784704347547476744833593959051239987455656492991690929110057776187651745011046495572223232179906271885029639566994962961751420295596050170876718201976232073313442092469148257068924122205928495395843354406033087633663157320015417942886925426409641297819144861516715728591303834175552581452070473350075769438068777969720417764064190628218036180170101856467748070658740635441921977032005183554438715223073852</signature>
+</identity>"""
+
+
+class TestIdentityDB(TestCase):
+
+    def setUp(self):
+        try:
+            bpio.rmdir_recursive('/tmp/.bitdust_test_identitydb')
+        except Exception:
+            pass
+        lg.set_debug_level(30)
+        settings.init(base_dir='/tmp/.bitdust_test_identitydb')
+        id_url.init()
+        identitydb.init()
+
+    def tearDown(self):
+        identitydb.shutdown()
+        id_url.shutdown()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_test_identitydb')
+
+    def test_lazy_loading_from_index(self):
+        idurl = b'http://127.0.0.1:8084/alice.xml'
+        self.assertTrue(identitydb.update(idurl, _some_identity_xml))
+        identitydb.shutdown()
+        self.assertTrue(os.path.isfile(settings.IdentityCacheIndexFile()))
+        identitydb.init()
+        self.assertEqual(identitydb.startup_stats()['indexed'], 1)
+        self.assertEqual(identitydb.startup_stats()['parsed'], 0)
+        # identity is known from the index, but the file was not parsed yet
+        self.assertTrue(identitydb.has_idurl(idurl))
+        self.assertIsNone(identitydb.cache()[idurl])
+        self.assertEqual(identitydb.idcontacts(idurl), [b'tcp://127.0.0.1:7103'])
+        self.assertEqual(identitydb.get_idurl_by_ip_port('127.0.0.1', 7103), idurl)
+        self.assertEqual(identitydb.idinfo(idurl)['revision'], 0)
+        id_obj = identitydb.get_ident(idurl)
+        self.assertEqual(id_obj.getIDURL(as_original=True), idurl)
+        self.assertIs(identitydb.cache()[idurl], id_obj)
+        # modified file is parsed again at startup
+        identitydb.shutdown()
+        with open(identitydb.get_filename(idurl), 'a') as f:
+            f.write('\n')
+        identitydb.init()
+        self.assertEqual(identitydb.startup_stats()['parsed'], 1)
+        self.assertIsNotNone(identitydb.cache()[idurl])
@@ -0,0 +1,116 @@
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from bitdust.stream import io_scheduler
+
+
+class LoopbackTransport(object):
+
+    """
+    Delivers every started item after given latency and sends the Ack back to the scheduler.
+    """
+
+    def __init__(self, clock, latency=0.2):
+        self.clock = clock
+        self.latency = latency
+        self.scheduler = None
+        self.started = []
+        self.expired = []
+        self.acked = []
+        self.lost = set()
+        self.max_in_flight = 0
+
+    def start(self, item_id):
+        self.started.append(item_id)
+        self.max_in_flight = max(self.max_in_flight, len(self.scheduler.in_flight))
+        if item_id not in self.lost:
+            self.clock.callLater(self.latency, self.ack, item_id)
+
+    def ack(self, item_id):
+        if self.scheduler.acked(item_id):
+            self.acked.append(item_id)
+
+    def expire(self, item_id, reason):
+        self.expired.append((item_id, reason))
+
+
+class TestTransferScheduler(TestCase):
+
+    def _make(self, latency=0.2, **window_kwargs):
+        self.clock = Clock()
+        self.transport = LoopbackTransport(self.clock, latency=latency)
+        self.scheduler = io_scheduler.TransferScheduler(
+            name='test',
+            start_callback=self.transport.start,
+            expire_callback=self.transport.expire,
+            window=io_scheduler.InFlightWindow(**window_kwargs),
+            clock=self.clock,
+        )
+        self.transport.scheduler = self.scheduler
+
+    def _run(self, seconds, step=0.05):
+        for _ in range(int(seconds/step)):
+            self.clock.advance(step)
+
+    def test_priority_classes(self):
+        self._make(initial=1, maximum=1)
+        for i in range(3):
+            self.scheduler.enqueue('upload%d' % i, priority=io_scheduler.PRIORITY_UPLOAD)
+        self.scheduler.enqueue('rebuild0', priority=io_scheduler.PRIORITY_REBUILD)
+        self.scheduler.enqueue('restore0', priority=io_scheduler.PRIORITY_RESTORE)
+        self._run(3)
+        self.assertEqual(self.transport.started, ['restore0', 'rebuild0', 'upload0', 'upload1', 'upload2'])
+        self.assertEqual(len(self.transport.acked), 5)
+        self.assertEqual(self.transport.max_in_flight, 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_removed_and_queued_again(self):
+        self._make(initial=1, maximum=1)
+        self.scheduler.enqueue('item', priority=io_scheduler.PRIORITY_RESTORE)
+        self.scheduler.remove('item')
+        self.scheduler.enqueue('rebuild0', priority=io_scheduler.PRIORITY_REBUILD)
+        self.scheduler.enqueue('item', priority=io_scheduler.PRIORITY_UPLOAD)
+        self._run(2)
+        # old entry in the restore queue must not start the item again with a higher priority
+        self.assertEqual(self.transport.started, ['rebuild0', 'item'])
+        self.assertEqual(self.scheduler.pending_count, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_adaptive_window(self):
+        self._make(initial=2, maximum=16)
+        for i in range(200):
+            self.scheduler.enqueue('upload%d' % i, size=1024)
+        self._run(10)
+        self.assertEqual(len(self.transport.acked), 200)
+        self.assertGreater(self.transport.max_in_flight, 8)
+        self.assertIsNotNone(self.scheduler.window.throughput)
+        size_before = self.scheduler.window.limit()
+        self.transport.lost.update(['lost0', 'lost1'])
+        self.scheduler.enqueue('lost0', timeout=1)
+        self.scheduler.enqueue('lost1', timeout=1)
+        self._run(2)
+        self.assertEqual(self.transport.expired, [('lost0', 'timeout'), ('lost1', 'timeout')])
+        self.assertLess(self.scheduler.window.limit(), size_before)
+        self.assertEqual(self.scheduler.items, {})
+
+    def test_deadline_fail_fast(self):
+        self._make(latency=1.0, initial=1, maximum=1)
+        self.scheduler.enqueue('upload0')
+        self._run(1.5)
+        # supplier needs ~1 second per item, so the restore can not be delivered in 0.5 seconds
+        self.scheduler.enqueue('restore0', priority=io_scheduler.PRIORITY_RESTORE, deadline=self.clock.seconds() + 0.5)
+        self._run(0.1)
+        self.assertEqual(self.transport.expired, [('restore0', 'deadline')])
+        self.assertNotIn('restore0', self.transport.started)
+        # window is busy with upload1, restore1 is waiting in the queue until its deadline is not reachable anymore
+        self.scheduler.enqueue('upload1')
+        self._run(0.1)
+        self.scheduler.enqueue('restore1', priority=io_scheduler.PRIORITY_RESTORE, deadline=self.clock.seconds() + 1.5)
+        self._run(0.5)
+        self.assertEqual(len(self.transport.expired), 1)
+        self._run(1.5)
+        self.assertEqual(self.transport.expired[-1], ('restore1', 'deadline'))
+        self.assertNotIn('restore1', self.transport.started)
+        self.assertEqual(self.scheduler.pending_count, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
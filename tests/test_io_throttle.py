@@ -0,0 +1,164 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from twisted.internet.task import Clock
+
+from bitdust.main import settings
+
+from bitdust.system import bpio
+
+from bitdust.logs import lg
+
+from bitdust.lib import serialization
+
+from bitdust.p2p import commands
+from bitdust.p2p import p2p_service
+
+from bitdust.crypt import key
+from bitdust.crypt import signed
+
+from bitdust.stream import file_down
+from bitdust.stream import io_throttle
+
+from bitdust.userid import global_id
+from bitdust.userid import id_url
+from bitdust.userid import my_id
+
+from tests import test_id_url
+from tests.test_my_keys import _some_priv_key, _some_identity_xml
+
+alice = b'http://127.0.0.1:8084/alice.xml'
+bob = b'http://127.0.0.1/bob.xml'
+
+packet_ids = [
+    'master$alice@127.0.0.1_8084:0/F20230101010101AM/0-0-Data',
+    'master$alice@127.0.0.1_8084:0/F20230101010101AM/0-1-Data',
+    'master$alice@127.0.0.1_8084:0/F20230101010101AM/0-2-Data',
+]
+
+
+class TestRequestsBatch(TestCase):
+
+    def setUp(self):
+        try:
+            bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+        except Exception:
+            pass
+        lg.set_debug_level(30)
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        id_url._IdentityHistoryDir = tempfile.mkdtemp()
+        id_url.init()
+        try:
+            os.makedirs('/tmp/.bitdust_tmp/identitycache/')
+        except:
+            pass
+        try:
+            os.makedirs('/tmp/.bitdust_tmp/default/metadata/')
+        except:
+            pass
+        fout = open(settings.KeyFileName(), 'w')
+        fout.write(_some_priv_key)
+        fout.close()
+        fout = open(settings.LocalIdentityFilename(), 'w')
+        fout.write(_some_identity_xml)
+        fout.close()
+        self.assertTrue(key.LoadMyKey())
+        self.assertTrue(my_id.loadLocalIdentity())
+        test_id_url.TestIDURL._cache_identity(self, 'alice')
+        test_id_url.TestIDURL._cache_identity(self, 'bob')
+        self.clock = Clock()
+        self.patchers = [
+            mock.patch.object(io_throttle, 'reactor', self.clock),
+            mock.patch.object(file_down, 'reactor', self.clock),
+            mock.patch.object(p2p_service, 'SendRetreive'),
+            mock.patch.object(signed, 'Unserialize'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.queue = io_throttle.SupplierQueue(id_url.field(bob), id_url.field(alice), customerIDURL=id_url.field(alice))
+        self.queue.requestScheduler.clock = self.clock
+        io_throttle.throttle().supplierQueues[id_url.field(bob)] = self.queue
+        self.results = {}
+
+    def tearDown(self):
+        self.queue.requestScheduler.stop()
+        io_throttle.throttle().supplierQueues.clear()
+        for patcher in self.patchers:
+            patcher.stop()
+        key.ForgetMyKey()
+        my_id.forgetLocalIdentity()
+        id_url.shutdown()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+
+    def _on_received(self, packet_or_id, result):
+        packet_id = packet_or_id if isinstance(packet_or_id, str) else packet_or_id.PacketID
+        self.results[packet_id] = result
+
+    def _request_batch(self):
+        for packet_id in packet_ids:
+            self.queue.SupplierRequestFile(self._on_received, id_url.field(alice), packet_id, id_url.field(alice), batch=True)
+        self.clock.advance(0)
+        # all files were requested with one Retrieve() packet
+        self.assertEqual(p2p_service.SendRetreive.call_count, 1)
+        call = p2p_service.SendRetreive.call_args
+        batch_id = global_id.CanonicalID(call[0][2])
+        self.assertEqual(serialization.BytesToDict(call[1]['payload'], values_to_text=True)['items'], packet_ids)
+        pkt_out = mock.Mock()
+        pkt_out.outpacket.Command = commands.Retrieve()
+        pkt_out.outpacket.PacketID = batch_id
+        self.queue.OnFileSendingFinished(pkt_out, None, 'finished', 0, None)
+        for packet_id in packet_ids:
+            self.assertEqual(self.queue.fileRequestDict[packet_id].state, 'REQUESTED')
+        return batch_id, call[1]['callbacks']
+
+    def _data_packet(self, packet_id):
+        return mock.Mock(Command=commands.Data(), CreatorID=id_url.field(bob), PacketID=packet_id, Payload=b'data')
+
+    def test_data_matched_to_batch(self):
+        batch_id, _ = self._request_batch()
+        signed.Unserialize.return_value.PacketID = packet_ids[1]
+        self.assertTrue(io_throttle._on_inbox_packet_received(self._data_packet(packet_ids[1]), None, 'finished', None))
+        self.clock.advance(0)
+        self.assertEqual(self.results, {packet_ids[1]: 'received'})
+        self.assertNotIn(packet_ids[1], self.queue.batchedRequests)
+        self.assertNotIn(packet_ids[1], self.queue.fileRequestDict)
+        # file which was not requested is not catched here
+        self.assertFalse(io_throttle._on_inbox_packet_received(self._data_packet(packet_ids[1]), None, 'finished', None))
+
+    def test_ack_fails_missing_items(self):
+        batch_id, callbacks = self._request_batch()
+        response = mock.Mock(PacketID=batch_id, Payload=serialization.DictToBytes({'sent': 2, 'missing': [packet_ids[0]]}))
+        callbacks[commands.Ack()](response, None)
+        self.clock.advance(0)
+        self.assertEqual(self.results, {packet_ids[0]: 'failed'})
+        self.assertNotIn(batch_id, self.queue.requestsBatches)
+        # other files are still expected to arrive
+        self.assertEqual(self.queue.batchedRequests, set(packet_ids[1:]))
+        self.assertIsNone(self.queue.fileRequestDict[packet_ids[1]].batchID)
+
+    def test_fail_resends_one_by_one(self):
+        batch_id, callbacks = self._request_batch()
+        callbacks[commands.Fail()](mock.Mock(PacketID=batch_id), None)
+        self.assertTrue(self.queue.batchRefused)
+        self.assertEqual(self.queue.batchedRequests, set())
+        self.assertEqual([c[0][2] for c in p2p_service.SendRetreive.call_args_list[1:]], packet_ids)
+        self.assertTrue(all('payload' not in c[1] for c in p2p_service.SendRetreive.call_args_list[1:]))
+        # next files are not batched anymore
+        self.assertFalse(self.queue.AddToRequestsBatch(self.queue.fileRequestDict[packet_ids[0]]))
+
+    def test_cancel_batched_request(self):
+        batch_id, _ = self._request_batch()
+        self.queue.fileRequestDict[packet_ids[0]].event('stop')
+        self.assertEqual(self.queue.requestsBatches[batch_id], packet_ids[1:])
+        self.assertNotIn(packet_ids[0], self.queue.batchedRequests)
+        self.queue.fileRequestDict[packet_ids[1]].event('stop')
+        self.queue.fileRequestDict[packet_ids[2]].event('stop')
+        # nothing is expected from that Retrieve() anymore
+        self.assertNotIn(batch_id, self.queue.requestsBatches)
+        self.assertEqual(self.queue.batchedRequests, set())
+        self.clock.advance(0)
+        self.assertEqual(set(self.results.values()), {'cancelled'})
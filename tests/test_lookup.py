@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from twisted.internet.defer import Deferred
+
+from bitdust.p2p import lookup
+
+
+class TestLookup(TestCase):
+
+    def tearDown(self):
+        del lookup._LookupTasks[:]
+        del lookup._RunningLookupTasks[:]
+        lookup._ObservedNodes.clear()
+        lookup._RejectedNodes.clear()
+        lookup._LookupStats.clear()
+
+    def test_concurrent_tasks(self):
+        dht_requests = []
+
+        def _lookup_method(layer_id=0):
+            d = Deferred()
+            dht_requests.append(d)
+            return d
+
+        results = []
+        for _ in range(lookup.MAX_CONCURRENT_LOOKUPS + 2):
+            t = lookup.start(count=1, layer_id=3, force_discovery=True, lookup_method=_lookup_method)
+            t.result_defer.addCallback(results.append)
+        lookup.work()
+        self.assertEqual(len(dht_requests), lookup.MAX_CONCURRENT_LOOKUPS)
+        self.assertEqual(len(lookup._LookupTasks), 2)
+        # one task is finished and the next one from the queue is started
+        dht_requests[0].callback([])
+        self.assertEqual(results, [[]])
+        lookup.work()
+        self.assertEqual(len(dht_requests), lookup.MAX_CONCURRENT_LOOKUPS + 1)
+        self.assertEqual(len(lookup._RunningLookupTasks), lookup.MAX_CONCURRENT_LOOKUPS)
+        stats = lookup.lookup_stats()
+        self.assertEqual(stats['running'], lookup.MAX_CONCURRENT_LOOKUPS)
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['layers'][3]['count'], 1)
+
+    def test_nodes_cache(self):
+        lookup.remember_observed_node(b'node1', b'http://127.0.0.1/alice.xml', layer_id=3)
+        lookup.remember_rejected_node(b'node2', layer_id=3)
+        self.assertEqual(lookup.get_observed_idurl(b'node1', layer_id=3), b'http://127.0.0.1/alice.xml')
+        self.assertIsNone(lookup.get_observed_idurl(b'node1', layer_id=2))
+        self.assertTrue(lookup.is_rejected(b'node2', layer_id=3))
+        self.assertFalse(lookup.is_rejected(b'node2', layer_id=2))
+        lookup.remember_rejected_node(b'node1', layer_id=3)
+        self.assertIsNone(lookup.get_observed_idurl(b'node1', layer_id=3))
+        self.assertTrue(lookup.is_rejected(b'node1', layer_id=3))
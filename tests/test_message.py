@@ -0,0 +1,75 @@
+from unittest import TestCase
+import os
+
+from bitdust.logs import lg
+
+from bitdust.system import bpio
+
+from bitdust.main import events
+from bitdust.main import settings
+
+from bitdust.crypt import key
+from bitdust.crypt import my_keys
+
+from bitdust.stream import message
+
+from bitdust.userid import my_id
+
+from tests.test_my_keys import _sample_private_key, _some_priv_key, _some_identity_xml
+
+
+class TestSessionKeys(TestCase):
+
+    def setUp(self):
+        try:
+            bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+        except Exception:
+            pass
+        lg.set_debug_level(30)
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        try:
+            os.makedirs('/tmp/.bitdust_tmp/default/metadata/')
+        except:
+            pass
+        fout = open(settings.KeyFileName(), 'w')
+        fout.write(_some_priv_key)
+        fout.close()
+        fout = open(settings.LocalIdentityFilename(), 'w')
+        fout.write(_some_identity_xml)
+        fout.close()
+        self.assertTrue(key.LoadMyKey())
+        self.assertTrue(my_id.loadLocalIdentity())
+        self.keys_folder = '/tmp/.bitdust_tmp/test_keys/'
+        os.makedirs(self.keys_folder)
+
+    def tearDown(self):
+        message.forget_session_keys()
+        key.ForgetMyKey()
+        my_id.forgetLocalIdentity()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+
+    def test_key_registered_again(self):
+        key_id = 'session_test$alice@127.0.0.1_8084'
+        my_keys.register_key(key_id, _sample_private_key, keys_folder=self.keys_folder)
+        first = message.PrivateMessage(recipient=key_id)
+        first.encrypt(b'first')
+        second = message.PrivateMessage(recipient=key_id)
+        second.encrypt(b'second')
+        # session key is re-used for the same key
+        self.assertEqual(first.encrypted_session, second.encrypted_session)
+        self.assertTrue(my_keys.erase_key(key_id, keys_folder=self.keys_folder))
+        my_keys.generate_key(key_id, key_size=1024, keys_folder=self.keys_folder)
+        third = message.PrivateMessage(recipient=key_id)
+        third.encrypt(b'third')
+        self.assertNotEqual(third.encrypted_session, first.encrypted_session)
+        self.assertEqual(third.decrypt(), b'third')
+        my_keys.erase_key(key_id, keys_folder=self.keys_folder)
+
+    def test_forget_session_keys(self):
+        message.get_outgoing_session_key(('key', 'a$alice@127.0.0.1_8084', 'fingerprint1'), lambda inp: inp)
+        message.get_outgoing_session_key(('key', 'b$alice@127.0.0.1_8084', 'fingerprint2'), lambda inp: inp)
+        message.get_incoming_session_key('a$alice@127.0.0.1_8084', b'session', lambda inp: inp)
+        message.on_key_changed(events.Event('key-erased', data={'key_id': 'a$alice@127.0.0.1_8084'}))
+        self.assertEqual(list(message._OutgoingSessionKeys.keys()), [('key', 'b$alice@127.0.0.1_8084', 'fingerprint2')])
+        self.assertEqual(message._IncomingSessionKeys, {})
@@ -0,0 +1,95 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from bitdust.crypt import my_keys
+
+from bitdust.chat import message_database
+
+
+class TestMessageDatabase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'chat.db')
+        message_database.init(filepath=self.filepath)
+
+    def tearDown(self):
+        message_database.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def _add(self, group_num, message_num, payload_time):
+        row = (group_num, 'group_%d$alice@127.0.0.1_8084' % group_num, group_num, 'group_%d$alice@127.0.0.1_8084' % group_num, 0, 3, payload_time, '%08d' % message_num, {'text': 'message %d' % message_num})
+        message_database._KnownConversations.add('{}&{}'.format(group_num, group_num))
+        message_database._PendingHistory.append(row)
+        message_database.update_conversation(group_num, group_num, 3, payload_time, '%08d' % message_num)
+
+    def _count(self, table):
+        return message_database.cur().execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+
+    def test_batched_writes(self):
+        for i in range(5):
+            self._add(i % 2, i, 1000 + i)
+        # nothing is written until the flush
+        self.assertEqual(self._count('history'), 0)
+        self.assertEqual(message_database.flush(), 5)
+        self.assertEqual(self._count('history'), 5)
+        self.assertEqual(message_database._PendingHistory, [])
+        self.assertEqual(message_database._PendingConversations, {})
+        # conversation records are updated in place
+        self._add(0, 5, 2000)
+        message_database.flush()
+        rows = list(message_database.cur().execute('SELECT conversation_id, started_time, last_updated_time, last_message_id FROM conversations ORDER BY conversation_id'))
+        self.assertEqual(rows, [('0&0', 1000, 2000, '00000005'), ('1&1', 1001, 1003, '00000003')])
+
+    def test_flush_failed(self):
+        self._add(0, 0, 1000)
+        self._add(1, 1, 1001)
+        locker = sqlite3.connect(self.filepath, timeout=1)
+        locker.execute('BEGIN EXCLUSIVE')
+        self.assertEqual(message_database.flush(), 0)
+        # pending records are not lost and another attempt is scheduled
+        self.assertEqual(len(message_database._PendingHistory), 2)
+        self.assertEqual(len(message_database._PendingConversations), 2)
+        self.assertTrue(message_database._FlushTask.active())
+        locker.rollback()
+        locker.close()
+        self.assertEqual(message_database.flush(), 2)
+        self.assertFalse(message_database._FlushTask)
+        self.assertEqual(self._count('history'), 2)
+        self.assertEqual(self._count('conversations'), 2)
+
+    def test_keyset_pagination_and_search(self):
+        for group_num in (1, 2):
+            my_keys.local_keys()[group_num] = 'group_%d$alice@127.0.0.1_8084' % group_num
+        try:
+            for i in range(10):
+                self._add(1 + i % 2, i, 1000 + i//2)
+            message_database.flush()
+            pages = []
+            cursor = 'latest'
+            while True:
+                page = message_database.query_messages(cursor=cursor, limit=4, with_row_id=True)
+                if not page:
+                    break
+                pages.append([m['payload']['message_id'] for _, m in page])
+                row_id, last_message = page[-1]
+                cursor = message_database.make_cursor(last_message['payload']['time'], row_id)
+            # messages with the same time are still ordered and not skipped between the pages
+            self.assertEqual(pages, [
+                ['00000009', '00000008', '00000007', '00000006'],
+                ['00000005', '00000004', '00000003', '00000002'],
+                ['00000001', '00000000'],
+            ])
+            # regular results are not changed
+            messages = message_database.query_messages(limit=2)
+            self.assertEqual(sorted(messages[0].keys()), ['conversation_id', 'direction', 'payload', 'recipient', 'sender'])
+            self.assertEqual(len(message_database.query_messages(raw_results=True)[0]), 9)
+            found = message_database.query_messages(text_query='message 7')
+            self.assertEqual([m['payload']['message_id'] for m in found], ['00000007'])
+            # quotes in the user input do not break the full-text query
+            self.assertEqual(len(message_database.query_messages(text_query='"message')), 10)
+        finally:
+            my_keys.local_keys().clear()
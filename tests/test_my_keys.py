@@ -1,6 +1,8 @@
 from unittest import TestCase
 import os
 
+import mock
+
 from bitdust.logs import lg
 
 from bitdust.system import bpio
@@ -169,3 +171,51 @@ class Test(TestCase):
         my_id.forgetLocalIdentity()
         settings.shutdown()
         bpio.rmdir_recursive('/tmp/.bitdust_test_signed_key')
+
+    def test_keys_index(self):
+        keys_folder = '/tmp/.bitdust_tmp/test_keys_index/'
+        os.makedirs(keys_folder)
+        my_keys.shutdown()
+        my_keys.scan_local_keys(keys_folder=keys_folder)
+        private_key_id = 'group_abc$alice@127.0.0.1_8084'
+        public_key_id = 'share_abc$alice@127.0.0.1_8084'
+        my_keys.register_key(private_key_id, _sample_private_key, label='abc', keys_folder=keys_folder)
+        my_keys.register_key(public_key_id, key.MyPublicKey(), active=False, keys_folder=keys_folder)
+        my_keys.shutdown()
+        my_keys.scan_local_keys(keys_folder=keys_folder)
+        # keys are known from the index, but not loaded yet
+        self.assertIsNone(my_keys.known_keys()[private_key_id])
+        self.assertIsNone(my_keys.known_keys()[public_key_id])
+        self.assertTrue(my_keys.is_key_private(private_key_id))
+        self.assertFalse(my_keys.is_key_private(public_key_id))
+        self.assertEqual(my_keys.get_label(private_key_id), 'abc')
+        self.assertFalse(my_keys.is_active(public_key_id))
+        self.assertIsNone(my_keys.known_keys()[private_key_id])
+        # the key is parsed on first use
+        self.assertTrue(my_keys.validate_key(my_keys.key_obj(private_key_id)))
+        self.assertIsNotNone(my_keys.known_keys()[private_key_id])
+        self.assertEqual(my_keys.keys_index()[private_key_id]['fingerprint'], my_keys.key_fingerprint(my_keys.key_obj(private_key_id)))
+        self.assertEqual(my_keys.keys_index()[public_key_id]['fingerprint'], my_keys.key_fingerprint(my_keys.key_obj(public_key_id)))
+        my_keys.shutdown()
+
+    def test_list_unloaded_keys(self):
+        from bitdust.interface import api
+        keys_folder = '/tmp/.bitdust_tmp/test_keys_list/'
+        os.makedirs(keys_folder)
+        my_keys.shutdown()
+        my_keys.scan_local_keys(keys_folder=keys_folder)
+        first_key_id = 'group_abc$alice@127.0.0.1_8084'
+        second_key_id = 'share_abc$alice@127.0.0.1_8084'
+        with mock.patch.object(my_keys, 'MAX_LOADED_KEYS', 1):
+            my_keys.register_key(first_key_id, _sample_private_key, label='abc', keys_folder=keys_folder)
+            my_keys.register_key(second_key_id, key.MyPublicKey(), label='def', keys_folder=keys_folder)
+            # first key was unloaded from memory
+            self.assertIsNone(my_keys.known_keys()[first_key_id])
+            with mock.patch.object(api.driver, 'is_on', return_value=True):
+                result = api.keys_list()['result']
+        keys = {k['key_id']: k for k in result}
+        self.assertEqual(keys[first_key_id]['label'], 'abc')
+        self.assertEqual(keys[second_key_id]['label'], 'def')
+        self.assertIsNotNone(keys[first_key_id]['public'])
+        self.assertIsNotNone(keys[second_key_id]['public'])
+        my_keys.shutdown()
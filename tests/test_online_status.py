@@ -0,0 +1,99 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from bitdust.main import settings
+
+from bitdust.system import bpio
+
+from bitdust.logs import lg
+
+from bitdust.p2p import online_status
+
+from bitdust.userid import id_url
+
+from tests import test_id_url
+from tests.test_id_url import alice_text, hans1, hans2
+
+
+class TestOnlineStatus(TestCase):
+
+    def setUp(self):
+        try:
+            bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+        except Exception:
+            pass
+        lg.set_debug_level(30)
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        id_url._IdentityHistoryDir = tempfile.mkdtemp()
+        id_url.init()
+        try:
+            os.makedirs('/tmp/.bitdust_tmp/identitycache/')
+        except:
+            pass
+        self.clock = Clock()
+        online_status.init(clock=self.clock)
+
+    def tearDown(self):
+        online_status.shutdown()
+        id_url.shutdown()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+
+    def _cache_identity(self, idname):
+        return test_id_url.TestIDURL._cache_identity(self, idname)
+
+    def test_peers_table(self):
+        self._cache_identity('alice')
+        self.assertFalse(online_status.isKnown(alice_text))
+        self.assertTrue(online_status.check_create(alice_text, keep_alive=False))
+        self.assertTrue(online_status.isKnown(alice_text))
+        self.assertTrue(online_status.isOffline(alice_text))
+        self.assertFalse(online_status.isOnline(alice_text))
+        self.assertEqual(online_status.getCurrentState(alice_text), 'OFFLINE')
+        self.assertEqual(online_status.getStatusLabel(alice_text), 'offline')
+        peer = online_status.online_statuses()[id_url.field(alice_text)]
+        online_status._dispatch(peer, 'shook-up-hands')
+        self.assertTrue(online_status.isOnline(alice_text))
+        self.assertEqual(online_status.countOnlineAmong([id_url.field(alice_text)]), 1)
+        self.assertIsNotNone(peer.latest_inbox_time)
+        # reading the state does not create a state machine for the peer
+        self.assertIsNone(peer.instance)
+
+    def test_scheduler(self):
+        self._cache_identity('alice')
+        online_status.check_create(alice_text, keep_alive=False)
+        peer = online_status.online_statuses()[id_url.field(alice_text)]
+        self.assertEqual(peer.due, online_status.OFFLINE_CHECK_PERIOD)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(online_status.OFFLINE_CHECK_PERIOD)
+        # the first check of offline peer was done, next one is scheduled much later
+        self.assertIsNotNone(peer.latest_check_time)
+        self.assertGreater(peer.due, self.clock.seconds() + online_status.OFFLINE_CHECK_PERIOD)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        online_status._dispatch(peer, 'inbox-packet')
+        self.assertEqual(peer.state, 'CONNECTED')
+        self.assertEqual(peer.due, self.clock.seconds() + online_status.CONNECTED_CHECK_INTERVAL)
+        # single timer is moved forward to the nearest due time
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), peer.due)
+        self.clock.advance(online_status.CONNECTED_CHECK_INTERVAL)
+        self.assertEqual(peer.state, 'CONNECTED')
+        self.assertEqual(peer.due, self.clock.seconds() + online_status.CONNECTED_CHECK_INTERVAL)
+        online_status._dispatch(peer, 'ping-failed')
+        self.assertEqual(peer.state, 'OFFLINE')
+
+    def test_identity_rotated(self):
+        self._cache_identity('alice')
+        self._cache_identity('hans1')
+        online_status.check_create(hans1, keep_alive=False)
+        peer = online_status.online_statuses()[id_url.field(hans1)]
+        self._cache_identity('hans2')
+        self.assertTrue(online_status.on_identity_url_changed(hans1))
+        self.assertEqual(len(online_status.online_statuses()), 1)
+        self.assertIs(online_status.online_statuses()[id_url.field(hans2)], peer)
+        self.assertEqual(peer.idurl.to_text(), hans2)
+        self.assertEqual(online_status.getCurrentState(hans2), 'CONNECTED')
+        self.assertFalse(online_status.on_identity_url_changed(alice_text))
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from bitdust.crypt import hashes
+from bitdust.system import bpio
+from bitdust.supplier import pieces_manifest
+
+
+class TestPiecesManifest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.customers_dir = os.path.join(self.tmp_dir, 'customers')
+        self.version_dir = os.path.join(self.customers_dir, 'alice@127.0.0.1_8084', 'master', '0', 'F20230101010101AM')
+        bpio._dirs_make(self.version_dir)
+        pieces_manifest.open_db(os.path.join(self.tmp_dir, 'pieces.db'))
+
+    def tearDown(self):
+        pieces_manifest.close_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def _store(self, piece_name, payload):
+        filepath = os.path.join(self.version_dir, piece_name)
+        file_data = b'header' + payload
+        bpio.WriteBinaryFile(filepath, file_data)
+        pieces_manifest.record_piece(filepath, file_data, payload, self.customers_dir)
+        return filepath
+
+    def test_scrub_and_forget(self):
+        first = self._store('0-0-Data', b'a'*100)
+        self._store('1-0-Data', b'b'*100)
+        self._store('0-0-Parity', b'c'*100)
+        self.assertEqual(pieces_manifest.count(), 3)
+        self.assertEqual(len(pieces_manifest.pieces_to_check(150)), 1)
+        bpio.WriteBinaryFile(first, b'broken data')
+        results = pieces_manifest.check_pieces(pieces_manifest.pieces_to_check(1024), self.customers_dir)
+        self.assertEqual(sorted(r[1] for r in results), ['corrupted', 'ok', 'ok'])
+        corrupted = pieces_manifest.apply_results(results, self.customers_dir)
+        self.assertEqual(corrupted, ['alice@127.0.0.1_8084/master/0/F20230101010101AM/0-0-Data'])
+        self.assertFalse(os.path.isfile(first))
+        self.assertEqual(pieces_manifest.count(), 2)
+        self.assertEqual(pieces_manifest.forget(os.path.join(self.customers_dir, 'alice@127.0.0.1_8084'), self.customers_dir), 2)
+        self.assertEqual(pieces_manifest.count(), 0)
+
+    def test_version_merkle_root(self):
+        payloads = {
+            '10-0-Data': b'x'*10,
+            '2-0-Parity': b'y'*10,
+            '2-0-Data': b'z'*10,
+        }
+        for piece_name, payload in payloads.items():
+            self._store(piece_name, payload)
+        merkle_root, pieces, unverified = pieces_manifest.version_merkle_root(self.version_dir, self.customers_dir)
+        self.assertEqual(pieces, ['2-0-Data', '2-0-Parity', '10-0-Data'])
+        self.assertEqual(unverified, [])
+        self.assertEqual(merkle_root, hashes.merkle_root([hashes.sha256(payloads[p]) for p in pieces]))
+        self.assertIsNone(hashes.merkle_root([]))
+
+    def test_usage_ledger(self):
+        self._store('0-0-Data', b'a'*100)
+        self._store('0-0-Data', b'a'*200)
+        self._store('1-0-Data', b'b'*100)
+        self.assertEqual(pieces_manifest.customer_usage('alice@127.0.0.1_8084'), (312, 2))
+        os.remove(os.path.join(self.version_dir, '1-0-Data'))
+        bpio.WriteBinaryFile(os.path.join(self.version_dir, '2-0-Data'), b'c'*50)
+        new_pieces, resized_pieces, missing_paths = pieces_manifest.compare_pieces(self.customers_dir)
+        self.assertEqual(len(new_pieces), 1)
+        self.assertEqual(len(missing_paths), 1)
+        self.assertEqual(pieces_manifest.reconcile(new_pieces, resized_pieces, missing_paths, started_time=2**31), (1, 0, 1))
+        self.assertEqual(pieces_manifest.customers_usage(), {'alice@127.0.0.1_8084': (256, 2)})
+        pieces_manifest.forget(self.version_dir, self.customers_dir)
+        self.assertEqual(pieces_manifest.customers_usage(), {})
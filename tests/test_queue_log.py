@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import time
+
+from unittest import TestCase
+
+from bitdust.lib import utime
+
+from bitdust.stream import queue_log
+
+_QueueID = 'event-test&alice@host-one.com&bob@server-second.com'
+
+
+class TestQueueLog(TestCase):
+
+    def setUp(self):
+        self.logs_dir = tempfile.mkdtemp(prefix='test_queue_log_')
+        queue_log.init(self.logs_dir)
+
+    def tearDown(self):
+        queue_log.shutdown()
+        shutil.rmtree(self.logs_dir)
+
+    def _append(self, message_id, consumers, created=None):
+        queue_log.append_message(_QueueID, message_id, 'alice@host-one.com', created or utime.utcnow_to_sec1970(), {'counter': message_id}, consumers)
+
+    def test_restore_pending_messages(self):
+        self.assertEqual(len(queue_log.open_log(_QueueID)), 0)
+        for message_id in range(1, 6):
+            self._append(message_id, ['bob@a.com', 'carl@b.com'])
+        for message_id in (1, 2, 3):
+            queue_log.append_ack(_QueueID, 'bob@a.com', message_id)
+        for message_id in (2, 1):
+            queue_log.append_ack(_QueueID, 'carl@b.com', message_id)
+        queue_log.append_removed(_QueueID, 5)
+        queue_log.close_log(_QueueID)
+        restored = queue_log.open_log(_QueueID)
+        self.assertEqual(list(restored.keys()), [3, 4])
+        self.assertEqual(restored[3]['u'], ['carl@b.com'])
+        self.assertEqual(restored[4]['u'], ['bob@a.com', 'carl@b.com'])
+        self.assertEqual(restored[4]['d'], {'counter': 4})
+
+    def test_acks_out_of_order(self):
+        queue_log.open_log(_QueueID)
+        for message_id in range(1, 5):
+            self._append(message_id, ['bob@a.com'])
+        queue_log.append_ack(_QueueID, 'bob@a.com', 3)
+        queue_log.append_ack(_QueueID, 'bob@a.com', 1)
+        queue_log.flush()
+        messages, cursors = queue_log.read_log(_QueueID)
+        self.assertEqual(list(messages.keys()), [2, 4])
+        self.assertEqual(cursors, {'bob@a.com': 1})
+        queue_log.close_log(_QueueID)
+        # acknowledgments are not lost after compaction
+        self.assertEqual(list(queue_log.open_log(_QueueID).keys()), [2, 4])
+        queue_log.append_ack(_QueueID, 'bob@a.com', 2)
+        queue_log.flush()
+        self.assertEqual(list(queue_log.read_log(_QueueID)[0].keys()), [4])
+
+    def test_closed_log_ignores_records(self):
+        queue_log.open_log(_QueueID)
+        self._append(1, ['bob@a.com'])
+        queue_log.close_log(_QueueID)
+        queue_log.append_ack(_QueueID, 'bob@a.com', 1)
+        self.assertEqual(list(queue_log.open_log(_QueueID).keys()), [1])
+
+    def test_sweep_expired_logs(self):
+        queue_log.open_log(_QueueID)
+        self._append(1, ['bob@a.com'])
+        queue_log.close_log(_QueueID)
+        opened_queue_id = 'group_def$carl@b.com&alice@host-one.com'
+        queue_log.open_log(opened_queue_id)
+        queue_log.append_message(opened_queue_id, 1, 'alice@host-one.com', utime.utcnow_to_sec1970(), {}, ['bob@a.com'])
+        queue_log.flush()
+        # recently closed log is kept
+        self.assertEqual(queue_log.sweep_logs(), [])
+        expired = time.time() - queue_log.MAX_MESSAGE_AGE - 10
+        os.utime(queue_log.log_filepath(_QueueID), (expired, expired))
+        os.utime(queue_log.log_filepath(opened_queue_id), (expired, expired))
+        # log of the opened queue is not touched
+        self.assertEqual(queue_log.sweep_logs(), [_QueueID])
+        self.assertFalse(os.path.isfile(queue_log.log_filepath(_QueueID)))
+        self.assertTrue(os.path.isfile(queue_log.log_filepath(opened_queue_id)))
+        self.assertEqual(len(queue_log.open_log(_QueueID)), 0)
+
+    def test_retention(self):
+        queue_log.open_log(_QueueID)
+        self._append(1, ['bob@a.com'], created=utime.utcnow_to_sec1970() - queue_log.MAX_MESSAGE_AGE - 10)
+        self._append(2, ['bob@a.com'])
+        queue_log.append_ack(_QueueID, 'bob@a.com', 2)
+        queue_log.close_log(_QueueID)
+        self.assertEqual(len(queue_log.open_log(_QueueID)), 0)
+        self.assertFalse(os.path.isfile(queue_log.log_filepath(_QueueID)))
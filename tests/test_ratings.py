@@ -0,0 +1,40 @@
+import os
+import time
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from bitdust.p2p import ratings
+
+
+class TestRatings(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        ratings.open_db(os.path.join(self.temp_dir, 'ratings.db'))
+
+    def tearDown(self):
+        ratings.close_db()
+        shutil.rmtree(self.temp_dir)
+
+    def test_increase_ratings_and_uptime(self):
+        alice = 'http://127.0.0.1/alice.xml'
+        bob = b'http://127.0.0.1/bob.xml'
+        now = time.time()
+        for hour in range(10):
+            ratings.increase_ratings({alice: True, bob: hour % 2 == 0}, now=now - (10 - hour)*60*60)
+        self.assertEqual(ratings.total(alice), {'all': '10', 'alive': '10'})
+        self.assertEqual(ratings.total_percent(bob), 50.0)
+        self.assertEqual(ratings.uptime_percent(alice, window=3*60*60, now=now), 100.0)
+        # the last 4 samples of bob were: alive, not alive, alive, not alive
+        self.assertEqual(ratings.uptime_percents([bob], window=4*60*60, now=now), {'http://127.0.0.1/bob.xml': 50.0})
+        self.assertIsNone(ratings.uptime_percent('http://127.0.0.1/carol.xml'))
+        ratings.remember_connected_time(bob)
+        # counters are loaded back from the database
+        ratings.close_db()
+        ratings.open_db(os.path.join(self.temp_dir, 'ratings.db'))
+        ratings.read_index(time.strftime('%m%y', time.localtime(now - 60*60)))
+        self.assertEqual(ratings.total(bob), {'all': '10', 'alive': '5'})
+        self.assertEqual(len(ratings.read_all_monthly_ratings(alice)), len(set(time.strftime('%m%y', time.localtime(now - h*60*60)) for h in range(1, 11))))
+        self.assertIsNotNone(ratings.connected_time(bob))
@@ -0,0 +1,90 @@
+import base64
+
+from unittest import TestCase
+
+from bitdust.lib import serialization
+
+from bitdust.crypt import key
+from bitdust.crypt import rsa_key
+
+from bitdust.transport.proxy import relay_channel
+
+
+class TestRelayChannel(TestCase):
+
+    def setUp(self):
+        relay_channel.clear()
+        self.router_key = rsa_key.RSAKey()
+        self.router_key.generate(1024)
+        self.publickey = self.router_key.toPublicString()
+        self.rsa_decrypted = 0
+
+    def tearDown(self):
+        relay_channel.clear()
+
+    def _decrypt_key(self, inp):
+        self.rsa_decrypted += 1
+        return self.router_key.decrypt(inp)
+
+    def test_channel_key_reused(self):
+        for i in range(10):
+            data = b'routed data %d' % i
+            payload = relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, data)
+            self.assertEqual(relay_channel.decrypt(payload, b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), data)
+        self.assertEqual(self.rsa_decrypted, 1)
+
+    def test_channel_rotated(self):
+        relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'abc')
+        first_id = relay_channel._OutgoingChannels[b'http://router.net/router.xml']['id']
+        relay_channel._OutgoingChannels[b'http://router.net/router.xml']['bytes'] = relay_channel._ChannelRotateBytes + 1
+        payload = relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'abc')
+        self.assertNotEqual(relay_channel._OutgoingChannels[b'http://router.net/router.xml']['id'], first_id)
+        self.assertEqual(relay_channel.decrypt(payload, b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'abc')
+
+    def test_tampered_payload(self):
+        payload = relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'abc')
+        dct = serialization.BytesToDict(payload, keys_to_text=True, encoding='utf-8')
+        dct['l'] = 2
+        tampered = serialization.DictToBytes(dct, encoding='utf-8')
+        self.assertIsNone(relay_channel.decrypt(tampered, b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+
+    def test_legacy_block(self):
+        session_key = key.NewSessionKey(session_key_type=key.SessionKeyType())
+        dct = {
+            'c': 'http://sender.net/alice.xml',
+            'b': 'routed outgoing data',
+            'n': 0,
+            'e': True,
+            'k': base64.b64encode(key.EncryptOpenSSHPublicKey(self.publickey, session_key)).decode(),
+            't': key.SessionKeyType(),
+            'l': 3,
+            'p': key.EncryptWithSessionKey(session_key, b'abc', session_key_type=key.SessionKeyType()),
+            's': b'',
+        }
+        payload = serialization.DictToBytes(dct, encoding='utf-8')
+        self.assertEqual(relay_channel.decrypt(payload, b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'abc')
+
+    def test_malformed_payload(self):
+        self.assertIsNone(relay_channel.decrypt(b'garbage', b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+        self.assertIsNone(relay_channel.decrypt(b'[1, 2, 3]', b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+        self.assertIsNone(relay_channel.decrypt(b'"abc"', b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+        self.assertIsNone(relay_channel.decrypt(b'{}', b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+
+    def test_replayed_payload(self):
+        rejected = relay_channel.counters()['replay_rejected']
+        payloads = [relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'data %d' % i) for i in range(3)]
+        # packets may arrive out of order
+        self.assertEqual(relay_channel.decrypt(payloads[1], b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'data 1')
+        self.assertEqual(relay_channel.decrypt(payloads[0], b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'data 0')
+        self.assertIsNone(relay_channel.decrypt(payloads[1], b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+        self.assertEqual(relay_channel.decrypt(payloads[2], b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'data 2')
+        self.assertIsNone(relay_channel.decrypt(payloads[0], b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+        # too old to be checked against the window
+        for i in range(relay_channel._ReplayWindow):
+            relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'skipped')
+        latest = relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'latest')
+        self.assertEqual(relay_channel.decrypt(latest, b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'latest')
+        old = relay_channel.encrypt(b'http://router.net/router.xml', self.publickey, b'old')
+        self.assertEqual(relay_channel.decrypt(old, b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key), b'old')
+        self.assertIsNone(relay_channel.decrypt(payloads[2], b'http://sender.net/alice.xml', decrypt_key=self._decrypt_key))
+        self.assertEqual(relay_channel.counters()['replay_rejected'] - rejected, 3)
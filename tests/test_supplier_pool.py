@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from twisted.internet import task
+
+from bitdust.customer import supplier_pool
+
+
+class TestSupplierPool(TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        supplier_pool._Clock = self.clock
+
+    def tearDown(self):
+        supplier_pool.candidates().clear()
+        supplier_pool._Refusals.clear()
+        supplier_pool._Clock = None
+
+    def test_score(self):
+        self.assertGreater(supplier_pool.score(0.1, 90.0), supplier_pool.score(1.0, 90.0))
+        self.assertGreater(supplier_pool.score(0.5, 99.0), supplier_pool.score(0.5, 20.0))
+        self.assertGreater(supplier_pool.score(0.5, 80.0), supplier_pool.score(0.5, 80.0, refusals=1))
+        self.assertEqual(supplier_pool.score(0.5), supplier_pool.score(0.5, supplier_pool.UNKNOWN_UPTIME))
+
+    def test_pop_best(self):
+        supplier_pool.add_candidate(b'http://127.0.0.1/slow.xml', latency=2.0)
+        supplier_pool.add_candidate(b'http://127.0.0.1/fast.xml', latency=0.1)
+        supplier_pool.add_candidate(b'http://127.0.0.1/medium.xml', latency=0.5)
+        supplier_pool.on_refused(b'http://127.0.0.1/fast.xml')
+        supplier_pool.add_candidate(b'http://127.0.0.1/fast.xml', latency=0.1)
+        # refused recently, so it is behind the others even being the fastest one
+        self.assertEqual([i[1] for i in supplier_pool.ranked()], [
+            b'http://127.0.0.1/medium.xml',
+            b'http://127.0.0.1/fast.xml',
+            b'http://127.0.0.1/slow.xml',
+        ])
+        self.assertEqual(supplier_pool.pop_best(ignore_idurls=[b'http://127.0.0.1/medium.xml']), b'http://127.0.0.1/fast.xml')
+        self.assertEqual(supplier_pool.pop_best(), b'http://127.0.0.1/medium.xml')
+        # candidate which was not pinged for too long is not offered anymore
+        self.clock.advance(supplier_pool.CANDIDATE_TTL + 1)
+        self.assertIsNone(supplier_pool.pop_best())
+        self.clock.advance(supplier_pool.REFUSALS_MEMORY)
+        self.assertEqual(supplier_pool.refusals(b'http://127.0.0.1/fast.xml'), 0)
@@ -0,0 +1,89 @@
+import os
+import struct
+import tempfile
+
+from unittest import TestCase
+
+from bitdust.transport.tcp import tcp_stream
+
+
+class _Consumer(object):
+
+    producerPaused = False
+
+    def __init__(self):
+        self.producer = None
+        self.written = []
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def writeSequence(self, seq):
+        self.written.append(b''.join(seq))
+
+
+class TestMultipleFilesSender(TestCase):
+
+    def setUp(self):
+        self.temp_files = []
+
+    def tearDown(self):
+        for f in self.temp_files:
+            f.close()
+            os.remove(f.name)
+
+    def _file(self, data):
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.write(data)
+        f.flush()
+        f.seek(0)
+        self.temp_files.append(f)
+        return f
+
+    def test_weighted_fair_queueing(self):
+        chunk_size = tcp_stream.MultipleFilesSender.CHUNK_SIZE
+        contents = {
+            1: os.urandom(chunk_size*4),
+            2: os.urandom(chunk_size*4),
+            3: os.urandom(chunk_size*4 - 100),
+        }
+        weights = {
+            1: tcp_stream.DATA_FILE_WEIGHT,
+            2: tcp_stream.DATA_FILE_WEIGHT,
+            3: tcp_stream.SHORT_FILE_WEIGHT,
+        }
+        consumer = _Consumer()
+        sender = tcp_stream.MultipleFilesSender(consumer)
+        finished = []
+        sent = {}
+        for file_id in sorted(contents):
+
+            def _header(length, file_id=file_id):
+                return struct.pack('ii', file_id, length)
+
+            def _sent(length, file_id=file_id):
+                sent[file_id] = sent.get(file_id, 0) + length
+
+            d = sender.startFileTransfer(file_id, self._file(contents[file_id]), len(contents[file_id]), _header, _sent, weights[file_id])
+            d.addCallback(lambda result, file_id=file_id: finished.append(file_id))
+        while sender.active_files:
+            sender.resumeProducing()
+        # file with a bigger weight was started last, but finished first
+        self.assertEqual(finished, [3, 1, 2])
+        self.assertEqual(sent, dict((file_id, len(data)) for file_id, data in contents.items()))
+        received = {}
+        for chunk in consumer.written:
+            file_id, length = struct.unpack_from('ii', chunk)
+            self.assertEqual(len(chunk), 8 + length)
+            received[file_id] = received.get(file_id, b'') + chunk[8:]
+        self.assertEqual(received, contents)
+        sender.close()
+        self.assertIsNone(consumer.producer)
+
+    def test_file_weight(self):
+        self.assertEqual(tcp_stream.file_weight('Data', 1024), tcp_stream.SHORT_FILE_WEIGHT)
+        self.assertEqual(tcp_stream.file_weight('Data', 1024*1024), tcp_stream.DATA_FILE_WEIGHT)
+        self.assertEqual(tcp_stream.file_weight('Identity', 1024*1024), tcp_stream.SERVICE_FILE_WEIGHT)
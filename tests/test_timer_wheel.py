@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from bitdust.automats import timer_wheel
+
+
+class TestTimerWheel(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        timer_wheel.init(clock=self.clock)
+        self.fired = []
+
+    def tearDown(self):
+        timer_wheel.shutdown()
+
+    def _advance(self, seconds, step=0.01):
+        for _ in range(int(round(seconds/step))):
+            self.clock.advance(step)
+
+    def test_periodic_timers(self):
+        short = timer_wheel.WheelTimer(self.fired.append, 0.1, 'short')
+        long = timer_wheel.WheelTimer(self.fired.append, 5.0, 'long')
+        short.start()
+        long.start()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self._advance(1.0)
+        self.assertEqual(self.fired.count('short'), 10)
+        short.stop()
+        self._advance(10.0, step=0.1)
+        self.assertEqual(self.fired.count('short'), 10)
+        self.assertEqual(self.fired.count('long'), 2)
+
+    def test_restart_and_long_interval(self):
+        timer = timer_wheel.WheelTimer(self.fired.append, 600, 'slow')
+        timer.start()
+        self._advance(500, step=1.0)
+        timer.start()
+        self._advance(500, step=1.0)
+        self.assertEqual(self.fired, [])
+        self._advance(101, step=1.0)
+        self.assertEqual(self.fired, ['slow'])
+        timer.stop()
+        self.assertEqual(timer_wheel.counters()['timers'], 0)
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from bitdust.transport import transport_worker
+
+
+class _Pipe(transport_worker.FrameChannel):
+
+    def __init__(self, handler):
+        transport_worker.FrameChannel.__init__(self)
+        self.handler = handler
+        self.remote = None
+
+    def write(self, data):
+        # deliver byte by byte to make sure frames are re-assembled from any chunks
+        for i in range(len(data)):
+            self.remote.data_received(data[i:i + 1])
+
+    def handle(self, kind, method, args):
+        return self.handler(kind, method, args)
+
+
+class TestTransportWorker(TestCase):
+
+    def test_pack_unpack(self):
+        value = {
+            'host': (b'127.0.0.1', 7771),
+            'options': {'idurl': b'http://127.0.0.1/alice.xml', 'enabled': True, 'none': None},
+            'text': u'привет',
+            'numbers': [0, -1, 2**40, 2**70, 0.5],
+        }
+        self.assertEqual(transport_worker.unpack(transport_worker.pack(value)), value)
+        self.assertRaises(TypeError, transport_worker.pack, object())
+        self.assertRaises(ValueError, transport_worker.unpack, transport_worker.pack(b'abc')[:-1])
+
+    def test_calls_and_replies(self):
+        calls = []
+
+        def _worker_handler(kind, method, args):
+            calls.append((kind, method, args))
+            if method == 'fail':
+                raise Exception('failed')
+            return args[0]*2
+
+        parent = _Pipe(None)
+        worker = _Pipe(_worker_handler)
+        parent.remote = worker
+        worker.remote = parent
+        results = []
+        parent.send_call(transport_worker.FRAME_CALL, 'double', 21).addCallback(results.append)
+        parent.send_call(transport_worker.FRAME_CALL, 'fail').addErrback(lambda err: results.append(err.getErrorMessage()))
+        self.assertEqual(results, [42, 'failed'])
+        self.assertEqual(calls[0], (transport_worker.FRAME_CALL, 'double', (21, )))
+        self.assertEqual(parent.pending, {})
+        self.assertEqual(worker.buffer, bytearray())
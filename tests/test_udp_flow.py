@@ -0,0 +1,147 @@
+import os
+
+from unittest import TestCase
+
+from twisted.internet import task
+
+from bitdust.transport.udp import udp_flow
+from bitdust.transport.udp import udp_stream
+
+
+class _Session(object):
+
+    def __init__(self):
+        self.peer_id = 'peer'
+        self.min_rtt = None
+        self.flow_datagram_size = None
+        self.flow_failed_sizes = set()
+
+
+class _Producer(object):
+
+    def __init__(self, clock, delay, drop=None):
+        self.session = _Session()
+        self.clock = clock
+        self.delay = delay
+        self.drop = drop
+        self.remote = None
+        self.sent = 0
+        self.done = []
+
+    def _send(self, payload, handler):
+        self.sent += 1
+        if self.drop and self.drop(self.sent, payload):
+            return True
+        self.clock.callLater(self.delay, handler, payload)
+        return True
+
+    def do_send_flow_data(self, payload):
+        return self._send(payload, self.remote.on_data_received)
+
+    def do_send_flow_ack(self, payload):
+        return self._send(payload, self.remote.on_ack_received)
+
+    def on_outbox_file_done(self, stream_id):
+        self.done.append('sent')
+
+    def on_inbox_file_done(self, stream_id):
+        self.done.append('received')
+
+    def on_timeout_sending(self, stream_id):
+        self.done.append('timeout')
+
+    def on_timeout_receiving(self, stream_id):
+        self.done.append('timeout')
+
+
+class _Source(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.pos = 0
+        self.bytes_delivered = 0
+        self.stream_callback = None
+        self.status = None
+        self.error_message = ''
+        self.timeout = False
+
+    def set_stream_callback(self, cb):
+        self.stream_callback = cb
+        self.process()
+
+    def process(self):
+        while self.pos < self.size:
+            chunk = self.data[self.pos:self.pos + udp_stream.CHUNK_SIZE]
+            try:
+                self.stream_callback(chunk)
+            except udp_stream.BufferOverflow:
+                break
+            self.pos += len(chunk)
+
+    def is_done(self):
+        return self.bytes_delivered == self.size
+
+    def on_sent_raw_data(self, bytes_delivered):
+        self.bytes_delivered += bytes_delivered
+        self.process()
+        return self.is_done()
+
+
+class _Sink(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.received = []
+        self.status = None
+        self.error_message = ''
+        self.timeout = False
+
+    def on_received_raw_data(self, newdata):
+        self.received.append(newdata)
+        return sum(map(len, self.received)) == self.size
+
+
+class TestUDPFlow(TestCase):
+
+    def _transfer(self, data, drop=None):
+        clock = task.Clock()
+        sender_producer = _Producer(clock, 0.01, drop=drop)
+        receiver_producer = _Producer(clock, 0.01)
+        source = _Source(data)
+        sink = _Sink(len(data))
+        sender = udp_flow.FlowStream(1, source, sender_producer, clock=clock)
+        receiver = udp_flow.FlowStream(1, sink, receiver_producer, clock=clock)
+        sender_producer.remote = receiver
+        receiver_producer.remote = sender
+        receiver.start()
+        sender.start()
+        for _ in range(5000):
+            if sender_producer.done:
+                break
+            clock.advance(0.005)
+        return sender, sink, sender_producer, receiver_producer
+
+    def test_transfer_probes_bigger_datagrams(self):
+        data = os.urandom(300*1000)
+        sender, sink, sender_producer, receiver_producer = self._transfer(data)
+        self.assertEqual(sender_producer.done, ['sent'])
+        self.assertEqual(receiver_producer.done, ['received'])
+        self.assertEqual(b''.join(sink.received), data)
+        self.assertEqual(sender.datagram_size, udp_flow.DATAGRAM_SIZES[-1])
+        self.assertEqual(sender_producer.session.flow_datagram_size, udp_flow.DATAGRAM_SIZES[-1])
+        self.assertEqual(sender.packets_lost, 0)
+
+    def test_lost_packets_and_probes_are_retransmitted(self):
+        data = os.urandom(200*1000)
+
+        def _drop(counter, payload):
+            # every 7th packet is lost and all datagrams bigger than 1472 bytes are lost as well
+            return counter % 7 == 0 or len(payload) + udp_flow.COMMAND_HEADER_SIZE > 1472
+
+        sender, sink, sender_producer, receiver_producer = self._transfer(data, drop=_drop)
+        self.assertEqual(sender_producer.done, ['sent'])
+        self.assertEqual(b''.join(sink.received), data)
+        self.assertEqual(sender.datagram_size, 1472)
+        self.assertIn(8192, sender_producer.session.flow_failed_sizes)
+        self.assertGreater(sender.packets_lost, 0)
@@ -0,0 +1,70 @@
+import os
+import struct
+import random
+
+from unittest import TestCase
+
+from bitdust.transport.udp import udp_stream
+
+
+class _Session(object):
+    peer_id = 'peer'
+    min_rtt = None
+
+
+class _Producer(object):
+
+    def __init__(self):
+        self.session = _Session()
+        self.acks = []
+        self.done = False
+
+    def do_send_ack(self, stream_id, consumer, ack_data):
+        self.acks.append(ack_data)
+
+    def on_inbox_file_done(self, stream_id):
+        self.done = True
+
+
+class _Consumer(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.data = bytearray(size)
+        self.bytes_received = 0
+        self.writes = 0
+        self.status = None
+
+    def set_stream_callback(self, cb):
+        pass
+
+    def write_block(self, offset, data):
+        self.data[offset:offset + len(data)] = data
+        self.bytes_received += len(data)
+        self.writes += 1
+        return self.bytes_received == self.size
+
+
+class TestUDPStream(TestCase):
+
+    def test_out_of_order_blocks(self):
+        data = os.urandom(udp_stream.BLOCK_SIZE*50 + 100)
+        blocks_total = 51
+        order = list(range(blocks_total))
+        random.shuffle(order)
+        order = order[:10] + order[:5] + order[10:]
+        producer = _Producer()
+        consumer = _Consumer(len(data))
+        s = udp_stream.create(1, consumer, producer)
+        for index in order:
+            block = struct.pack('i', index + 1) + data[index*udp_stream.BLOCK_SIZE:(index + 1)*udp_stream.BLOCK_SIZE]
+            s.on_block_received(memoryview(block))
+        self.assertTrue(producer.done)
+        self.assertEqual(bytes(consumer.data), data)
+        self.assertEqual(consumer.writes, blocks_total)
+        self.assertEqual(s.input_block_id_current, blocks_total)
+        self.assertEqual(s.input_duplicated_blocks + s.input_old_blocks, 5)
+        self.assertEqual(s.input_blocks_pending, 0)
+        # block which does not fit into the file is ignored
+        s.on_block_received(memoryview(struct.pack('i', blocks_total + 1) + b'x'))
+        self.assertEqual(consumer.writes, blocks_total)